@@ -0,0 +1,344 @@
+"""
+Офлайн-проверка и превью статей без запуска браузера.
+
+Компилирует статьи в блоки редактора (как при публикации) в пуле процессов,
+проверяет локальные картинки, ссылки [image_url:...] / cover_image_url
+(HEAD-запросы параллельно), тему из tags[0] и корректность HTML.
+
+Запуск:
+  python article_check.py validate                      # все статьи в articles/
+  python article_check.py validate articles/a.json other_dir/ --strict
+  python article_check.py validate --no-network         # без проверки URL
+  python article_check.py preview --out preview/        # HTML-превью блоков
+
+Exit codes:
+  0 — ошибок нет
+  3 — есть ошибки (или предупреждения с --strict)
+"""
+
+import argparse
+import asyncio
+import html
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from typing import List, Optional, Dict
+
+import httpx
+
+from article_format import parse_blocks, split_links, looks_like_html
+from main import load_article
+from theme_resolver import THEMES_CACHE, ThemeResolver
+
+VOID_TAGS = {"br", "img", "hr", "meta", "link", "input", "source", "wbr"}
+
+
+# =========================================================================
+# КОМПИЛЯЦИЯ (в пуле процессов)
+# =========================================================================
+class _TagBalanceParser(HTMLParser):
+    """Проверка парности тегов: незакрытые и перепутанные теги."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.problems = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in VOID_TAGS:
+            self.stack.append((tag, self.getpos()[0]))
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if not self.stack:
+            self.problems.append(f"лишний </{tag}> (строка {self.getpos()[0]})")
+            return
+        open_tag, line = self.stack[-1]
+        if open_tag == tag:
+            self.stack.pop()
+        elif any(t == tag for t, _ in self.stack):
+            while self.stack and self.stack[-1][0] != tag:
+                t, l = self.stack.pop()
+                self.problems.append(f"<{t}> не закрыт (строка {l})")
+            self.stack.pop()
+        else:
+            self.problems.append(f"лишний </{tag}> (строка {self.getpos()[0]})")
+
+    def close(self):
+        super().close()
+        for t, l in self.stack:
+            self.problems.append(f"<{t}> не закрыт (строка {l})")
+
+
+def check_html(content: str) -> List[str]:
+    parser = _TagBalanceParser()
+    parser.feed(content)
+    parser.close()
+    return parser.problems
+
+
+def compile_article(path: str, themes: Optional[ThemeResolver], render: bool) -> dict:
+    """
+    Загрузить статью, разобрать в блоки и проверить всё, что можно без сети.
+    Возвращает сериализуемый dict (результат уходит из процесса-воркера).
+    """
+    result = {
+        "path": path,
+        "title": "",
+        "errors": [],
+        "warnings": [],
+        "urls": [],
+        "blocks": 0,
+        "preview": None,
+    }
+    try:
+        article = load_article(path)
+    except (FileNotFoundError, ValueError, json.JSONDecodeError) as e:
+        result["errors"].append(str(e))
+        return result
+
+    result["title"] = article["title"]
+    content = article.get("content", "")
+    if isinstance(content, list):
+        content = "\n".join(content)
+
+    if looks_like_html(content):
+        for problem in check_html(content):
+            result["errors"].append(f"HTML: {problem}")
+
+    blocks = parse_blocks(content)
+    result["blocks"] = len(blocks)
+    if not blocks:
+        result["errors"].append("Пустой content")
+
+    # Локальные картинки — публикация ищет их относительно рабочей папки
+    cover_image = article.get("cover_image")
+    if cover_image and not os.path.exists(cover_image):
+        result["errors"].append(f"cover_image не найден: {cover_image}")
+    if article.get("cover_image_url"):
+        result["urls"].append({"url": article["cover_image_url"], "kind": "image"})
+
+    for block in blocks:
+        if block["type"] == "image" and not os.path.exists(block["path"]):
+            result["errors"].append(f"[image:] не найден: {block['path']}")
+        elif block["type"] == "image_url":
+            result["urls"].append({"url": block["url"], "kind": "image"})
+        elif block["type"] == "embed":
+            result["urls"].append({"url": block["url"], "kind": "link"})
+        for text in _block_texts(block):
+            for kind, value in split_links(text):
+                if kind == "link" and value[1].startswith(("http://", "https://")):
+                    result["urls"].append({"url": value[1], "kind": "link"})
+
+    tags = article.get("tags") or []
+    # Как при публикации: нормализация и нечёткое сопоставление ThemeResolver
+    if tags and themes is not None and themes.resolve(tags[0]) is None:
+        result["warnings"].append(f"Тема '{tags[0]}' не найдена в {THEMES_CACHE}")
+
+    if render:
+        result["preview"] = render_preview(article, blocks)
+    return result
+
+
+def _block_texts(block: dict) -> List[str]:
+    if block["type"] == "list":
+        return block["items"]
+    if block["type"] in ("paragraph", "quote"):
+        return [block["text"]]
+    return []
+
+
+# =========================================================================
+# ПРЕВЬЮ
+# =========================================================================
+def _inline(text: str) -> str:
+    out = []
+    for kind, value in split_links(text):
+        if kind == "text":
+            out.append(html.escape(value))
+        else:
+            out.append(f'<a href="{html.escape(value[1])}">{html.escape(value[0])}</a>')
+    return "".join(out)
+
+
+def _image_src(path: str) -> str:
+    return "file://" + os.path.abspath(path)
+
+
+def render_preview(article: dict, blocks: List[dict]) -> str:
+    """HTML-превью блоков в том порядке, в котором их вставит редактор."""
+    parts = [f"<h1>{html.escape(article['title'])}</h1>"]
+    tags = article.get("tags") or []
+    if tags:
+        parts.append(f'<p class="theme">Тема: {html.escape(tags[0])}</p>')
+
+    cover_src = article.get("cover_image_url") or (
+        _image_src(article["cover_image"]) if article.get("cover_image") else None
+    )
+    if cover_src:
+        caption = html.escape(article.get("image_caption") or "")
+        parts.append(f'<figure><img src="{html.escape(cover_src)}"><figcaption>{caption}</figcaption></figure>')
+
+    for block in blocks:
+        kind = block["type"]
+        if kind in ("h2", "h3"):
+            parts.append(f"<{kind}>{html.escape(block['text'])}</{kind}>")
+        elif kind == "paragraph":
+            parts.append(f"<p>{_inline(block['text'])}</p>")
+        elif kind == "list":
+            items = "".join(f"<li>{_inline(item)}</li>" for item in block["items"])
+            parts.append(f"<ul>{items}</ul>")
+        elif kind == "quote":
+            author = f"<cite>{html.escape(block['author'])}</cite>" if block["author"] else ""
+            parts.append(f"<blockquote>{_inline(block['text'])}{author}</blockquote>")
+        elif kind == "code":
+            parts.append(f"<pre>{html.escape(chr(10).join(block['lines']))}</pre>")
+        elif kind == "embed":
+            url = html.escape(block["url"])
+            parts.append(f'<p class="embed">embed: <a href="{url}">{url}</a></p>')
+        elif kind in ("image", "image_url"):
+            src = block["url"] if kind == "image_url" else _image_src(block["path"])
+            parts.append(
+                f'<figure><img src="{html.escape(src)}">'
+                f"<figcaption>{html.escape(block['caption'])}</figcaption></figure>"
+            )
+
+    return (
+        '<!doctype html><html lang="ru"><head><meta charset="utf-8">'
+        f"<title>{html.escape(article['title'])}</title>"
+        "<style>body{max-width:680px;margin:40px auto;font:17px/1.5 sans-serif}"
+        "img{max-width:100%}blockquote{border-left:3px solid #ccc;margin:0;padding-left:16px}"
+        "cite{display:block;color:#777}.theme,.embed{color:#777}</style>"
+        "</head><body>" + "\n".join(parts) + "</body></html>"
+    )
+
+
+# =========================================================================
+# ПРОВЕРКА URL (асинхронно, HEAD)
+# =========================================================================
+async def _check_url(client: httpx.AsyncClient, sem: asyncio.Semaphore, url: str) -> dict:
+    """{"ok": bool, "detail": content-type или текст проблемы}."""
+    async with sem:
+        try:
+            r = await client.head(url)
+            if r.status_code in (403, 405, 501):
+                # Не все серверы отвечают на HEAD — пробуем первый байт
+                r = await client.get(url, headers={"Range": "bytes=0-0"})
+        except httpx.HTTPError as e:
+            return {"ok": False, "detail": f"{type(e).__name__}: {e}"}
+    if r.status_code >= 400:
+        return {"ok": False, "detail": f"HTTP {r.status_code}"}
+    return {"ok": True, "detail": r.headers.get("content-type", "")}
+
+
+async def check_urls(urls: List[str], concurrency: int = 20) -> Dict[str, dict]:
+    """Проверить уникальные URL параллельно. -> {url: {"ok": bool, "detail": str}}"""
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(follow_redirects=True, timeout=15, limits=limits) as client:
+        results = await asyncio.gather(*(_check_url(client, sem, url) for url in urls))
+    return dict(zip(urls, results))
+
+
+# =========================================================================
+# CLI
+# =========================================================================
+def collect_paths(paths: List[str]) -> List[str]:
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, files in os.walk(p):
+                found.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(".json"))
+        else:
+            found.append(p)
+    return found
+
+
+def load_themes() -> Optional[ThemeResolver]:
+    """Кэш тем vc.ru (None — кэша нет, тема не проверяется)."""
+    themes = ThemeResolver()
+    return themes if themes.themes else None
+
+
+def run(paths: List[str], workers: Optional[int], network: bool, strict: bool, out_dir: Optional[str]) -> int:
+    files = collect_paths(paths)
+    if not files:
+        print("Статьи не найдены", file=sys.stderr)
+        return 3
+
+    themes = load_themes()
+    render = out_dir is not None
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            compile_article, files, [themes] * len(files), [render] * len(files),
+            chunksize=max(1, len(files) // ((workers or os.cpu_count() or 1) * 4)),
+        ))
+
+    if network:
+        urls = sorted({u["url"] for r in results for u in r["urls"]})
+        checked = asyncio.run(check_urls(urls)) if urls else {}
+        for r in results:
+            for u in r["urls"]:
+                status = checked[u["url"]]
+                if not status["ok"]:
+                    msg = f"URL недоступен ({status['detail']}): {u['url']}"
+                    (r["errors"] if u["kind"] == "image" else r["warnings"]).append(msg)
+                elif u["kind"] == "image" and not status["detail"].startswith("image/"):
+                    r["warnings"].append(f"Не картинка ({status['detail'] or '?'}): {u['url']}")
+
+    if render:
+        os.makedirs(out_dir, exist_ok=True)
+        index = []
+        for r in results:
+            if r["preview"] is None:
+                continue
+            name = os.path.splitext(os.path.basename(r["path"]))[0] + ".html"
+            with open(os.path.join(out_dir, name), "w", encoding="utf-8") as f:
+                f.write(r["preview"])
+            mark = "✗" if r["errors"] else "✓"
+            index.append(f'<li>{mark} <a href="{html.escape(name)}">{html.escape(r["title"])}</a></li>')
+        with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+            f.write('<!doctype html><meta charset="utf-8"><ul>' + "".join(index) + "</ul>")
+        print(f"Превью: {os.path.join(out_dir, 'index.html')}")
+
+    failed = 0
+    for r in results:
+        bad = r["errors"] or (strict and r["warnings"])
+        failed += bool(bad)
+        mark = "✗" if bad else "✓"
+        print(f"{mark} {r['path']} — блоков: {r['blocks']}")
+        for e in r["errors"]:
+            print(f"    ошибка: {e}")
+        for w in r["warnings"]:
+            print(f"    предупреждение: {w}")
+    print(f"\nПроверено: {len(results)}, с ошибками: {failed}")
+    return 3 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка и превью статей без браузера")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("validate", "preview"):
+        p = sub.add_parser(name)
+        p.add_argument("paths", nargs="*", default=["articles"], help="Файлы или папки со статьями")
+        p.add_argument("--workers", type=int, default=None, help="Процессов в пуле (по умолчанию = ядер)")
+        p.add_argument("--no-network", action="store_true", help="Не проверять URL")
+        p.add_argument("--strict", action="store_true", help="Предупреждения считать ошибками")
+        if name == "preview":
+            p.add_argument("--out", default="preview", help="Папка для HTML-превью")
+    args = parser.parse_args()
+
+    return run(
+        args.paths,
+        workers=args.workers,
+        network=not args.no_network,
+        strict=args.strict,
+        out_dir=getattr(args, "out", None),
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Разбор контента статьи в блоки редактора vc.ru.
+
+Чистые функции без браузера: их использует VcRuClient при вставке контента
+и article_check.py при офлайн-проверке и превью.
+
+Поддерживаемые маркеры:
+- ## Заголовок H2
+- ### Заголовок H3
+- - / • / * элемент списка
+- > цитата | автор
+- ```...``` блок кода
+- [embed:url]
+- [image:/path/to/file.png|подпись]
+- [image_url:https://example.com/img.jpg|подпись]
+- [текст](url) — inline-ссылка внутри параграфа/пункта списка
+"""
+
+import re
+from typing import List
+
+IMAGE_RE = re.compile(r"\[image:([^\]|]+?)(?:\|([^\]]*))?\]")
+IMAGE_URL_RE = re.compile(r"\[image_url:(https?://[^\]|]+?)(?:\|([^\]]*))?\]")
+EMBED_RE = re.compile(r"\[embed:(https?://[^\]]+)\]")
+LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+
+LIST_PREFIXES = ("• ", "- ", "* ")
+
+
+def looks_like_html(content: str) -> bool:
+    return "<" in content and ">" in content
+
+
+def html_to_text(html: str) -> str:
+    """Конвертация HTML в простой текстовый формат."""
+    text = html
+    text = re.sub(r"<h2[^>]*>(.*?)</h2>", r"\n## \1\n", text, flags=re.DOTALL)
+    text = re.sub(r"<h3[^>]*>(.*?)</h3>", r"\n### \1\n", text, flags=re.DOTALL)
+    text = re.sub(r"<ul[^>]*>(.*?)</ul>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(r"<ol[^>]*>(.*?)</ol>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(r"<li[^>]*>(.*?)</li>", r"- \1\n", text, flags=re.DOTALL)
+    text = re.sub(r"<blockquote[^>]*>(.*?)</blockquote>", r"> \1\n", text, flags=re.DOTALL)
+    text = re.sub(r"<p[^>]*>(.*?)</p>", r"\1\n", text, flags=re.DOTALL)
+    text = re.sub(r"<br\s*/?>", "\n", text)
+    text = re.sub(r'<a[^>]*href="([^"]*)"[^>]*>(.*?)</a>', r"[\2](\1)", text, flags=re.DOTALL)
+    text = re.sub(r"<strong[^>]*>(.*?)</strong>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(r"<b[^>]*>(.*?)</b>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(r"<em[^>]*>(.*?)</em>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(r"<i[^>]*>(.*?)</i>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(r"<code[^>]*>(.*?)</code>", r"\1", text, flags=re.DOTALL)
+    text = re.sub(
+        r"<pre[^>]*>(.*?)</pre>",
+        lambda m: "\n```\n" + m.group(1).strip() + "\n```\n",
+        text,
+        flags=re.DOTALL,
+    )
+    text = re.sub(r"<[^>]+>", "", text)
+    text = text.replace("&nbsp;", " ")
+    text = text.replace("&amp;", "&")
+    text = text.replace("&lt;", "<")
+    text = text.replace("&gt;", ">")
+    text = text.replace("&quot;", '"')
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def parse_blocks(content: str) -> List[dict]:
+    """
+    Разбить контент на блоки: {"type": ..., ...}.
+    Типы: code, image, image_url, h2, h3, list, quote, embed, paragraph.
+    """
+    if looks_like_html(content):
+        content = html_to_text(content)
+
+    blocks = []
+    lines = content.split("\n")
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+
+        if not stripped:
+            i += 1
+            continue
+
+        # Блок кода — маркеры ``` не вставляются
+        if stripped.startswith("```"):
+            code_lines = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                code_lines.append(lines[i])
+                i += 1
+            i += 1
+            blocks.append({"type": "code", "lines": code_lines})
+            continue
+
+        image_match = IMAGE_RE.match(stripped)
+        if image_match:
+            blocks.append({
+                "type": "image",
+                "path": image_match.group(1).strip(),
+                "caption": (image_match.group(2) or "").strip(),
+            })
+            i += 1
+            continue
+
+        image_url_match = IMAGE_URL_RE.match(stripped)
+        if image_url_match:
+            blocks.append({
+                "type": "image_url",
+                "url": image_url_match.group(1).strip(),
+                "caption": (image_url_match.group(2) or "").strip(),
+            })
+            i += 1
+            continue
+
+        if stripped.startswith("## "):
+            blocks.append({"type": "h2", "text": stripped[3:].strip()})
+            i += 1
+            continue
+
+        if stripped.startswith("### "):
+            blocks.append({"type": "h3", "text": stripped[4:].strip()})
+            i += 1
+            continue
+
+        if stripped.startswith(LIST_PREFIXES):
+            items = []
+            while i < len(lines):
+                s = lines[i].strip()
+                if not s.startswith(LIST_PREFIXES):
+                    break
+                items.append(s[2:].strip())
+                i += 1
+            blocks.append({"type": "list", "items": items})
+            continue
+
+        if stripped.startswith("> "):
+            parts = stripped[2:].strip().split(" | ", 1)
+            blocks.append({
+                "type": "quote",
+                "text": parts[0],
+                "author": parts[1] if len(parts) > 1 else "",
+            })
+            i += 1
+            continue
+
+        embed_match = EMBED_RE.match(stripped)
+        if embed_match:
+            blocks.append({"type": "embed", "url": embed_match.group(1)})
+            i += 1
+            continue
+
+        blocks.append({"type": "paragraph", "text": stripped})
+        i += 1
+
+    return blocks
+
+
+def split_links(text: str) -> List[tuple]:
+    """
+    Разбить текст на части: [("text", str), ("link", (текст, url)), ...].
+    """
+    parts = LINK_RE.split(text)
+    result = []
+    i = 0
+    while i < len(parts):
+        if i % 3 == 0:
+            if parts[i]:
+                result.append(("text", parts[i]))
+            i += 1
+        else:
+            result.append(("link", (parts[i], parts[i + 1])))
+            i += 2
+    return result
@@ -14,6 +14,7 @@ import asyncio
 import json
 import os
 import sys
+from typing import List
 
 from dotenv import load_dotenv
 
@@ -42,43 +43,59 @@ def load_article(path: str) -> dict:
     return data
 
 
+def article_kwargs(article: dict, publish_flag: bool) -> dict:
+    """Параметры VcRuClient.create_post из JSON статьи."""
+    content = article.get("content", "")
+    if isinstance(content, list):
+        content = "\n".join(content)
+
+    # Приоритет publish: CLI --publish > article.publish > False
+    final_publish = article.get("publish", False)
+    if publish_flag:
+        final_publish = True
+
+    return {
+        "title": article["title"],
+        "content": content,
+        "tags": article.get("tags") or [],
+        "cover_image": article.get("cover_image"),
+        "cover_image_url": article.get("cover_image_url"),
+        "image_caption": article.get("image_caption", ""),
+        "publish": final_publish,
+    }
+
+
 async def run(
-    file_path: str,
+    file_paths: List[str],
     publish_flag: bool = False,
     keep_open: bool = False,
     headless: bool = False,
 ) -> int:
     """
     Основная логика:
-    1. Загрузить статью
+    1. Загрузить статьи
     2. Запустить браузер
     3. Авторизоваться
-    4. Создать пост
+    4. Создать посты (один браузер на все статьи, между постами — MemoryGovernor)
     5. Опубликовать (если нужно)
+
+    Для нескольких статей возвращается худший код выхода.
     """
     from vcru_client import VcRuClient
-
-    # --- Загрузка статьи ---
-    try:
-        article = load_article(file_path)
-    except (FileNotFoundError, ValueError, json.JSONDecodeError) as e:
-        print(f"Ошибка загрузки статьи: {e}", file=sys.stderr)
+    from memory_governor import MemoryGovernor
+
+    # --- Загрузка статей ---
+    codes = []
+    jobs = []
+    for file_path in file_paths:
+        try:
+            jobs.append(article_kwargs(load_article(file_path), publish_flag))
+        except (FileNotFoundError, ValueError, json.JSONDecodeError) as e:
+            print(f"Ошибка загрузки статьи {file_path}: {e}", file=sys.stderr)
+            codes.append(3)
+    if not jobs:
         return 3
 
-    title = article["title"]
-    content = article.get("content", "")
-    if isinstance(content, list):
-        content = "\n".join(content)
-    tags = article.get("tags") or []
-    cover_image = article.get("cover_image")
-    cover_image_url = article.get("cover_image_url")
-    image_caption = article.get("image_caption", "")
-
-    # Приоритет publish: CLI --publish > article.publish > False
-    final_publish = article.get("publish", False)
-    if publish_flag:
-        final_publish = True
-
     # ENV overrides
     if keep_open:
         os.environ["KEEP_BROWSER_OPEN"] = "true"
@@ -92,6 +109,7 @@ async def run(
         print(f"Ошибка инициализации: {e}", file=sys.stderr)
         return 3
 
+    governor = MemoryGovernor()
     try:
         await client.start()
 
@@ -100,25 +118,24 @@ async def run(
             print("Не удалось авторизоваться на vc.ru", file=sys.stderr)
             return 1
 
-        # --- Создание поста ---
-        ok = await client.create_post(
-            title=title,
-            content=content,
-            tags=tags,
-            cover_image=cover_image,
-            cover_image_url=cover_image_url,
-            image_caption=image_caption,
-            publish=final_publish,
-        )
+        for index, job in enumerate(jobs):
+            # Пересоздание контекста — только между постами
+            if index > 0:
+                await governor.after_job(client)
+
+            # --- Создание поста ---
+            ok = await client.create_post(**job)
+
+            if ok:
+                action = "опубликован" if job["publish"] else "сохранён как черновик"
+                print(f"Пост {action}: {job['title']}")
+                codes.append(0)
+            else:
+                action = "публикации" if job["publish"] else "создания"
+                print(f"Ошибка {action} поста: {job['title']}", file=sys.stderr)
+                codes.append(2)
 
-        if ok:
-            action = "опубликован" if final_publish else "сохранён как черновик"
-            print(f"Пост {action}: {title}")
-            return 0
-        else:
-            action = "публикации" if final_publish else "создания"
-            print(f"Ошибка {action} поста", file=sys.stderr)
-            return 2
+        return max(codes)
 
     except Exception as e:
         print(f"Непредвиденная ошибка: {e}", file=sys.stderr)
@@ -137,9 +154,10 @@ def main():
   python main.py --file articles/semechki.json --publish
   python main.py --file articles/semechki.json --publish --keep-open
   python main.py --file articles/semechki.json --headless
+  python main.py --file articles/a.json articles/b.json --publish --headless
         """,
     )
-    parser.add_argument("--file", "-f", required=True, help="Путь к JSON статье")
+    parser.add_argument("--file", "-f", required=True, nargs="+", help="Путь к JSON статье (можно несколько)")
     parser.add_argument("--publish", action="store_true", help="Опубликовать (иначе черновик)")
     parser.add_argument("--keep-open", action="store_true", help="Не закрывать браузер после")
     parser.add_argument("--headless", action="store_true", help="Запуск в headless режиме")
@@ -147,7 +165,7 @@ def main():
 
     code = asyncio.run(
         run(
-            file_path=args.file,
+            file_paths=args.file,
             publish_flag=args.publish,
             keep_open=args.keep_open,
             headless=args.headless,
@@ -25,7 +25,8 @@ async def main():
     os.environ["HEADLESS"] = "false"
     
     try:
-        client = VcRuClient()
+        # Аккаунт для session vault: python manual_login_helper.py [имя_аккаунта]
+        client = VcRuClient(account=sys.argv[1] if len(sys.argv) > 1 else None)
         await client.start()
         
         logger.info("Открываю vc.ru...")
@@ -45,7 +46,8 @@ async def main():
         if await client._is_logged_in():
             logger.info("Успешно авторизованы!")
             await client.save_cookies()
-            logger.info(f"Cookies сохранены в {client.storage_state_path}")
+            target = client.vault.path if client.vault else client.storage_state_path
+            logger.info(f"Cookies сохранены в {target}")
             print("\nТеперь вы можете запускать скрипт публикации без ввода пароля.")
         else:
             logger.error("Не удалось обнаружить авторизацию. Вы точно вошли?")
@@ -0,0 +1,144 @@
+"""
+Контроль памяти браузера при публикации многих постов одним VcRuClient.
+
+После каждого поста (строго между задачами) снимает RSS процессов Chromium
+(browser / renderer / прочие), число контекстов и страниц, JS heap текущей
+страницы. Если с последнего пересоздания опубликовано GOVERNOR_MAX_POSTS
+постов или суммарный RSS выше GOVERNOR_MAX_RSS_MB — пересоздаёт контекст
+(VcRuClient.recycle_context, сессия сохраняется).
+
+Метрики пишутся в GOVERNOR_METRICS_FILE: *.prom — формат Prometheus
+(textfile collector node_exporter), иначе JSON.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+CHROMIUM_NAMES = ("chrome", "chromium", "headless_shell")
+
+
+def _chromium_processes():
+    """Процессы Chromium — потомки текущего процесса (через драйвер Playwright)."""
+    try:
+        children = psutil.Process(os.getpid()).children(recursive=True)
+    except psutil.Error:
+        return []
+    result = []
+    for proc in children:
+        try:
+            name = proc.name().lower()
+            if any(n in name for n in CHROMIUM_NAMES):
+                result.append((proc, proc.cmdline(), proc.memory_info().rss))
+        except psutil.Error:
+            continue
+    return result
+
+
+def sample_processes() -> dict:
+    """RSS по ролям процессов Chromium, байты."""
+    stats = {"browser_rss": 0, "renderer_rss": 0, "other_rss": 0, "renderers": 0, "processes": 0}
+    for _, cmdline, rss in _chromium_processes():
+        stats["processes"] += 1
+        proc_type = next((a.split("=", 1)[1] for a in cmdline if a.startswith("--type=")), None)
+        if proc_type is None:
+            stats["browser_rss"] += rss
+        elif proc_type == "renderer":
+            stats["renderer_rss"] += rss
+            stats["renderers"] += 1
+        else:
+            stats["other_rss"] += rss
+    stats["total_rss"] = stats["browser_rss"] + stats["renderer_rss"] + stats["other_rss"]
+    return stats
+
+
+class MemoryGovernor:
+    def __init__(
+        self,
+        max_posts: Optional[int] = None,
+        max_rss_mb: Optional[float] = None,
+        metrics_file: Optional[str] = None,
+    ):
+        self.max_posts = max_posts or int(os.getenv("GOVERNOR_MAX_POSTS", "20"))
+        self.max_rss = (max_rss_mb or float(os.getenv("GOVERNOR_MAX_RSS_MB", "1500"))) * MB
+        self.metrics_file = metrics_file if metrics_file is not None else os.getenv("GOVERNOR_METRICS_FILE", "")
+
+        self.posts_total = 0
+        self.posts_since_recycle = 0
+        self.recycles = 0
+        self.last_sample: dict = {}
+        self.peak_rss = 0
+
+    async def sample(self, client) -> dict:
+        stats = sample_processes()
+        stats["contexts"] = len(client.browser.contexts) if client.browser else 0
+        stats["pages"] = sum(len(ctx.pages) for ctx in client.browser.contexts) if client.browser else 0
+        stats["js_heap"] = 0
+        try:
+            heap = await client.page.evaluate(
+                "() => performance.memory ? performance.memory.usedJSHeapSize : 0"
+            )
+            stats["js_heap"] = int(heap or 0)
+        except Exception:
+            pass
+        stats["timestamp"] = time.time()
+        self.peak_rss = max(self.peak_rss, stats["total_rss"])
+        self.last_sample = stats
+        return stats
+
+    async def after_job(self, client) -> bool:
+        """Вызывать между постами. True — контекст был пересоздан."""
+        self.posts_total += 1
+        self.posts_since_recycle += 1
+        stats = await self.sample(client)
+        logger.info(
+            "Память браузера: %.0f МБ (renderer %.0f МБ, процессов %d), страниц %d, постов с пересоздания %d",
+            stats["total_rss"] / MB, stats["renderer_rss"] / MB, stats["processes"],
+            stats["pages"], self.posts_since_recycle,
+        )
+
+        reason = None
+        if self.posts_since_recycle >= self.max_posts:
+            reason = f"{self.posts_since_recycle} постов"
+        elif stats["total_rss"] >= self.max_rss:
+            reason = f"RSS {stats['total_rss'] / MB:.0f} МБ"
+
+        if reason:
+            logger.info("Пересоздаём контекст браузера (%s)", reason)
+            await client.recycle_context()
+            self.recycles += 1
+            self.posts_since_recycle = 0
+            await self.sample(client)
+
+        self.write_metrics()
+        return bool(reason)
+
+    def metrics(self) -> dict:
+        return {
+            "posts_total": self.posts_total,
+            "posts_since_recycle": self.posts_since_recycle,
+            "recycles_total": self.recycles,
+            "peak_rss_bytes": self.peak_rss,
+            **{k: v for k, v in self.last_sample.items() if k != "timestamp"},
+        }
+
+    def write_metrics(self):
+        if not self.metrics_file:
+            return
+        data = self.metrics()
+        tmp_path = self.metrics_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if self.metrics_file.endswith(".prom"):
+                for key, value in data.items():
+                    f.write(f"vcru_autopost_{key} {value}\n")
+            else:
+                json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.metrics_file)
@@ -0,0 +1,332 @@
+"""
+Сбор статистики опубликованных постов vc.ru (просмотры, лайки, комментарии).
+
+Каждый пост, прошедший _verify_publication, записывается в SQLite
+(vcru_stats.sqlite3). Сборщик опрашивает API vc.ru пачками: параллельно,
+с ограничением запросов в секунду, через один пул keep-alive соединений
+и с условными запросами (ETag / Last-Modified) — без загрузки страниц.
+
+Хранение компактное: точка пишется только если счётчики изменились,
+точки старше STATS_RAW_DAYS сворачиваются в одну на день.
+Свежие посты опрашиваются чаще, старые — реже.
+
+Запуск:
+  python post_stats.py harvest                 # один проход (cron / systemd timer)
+  python post_stats.py export --out stats.csv  # агрегаты для Google Sheets
+  python post_stats.py track 1234567 "Заголовок"
+"""
+
+import argparse
+import asyncio
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import time
+from typing import Optional, List
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STATS_DB = os.getenv("STATS_DB", "vcru_stats.sqlite3")
+STATS_API_URL = os.getenv("STATS_API_URL", "https://api.vc.ru/v2.1/content")
+STATS_RAW_DAYS = int(os.getenv("STATS_RAW_DAYS", "7"))
+
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    post_id       INTEGER PRIMARY KEY,
+    title         TEXT,
+    url           TEXT,
+    account       TEXT,
+    published_at  INTEGER NOT NULL,
+    etag          TEXT,
+    last_modified TEXT,
+    last_checked  INTEGER NOT NULL DEFAULT 0,
+    active        INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS samples (
+    post_id  INTEGER NOT NULL,
+    ts       INTEGER NOT NULL,
+    views    INTEGER,
+    likes    INTEGER,
+    comments INTEGER,
+    PRIMARY KEY (post_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS samples_daily (
+    post_id  INTEGER NOT NULL,
+    day      INTEGER NOT NULL,
+    views    INTEGER,
+    likes    INTEGER,
+    comments INTEGER,
+    PRIMARY KEY (post_id, day)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS posts_due ON posts (active, last_checked);
+"""
+
+# Интервал опроса по возрасту поста: (возраст до, секунд; интервал, секунд)
+POLL_SCHEDULE = [(2 * DAY, 3600), (30 * DAY, 6 * 3600), (None, DAY)]
+
+
+class PostStatsStore:
+    """SQLite-хранилище постов и временных рядов счётчиков."""
+
+    def __init__(self, path: str = STATS_DB):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def track(self, post_id: int, title: str = "", url: str = "", account: str = ""):
+        """Запомнить опубликованный пост (повторный вызов обновляет заголовок)."""
+        with self.db:
+            self.db.execute(
+                "INSERT INTO posts (post_id, title, url, account, published_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (post_id) DO UPDATE SET title = excluded.title, url = excluded.url, active = 1",
+                (post_id, title, url or f"https://vc.ru/{post_id}", account, int(time.time())),
+            )
+
+    def due_posts(self, now: Optional[int] = None, limit: Optional[int] = None) -> List[tuple]:
+        """(post_id, etag, last_modified) постов, которым пора обновить счётчики."""
+        now = now or int(time.time())
+        case = " ".join(
+            f"WHEN ? - published_at < {age} THEN {interval}" for age, interval in POLL_SCHEDULE if age
+        )
+        default = POLL_SCHEDULE[-1][1]
+        sql = (
+            "SELECT post_id, etag, last_modified FROM posts WHERE active = 1 "
+            f"AND ? - last_checked >= CASE {case} ELSE {default} END "
+            "ORDER BY last_checked"
+        )
+        params = [now] + [now] * sum(1 for age, _ in POLL_SCHEDULE if age)
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.db.execute(sql, params).fetchall()
+
+    def save_results(self, results: List[dict], now: Optional[int] = None):
+        """Записать пачку результатов одной транзакцией."""
+        now = now or int(time.time())
+        with self.db:
+            for r in results:
+                if r.get("gone"):
+                    self.db.execute("UPDATE posts SET active = 0, last_checked = ? WHERE post_id = ?", (now, r["post_id"]))
+                    continue
+                if r.get("unparsed"):
+                    self.db.execute(
+                        "UPDATE posts SET last_checked = ?, etag = NULL, last_modified = NULL WHERE post_id = ?",
+                        (now, r["post_id"]),
+                    )
+                    continue
+                self.db.execute(
+                    "UPDATE posts SET last_checked = ?, etag = COALESCE(?, etag), "
+                    "last_modified = COALESCE(?, last_modified) WHERE post_id = ?",
+                    (now, r.get("etag"), r.get("last_modified"), r["post_id"]),
+                )
+                if r.get("counters") is None:
+                    continue  # 304 или ошибка — точку не пишем
+                views, likes, comments = r["counters"]
+                last = self.db.execute(
+                    "SELECT views, likes, comments FROM samples WHERE post_id = ? ORDER BY ts DESC LIMIT 1",
+                    (r["post_id"],),
+                ).fetchone()
+                if last == (views, likes, comments):
+                    continue
+                self.db.execute(
+                    "INSERT OR REPLACE INTO samples (post_id, ts, views, likes, comments) VALUES (?, ?, ?, ?, ?)",
+                    (r["post_id"], now, views, likes, comments),
+                )
+
+    def downsample(self, raw_days: int = STATS_RAW_DAYS, now: Optional[int] = None) -> int:
+        """Свернуть точки старше raw_days в дневные (последнее значение дня)."""
+        cutoff = (now or int(time.time())) - raw_days * DAY
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO samples_daily (post_id, day, views, likes, comments) "
+                "SELECT post_id, day, views, likes, comments FROM ("
+                # SQLite: при MAX(ts) остальные столбцы берутся из той же строки
+                "SELECT post_id, ts / ? AS day, views, likes, comments, MAX(ts) "
+                "FROM samples WHERE ts < ? GROUP BY post_id, day)",
+                (DAY, cutoff),
+            )
+            deleted = self.db.execute("DELETE FROM samples WHERE ts < ?", (cutoff,)).rowcount
+        return deleted
+
+    def aggregates(self, now: Optional[int] = None) -> List[dict]:
+        """Последние значения и прирост просмотров за 24 часа и 7 дней."""
+        now = now or int(time.time())
+        series = (
+            "SELECT post_id, ts, views, likes, comments FROM samples "
+            "UNION ALL SELECT post_id, day * ? + ? - 1, views, likes, comments FROM samples_daily"
+        )
+        rows = self.db.execute(
+            f"""
+            WITH s AS ({series}),
+            latest AS (
+                SELECT post_id, views, likes, comments, MAX(ts) AS ts FROM s GROUP BY post_id
+            )
+            SELECT p.post_id, p.title, p.url, p.published_at,
+                   l.views, l.likes, l.comments,
+                   l.views - (SELECT views FROM s WHERE s.post_id = p.post_id AND s.ts <= ? ORDER BY ts DESC LIMIT 1),
+                   l.views - (SELECT views FROM s WHERE s.post_id = p.post_id AND s.ts <= ? ORDER BY ts DESC LIMIT 1)
+            FROM posts p LEFT JOIN latest l ON l.post_id = p.post_id
+            ORDER BY p.published_at DESC
+            """,
+            (DAY, DAY, now - DAY, now - 7 * DAY),
+        ).fetchall()
+        keys = ["post_id", "title", "url", "published_at", "views", "likes", "comments", "views_24h", "views_7d"]
+        return [dict(zip(keys, row)) for row in rows]
+
+
+# =========================================================================
+# СБОР
+# =========================================================================
+def parse_counters(payload: dict) -> Optional[tuple]:
+    """(views, likes, comments) из ответа API vc.ru."""
+    entry = payload.get("result", payload)
+    if not isinstance(entry, dict):
+        return None
+    counters = entry.get("counters") or {}
+    views = entry.get("hitsCount", counters.get("hits", entry.get("views")))
+    likes = entry.get("likes", {})
+    likes = likes.get("counter", likes.get("summ")) if isinstance(likes, dict) else likes
+    comments = counters.get("comments", entry.get("commentsCount"))
+    if views is None and likes is None and comments is None:
+        return None
+    return views, likes, comments
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду (равномерно)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def fetch_one(client: httpx.AsyncClient, limiter: RateLimiter, post_id: int,
+                    etag: Optional[str], last_modified: Optional[str]) -> dict:
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    await limiter.wait()
+    try:
+        r = await client.get(STATS_API_URL, params={"id": post_id}, headers=headers)
+    except httpx.HTTPError as e:
+        logger.warning("Статистика %s: %s", post_id, e)
+        return {"post_id": post_id}
+    if r.status_code == 304:
+        return {"post_id": post_id}
+    if r.status_code == 404:
+        return {"post_id": post_id, "gone": True}
+    if r.status_code >= 400:
+        logger.warning("Статистика %s: HTTP %s", post_id, r.status_code)
+        return {"post_id": post_id}
+    try:
+        counters = parse_counters(r.json())
+    except ValueError:
+        counters = None
+    if counters is None:
+        # Валидаторы такого ответа не сохраняем: иначе API будет отвечать 304,
+        # пока пост не изменится, и точек не будет
+        logger.warning("Статистика %s: не удалось разобрать ответ", post_id)
+        return {"post_id": post_id, "unparsed": True}
+    return {
+        "post_id": post_id,
+        "etag": r.headers.get("etag"),
+        "last_modified": r.headers.get("last-modified"),
+        "counters": counters,
+    }
+
+
+async def harvest(store: PostStatsStore, concurrency: int = 8, rate: float = 5.0,
+                  batch_size: int = 200, limit: Optional[int] = None) -> int:
+    """Обновить счётчики всех постов, которым пора. Возвращает число опрошенных."""
+    due = store.due_posts(limit=limit)
+    if not due:
+        return 0
+    limiter = RateLimiter(rate)
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def guarded(row):
+        async with sem:
+            return await fetch_one(client, limiter, *row)
+
+    async with httpx.AsyncClient(timeout=20, limits=limits, headers={"Accept": "application/json"}) as client:
+        for start in range(0, len(due), batch_size):
+            batch = due[start:start + batch_size]
+            results = await asyncio.gather(*(guarded(row) for row in batch))
+            store.save_results(results)
+            logger.info("Статистика: %d/%d постов", start + len(batch), len(due))
+    store.downsample()
+    return len(due)
+
+
+def export_csv(store: PostStatsStore, out) -> int:
+    rows = store.aggregates()
+    fields = ["post_id", "title", "url", "published", "views", "likes", "comments", "views_24h", "views_7d"]
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    for r in rows:
+        published = time.strftime("%d.%m.%Y %H:%M", time.localtime(r["published_at"]))
+        writer.writerow([r["post_id"], r["title"], r["url"], published, r["views"], r["likes"],
+                         r["comments"], r["views_24h"], r["views_7d"]])
+    return len(rows)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Статистика постов vc.ru")
+    sub = parser.add_subparsers(dest="command", required=True)
+    h = sub.add_parser("harvest", help="Обновить счётчики")
+    h.add_argument("--concurrency", type=int, default=int(os.getenv("STATS_CONCURRENCY", "8")))
+    h.add_argument("--rate", type=float, default=float(os.getenv("STATS_RATE", "5")), help="Запросов в секунду")
+    h.add_argument("--limit", type=int, default=None)
+    e = sub.add_parser("export", help="CSV с агрегатами")
+    e.add_argument("--out", default=None, help="Файл (по умолчанию stdout)")
+    t = sub.add_parser("track", help="Добавить пост вручную")
+    t.add_argument("post_id", type=int)
+    t.add_argument("title", nargs="?", default="")
+    args = parser.parse_args()
+
+    store = PostStatsStore()
+    try:
+        if args.command == "harvest":
+            count = asyncio.run(harvest(store, args.concurrency, args.rate, limit=args.limit))
+            print(f"Опрошено постов: {count}")
+        elif args.command == "export":
+            if args.out:
+                with open(args.out, "w", encoding="utf-8", newline="") as f:
+                    count = export_csv(store, f)
+                print(f"Выгружено постов: {count} -> {args.out}")
+            else:
+                export_csv(store, sys.stdout)
+        elif args.command == "track":
+            store.track(args.post_id, args.title)
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Фоновое обновление сессий vc.ru.
+
+По расписанию проходит по аккаунтам из session vault и для тех, у кого
+сессия давно не проверялась или cookies скоро истекают, открывает vc.ru
+с сохранённым storage_state, проверяет авторизацию и пересохраняет
+(свежие) cookies. Так публикация почти никогда не попадает в медленный
+вход по паролю или в manual_login_helper.py.
+
+Запуск:
+  python session_refresher.py            # бесконечный цикл
+  python session_refresher.py --once     # один проход (для cron / systemd timer)
+
+Настройки (.env):
+  SESSION_VAULT_KEY             — ключ хранилища (обязателен)
+  SESSION_REFRESH_INTERVAL      — пауза между проходами, сек (по умолчанию 1800)
+  SESSION_MAX_AGE               — перепроверять сессию не реже, сек (по умолчанию 21600)
+  SESSION_EXPIRY_MARGIN         — обновлять за столько секунд до истечения cookies (86400)
+  SESSION_REFRESH_PAUSE_HOURS   — часы публикаций, когда refresher не запускает браузер,
+                                  например "9-12,18-21"
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from vcru_client import VcRuClient
+from session_vault import SessionVault
+
+logger = logging.getLogger("session_refresher")
+
+
+def parse_pause_hours(value: str) -> List[Tuple[int, int]]:
+    """'9-12,18-21' -> [(9, 12), (18, 21)] (конец не включается)."""
+    windows = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        windows.append((int(start), int(end or int(start) + 1)))
+    return windows
+
+
+def in_pause_window(windows: List[Tuple[int, int]], hour: int) -> bool:
+    for start, end in windows:
+        if start <= end and start <= hour < end:
+            return True
+        if start > end and (hour >= start or hour < end):  # окно через полночь
+            return True
+    return False
+
+
+async def refresh_account(account: str) -> bool:
+    """Открыть vc.ru с сохранённой сессией, проверить вход и пересохранить cookies."""
+    client = VcRuClient(account=account)
+    client.headless = True
+    client.keep_open = False
+    try:
+        await client.start()
+        if not await client.login():
+            client.vault.mark_failed(account)
+            logger.error("Сессия %s не восстановлена", account)
+            return False
+        await client.save_cookies()
+        logger.info("Сессия %s обновлена", account)
+        return True
+    except Exception as e:
+        client.vault.mark_failed(account)
+        logger.error("Ошибка обновления сессии %s: %s", account, e)
+        return False
+    finally:
+        await client.close()
+
+
+async def refresh_due(vault: SessionVault, max_age: float, expiry_margin: float) -> int:
+    """Один проход: обновить все сессии, которым пора. Возвращает число неудач."""
+    accounts = vault.accounts()
+    default_account = os.getenv("VCRU_ACCOUNT") or os.getenv("VCRU_EMAIL")
+    if default_account and default_account not in accounts:
+        accounts.append(default_account)
+
+    failures = 0
+    for account in accounts:
+        if not vault.needs_refresh(account, max_age, expiry_margin):
+            logger.debug("Сессия %s ещё свежая", account)
+            continue
+        # Браузеры по одному — refresher не должен раздувать память VPS
+        if not await refresh_account(account):
+            failures += 1
+    return failures
+
+
+async def run_forever(vault: SessionVault, once: bool = False) -> int:
+    interval = float(os.getenv("SESSION_REFRESH_INTERVAL", "1800"))
+    max_age = float(os.getenv("SESSION_MAX_AGE", "21600"))
+    expiry_margin = float(os.getenv("SESSION_EXPIRY_MARGIN", "86400"))
+    pause_windows = parse_pause_hours(os.getenv("SESSION_REFRESH_PAUSE_HOURS", ""))
+
+    while True:
+        if in_pause_window(pause_windows, datetime.now().hour):
+            logger.info("Окно публикаций — refresher пропускает проход")
+            failures = 0
+        else:
+            failures = await refresh_due(vault, max_age, expiry_margin)
+        if once:
+            return 1 if failures else 0
+        await asyncio.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фоновое обновление сессий vc.ru")
+    parser.add_argument("--once", action="store_true", help="Один проход и выход")
+    args = parser.parse_args()
+
+    vault = SessionVault.from_env()
+    if vault is None:
+        print("SESSION_VAULT_KEY не задан в .env", file=sys.stderr)
+        return 3
+    return asyncio.run(run_forever(vault, once=args.once))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
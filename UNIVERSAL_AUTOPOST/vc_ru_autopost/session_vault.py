@@ -0,0 +1,227 @@
+"""
+Хранилище сессий vc.ru (session vault).
+
+Держит storage_state Playwright для нескольких аккаунтов в одном файле,
+каждое состояние зашифровано (Fernet, ключ из SESSION_VAULT_KEY).
+Метаданные (когда сохранено, когда проверено, когда истекают cookies)
+лежат открыто — по ним фоновый refresher решает, кого обновлять,
+не расшифровывая сами cookies. Изменения файла идут под flock на
+<vault>.lock: main.py и session_refresher.py, запущенные одновременно,
+не затирают аккаунты друг друга.
+
+Запуск:
+  python session_vault.py genkey                       # сгенерировать ключ для .env
+  python session_vault.py import vcru_storage_state.json [--account имя]
+  python session_vault.py list
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Optional, List
+
+from dotenv import load_dotenv
+from cryptography.fernet import Fernet, InvalidToken
+
+load_dotenv()
+
+VAULT_VERSION = 1
+
+
+class SessionVault:
+    """Зашифрованное хранилище storage_state по аккаунтам."""
+
+    def __init__(self, path: str, key: str, domain: str = "vc.ru"):
+        self.path = path
+        self.domain = domain
+        self._fernet = Fernet(key.encode() if isinstance(key, str) else key)
+
+    @classmethod
+    def from_env(cls) -> Optional["SessionVault"]:
+        """Vault включается только если задан SESSION_VAULT_KEY."""
+        key = os.getenv("SESSION_VAULT_KEY")
+        if not key:
+            return None
+        path = os.getenv("SESSION_VAULT", "vcru_sessions.vault")
+        return cls(path, key)
+
+    # ------------------------------------------------------------------
+    # Файл
+    # ------------------------------------------------------------------
+    def _read(self) -> dict:
+        if not os.path.exists(self.path):
+            return {"version": VAULT_VERSION, "accounts": {}}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @contextmanager
+    def _locked(self):
+        """Эксклюзивная блокировка на чтение-изменение-запись (файл vault заменяется, поэтому lock отдельный)."""
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, data: dict):
+        """Атомарная запись: временный файл + os.replace."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".vault_", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # ------------------------------------------------------------------
+    # Сессии
+    # ------------------------------------------------------------------
+    def accounts(self) -> List[str]:
+        return sorted(self._read()["accounts"].keys())
+
+    def meta(self, account: str) -> Optional[dict]:
+        entry = self._read()["accounts"].get(account)
+        return dict(entry["meta"]) if entry else None
+
+    def load(self, account: str) -> Optional[dict]:
+        """Расшифрованный storage_state или None (нет записи / чужой ключ)."""
+        entry = self._read()["accounts"].get(account)
+        if not entry:
+            return None
+        try:
+            raw = self._fernet.decrypt(entry["state"].encode())
+        except InvalidToken:
+            return None
+        return json.loads(raw.decode("utf-8"))
+
+    def save(self, account: str, state: dict, validated: bool = True):
+        """Сохранить storage_state и пересчитать срок жизни cookies."""
+        now = time.time()
+        token = self._fernet.encrypt(
+            json.dumps(state, ensure_ascii=False).encode("utf-8")
+        )
+        with self._locked():
+            data = self._read()
+            previous = data["accounts"].get(account, {}).get("meta", {})
+            data["accounts"][account] = {
+                "meta": {
+                    "saved_at": now,
+                    "validated_at": now if validated else previous.get("validated_at"),
+                    "expires_at": self._cookies_expire_at(state, now),
+                    "failures": 0 if validated else previous.get("failures", 0),
+                },
+                "state": token.decode("ascii"),
+            }
+            self._write(data)
+
+    def mark_failed(self, account: str):
+        """Сессия не прошла проверку — увеличиваем счётчик неудач."""
+        with self._locked():
+            data = self._read()
+            entry = data["accounts"].get(account)
+            if not entry:
+                return
+            entry["meta"]["failures"] = entry["meta"].get("failures", 0) + 1
+            entry["meta"]["failed_at"] = time.time()
+            self._write(data)
+
+    def remove(self, account: str):
+        with self._locked():
+            data = self._read()
+            if data["accounts"].pop(account, None) is not None:
+                self._write(data)
+
+    def needs_refresh(
+        self,
+        account: str,
+        max_age: float,
+        expiry_margin: float,
+        now: Optional[float] = None,
+    ) -> bool:
+        """
+        Пора обновлять, если сессию давно не проверяли
+        или cookies домена истекают в пределах expiry_margin секунд.
+        """
+        meta = self.meta(account)
+        if not meta:
+            return True
+        now = now or time.time()
+        validated_at = meta.get("validated_at") or 0
+        if now - validated_at >= max_age:
+            return True
+        expires_at = meta.get("expires_at")
+        return bool(expires_at and expires_at - now <= expiry_margin)
+
+    def _cookies_expire_at(self, state: dict, now: float) -> Optional[float]:
+        """Ближайшее истечение постоянных cookies домена (session-cookies не считаем)."""
+        expiries = [
+            c["expires"]
+            for c in state.get("cookies", [])
+            if self.domain in c.get("domain", "") and c.get("expires", -1) > now
+        ]
+        return min(expiries) if expiries else None
+
+
+# =========================================================================
+# CLI
+# =========================================================================
+def _format_ts(ts: Optional[float]) -> str:
+    if not ts:
+        return "—"
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Хранилище сессий vc.ru")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("genkey", help="Сгенерировать SESSION_VAULT_KEY")
+    imp = sub.add_parser("import", help="Импортировать storage_state JSON")
+    imp.add_argument("path")
+    imp.add_argument("--account", default=os.getenv("VCRU_ACCOUNT") or os.getenv("VCRU_EMAIL"))
+    sub.add_parser("list", help="Список аккаунтов и сроки сессий")
+    rm = sub.add_parser("remove", help="Удалить сессию аккаунта")
+    rm.add_argument("account")
+    args = parser.parse_args()
+
+    if args.command == "genkey":
+        print(Fernet.generate_key().decode("ascii"))
+        return 0
+
+    vault = SessionVault.from_env()
+    if vault is None:
+        print("SESSION_VAULT_KEY не задан в .env", file=sys.stderr)
+        return 3
+
+    if args.command == "import":
+        if not args.account:
+            print("Укажите --account или VCRU_EMAIL в .env", file=sys.stderr)
+            return 3
+        with open(args.path, "r", encoding="utf-8") as f:
+            vault.save(args.account, json.load(f), validated=False)
+        print(f"Сессия {args.account} импортирована в {vault.path}")
+    elif args.command == "list":
+        for account in vault.accounts():
+            meta = vault.meta(account) or {}
+            print(
+                f"{account}: проверена {_format_ts(meta.get('validated_at'))}, "
+                f"cookies до {_format_ts(meta.get('expires_at'))}, "
+                f"неудач {meta.get('failures', 0)}"
+            )
+    elif args.command == "remove":
+        vault.remove(args.account)
+        print(f"Сессия {args.account} удалена")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Кэш тем/подсайтов vc.ru для выбора темы поста.
+
+Список тем снимается один раз (одним проходом по dropdown редактора)
+и хранится в vcru_themes.json: имя темы -> id подсайта (если удалось
+достать) + время снятия. Пока кэш свежий (THEMES_TTL), тема из tags[0]
+сопоставляется без браузера: точное совпадение после нормализации,
+затем нечёткое (difflib). Тем же файлом пользуется article_check.py.
+"""
+
+import difflib
+import json
+import os
+import re
+import time
+from typing import Optional, Dict, Tuple
+
+THEMES_CACHE = os.getenv("THEMES_CACHE", "vcru_themes.json")
+THEMES_TTL = float(os.getenv("THEMES_TTL", str(7 * 24 * 3600)))
+
+# Снять список тем из открытого dropdown "Без темы" (внутри модалки редактора).
+# Ждём popup прямо в странице, чтобы не тратить фиксированные секунды.
+SCRAPE_THEMES_JS = """async () => {
+    const modal = document.querySelector('.modal-fullpage');
+    if (!modal) return null;
+    const opener = [...modal.querySelectorAll('span, div, button, a')]
+        .find(el => /^Без темы/.test(el.textContent.trim()));
+    if (!opener) return null;
+    opener.click();
+
+    const popupSel = '[class*="popup"], [class*="dropdown"], [class*="v-popover"], ' +
+        '[class*="popper"], [class*="tippy"], [class*="select-list"], [class*="subsite-select"]';
+    let popups = [];
+    for (let i = 0; i < 30 && popups.length === 0; i++) {
+        await new Promise(r => setTimeout(r, 100));
+        popups = [...document.querySelectorAll(popupSel)].filter(p => p.offsetHeight > 0);
+    }
+
+    const themes = {};
+    for (const popup of popups) {
+        for (const item of popup.querySelectorAll('div, span, li, a')) {
+            if (item.children.length > 1) continue;
+            const text = item.textContent.trim();
+            if (!text || text.length > 60 || text.startsWith('Без темы') || text in themes) continue;
+            let id = null;
+            const holder = item.closest('[data-id], [data-subsite-id], a[href]');
+            if (holder) {
+                id = holder.dataset.id || holder.dataset.subsiteId || null;
+                if (!id && holder.href) {
+                    const m = holder.href.match(/\\/(?:u|s)\\/(\\d+)/);
+                    id = m ? m[1] : null;
+                }
+            }
+            themes[text] = id;
+        }
+    }
+    return themes;
+}"""
+
+# Выбрать тему одним действием: открыть dropdown и кликнуть по id / точному имени.
+SELECT_THEME_JS = """async ([name, id]) => {
+    const modal = document.querySelector('.modal-fullpage');
+    if (!modal) return null;
+    const opener = [...modal.querySelectorAll('span, div, button, a')]
+        .find(el => /^Без темы/.test(el.textContent.trim()));
+    if (!opener) return null;
+    opener.click();
+
+    const popupSel = '[class*="popup"], [class*="dropdown"], [class*="v-popover"], ' +
+        '[class*="popper"], [class*="tippy"], [class*="select-list"], [class*="subsite-select"]';
+    for (let i = 0; i < 30; i++) {
+        await new Promise(r => setTimeout(r, 100));
+        for (const popup of document.querySelectorAll(popupSel)) {
+            if (popup.offsetHeight === 0) continue;
+            if (id) {
+                const byId = popup.querySelector(`[data-id="${id}"], [data-subsite-id="${id}"]`);
+                if (byId) { byId.click(); return 'id: ' + id; }
+            }
+            for (const item of popup.querySelectorAll('div, span, li, a')) {
+                if (item.textContent.trim() === name) { item.click(); return 'name: ' + name; }
+            }
+        }
+    }
+    return null;
+}"""
+
+
+def normalize(name: str) -> str:
+    name = (name or "").casefold().replace("ё", "е")
+    return re.sub(r"\s+", " ", name).strip()
+
+
+class ThemeResolver:
+    """Кэш name -> id тем с TTL и нечётким сопоставлением."""
+
+    def __init__(self, path: str = THEMES_CACHE, ttl: float = THEMES_TTL, cutoff: float = 0.8):
+        self.path = path
+        self.ttl = ttl
+        self.cutoff = cutoff
+        self.fetched_at = 0.0
+        self.themes: Dict[str, Optional[str]] = {}
+        self._index: Dict[str, str] = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._set(data.get("themes", {}), data.get("fetched_at", 0.0))
+
+    def _set(self, themes: Dict[str, Optional[str]], fetched_at: float):
+        self.themes = dict(themes)
+        self.fetched_at = fetched_at
+        self._index = {normalize(name): name for name in self.themes}
+
+    def update(self, themes: Dict[str, Optional[str]]):
+        """Сохранить свежий список тем."""
+        self._set(themes, time.time())
+        self._save()
+
+    def add(self, name: str, theme_id: Optional[str] = None):
+        """Дописать тему, найденную поиском в dropdown (в снятом списке её не было)."""
+        self._set({**self.themes, name: theme_id}, self.fetched_at)
+        self._save()
+
+    def _save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"fetched_at": self.fetched_at, "themes": self.themes},
+                f, ensure_ascii=False, indent=2,
+            )
+
+    def is_fresh(self) -> bool:
+        return bool(self.themes) and time.time() - self.fetched_at < self.ttl
+
+    def resolve(self, name: str) -> Optional[Tuple[str, Optional[str]]]:
+        """(каноническое имя, id) или None."""
+        key = normalize(name)
+        canonical = self._index.get(key)
+        if canonical is None:
+            close = difflib.get_close_matches(key, self._index.keys(), n=1, cutoff=self.cutoff)
+            if not close:
+                return None
+            canonical = self._index[close[0]]
+        return canonical, self.themes[canonical]
@@ -23,6 +23,11 @@ from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 import logging
 import httpx
 
+from article_format import parse_blocks, split_links
+from post_stats import PostStatsStore
+from session_vault import SessionVault
+from theme_resolver import ThemeResolver, SCRAPE_THEMES_JS, SELECT_THEME_JS
+
 # UTF-8 для кириллицы
 try:
     sys.stdout.reconfigure(encoding="utf-8")
@@ -47,7 +52,7 @@ class VcRuClient:
     BASE_URL = "https://vc.ru"
     EDITOR_URL = "https://vc.ru/?modal=editor"
 
-    def __init__(self):
+    def __init__(self, account: Optional[str] = None):
         self.email = os.getenv("VCRU_EMAIL")
         self.password = os.getenv("VCRU_PASSWORD")
         self.headless = os.getenv("HEADLESS", "false").lower() == "true"
@@ -55,6 +60,13 @@ class VcRuClient:
         self.storage_state_path = os.getenv("STORAGE_STATE", "vcru_storage_state.json")
         self.keep_open = os.getenv("KEEP_BROWSER_OPEN", "false").lower() == "true"
 
+        # Зашифрованное хранилище сессий (если задан SESSION_VAULT_KEY)
+        self.vault = SessionVault.from_env()
+        self.account = account or os.getenv("VCRU_ACCOUNT") or self.email
+
+        # Кэш тем/подсайтов (vcru_themes.json)
+        self.themes = ThemeResolver()
+
         self.playwright = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
@@ -72,6 +84,22 @@ class VcRuClient:
             headless=self.headless,
             args=["--disable-blink-features=AutomationControlled"],
         )
+        storage_state = None
+        if self.vault:
+            storage_state = self.vault.load(self.account)
+            if storage_state:
+                logger.info("Загружена сессия %s из %s", self.account, self.vault.path)
+            else:
+                logger.warning("В %s нет сессии для %s", self.vault.path, self.account)
+        elif self.storage_state_path and os.path.exists(self.storage_state_path):
+            storage_state = self.storage_state_path
+            logger.info("Загружены cookies из %s", self.storage_state_path)
+
+        await self._new_context(storage_state)
+        logger.info("Браузер запущен")
+
+    async def _new_context(self, storage_state=None):
+        """Новый контекст + страница (storage_state — путь к файлу или dict)."""
         context_kwargs = {
             "viewport": {"width": 1920, "height": 1080},
             "user_agent": (
@@ -82,9 +110,8 @@ class VcRuClient:
             "locale": "ru-RU",
             "timezone_id": "Europe/Moscow",
         }
-        if self.storage_state_path and os.path.exists(self.storage_state_path):
-            context_kwargs["storage_state"] = self.storage_state_path
-            logger.info("Загружены cookies из %s", self.storage_state_path)
+        if storage_state:
+            context_kwargs["storage_state"] = storage_state
 
         self.context = await self.browser.new_context(**context_kwargs)
         self.context.set_default_timeout(self.timeout)
@@ -99,7 +126,17 @@ class VcRuClient:
 
         self.page.on("console", _on_console)
         self.page.on("pageerror", _on_page_error)
-        logger.info("Браузер запущен")
+
+    async def recycle_context(self):
+        """
+        Пересоздать контекст браузера, сохранив сессию.
+        Вызывать только МЕЖДУ постами: текущая страница закрывается.
+        """
+        state = await self.context.storage_state()
+        await self.save_cookies()
+        await self.context.close()
+        await self._new_context(state)
+        logger.info("Контекст браузера пересоздан")
 
     async def close(self):
         if self.keep_open:
@@ -112,7 +149,11 @@ class VcRuClient:
         logger.info("Браузер закрыт")
 
     async def save_cookies(self):
-        if self.context and self.storage_state_path:
+        if self.context and self.vault:
+            state = await self.context.storage_state()
+            self.vault.save(self.account, state)
+            logger.info("Сессия %s сохранена в %s", self.account, self.vault.path)
+        elif self.context and self.storage_state_path:
             await self.context.storage_state(path=self.storage_state_path)
             logger.info("Cookies сохранены в %s", self.storage_state_path)
 
@@ -158,6 +199,15 @@ class VcRuClient:
                 logger.info("Уже авторизованы (cookies)")
                 return True
 
+            if self.vault and self.account != self.email:
+                # В vault несколько аккаунтов, а пароль есть только у основного из .env
+                logger.error(
+                    "Сессия %s истекла, а вход по паролю возможен только для %s — "
+                    "запустите manual_login_helper.py",
+                    self.account, self.email,
+                )
+                return False
+
             logger.info("Не залогинены, начинаем вход...")
 
             # 1. Открыть модалку входа (если еще не открыта)
@@ -466,9 +516,76 @@ class VcRuClient:
     # ВЫБОР ТЕМЫ
     # =========================================================================
     async def _select_theme(self, theme_name: str):
+        """
+        Выбрать тему по кэшу тем (theme_resolver): имя сопоставляется без браузера,
+        затем одно действие в модалке — открыть dropdown и кликнуть нужный пункт.
+        Если кэш устарел — один раз снимаем список тем из dropdown.
+        Fallback — поиск по dropdown (_select_theme_dropdown): он находит и
+        подсайты, которых нет в снятом видимом списке; найденная так тема
+        дописывается в кэш.
+        """
+        if not self.themes.is_fresh():
+            await self._refresh_themes()
+
+        match = self.themes.resolve(theme_name)
+        if match is None:
+            logger.info("Тема '%s' не найдена в кэше тем, ищем в dropdown", theme_name)
+            if await self._select_theme_dropdown(theme_name):
+                self.themes.add(theme_name)
+            return
+
+        if match:
+            canonical, theme_id = match
+            current_url = self.page.url
+            try:
+                selected = await self.page.evaluate(SELECT_THEME_JS, [canonical, theme_id])
+            except Exception as e:
+                logger.warning("Ошибка выбора темы из кэша: %s", e)
+                selected = None
+
+            if self.page.url != current_url and "modal=editor" not in self.page.url:
+                logger.warning("Навигация при выборе темы! Возвращаемся в редактор...")
+                await self.page.goto(self.EDITOR_URL, wait_until="domcontentloaded")
+                await self.page.wait_for_timeout(3000)
+                return
+
+            if selected:
+                logger.info("Тема выбрана (%s): %s", selected, canonical)
+                return
+
+            logger.warning("Тема '%s' из кэша не нашлась в dropdown, пробуем поиск", canonical)
+            await self._click_title_area()
+
+        await self._select_theme_dropdown(theme_name)
+
+    async def _refresh_themes(self):
+        """Снять список тем из dropdown редактора и обновить кэш."""
+        current_url = self.page.url
+        try:
+            themes = await self.page.evaluate(SCRAPE_THEMES_JS)
+        except Exception as e:
+            logger.warning("Не удалось снять список тем: %s", e)
+            themes = None
+
+        if self.page.url != current_url and "modal=editor" not in self.page.url:
+            logger.warning("Навигация при чтении тем! Возвращаемся в редактор...")
+            await self.page.goto(self.EDITOR_URL, wait_until="domcontentloaded")
+            await self.page.wait_for_timeout(3000)
+            return
+
+        # Закрыть dropdown кликом по заголовку (НЕ Escape!)
+        await self._click_title_area()
+        if themes:
+            self.themes.update(themes)
+            logger.info("Кэш тем обновлён: %d тем -> %s", len(themes), self.themes.path)
+        else:
+            logger.warning("Список тем пуст — кэш не обновлён")
+
+    async def _select_theme_dropdown(self, theme_name: str) -> bool:
         """
         Выбрать тему через dropdown СТРОГО ВНУТРИ модалки редактора.
         НИКОГДА не кликать по сайдбару основной страницы!
+        True — тема выбрана.
         """
         try:
             logger.info("Выбираем тему: %s", theme_name)
@@ -495,7 +612,7 @@ class VcRuClient:
 
             if not opened:
                 logger.warning("Кнопка 'Без темы' не найдена в модалке")
-                return
+                return False
 
             await self.page.wait_for_timeout(2000)
 
@@ -504,7 +621,7 @@ class VcRuClient:
                 logger.warning("Навигация при выборе темы! Возвращаемся в редактор...")
                 await self.page.goto(self.EDITOR_URL, wait_until="domcontentloaded")
                 await self.page.wait_for_timeout(3000)
-                return
+                return False
 
             # Скриншот dropdown для отладки
             await self.screenshot("theme_dropdown_opened")
@@ -565,7 +682,7 @@ class VcRuClient:
                 logger.warning("Навигация после выбора темы! Возвращаемся...")
                 await self.page.goto(self.EDITOR_URL, wait_until="domcontentloaded")
                 await self.page.wait_for_timeout(3000)
-                return
+                return False
 
             if selected:
                 logger.info("Тема выбрана (%s): %s", selected, theme_name)
@@ -575,6 +692,7 @@ class VcRuClient:
                 await self._click_title_area()
 
             await self.page.wait_for_timeout(500)
+            return bool(selected)
 
         except Exception as e:
             logger.warning("Ошибка выбора темы: %s", e)
@@ -583,6 +701,7 @@ class VcRuClient:
                 await self._click_title_area()
             except Exception:
                 pass
+            return False
 
     async def _click_title_area(self):
         """Кликнуть по заголовку для закрытия dropdown и восстановления фокуса."""
@@ -857,70 +976,41 @@ class VcRuClient:
         Вставить контент в редактор vc.ru.
         Поскольку CodeX Editor может не полностью инициализироваться,
         используем простой подход: набираем текст через keyboard.type.
-        
-        Поддерживаемые маркеры:
-        - ## Заголовок H2
-        - ### Заголовок H3
-        - - / • / * элемент списка
-        - > цитата | автор
-        - [embed:url]
-        - [image:/path/to/file.png|подпись]
-        - [image_url:https://example.com/img.jpg|подпись]
+
+        Разбор маркеров (## / ### / списки / цитаты / [embed:] / [image:] /
+        [image_url:]) — в article_format.parse_blocks.
         """
         logger.info("Вставка контента...")
 
-        # Конвертируем HTML в текст если нужно
-        if "<" in content and ">" in content:
-            content = self._html_to_text(content)
-
         # Убедимся что курсор в контенте (после заголовка)
         await self._click_content_area()
         await self.page.wait_for_timeout(500)
 
-        lines = content.split("\n")
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            stripped = line.strip()
+        for block in parse_blocks(content):
+            kind = block["type"]
 
-            if not stripped:
-                i += 1
-                continue
-
-            # Блок кода — пропускаем маркеры
-            if stripped.startswith("```"):
-                code_lines = []
-                i += 1
-                while i < len(lines) and not lines[i].strip().startswith("```"):
-                    code_lines.append(lines[i])
-                    i += 1
-                i += 1
-                # Вставляем код как текст
-                for code_line in code_lines:
+            # Блок кода — вставляем как текст
+            if kind == "code":
+                for code_line in block["lines"]:
                     await self.page.keyboard.type(code_line, delay=5)
                     await self.page.keyboard.press("Enter")
                     await self.page.wait_for_timeout(50)
                 continue
 
             # Изображение из файла: [image:/path/to/file.png|подпись]
-            image_match = re.match(r"\[image:([^\]|]+?)(?:\|([^\]]*))?\]", stripped)
-            if image_match:
-                img_path = image_match.group(1).strip()
-                img_caption = (image_match.group(2) or "").strip()
+            if kind == "image":
+                img_path = block["path"]
                 logger.info("Вставка изображения из контента: %s", img_path)
                 if os.path.exists(img_path):
-                    await self._insert_image_block(img_path, img_caption)
+                    await self._insert_image_block(img_path, block["caption"])
                 else:
                     logger.warning("Файл изображения не найден: %s", img_path)
-                i += 1
                 await self.page.wait_for_timeout(500)
                 continue
 
             # Изображение по URL: [image_url:https://...|подпись]
-            image_url_match = re.match(r"\[image_url:(https?://[^\]|]+?)(?:\|([^\]]*))?\]", stripped)
-            if image_url_match:
-                img_url = image_url_match.group(1).strip()
-                img_caption = (image_url_match.group(2) or "").strip()
+            if kind == "image_url":
+                img_url = block["url"]
                 logger.info("Вставка изображения по URL из контента: %s", img_url[:80])
                 tmp_path = None
                 try:
@@ -938,7 +1028,7 @@ class VcRuClient:
                             tmp_path = tmp_path.replace(".jpg", ".webp")
                         with open(tmp_path, "wb") as f:
                             f.write(r.content)
-                    await self._insert_image_block(tmp_path, img_caption)
+                    await self._insert_image_block(tmp_path, block["caption"])
                 except Exception as e:
                     logger.warning("Ошибка загрузки inline-изображения: %s", e)
                 finally:
@@ -947,48 +1037,20 @@ class VcRuClient:
                             os.remove(tmp_path)
                         except Exception:
                             pass
-                i += 1
                 await self.page.wait_for_timeout(500)
                 continue
 
-            # H2
-            if stripped.startswith("## "):
-                text = stripped[3:].strip()
-                # Пробуем создать H2 через тулбокс
-                if await self._try_create_block("Подзаголовок"):
-                    await self.page.keyboard.type(text, delay=15)
-                    await self.page.keyboard.press("Enter")
-                else:
-                    await self.page.keyboard.type(text, delay=15)
-                    await self.page.keyboard.press("Enter")
-                i += 1
-                await self.page.wait_for_timeout(200)
-                continue
-
-            # H3
-            if stripped.startswith("### "):
-                text = stripped[4:].strip()
-                if await self._try_create_block("Подзаголовок"):
-                    await self.page.keyboard.type(text, delay=15)
-                    await self.page.keyboard.press("Enter")
-                else:
-                    await self.page.keyboard.type(text, delay=15)
-                    await self.page.keyboard.press("Enter")
-                i += 1
+            # H2 / H3 — пробуем создать подзаголовок через тулбокс
+            if kind in ("h2", "h3"):
+                await self._try_create_block("Подзаголовок")
+                await self.page.keyboard.type(block["text"], delay=15)
+                await self.page.keyboard.press("Enter")
                 await self.page.wait_for_timeout(200)
                 continue
 
             # Список
-            if stripped.startswith(("• ", "- ", "* ")):
-                list_items = []
-                while i < len(lines):
-                    s = lines[i].strip()
-                    if s.startswith(("• ", "- ", "* ")):
-                        list_items.append(s[2:].strip())
-                        i += 1
-                    else:
-                        break
-                # Пробуем создать список через тулбокс
+            if kind == "list":
+                list_items = block["items"]
                 if await self._try_create_block("Список"):
                     for idx, item in enumerate(list_items):
                         await self._type_with_links(item)
@@ -999,7 +1061,7 @@ class VcRuClient:
                     await self.page.keyboard.press("Enter")
                 else:
                     for item in list_items:
-                        await self.page.keyboard.type(f"• ", delay=15)
+                        await self.page.keyboard.type("• ", delay=15)
                         await self._type_with_links(item)
                         await self.page.keyboard.press("Enter")
                         await self.page.wait_for_timeout(100)
@@ -1007,12 +1069,9 @@ class VcRuClient:
                 continue
 
             # Цитата
-            if stripped.startswith("> "):
-                text = stripped[2:].strip()
-                parts = text.split(" | ", 1)
-                quote_text = parts[0]
-                quote_author = parts[1] if len(parts) > 1 else ""
-
+            if kind == "quote":
+                quote_text = block["text"]
+                quote_author = block["author"]
                 if await self._try_create_block("Цитата"):
                     await self.page.keyboard.type(quote_text, delay=15)
                     if quote_author:
@@ -1027,24 +1086,19 @@ class VcRuClient:
                         text_out += f" — {quote_author}"
                     await self.page.keyboard.type(text_out, delay=15)
                     await self.page.keyboard.press("Enter")
-                i += 1
                 await self.page.wait_for_timeout(200)
                 continue
 
             # Embed
-            embed_match = re.match(r"\[embed:(https?://[^\]]+)\]", stripped)
-            if embed_match:
-                url = embed_match.group(1)
-                await self.page.keyboard.type(url, delay=10)
+            if kind == "embed":
+                await self.page.keyboard.type(block["url"], delay=10)
                 await self.page.keyboard.press("Enter")
                 await self.page.wait_for_timeout(2000)
-                i += 1
                 continue
 
             # Обычный параграф (с inline ссылками)
-            await self._type_with_links(stripped)
+            await self._type_with_links(block["text"])
             await self.page.keyboard.press("Enter")
-            i += 1
             await self.page.wait_for_timeout(150)
 
         logger.info("Контент вставлен")
@@ -1209,41 +1263,6 @@ class VcRuClient:
         except Exception:
             return False
 
-    # =========================================================================
-    # HTML -> TEXT
-    # =========================================================================
-    def _html_to_text(self, html: str) -> str:
-        """Конвертация HTML в простой текстовый формат."""
-        text = html
-        text = re.sub(r"<h2[^>]*>(.*?)</h2>", r"\n## \1\n", text, flags=re.DOTALL)
-        text = re.sub(r"<h3[^>]*>(.*?)</h3>", r"\n### \1\n", text, flags=re.DOTALL)
-        text = re.sub(r"<ul[^>]*>(.*?)</ul>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(r"<ol[^>]*>(.*?)</ol>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(r"<li[^>]*>(.*?)</li>", r"- \1\n", text, flags=re.DOTALL)
-        text = re.sub(r"<blockquote[^>]*>(.*?)</blockquote>", r"> \1\n", text, flags=re.DOTALL)
-        text = re.sub(r"<p[^>]*>(.*?)</p>", r"\1\n", text, flags=re.DOTALL)
-        text = re.sub(r"<br\s*/?>", "\n", text)
-        text = re.sub(r'<a[^>]*href="([^"]*)"[^>]*>(.*?)</a>', r"[\2](\1)", text, flags=re.DOTALL)
-        text = re.sub(r"<strong[^>]*>(.*?)</strong>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(r"<b[^>]*>(.*?)</b>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(r"<em[^>]*>(.*?)</em>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(r"<i[^>]*>(.*?)</i>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(r"<code[^>]*>(.*?)</code>", r"\1", text, flags=re.DOTALL)
-        text = re.sub(
-            r"<pre[^>]*>(.*?)</pre>",
-            lambda m: "\n```\n" + m.group(1).strip() + "\n```\n",
-            text,
-            flags=re.DOTALL,
-        )
-        text = re.sub(r"<[^>]+>", "", text)
-        text = text.replace("&nbsp;", " ")
-        text = text.replace("&amp;", "&")
-        text = text.replace("&lt;", "<")
-        text = text.replace("&gt;", ">")
-        text = text.replace("&quot;", '"')
-        text = re.sub(r"\n{3,}", "\n\n", text)
-        return text.strip()
-
     # =========================================================================
     # INLINE ССЫЛКИ (JS Selection API)
     # =========================================================================
@@ -1252,31 +1271,19 @@ class VcRuClient:
         Печатает текст с inline-ссылками [текст](url).
         Ссылки создаются через document.execCommand('createLink').
         """
-        pattern = r"\[([^\]]+)\]\(([^)]+)\)"
-        parts = re.split(pattern, text)
-
-        # parts: [text, link_text, link_url, text, link_text, link_url, ...]
-        i = 0
-        while i < len(parts):
-            if i % 3 == 0:
-                # Обычный текст
-                if parts[i]:
-                    await self.page.keyboard.type(parts[i], delay=12)
-            elif i % 3 == 1:
-                # Текст ссылки
-                link_text = parts[i]
-                link_url = parts[i + 1] if i + 1 < len(parts) else ""
-
-                await self.page.keyboard.type(link_text, delay=12)
-                await self.page.wait_for_timeout(200)
+        for kind, value in split_links(text):
+            if kind == "text":
+                await self.page.keyboard.type(value, delay=12)
+                continue
 
-                # Применяем ссылку через JS
-                ok = await self._create_link_js(link_text, link_url)
-                if not ok:
-                    await self.page.keyboard.type(f" ({link_url})", delay=8)
+            link_text, link_url = value
+            await self.page.keyboard.type(link_text, delay=12)
+            await self.page.wait_for_timeout(200)
 
-                i += 1  # пропускаем URL
-            i += 1
+            # Применяем ссылку через JS
+            ok = await self._create_link_js(link_text, link_url)
+            if not ok:
+                await self.page.keyboard.type(f" ({link_url})", delay=8)
 
     async def _create_link_js(self, link_text: str, url: str) -> bool:
         """Применить ссылку через JS Selection API."""
@@ -1479,6 +1486,14 @@ class VcRuClient:
         if title_prefix in page_title.lower():
             logger.info("Заголовок подтверждён")
 
+        # Запоминаем пост для сборщика статистики (post_stats.py)
+        try:
+            store = PostStatsStore()
+            store.track(post_id, title, public_url, self.account or "")
+            store.close()
+        except Exception as e:
+            logger.warning("Не удалось записать пост в статистику: %s", e)
+
         await self.screenshot("post_published")
         logger.info("ПОСТ ОПУБЛИКОВАН: %s", public_url)
         print(f"\n{'='*50}")
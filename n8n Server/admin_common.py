@@ -0,0 +1,41 @@
+"""
+Общее для страниц админки Streamlit: пул соединений и кэш настроек.
+Функции с st.cache_* должны жить в одном модуле, чтобы app.py и pages/
+делили один пул на процесс.
+"""
+
+import os
+
+import streamlit as st
+from psycopg2.extras import execute_values
+
+import db
+
+SETTINGS_TTL = int(os.getenv("SETTINGS_TTL", "30"))
+
+
+@st.cache_resource
+def get_pool():
+    """Один пул соединений на процесс Streamlit (а не connect на каждый rerun)."""
+    return db.create_pool()
+
+
+@st.cache_data(ttl=SETTINGS_TTL)
+def load_settings():
+    with db.connection(get_pool()) as conn, conn.cursor() as cur:
+        cur.execute("SELECT key, value FROM n8n_app_settings;")
+        return dict(cur.fetchall())
+
+
+def save_settings(changes: dict):
+    """Все изменённые ключи — одним upsert в одной транзакции."""
+    if not changes:
+        return
+    with db.connection(get_pool()) as conn, conn.cursor() as cur:
+        execute_values(
+            cur,
+            "INSERT INTO n8n_app_settings (key, value) VALUES %s "
+            "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;",
+            list(changes.items()),
+        )
+    load_settings.clear()
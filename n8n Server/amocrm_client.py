@@ -0,0 +1,464 @@
+"""
+Асинхронный клиент amoCRM для сервисов рядом с n8n.
+
+Вместо отдельных HTTP-нод ("amocrm: Получить links", "amocrm: Файл с
+drive", "AMO Summary HTTP Request") с ручными таймаутами из
+fix_amocrm_timeout.py:
+
+- одна aiohttp-сессия с keep-alive пулом на оба домена — API аккаунта
+  (<subdomain>.amocrm.ru) и файловый drive-b.amocrm.ru;
+- token bucket на AMOCRM_RPS запросов в секунду (лимит amoCRM — 7) на
+  процесс;
+- повторы на 429/5xx/сетевые ошибки с паузой "full jitter" (случайная
+  от 0 до AMOCRM_RETRY_BASE * 2^попытка, не больше AMOCRM_RETRY_MAX),
+  429 — не раньше Retry-After;
+- сделки, ссылки и примечания кэшируются на AMOCRM_CACHE_TTL секунд,
+  одинаковые одновременные запросы сливаются в один;
+- примечания пишутся пачками: add_notes() — до NOTES_BATCH штук одним
+  POST /api/v4/{entity}/notes, NoteBatcher копит их по таймеру.
+
+Токен: долгосрочный AMOCRM_ACCESS_TOKEN или OAuth2 (AMOCRM_CLIENT_ID,
+AMOCRM_CLIENT_SECRET, AMOCRM_REDIRECT_URI) с парой токенов в таблице
+amocrm_tokens. refresh_token у amoCRM одноразовый, поэтому при гонке
+сервисов проигравший берёт уже обновлённую пару из базы.
+
+  python amocrm_client.py lead 123
+  python amocrm_client.py file <file_uuid>
+  python amocrm_client.py note 123 "Текст примечания"
+
+Проверка без amoCRM: python stubs.py amocrm и AMOCRM_BASE_URL=http://localhost:8606
+AMOCRM_DRIVE_URL=http://localhost:8606 AMOCRM_ACCESS_TOKEN=test.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+
+import aiohttp
+
+import db
+
+logger = logging.getLogger(__name__)
+
+SUBDOMAIN = os.getenv("AMOCRM_SUBDOMAIN", "alexneurosolutions")
+BASE_URL = os.getenv("AMOCRM_BASE_URL", f"https://{SUBDOMAIN}.amocrm.ru").rstrip("/")
+DRIVE_URL = os.getenv("AMOCRM_DRIVE_URL", "https://drive-b.amocrm.ru").rstrip("/")
+RPS = float(os.getenv("AMOCRM_RPS", "7"))
+POOL_SIZE = int(os.getenv("AMOCRM_POOL_SIZE", "10"))
+TIMEOUT = float(os.getenv("AMOCRM_TIMEOUT", "30"))
+MAX_ATTEMPTS = int(os.getenv("AMOCRM_MAX_ATTEMPTS", "5"))
+RETRY_BASE = float(os.getenv("AMOCRM_RETRY_BASE", "0.5"))
+RETRY_MAX = float(os.getenv("AMOCRM_RETRY_MAX", "20"))
+CACHE_TTL = float(os.getenv("AMOCRM_CACHE_TTL", "60"))
+CACHE_SIZE = 2000
+NOTES_BATCH = int(os.getenv("AMOCRM_NOTES_BATCH", "50"))
+NOTES_FLUSH_SECONDS = float(os.getenv("AMOCRM_NOTES_FLUSH_SECONDS", "2"))
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS amocrm_tokens (
+    subdomain TEXT PRIMARY KEY,
+    access_token TEXT NOT NULL,
+    refresh_token TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+"""
+
+
+class AmoCRMError(Exception):
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+
+
+# =========================================================================
+# ТОКЕНЫ
+# =========================================================================
+class TokenStore:
+    """Пара OAuth-токенов в amocrm_tokens (общая для всех сервисов) или статичный токен."""
+
+    def __init__(self, pool=None, subdomain: str = SUBDOMAIN):
+        self.pool = pool
+        self.subdomain = subdomain
+        self.static = os.getenv("AMOCRM_ACCESS_TOKEN", "")
+        self.access_token = self.static
+        self.refresh_token = os.getenv("AMOCRM_REFRESH_TOKEN", "")
+        self.expires_at = float("inf") if self.static else 0.0
+        self._lock = asyncio.Lock()
+
+    def _db(self, func, *args):
+        def _call():
+            with db.connection(self.pool) as conn:
+                return func(conn, *args)
+        return asyncio.to_thread(_call)
+
+    @staticmethod
+    def _load(conn, subdomain):
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT access_token, refresh_token, extract(epoch FROM expires_at) "
+                "FROM amocrm_tokens WHERE subdomain = %s;",
+                (subdomain,),
+            )
+            return cur.fetchone()
+
+    @staticmethod
+    def _save(conn, subdomain, access_token, refresh_token, expires_in, old_refresh):
+        """Записать новую пару, если в базе ещё старая (иначе её уже обновил другой сервис)."""
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO amocrm_tokens (subdomain, access_token, refresh_token, expires_at)
+                VALUES (%s, %s, %s, now() + %s * interval '1 second')
+                ON CONFLICT (subdomain) DO UPDATE SET
+                    access_token = EXCLUDED.access_token,
+                    refresh_token = EXCLUDED.refresh_token,
+                    expires_at = EXCLUDED.expires_at,
+                    updated_at = now()
+                WHERE amocrm_tokens.refresh_token = %s;
+                """,
+                (subdomain, access_token, refresh_token, expires_in, old_refresh),
+            )
+
+    def _apply(self, row):
+        access_token, refresh_token, expires_epoch = row
+        self.access_token, self.refresh_token = access_token, refresh_token
+        self.expires_at = time.monotonic() + float(expires_epoch) - time.time()
+
+    async def get(self, session: aiohttp.ClientSession) -> str:
+        if self.static:
+            return self.static
+        async with self._lock:
+            if time.monotonic() < self.expires_at - 60:
+                return self.access_token
+            if self.pool:
+                row = await self._db(self._load, self.subdomain)
+                if row:
+                    self._apply(row)
+                    if time.monotonic() < self.expires_at - 60:
+                        return self.access_token
+            await self._refresh(session)
+            return self.access_token
+
+    async def invalidate(self, session: aiohttp.ClientSession, failed_token: str):
+        """401: токен отозван/истёк раньше срока — обновить, если ещё не обновили."""
+        if self.static:
+            raise AmoCRMError("amoCRM отклонил AMOCRM_ACCESS_TOKEN", 401)
+        async with self._lock:
+            if self.access_token == failed_token:
+                self.expires_at = 0.0
+        await self.get(session)
+
+    async def _refresh(self, session: aiohttp.ClientSession):
+        if not self.refresh_token:
+            raise AmoCRMError("Нет токена amoCRM: AMOCRM_ACCESS_TOKEN или refresh_token в amocrm_tokens")
+        old_refresh = self.refresh_token
+        body = {
+            "client_id": os.getenv("AMOCRM_CLIENT_ID", ""),
+            "client_secret": os.getenv("AMOCRM_CLIENT_SECRET", ""),
+            "grant_type": "refresh_token",
+            "refresh_token": old_refresh,
+            "redirect_uri": os.getenv("AMOCRM_REDIRECT_URI", ""),
+        }
+        async with session.post(f"{BASE_URL}/oauth2/access_token", json=body) as resp:
+            data = await resp.json(content_type=None)
+        if resp.status >= 400 or "access_token" not in data:
+            # refresh_token уже использован другим сервисом — свежая пара в базе
+            # (он может ещё не успеть её записать)
+            for _ in range(5 if self.pool else 0):
+                row = await self._db(self._load, self.subdomain)
+                if row and row[1] != old_refresh:
+                    logger.info("Токен amoCRM уже обновлён другим сервисом")
+                    self._apply(row)
+                    return
+                await asyncio.sleep(0.5)
+            raise AmoCRMError(f"Обновление токена amoCRM: HTTP {resp.status} {data}", resp.status)
+        self.access_token, self.refresh_token = data["access_token"], data["refresh_token"]
+        self.expires_at = time.monotonic() + float(data.get("expires_in", 86400))
+        if self.pool:
+            await self._db(self._save, self.subdomain, self.access_token, self.refresh_token,
+                           float(data.get("expires_in", 86400)), old_refresh)
+        logger.info("Токен amoCRM обновлён")
+
+
+# =========================================================================
+# ЛИМИТ И КЭШ
+# =========================================================================
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:  # ожидающие встают в очередь, а не просыпаются все разом
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TTLCache:
+    """Кэш ответов на ttl секунд; одинаковые одновременные запросы ждут один."""
+
+    def __init__(self, ttl: float = CACHE_TTL, size: int = CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.items = {}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, factory):
+        item = self.items.get(key)
+        if item and item[0] > time.monotonic():
+            self.hits += 1
+            return item[1]
+        if key in self.inflight:
+            self.hits += 1
+            return await asyncio.shield(self.inflight[key])
+        self.misses += 1
+        future = asyncio.ensure_future(factory())
+        self.inflight[key] = future
+        try:
+            value = await asyncio.shield(future)
+        finally:
+            self.inflight.pop(key, None)
+        if len(self.items) >= self.size:
+            now = time.monotonic()
+            self.items = {k: v for k, v in self.items.items() if v[0] > now}
+            if len(self.items) >= self.size:
+                self.items.clear()
+        self.items[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def drop(self, prefix: tuple):
+        for key in [k for k in self.items if k[:len(prefix)] == prefix]:
+            del self.items[key]
+
+
+# =========================================================================
+# КЛИЕНТ
+# =========================================================================
+class AmoCRM:
+    def __init__(self, pool=None, session: aiohttp.ClientSession = None, rps: float = RPS):
+        self.tokens = TokenStore(pool)
+        # Ёмкость 1 — запросы идут равномерно: amoCRM считает лимит скользящим окном,
+        # и пачка из rps запросов сразу после паузы упирается в 429
+        self.bucket = TokenBucket(rps, capacity=1)
+        self.cache = TTLCache()
+        self._own_session = session is None
+        self.session = session or aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=POOL_SIZE, limit_per_host=POOL_SIZE, keepalive_timeout=60, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+        )
+        self.requests = 0
+        self.retries = 0
+
+    async def close(self):
+        if self._own_session:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @staticmethod
+    def _pause(attempt: int, retry_after: float = None) -> float:
+        delay = random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    async def request(self, method: str, url: str, **kwargs):
+        """Запрос с лимитом, токеном и повторами; JSON ответа (None для 204)."""
+        last_error = None
+        for attempt in range(MAX_ATTEMPTS):
+            retry_after = None
+            try:
+                token = await self.tokens.get(self.session)
+                await self.bucket.acquire()
+                self.requests += 1
+                async with self.session.request(
+                    method, url, headers={"Authorization": f"Bearer {token}"}, **kwargs,
+                ) as resp:
+                    if resp.status == 204:
+                        return None
+                    if resp.status < 400:
+                        return await resp.json(content_type=None)
+                    text = (await resp.text())[:300]
+                    last_error = AmoCRMError(f"{method} {url}: HTTP {resp.status} {text}", resp.status)
+                    if resp.status == 401 and attempt == 0:
+                        await self.tokens.invalidate(self.session, token)
+                        continue
+                    if resp.status != 429 and resp.status < 500:
+                        raise last_error
+                    header = resp.headers.get("Retry-After", "")
+                    retry_after = float(header) if header.isdigit() else (1.0 if resp.status == 429 else None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = AmoCRMError(f"{method} {url}: {type(e).__name__}: {e}")
+            if attempt + 1 < MAX_ATTEMPTS:
+                self.retries += 1
+                delay = self._pause(attempt, retry_after)
+                logger.warning("amoCRM: %s, повтор через %.1f с", last_error, delay)
+                await asyncio.sleep(delay)
+        raise last_error
+
+    # --- чтение (с кэшем) ---
+
+    async def get_lead(self, lead_id: int, with_: str = "contacts") -> dict:
+        return await self.cache.get(
+            ("lead", int(lead_id), with_),
+            lambda: self.request("GET", f"{BASE_URL}/api/v4/leads/{int(lead_id)}", params={"with": with_}),
+        )
+
+    async def get_lead_links(self, lead_id: int) -> list:
+        data = await self.cache.get(
+            ("links", int(lead_id)),
+            lambda: self.request("GET", f"{BASE_URL}/api/v4/leads/{int(lead_id)}/links"),
+        )
+        return (data or {}).get("_embedded", {}).get("links", [])
+
+    async def get_note(self, entity: str, note_id: int) -> dict:
+        return await self.cache.get(
+            ("note", entity, int(note_id)),
+            lambda: self.request("GET", f"{BASE_URL}/api/v4/{entity}/notes/{int(note_id)}"),
+        )
+
+    async def get_file(self, file_uuid: str) -> dict:
+        """Файл на drive-b: метаданные и ссылки на скачивание."""
+        return await self.cache.get(
+            ("file", file_uuid),
+            lambda: self.request("GET", f"{DRIVE_URL}/v1.0/files/{file_uuid}"),
+        )
+
+    async def file_download_url(self, file_uuid: str) -> str:
+        data = await self.get_file(file_uuid)
+        links = data.get("_links", {})
+        href = (links.get("download_version") or links.get("download") or {}).get("href")
+        if not href:
+            raise AmoCRMError(f"У файла {file_uuid} нет ссылки на скачивание")
+        return href
+
+    # --- запись ---
+
+    async def add_notes(self, entity: str, notes: list) -> list:
+        """
+        Примечания [{"entity_id", "note_type", "params"}] одним запросом на
+        каждые NOTES_BATCH штук (POST /api/v4/{entity}/notes принимает массив).
+        """
+        created = []
+        for i in range(0, len(notes), NOTES_BATCH):
+            batch = notes[i:i + NOTES_BATCH]
+            data = await self.request("POST", f"{BASE_URL}/api/v4/{entity}/notes", json=batch)
+            created.extend((data or {}).get("_embedded", {}).get("notes", []))
+            for note in batch:
+                self.cache.drop(("lead", int(note["entity_id"])))
+        return created
+
+    async def add_lead_note(self, lead_id: int, text: str) -> dict:
+        created = await self.add_notes("leads", [common_note(lead_id, text)])
+        return created[0] if created else {}
+
+
+def common_note(entity_id: int, text: str) -> dict:
+    return {"entity_id": int(entity_id), "note_type": "common", "params": {"text": text}}
+
+
+class NoteBatcher:
+    """Копит примечания и отправляет их пачкой по размеру или по таймеру."""
+
+    def __init__(self, client: AmoCRM, entity: str = "leads",
+                 batch: int = NOTES_BATCH, flush_seconds: float = NOTES_FLUSH_SECONDS):
+        self.client = client
+        self.entity = entity
+        self.batch = batch
+        self.flush_seconds = flush_seconds
+        self.buffer = []  # (примечание, future)
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, entity_id: int, text: str) -> asyncio.Future:
+        """Поставить примечание в пачку; future завершится после записи."""
+        future = asyncio.get_running_loop().create_future()
+        self.buffer.append((common_note(entity_id, text), future))
+        if len(self.buffer) >= self.batch:
+            self._full.set()
+        return future
+
+    async def flush(self):
+        async with self._flush_lock:
+            self._full.clear()
+            while self.buffer:
+                items, self.buffer = self.buffer[:self.batch], self.buffer[self.batch:]
+                try:
+                    created = await self.client.add_notes(self.entity, [note for note, _ in items])
+                except AmoCRMError as e:
+                    logger.error("Не удалось записать %d примечаний: %s", len(items), e)
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for i, (_, future) in enumerate(items):
+                    if not future.done():
+                        future.set_result(created[i] if i < len(created) else None)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+# =========================================================================
+# CLI
+# =========================================================================
+async def _cli(args):
+    pool = db.create_pool() if os.getenv("AMOCRM_DB", "1") == "1" and not os.getenv("AMOCRM_ACCESS_TOKEN") else None
+    if pool:
+        with db.connection(pool) as conn:
+            ensure_schema(conn)
+    async with AmoCRM(pool) as client:
+        if args.command == "lead":
+            result = {"lead": await client.get_lead(args.id), "links": await client.get_lead_links(args.id)}
+        elif args.command == "file":
+            result = {"file": await client.get_file(args.uuid), "download_url": await client.file_download_url(args.uuid)}
+        else:
+            result = await client.add_lead_note(args.id, args.text)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Клиент amoCRM (проверка доступа и лимитов)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_lead = sub.add_parser("lead", help="Сделка и её связи")
+    p_lead.add_argument("id", type=int)
+    p_file = sub.add_parser("file", help="Файл на drive-b и ссылка на скачивание")
+    p_file.add_argument("uuid")
+    p_note = sub.add_parser("note", help="Добавить примечание к сделке")
+    p_note.add_argument("id", type=int)
+    p_note.add_argument("text")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_cli(args))
+
+
+if __name__ == "__main__":
+    main()
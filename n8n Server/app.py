@@ -1,7 +1,12 @@
 import streamlit as st
-import psycopg2
 import os
 from dotenv import load_dotenv
+from psycopg2 import errors
+
+import db
+import settings_service
+import transcript_compaction
+from admin_common import get_pool, load_settings, save_settings
 
 # Настройка страницы
 st.set_page_config(page_title="n8n Call Analyzer Admin", page_icon="📞")
@@ -9,37 +14,6 @@ st.set_page_config(page_title="n8n Call Analyzer Admin", page_icon="📞")
 st.title("⚙️ Настройки анализа звонков")
 st.markdown("Здесь вы можете изменить логику работы вашего AI-ассистента без правки n8n.")
 
-# Загрузка конфигов (для локальной разработки, на сервере возьмем из Docker)
-DB_CONFIG = {
-    "host": "postgres", # Внутри сети docker
-    "database": "n8n",
-    "user": "root",
-    "password": "Ujp74hLVjaU5pUA1KTshZx2Xr154yAQW"
-}
-
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
-
-def load_settings():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT key, value FROM n8n_app_settings;")
-    settings = dict(cur.fetchall())
-    cur.close()
-    conn.close()
-    return settings
-
-def save_setting(key, value):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO n8n_app_settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;",
-        (key, value)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-
 # Загружаем текущие данные
 current_settings = load_settings()
 
@@ -53,12 +27,26 @@ with st.form("settings_form"):
         type="password"
     )
     
+    stt_backends = {"assemblyai": "AssemblyAI (облако)", "local": "Локально на сервере (Whisper, CPU)"}
+    stt_backend = st.selectbox(
+        "Транскрибация звонков",
+        list(stt_backends),
+        index=list(stt_backends).index(current_settings.get("stt_backend", "assemblyai"))
+        if current_settings.get("stt_backend") in stt_backends else 0,
+        format_func=stt_backends.get,
+    )
+
     st.subheader("2. Логика анализа (Промпт)")
     system_prompt = st.text_area(
         "Системный промпт для эксперта", 
         value=current_settings.get("system_prompt", "Ты — Эксперт по аудиту продаж..."),
         height=300
     )
+    ivr_phrases = st.text_area(
+        "Фразы автоответчика (IVR) — вырезаются из транскрипции перед анализом, по одной в строке",
+        value=current_settings.get("ivr_phrases", "\n".join(transcript_compaction.DEFAULT_IVR_PHRASES)),
+        height=150
+    )
     
     st.subheader("3. Уведомления")
     tg_chat_id = st.text_input(
@@ -69,11 +57,43 @@ with st.form("settings_form"):
     submitted = st.form_submit_button("Сохранить настройки")
     
     if submitted:
-        save_setting("gemini_key", gemini_key)
-        save_setting("system_prompt", system_prompt)
-        save_setting("tg_chat_id", tg_chat_id)
+        submitted_values = {
+            "gemini_key": gemini_key,
+            "stt_backend": stt_backend,
+            "system_prompt": system_prompt,
+            "ivr_phrases": ivr_phrases,
+            "tg_chat_id": tg_chat_id,
+        }
+        changes = {
+            key: value for key, value in submitted_values.items()
+            if current_settings.get(key) != value
+        }
+        save_settings(changes)
         st.success("✅ Настройки сохранены в базу данных!")
         st.info("Теперь n8n будет использовать эти данные при следующем запуске.")
 
+# --- ИСТОРИЯ И ОТКАТ ---
+
+with st.expander("🕓 История изменений и откат"):
+    try:
+        with db.connection(get_pool()) as conn:
+            history = settings_service.history(conn, limit=30)
+    except errors.UndefinedTable:
+        history = None
+        st.info("История появится после первого запуска settings_service.py.")
+
+    if history:
+        for row in history:
+            value = row["value"] if row["key"] != "gemini_key" else "••••••"
+            preview = (value or "(удалено)")[:120]
+            st.markdown(f"**v{row['version']}** · `{row['key']}` · {row['changed_at'][:19]} — {preview}")
+
+        version = st.selectbox("Вернуть настройки к версии", [row["version"] for row in history])
+        if st.button("Откатить"):
+            with db.connection(get_pool()) as conn:
+                changed = settings_service.rollback(conn, version)
+            load_settings.clear()
+            st.success(f"✅ Настройки возвращены к версии {version} (изменено ключей: {changed})")
+
 st.sidebar.markdown("---")
 st.sidebar.info("Это MVP панель управления для n8n Call Analyzer.")
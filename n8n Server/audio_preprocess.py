@@ -0,0 +1,190 @@
+"""
+Подготовка записи звонка перед транскрибацией.
+
+Файл с drive amoCRM (часто стерео-видео или WAV с длинной тишиной и
+ожиданием на линии) потоково перекодируется ffmpeg в моно 16 кГц Opus
+(~24 кбит/с): тишина в начале и конце обрезается, паузы длиннее
+PREPROCESS_MAX_GAP сокращаются до PREPROCESS_KEEP_GAP. Результат по мере
+кодирования уходит в AssemblyAI /v2/upload (chunked), на диск ничего не пишется.
+
+Источник читается aiohttp и подаётся ffmpeg в stdin. Контейнеры, которым
+нужен seek (mp4/m4a/mov/3gp — moov в конце), ffmpeg читает сам по URL
+(HTTP range), тоже без записи на диск.
+
+Одновременно работает не больше PREPROCESS_WORKERS процессов ffmpeg.
+
+Проверка на файле/URL:
+  python audio_preprocess.py https://.../call.wav --out call.ogg
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(os.cpu_count() or 2)))
+BITRATE = os.getenv("PREPROCESS_BITRATE", "24k")
+SILENCE_DB = os.getenv("PREPROCESS_SILENCE_DB", "-45dB")
+MAX_GAP = float(os.getenv("PREPROCESS_MAX_GAP", "2"))
+KEEP_GAP = float(os.getenv("PREPROCESS_KEEP_GAP", "0.7"))
+
+CHUNK_SIZE = 64 * 1024
+SEEK_EXTENSIONS = (".mp4", ".m4a", ".mov", ".3gp")
+
+_slots = None
+
+
+class PreprocessError(Exception):
+    pass
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(WORKERS)
+    return _slots
+
+
+def silence_filter(max_gap: float = MAX_GAP, keep_gap: float = KEEP_GAP, threshold: str = SILENCE_DB) -> str:
+    return (
+        f"silenceremove=start_periods=1:start_threshold={threshold}:start_silence=0.2"
+        f":stop_periods=-1:stop_duration={max_gap}:stop_threshold={threshold}:stop_silence={keep_gap}"
+    )
+
+
+def ffmpeg_args(source: str) -> list:
+    return [
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error",
+        "-i", source,
+        "-vn", "-ac", "1", "-ar", "16000",
+        "-af", silence_filter(),
+        "-c:a", "libopus", "-b:a", BITRATE, "-application", "voip",
+        "-f", "ogg", "pipe:1",
+    ]
+
+
+def needs_seek(url: str) -> bool:
+    return urlparse(url).path.lower().endswith(SEEK_EXTENSIONS)
+
+
+async def _feed(session: aiohttp.ClientSession, url: str, stdin: asyncio.StreamWriter, stats: dict):
+    """Скачивание -> stdin ffmpeg, с backpressure через drain()."""
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=60)) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                stats["bytes_in"] += len(chunk)
+                stdin.write(chunk)
+                await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # ffmpeg завершился раньше — ошибку покажет код возврата
+    finally:
+        if not stdin.is_closing():
+            stdin.close()
+
+
+async def transcode(session: aiohttp.ClientSession, url: str, stats: dict = None, seek: bool = None):
+    """
+    Асинхронный генератор кусков Ogg/Opus. seek=True — ffmpeg читает
+    источник сам (URL или локальный путь). stats заполняется:
+    bytes_in (если качали сами), bytes_out, seconds.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(bytes_in=0, bytes_out=0, seconds=0.0)
+    if seek is None:
+        seek = needs_seek(url)
+    started = time.monotonic()
+    async with _get_slots():
+        proc = await asyncio.create_subprocess_exec(
+            *ffmpeg_args(url if seek else "pipe:0"),
+            stdin=asyncio.subprocess.DEVNULL if seek else asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        feeder = None if seek else asyncio.create_task(_feed(session, url, proc.stdin, stats))
+        try:
+            while True:
+                chunk = await proc.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                stats["bytes_out"] += len(chunk)
+                yield chunk
+            if feeder:
+                await feeder
+            stderr = await proc.stderr.read()
+            if await proc.wait() != 0:
+                raise PreprocessError(f"ffmpeg: {stderr.decode('utf-8', 'replace').strip()[-500:]}")
+        except Exception as e:
+            # При потоковой загрузке aiohttp подменяет исключение генератора своим
+            stats["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if feeder and not feeder.done():
+                feeder.cancel()
+            stats["seconds"] = time.monotonic() - started
+
+
+async def upload(session: aiohttp.ClientSession, base_url: str, api_key: str, chunks) -> str:
+    """Потоковая загрузка в AssemblyAI /v2/upload -> upload_url."""
+    async with session.post(
+        f"{base_url}/v2/upload",
+        data=chunks,
+        headers={"authorization": api_key, "Content-Type": "application/octet-stream"},
+        timeout=aiohttp.ClientTimeout(total=None, sock_read=300),
+    ) as resp:
+        data = await resp.json()
+        if resp.status >= 400:
+            raise PreprocessError(f"upload: HTTP {resp.status} {data}")
+        return data["upload_url"]
+
+
+async def preprocess_and_upload(session: aiohttp.ClientSession, audio_url: str, base_url: str, api_key: str) -> tuple:
+    """(upload_url, stats) для передачи в /v2/transcript вместо исходного URL."""
+    stats = {}
+    try:
+        upload_url = await upload(session, base_url, api_key, transcode(session, audio_url, stats))
+    except aiohttp.ClientError as e:
+        raise PreprocessError(stats.get("error") or str(e)) from e
+    logger.info(
+        "Аудио подготовлено: %s -> %.0f КБ за %.1f с",
+        f"{stats['bytes_in'] / 1024:.0f} КБ" if stats["bytes_in"] else "по URL",
+        stats["bytes_out"] / 1024, stats["seconds"],
+    )
+    return upload_url, stats
+
+
+# =========================================================================
+# CLI
+# =========================================================================
+async def _to_file(source: str, out: str):
+    local = "://" not in source
+    stats = {}
+    async with aiohttp.ClientSession() as session:
+        with open(out, "wb") as f:
+            async for chunk in transcode(session, os.path.abspath(source) if local else source, stats, seek=local or None):
+                f.write(chunk)
+    size_in = os.path.getsize(source) if local else stats["bytes_in"]
+    print(f"{source}: {size_in / 1024:.0f} КБ -> {stats['bytes_out'] / 1024:.0f} КБ за {stats['seconds']:.1f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перекодировать запись звонка в моно 16 кГц Opus без тишины")
+    parser.add_argument("source", help="URL или путь к файлу")
+    parser.add_argument("--out", default="call.ogg", help="Куда сохранить результат")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_to_file(args.source, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Длительность записи звонка по заголовку файла, без скачивания целиком.
+
+Один GET с Range: bytes=0-PROBE_BYTES: из ответа — первые килобайты и полный
+размер (Content-Range). Дальше:
+  WAV  — byte rate из fmt и размер data;
+  MP3  — число кадров из заголовка Xing/Info/VBRI (VBR) или битрейт
+         первого кадра и размер файла (CBR);
+  иное — размер / PROBE_DEFAULT_KBPS.
+Нужна для планирования очереди (job_queue): короткие звонки вперёд.
+
+  python audio_probe.py <url> [<url> ...]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+PROBE_BYTES = int(os.getenv("PROBE_BYTES", str(64 * 1024)))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "5"))
+PROBE_DEFAULT_KBPS = float(os.getenv("PROBE_DEFAULT_KBPS", "64"))  # типичный mp3 телефонии
+
+# Битрейт MP3 Layer III, кбит/с: MPEG-1 и MPEG-2/2.5
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+
+
+def wav_duration(head: bytes, total: int) -> float:
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        return None
+    offset, byte_rate = 12, None
+    while offset + 8 <= len(head):
+        chunk, size = head[offset:offset + 4], int.from_bytes(head[offset + 4:offset + 8], "little")
+        if chunk == b"fmt ":
+            byte_rate = int.from_bytes(head[offset + 16:offset + 20], "little")
+        elif chunk == b"data" and byte_rate:
+            # Потоковая запись пишет 0 или 0xFFFFFFFF вместо размера — берём остаток файла
+            if size in (0, 0xFFFFFFFF) and total:
+                size = total - offset - 8
+            return size / byte_rate
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def _id3_size(head: bytes) -> int:
+    if head[:3] != b"ID3" or len(head) < 10:
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    return 10 + size
+
+
+def _frame_header(head: bytes, offset: int) -> tuple:
+    """(версия, индекс битрейта, индекс частоты, моно, длина кадра) или None — не кадр Layer III."""
+    if offset + 4 > len(head):
+        return None
+    b0, b1, b2, b3 = head[offset:offset + 4]
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 2.5}.get((b1 >> 3) & 3)
+    layer, bitrate_index, rate_index = (b1 >> 1) & 3, b2 >> 4, (b2 >> 2) & 3
+    if version is None or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    length = (144 if version == 1 else 72) * bitrate // sample_rate + padding
+    return version, bitrate_index, rate_index, b3 >> 6 == 3, length
+
+
+def mp3_duration(head: bytes, total: int) -> float:
+    start = _id3_size(head)
+    for offset in range(start, len(head) - 4):
+        header = _frame_header(head, offset)
+        if header is None:
+            continue
+        version, bitrate_index, rate_index, mono, length = header
+        # Два байта FF Ex встречаются и в случайных данных (Ogg, M4A, AMR):
+        # верим заголовку, только если сразу за кадром начинается такой же
+        following = _frame_header(head, offset + length)
+        if following is None or following[0] != version or following[2] != rate_index:
+            continue
+        sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+        samples = 1152 if version == 1 else 576
+        side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+
+        xing = offset + 4 + side_info
+        if head[xing:xing + 4] in (b"Xing", b"Info") and len(head) >= xing + 12 and head[xing + 7] & 1:
+            frames = int.from_bytes(head[xing + 8:xing + 12], "big")
+            return frames * samples / sample_rate
+        if head[offset + 36:offset + 40] == b"VBRI" and len(head) >= offset + 54:
+            frames = int.from_bytes(head[offset + 50:offset + 54], "big")
+            return frames * samples / sample_rate
+        if not total:
+            return None
+        bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+        return (total - offset) * 8 / bitrate
+    return None
+
+
+def duration_from_header(head: bytes, total: int = None) -> float:
+    """Секунды по первым байтам файла и его полному размеру; None — не определить."""
+    seconds = wav_duration(head, total) or mp3_duration(head, total)
+    if seconds is None and total:
+        seconds = total * 8 / (PROBE_DEFAULT_KBPS * 1000)
+    return round(seconds, 1) if seconds is not None else None
+
+
+async def probe_url(session: aiohttp.ClientSession, url: str, headers: dict = None, size: int = None) -> float:
+    """Длительность записи по ссылке: один Range-запрос начала файла."""
+    async with session.get(
+        url, headers={**(headers or {}), "Range": f"bytes=0-{PROBE_BYTES - 1}"},
+        timeout=aiohttp.ClientTimeout(total=PROBE_TIMEOUT),
+    ) as resp:
+        if resp.status >= 400:
+            raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status, message="probe")
+        content_range = resp.headers.get("Content-Range", "")
+        if "/" in content_range and content_range.rsplit("/", 1)[1].isdigit():
+            size = int(content_range.rsplit("/", 1)[1])
+        elif resp.status == 200 and resp.content_length:
+            size = resp.content_length
+        head = b""
+        # Сервер без Range отдаст весь файл — читаем только начало и закрываем
+        while len(head) < PROBE_BYTES:
+            chunk = await resp.content.read(PROBE_BYTES - len(head))
+            if not chunk:
+                break
+            head += chunk
+    return duration_from_header(head, size)
+
+
+async def _cli(urls: list):
+    async with aiohttp.ClientSession() as session:
+        for url in urls:
+            try:
+                print(f"{await probe_url(session, url)} с  {url}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"ошибка: {e}  {url}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Длительность записи по заголовку файла")
+    parser.add_argument("urls", nargs="+")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_cli(args.urls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Анализ транскрипции звонка вместо ноды "Message a model1" (Gemini).
+
+Короткий звонок (до ANALYSIS_WINDOW_TOKENS) анализируется одним запросом
+с system_prompt из админки, как раньше. Длинный — map-reduce:
+- map: транскрипция режется на окна по репликам (реплика не рвётся,
+  последние реплики окна повторяются в начале следующего как контекст),
+  из каждого окна параллельно (ANALYSIS_CONCURRENCY) извлекаются факты;
+- reduce: факты всех окон + конец разговора (там договорённости) ->
+  итоговый JSON по system_prompt. Если фактов больше бюджета — сначала
+  сворачиваются группами.
+Ответы Gemini читаются потоком (streamGenerateContent, SSE). Если задан
+LLM_ROUTER_URL, запросы идут через llm_router.py (Gemini/Ollama с
+хеджированием). Итог кэшируется в analysis_cache (call_cache.py).
+Если у транскрипции есть utterances, метрики разговора (доля речи,
+монологи, перебивания, тишина, вопросы) считаются локально
+(conversation_metrics.py): в промпт идёт одна строка с ними вместо
+таймкодов у каждой реплики, в ответ — поле metrics.
+Перед анализом транскрипция сжимается (transcript_compaction.py): фразы
+IVR из админки, слова-паразиты, повторы, бюджет токенов на звонок.
+
+Эндпоинты:
+  POST /analyze   {"transcript": <ответ AssemblyAI> | "text": ..., "system_prompt"?, "model"?, "compact"?: false}
+                  -> JSON как у "Распарсить JSON1" (manager_name, manager_score, ...) + metrics
+                  X-Analysis-Windows, X-Cache, X-Tokens (до->после сжатия)
+  GET  /health    число запросов к LLM, сэкономленные сжатием токены
+
+Запуск:
+  python call_analysis.py        # порт ANALYSIS_PORT (по умолчанию 8506)
+
+Проверка без Gemini: python stubs.py gemini и GEMINI_BASE_URL=http://localhost:8602.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+import aiohttp
+from aiohttp import web
+
+import call_cache
+import conversation_metrics
+import db
+import transcript_compaction
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+LLM_ROUTER_URL = os.getenv("LLM_ROUTER_URL", "").rstrip("/")
+WINDOW_TOKENS = int(os.getenv("ANALYSIS_WINDOW_TOKENS", "6000"))
+REDUCE_TOKENS = int(os.getenv("ANALYSIS_REDUCE_TOKENS", "8000"))
+CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "8"))
+OVERLAP_UTTERANCES = 2
+TAIL_TOKENS = 800
+CHARS_PER_TOKEN = 3.5  # грубая оценка для русского текста
+
+ANALYSIS_KEYS = (
+    "manager_name", "manager_score", "client_intent", "outcome",
+    "good_points", "bad_points", "advice", "next_step", "summary",
+)
+
+MAP_PROMPT = """Ты помогаешь аудитору продаж. Перед тобой ФРАГМЕНТ {index} из {total} длинного телефонного разговора.
+Строки с пометкой [контекст] — конец предыдущего фрагмента, их не анализируй повторно.
+Извлеки только факты из этого фрагмента. Верни ТОЛЬКО JSON без markdown:
+{{
+  "roles": "кто из спикеров менеджер, кто клиент, если понятно",
+  "manager_name": "имя менеджера, если прозвучало, иначе пусто",
+  "client_needs": ["потребности и вопросы клиента"],
+  "objections": ["возражения клиента и как менеджер на них ответил"],
+  "strengths": ["что менеджер сделал хорошо"],
+  "mistakes": ["ошибки менеджера: перебивал, спорил, не знал продукт, не закрыл на шаг"],
+  "agreements": ["договорённости, сроки, суммы, следующий шаг"],
+  "stage": "этап: приветствие / выявление потребностей / презентация / возражения / закрытие"
+}}"""
+
+MERGE_PROMPT = """Объедини факты из нескольких последовательных фрагментов одного разговора
+в один JSON той же структуры (roles, manager_name, client_needs, objections, strengths,
+mistakes, agreements, stage). Убери повторы, сохрани порядок событий. Верни ТОЛЬКО JSON."""
+
+REDUCE_TEMPLATE = """Разговор длинный, поэтому вместо полной транскрипции ниже — факты,
+извлечённые из него по порядку фрагментов, и дословный конец разговора.
+
+ФАКТЫ ПО ФРАГМЕНТАМ:
+{findings}
+
+КОНЕЦ РАЗГОВОРА:
+{tail}"""
+
+
+class AnalysisError(Exception):
+    pass
+
+
+# =========================================================================
+# ОКНА ТРАНСКРИПЦИИ
+# =========================================================================
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _clock(ms) -> str:
+    seconds = int((ms or 0) / 1000)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def transcript_lines(transcript: dict, timestamps: bool = True) -> list:
+    """Реплики "Speaker A [мм:сс]: текст"; без utterances — предложения сплошного текста."""
+    utterances = transcript.get("utterances") or []
+    if utterances:
+        # Без спикера — служебная строка transcript_compaction ("[пропущено реплик: N]")
+        if not timestamps:
+            return [u["text"].strip() if u.get("speaker") is None else f"Speaker {u['speaker']}: {u['text'].strip()}"
+                    for u in utterances]
+        return [u["text"].strip() if u.get("speaker") is None
+                else f"Speaker {u['speaker']} [{_clock(u.get('start'))}]: {u['text'].strip()}"
+                for u in utterances]
+    text = transcript.get("text") or ""
+    return [s for s in re.split(r"(?<=[.!?…])\s+", text) if s]
+
+
+def _split_long(line: str, budget: int) -> list:
+    """Реплика длиннее окна — по предложениям."""
+    parts, current = [], ""
+    for sentence in re.split(r"(?<=[.!?…])\s+", line):
+        if current and estimate_tokens(current + " " + sentence) > budget:
+            parts.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def make_windows(lines: list, budget: int = WINDOW_TOKENS, overlap: int = OVERLAP_UTTERANCES) -> list:
+    """Окна из целых реплик до budget токенов; overlap реплик повторяются как контекст."""
+    expanded = []
+    for line in lines:
+        expanded.extend(_split_long(line, budget // 2) if estimate_tokens(line) > budget // 2 else [line])
+
+    windows, current, tokens = [], [], 0
+    for line in expanded:
+        line_tokens = estimate_tokens(line)
+        has_new = any(not l.startswith("[контекст]") for l in current)
+        if has_new and tokens + line_tokens > budget:
+            windows.append(current)
+            context = [f"[контекст] {l}" for l in current[-overlap:] if not l.startswith("[контекст]")]
+            current = context
+            tokens = sum(estimate_tokens(l) for l in current)
+        current.append(line)
+        tokens += line_tokens
+    if current:
+        windows.append(current)
+    return ["\n".join(w) for w in windows]
+
+
+def tail_text(lines: list, budget: int = TAIL_TOKENS) -> str:
+    tail, tokens = [], 0
+    for line in reversed(lines):
+        tokens += estimate_tokens(line)
+        if tokens > budget and tail:
+            break
+        tail.append(line)
+    return "\n".join(reversed(tail))
+
+
+def parse_json(text: str) -> dict:
+    """Как "Распарсить JSON1": снять ```json и разобрать; иначе — первый {...}. Не объект — ошибка."""
+    cleaned = re.sub(r"```json\n?|```", "", text or "").strip()
+    try:
+        result = json.loads(cleaned)
+    except json.JSONDecodeError:
+        match = re.search(r"\{.*\}", cleaned, re.S)
+        if not match:
+            raise
+        result = json.loads(match.group(0))
+    if not isinstance(result, dict):
+        raise json.JSONDecodeError(f"ожидался объект, получен {type(result).__name__}", cleaned, 0)
+    return result
+
+
+# =========================================================================
+# GEMINI
+# =========================================================================
+async def gemini_stream(
+    session: aiohttp.ClientSession,
+    api_key: str,
+    model: str,
+    system: str,
+    text: str,
+    max_tokens: int = 2048,
+) -> str:
+    """streamGenerateContent (SSE): текст ответа, собранный из частей по мере прихода."""
+    url = f"{GEMINI_BASE_URL}/v1beta/models/{model}:streamGenerateContent"
+    body = {
+        "systemInstruction": {"parts": [{"text": system}]},
+        "contents": [{"role": "user", "parts": [{"text": text}]}],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "maxOutputTokens": max_tokens,
+            "temperature": 0.2,
+        },
+    }
+    parts = []
+    async with session.post(
+        url, params={"alt": "sse", "key": api_key}, json=body,
+        timeout=aiohttp.ClientTimeout(total=None, sock_read=120),
+    ) as resp:
+        if resp.status >= 400:
+            raise AnalysisError(f"Gemini HTTP {resp.status}: {(await resp.text())[:300]}")
+        async for raw in resp.content:
+            line = raw.decode("utf-8", errors="replace").strip()
+            if not line.startswith("data:") or not line[5:].strip():
+                continue
+            try:
+                chunk = json.loads(line[5:])
+            except json.JSONDecodeError as e:
+                raise AnalysisError(f"Gemini: оборванное событие SSE ({e}): {line[:200]}") from e
+            for candidate in chunk.get("candidates", []):
+                for part in candidate.get("content", {}).get("parts", []):
+                    parts.append(part.get("text", ""))
+    return "".join(parts)
+
+
+async def router_generate(session: aiohttp.ClientSession, model: str, system: str, text: str, max_tokens: int = 2048) -> str:
+    """Тот же запрос через llm_router.py: бэкенд выбирает роутер."""
+    body = {"system": system, "prompt": text, "json": True, "max_tokens": max_tokens, "model": model}
+    async with session.post(
+        f"{LLM_ROUTER_URL}/v1/generate", json=body,
+        timeout=aiohttp.ClientTimeout(total=None, sock_read=300),
+    ) as resp:
+        if resp.status >= 400:
+            raise AnalysisError(f"LLM router HTTP {resp.status}: {(await resp.text())[:300]}")
+        return (await resp.json())["text"]
+
+
+class Analyzer:
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int = CONCURRENCY):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.calls = 0
+
+    async def _ask_json(self, api_key: str, model: str, system: str, text: str, max_tokens: int) -> dict:
+        """Запрос с разбором JSON; обрезанный/битый JSON — ещё одна попытка."""
+        last_error = None
+        for attempt in range(2):
+            async with self.semaphore:
+                self.calls += 1
+                if LLM_ROUTER_URL:
+                    answer = await router_generate(self.session, model, system, text, max_tokens)
+                else:
+                    answer = await gemini_stream(self.session, api_key, model, system, text, max_tokens)
+            try:
+                return parse_json(answer)
+            except json.JSONDecodeError as e:
+                last_error = e
+                logger.warning("Gemini вернул не JSON (попытка %d): %s", attempt + 1, answer[:200])
+        raise AnalysisError(f"Не удалось разобрать JSON: {last_error}")
+
+    async def _merge(self, api_key: str, model: str, group: list) -> dict:
+        if len(group) == 1:
+            return group[0]
+        return await self._ask_json(api_key, model, MERGE_PROMPT, json.dumps(group, ensure_ascii=False), 2048)
+
+    async def _reduce_findings(self, api_key: str, model: str, findings: list) -> list:
+        """Свернуть факты группами, пока не влезут в REDUCE_TOKENS."""
+        while len(findings) > 1 and estimate_tokens(json.dumps(findings, ensure_ascii=False)) > REDUCE_TOKENS:
+            groups, group, tokens = [], [], 0
+            for item in findings:
+                size = estimate_tokens(json.dumps(item, ensure_ascii=False))
+                if group and tokens + size > REDUCE_TOKENS // 2:
+                    groups.append(group)
+                    group, tokens = [], 0
+                group.append(item)
+                tokens += size
+            groups.append(group)
+            if len(groups) == len(findings):
+                break  # каждое окно само по себе больше половины бюджета — дальше не сжать
+            findings = await asyncio.gather(*[self._merge(api_key, model, g) for g in groups])
+        return findings
+
+    async def analyze(self, transcript: dict, system_prompt: str, api_key: str,
+                      model: str = GEMINI_MODEL, metrics: dict = None) -> tuple:
+        """(анализ, число окон). С metrics таймкоды реплик заменяет одна строка метрик."""
+        lines = transcript_lines(transcript, timestamps=not metrics)
+        header = f"{conversation_metrics.prompt_line(metrics)}\n\n" if metrics else ""
+        full_text = "\n".join(lines)
+        if estimate_tokens(full_text) <= WINDOW_TOKENS:
+            result = await self._ask_json(api_key, model, system_prompt, f"{header}Вот транскрипция звонка:\n{full_text}", 2048)
+            return result, 1
+
+        windows = make_windows(lines)
+        started = time.monotonic()
+        findings = await asyncio.gather(*[
+            self._ask_json(api_key, model, MAP_PROMPT.format(index=i + 1, total=len(windows)), window, 1024)
+            for i, window in enumerate(windows)
+        ])
+        findings = await self._reduce_findings(api_key, model, list(findings))
+        logger.info("Map по %d окнам за %.1f с", len(windows), time.monotonic() - started)
+
+        reduce_text = header + REDUCE_TEMPLATE.format(
+            findings=json.dumps(findings, ensure_ascii=False, indent=1),
+            tail=tail_text(lines),
+        )
+        result = await self._ask_json(api_key, model, system_prompt, reduce_text, 2048)
+        return result, len(windows)
+
+
+def normalize_analysis(result: dict) -> dict:
+    """Все ключи, которые ждут Google Sheets и Telegram; списки — строкой через запятую."""
+    normalized = {}
+    for key in ANALYSIS_KEYS:
+        value = result.get(key, "")
+        if isinstance(value, list):
+            value = ", ".join(str(v) for v in value)
+        normalized[key] = value
+    # Нет оценки — None, а не 0: ноль испортил бы средние в call_analyses_weekly
+    try:
+        normalized["manager_score"] = max(0, min(10, int(float(normalized["manager_score"]))))
+    except (TypeError, ValueError, OverflowError):
+        normalized["manager_score"] = None
+    return normalized
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+SETTINGS_TTL = float(os.getenv("SETTINGS_TTL", "30"))
+
+
+async def _settings(app: web.Application) -> dict:
+    cached_at, settings = app["settings"]
+    if time.monotonic() - cached_at > SETTINGS_TTL:
+        def _load():
+            with db.connection(app["pool"]) as conn, conn.cursor() as cur:
+                cur.execute("SELECT key, value FROM n8n_app_settings;")
+                return dict(cur.fetchall())
+        settings = await asyncio.to_thread(_load)
+        app["settings"] = (time.monotonic(), settings)
+    return settings
+
+
+def _db(app: web.Application, func, *args):
+    def _call():
+        with db.connection(app["pool"]) as conn:
+            return func(conn, *args)
+    return asyncio.to_thread(_call)
+
+
+async def post_analyze(request: web.Request) -> web.Response:
+    app = request.app
+    data = await request.json()
+    transcript = data.get("transcript") or {"text": data.get("text", "")}
+    if not (transcript.get("text") or transcript.get("utterances")):
+        raise web.HTTPBadRequest(text="Нужен transcript (ответ AssemblyAI) или text")
+
+    settings = await _settings(app)
+    system_prompt = data.get("system_prompt") or settings.get("system_prompt", "")
+    api_key = settings.get("gemini_key") or os.getenv("GEMINI_API_KEY", "")
+    model = data.get("model") or GEMINI_MODEL
+
+    # Метрики считаются за миллисекунды — не кэшируются, добавляются и к ответу из кэша
+    metrics = conversation_metrics.compute(transcript)
+    extra = {"metrics": metrics} if metrics else {}
+
+    # Ключ кэша — по сжатому тексту: новая фраза IVR в админке даёт новый анализ
+    headers = {}
+    if data.get("compact", True):
+        compacted, savings = await asyncio.to_thread(
+            transcript_compaction.compact, transcript, transcript_compaction.phrase_list(settings.get("ivr_phrases"))
+        )
+        if compacted["text"]:  # весь звонок — автоответчик: анализировать как есть
+            transcript = compacted
+            headers["X-Tokens"] = f"{savings['tokens_before']}->{savings['tokens_after']}"
+            _count_savings(app, savings)
+    transcript_hash = call_cache.sha256_text(transcript.get("text") or "\n".join(transcript_lines(transcript)))
+    version = call_cache.prompt_version(system_prompt)
+    cached = await _db(app, call_cache.get_analysis, transcript_hash, version, model)
+    if cached is not None:
+        return web.json_response({**cached, **extra}, headers={**headers, "X-Cache": "hit"})
+
+    started = time.monotonic()
+    try:
+        result, windows = await app["analyzer"].analyze(transcript, system_prompt, api_key, model, metrics)
+    except (AnalysisError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise web.HTTPBadGateway(text=f"Анализ не удался: {e}")
+    analysis = normalize_analysis(result)
+    await _db(app, call_cache.put_analysis, transcript_hash, version, model, analysis)
+    logger.info("Анализ готов за %.1f с, окон %d", time.monotonic() - started, windows)
+    return web.json_response({**analysis, **extra}, headers={
+        **headers, "X-Cache": "miss", "X-Analysis-Windows": str(windows),
+    })
+
+
+def _count_savings(app: web.Application, savings: dict):
+    totals = app["compaction"]
+    for key in ("tokens_before", "tokens_after", "ivr", "fillers", "duplicates", "dropped"):
+        totals[key] += savings[key]
+    logger.info("Сжатие: токенов %d -> %d (-%.0f%%), IVR %d, паразитов %d, повторов %d, выброшено реплик %d",
+                savings["tokens_before"], savings["tokens_after"], savings["saved"] * 100,
+                savings["ivr"], savings["fillers"], savings["duplicates"], savings["dropped"])
+
+
+async def health(request: web.Request) -> web.Response:
+    totals = request.app["compaction"]
+    saved = 1 - totals["tokens_after"] / totals["tokens_before"] if totals["tokens_before"] else 0.0
+    return web.json_response({"ok": True, "llm_calls": request.app["analyzer"].calls,
+                              "compaction": {**totals, "saved": round(saved, 3)}})
+
+
+async def _session(app: web.Application):
+    with db.connection(app["pool"]) as conn:
+        call_cache.ensure_schema(conn)
+    session = aiohttp.ClientSession()
+    app["analyzer"] = Analyzer(session)
+    app["settings"] = (float("-inf"), {})
+    app["compaction"] = dict.fromkeys(("tokens_before", "tokens_after", "ivr", "fillers", "duplicates", "dropped"), 0)
+    yield
+    await session.close()
+
+
+def create_app(pool=None) -> web.Application:
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app["pool"] = pool or db.create_pool()
+    app.router.add_post("/analyze", post_analyze)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_session)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("ANALYSIS_PORT", "8506")))
+
+
+if __name__ == "__main__":
+    main()
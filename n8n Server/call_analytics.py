@@ -0,0 +1,423 @@
+"""
+Хранилище результатов анализа звонков в Postgres n8n (вместо построчных
+append в Google Sheets) и запросы для дашборда админки.
+
+- call_analyses: по строке на звонок, note_id уникален (повтор вебхука
+  перезаписывает анализ, а не дублирует строку).
+- call_analyses_weekly: материализованная сводка менеджер x неделя,
+  обновляется CONCURRENTLY раз в ROLLUP_REFRESH секунд, если были вставки.
+- Запись пачками: POST /calls кладёт анализ в буфер, буфер сбрасывается
+  одним execute_values раз в CALLS_FLUSH_ROWS строк или CALLS_FLUSH_SECONDS.
+  База недоступна — пачка ждёт следующего сброса; строку, которую база
+  отвергла (NUL в тексте, число вне диапазона), пачка делится пополам
+  до неё, строка пишется в лог и выбрасывается.
+
+Эндпоинты:
+  POST /calls     объект анализа или список объектов -> 202 {"queued": N}
+  GET  /health
+
+Запуск:
+  python call_analytics.py       # порт CALLS_PORT (по умолчанию 8503)
+
+В n8n после "Распарсить JSON1": HTTP Request POST http://admin:8503/calls
+с телом {{ $json }} + lead_id, note_id, audio_url, filename, duration_sec,
+file_uuid (по нему call_search.py находит транскрипцию в кэше).
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+
+import psycopg2
+from aiohttp import web
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import PoolError
+
+import db
+
+logger = logging.getLogger(__name__)
+
+FLUSH_ROWS = int(os.getenv("CALLS_FLUSH_ROWS", "200"))
+FLUSH_SECONDS = float(os.getenv("CALLS_FLUSH_SECONDS", "2"))
+ROLLUP_REFRESH = float(os.getenv("ROLLUP_REFRESH", "300"))
+
+# Дата звонка: неделя в сводке и порядок в списке звонков считаются по ней
+CALL_TIME_SQL = "COALESCE(called_at, analyzed_at)"
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS call_analyses (
+    id            BIGSERIAL PRIMARY KEY,
+    note_id       TEXT NOT NULL UNIQUE,
+    lead_id       BIGINT,
+    manager       TEXT NOT NULL DEFAULT '',
+    manager_score SMALLINT,
+    outcome       TEXT,
+    client_intent TEXT,
+    summary       TEXT,
+    good_points   TEXT,
+    bad_points    TEXT,
+    advice        TEXT,
+    next_step     TEXT,
+    filename      TEXT,
+    audio_url     TEXT,
+    duration_sec  INTEGER,
+    called_at     TIMESTAMPTZ,
+    analyzed_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE call_analyses ADD COLUMN IF NOT EXISTS metrics JSONB;
+ALTER TABLE call_analyses ADD COLUMN IF NOT EXISTS file_uuid TEXT;
+CREATE INDEX IF NOT EXISTS call_analyses_manager_time
+    ON call_analyses (manager, analyzed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS call_analyses_time
+    ON call_analyses (analyzed_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS call_analyses_lead
+    ON call_analyses (lead_id);
+-- Дата звонка для сводки и списка звонков (CALL_TIME_SQL)
+CREATE INDEX IF NOT EXISTS call_analyses_call_time
+    ON call_analyses ((COALESCE(called_at, analyzed_at)) DESC, id DESC);
+CREATE INDEX IF NOT EXISTS call_analyses_manager_call_time
+    ON call_analyses (manager, (COALESCE(called_at, analyzed_at)) DESC, id DESC);
+
+-- Неделя — по дате звонка: повторный анализ старого звонка не переносит его
+-- в текущую неделю. Представление со старой группировкой пересоздаётся.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_matviews
+               WHERE matviewname = 'call_analyses_weekly' AND definition NOT LIKE '%called_at%') THEN
+        DROP MATERIALIZED VIEW call_analyses_weekly;
+    END IF;
+END $$;
+CREATE MATERIALIZED VIEW IF NOT EXISTS call_analyses_weekly AS
+SELECT date_trunc('week', COALESCE(called_at, analyzed_at)) AS week,
+       manager,
+       count(*)                          AS calls,
+       avg(manager_score)::numeric(4, 2) AS avg_score,
+       count(manager_score)              AS scored,
+       sum(duration_sec)                 AS total_duration_sec
+FROM call_analyses
+GROUP BY 1, 2;
+CREATE UNIQUE INDEX IF NOT EXISTS call_analyses_weekly_key
+    ON call_analyses_weekly (week, manager);
+"""
+
+COLUMNS = (
+    "note_id", "lead_id", "manager", "manager_score", "outcome", "client_intent",
+    "summary", "good_points", "bad_points", "advice", "next_step",
+    "filename", "audio_url", "duration_sec", "called_at", "analyzed_at", "metrics",
+    "file_uuid",
+)
+
+INSERT_SQL = (
+    f"INSERT INTO call_analyses ({', '.join(COLUMNS)}) VALUES %s "
+    "ON CONFLICT (note_id) DO UPDATE SET "
+    + ", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c != "note_id")
+    + ";"
+)
+
+
+# =========================================================================
+# РАБОТА С БАЗОЙ (используется и из админки)
+# =========================================================================
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return "\n".join(str(v) for v in value)
+    return str(value).strip()
+
+
+def _int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _timestamp(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def to_row(data: dict) -> tuple:
+    """
+    Анализ из воркфлоу -> строка call_analyses. Имена полей как в ответе
+    Gemini (manager_name, manager_score, ...) плюс данные звонка из amoCRM.
+    """
+    note_id = data.get("note_id") or data.get("file_uuid")
+    if not note_id:
+        raise ValueError("нет note_id")
+    score = _int(data.get("manager_score"))
+    if score is not None and not 0 <= score <= 10:
+        score = None
+    return (
+        str(note_id),
+        _int(data.get("lead_id")),
+        _text(data.get("manager_name") or data.get("manager")) or "",
+        score,
+        _text(data.get("outcome")),
+        _text(data.get("client_intent")),
+        _text(data.get("summary")),
+        _text(data.get("good_points")),
+        _text(data.get("bad_points")),
+        _text(data.get("advice")),
+        _text(data.get("next_step")),
+        _text(data.get("filename")),
+        _text(data.get("audio_url")),
+        _int(data.get("duration_sec")),
+        _timestamp(data.get("called_at")),
+        _timestamp(data.get("analyzed_at")) or datetime.now(timezone.utc),
+        Json(data["metrics"]) if isinstance(data.get("metrics"), dict) else None,
+        _text(data.get("file_uuid")),
+    )
+
+
+def insert_rows(conn, rows: list) -> int:
+    # Внутри одной пачки note_id должен быть уникален, иначе ON CONFLICT падает
+    unique = list({row[0]: row for row in rows}.values())
+    with conn.cursor() as cur:
+        execute_values(cur, INSERT_SQL, unique, page_size=500)
+    return len(unique)
+
+
+def refresh_rollups(conn):
+    with conn.cursor() as cur:
+        cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY call_analyses_weekly;")
+
+
+# =========================================================================
+# ЗАПРОСЫ ДАШБОРДА (агрегация на стороне Postgres)
+# =========================================================================
+def managers(conn) -> list:
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT manager FROM call_analyses_weekly ORDER BY manager;")
+        return [row[0] for row in cur.fetchall()]
+
+
+def weekly(conn, since: datetime, manager_list: list = None) -> list:
+    """Сводка по неделям из материализованного представления."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT week, manager, calls, avg_score, total_duration_sec
+            FROM call_analyses_weekly
+            WHERE week >= date_trunc('week', %(since)s::timestamptz)
+              AND (%(managers)s::text[] IS NULL OR manager = ANY(%(managers)s::text[]))
+            ORDER BY week, manager;
+            """,
+            {"since": since, "managers": manager_list or None},
+        )
+        return [
+            {"week": w, "manager": m, "calls": c,
+             "avg_score": float(s) if s is not None else None, "duration_sec": d}
+            for w, m, c, s, d in cur.fetchall()
+        ]
+
+
+def manager_summary(conn, since: datetime, manager_list: list = None) -> list:
+    """Итоги за период по менеджерам (по сводке, без скана call_analyses)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT manager, sum(calls) AS calls,
+                   (sum(avg_score * scored) / NULLIF(sum(scored), 0))::numeric(4, 2) AS avg_score,
+                   sum(total_duration_sec) AS duration_sec
+            FROM call_analyses_weekly
+            WHERE week >= date_trunc('week', %(since)s::timestamptz)
+              AND (%(managers)s::text[] IS NULL OR manager = ANY(%(managers)s::text[]))
+            GROUP BY manager
+            ORDER BY calls DESC;
+            """,
+            {"since": since, "managers": manager_list or None},
+        )
+        return [
+            {"manager": m, "calls": int(c),
+             "avg_score": float(s) if s is not None else None,
+             "duration_sec": int(d) if d is not None else None}
+            for m, c, s, d in cur.fetchall()
+        ]
+
+
+def calls_page(conn, since: datetime, manager_list: list = None, after: tuple = None, limit: int = 50) -> list:
+    """
+    Страница звонков, новые сверху. Дата и период — как в call_analyses_weekly
+    (дата звонка, с начала недели since), чтобы список сходился со сводкой.
+    Keyset-пагинация по (call_time, id): after — ключ последней строки
+    предыдущей страницы, без OFFSET.
+    """
+    after_time, after_id = after or (None, None)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT id, {CALL_TIME_SQL} AS call_time, manager, manager_score, outcome, lead_id,
+                   duration_sec, summary, audio_url
+            FROM call_analyses
+            WHERE {CALL_TIME_SQL} >= date_trunc('week', %(since)s::timestamptz)
+              AND (%(managers)s::text[] IS NULL OR manager = ANY(%(managers)s::text[]))
+              AND (%(after_time)s::timestamptz IS NULL
+                   OR ({CALL_TIME_SQL}, id) < (%(after_time)s::timestamptz, %(after_id)s::bigint))
+            ORDER BY {CALL_TIME_SQL} DESC, id DESC
+            LIMIT %(limit)s;
+            """,
+            {"since": since, "managers": manager_list or None,
+             "after_time": after_time, "after_id": after_id, "limit": limit},
+        )
+        names = [c.name for c in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+# =========================================================================
+# БУФЕР ЗАПИСИ
+# =========================================================================
+class BatchWriter:
+    """Копит строки и пишет их одной транзакцией по размеру или по таймеру."""
+
+    def __init__(self, pool, flush_rows: int = FLUSH_ROWS, flush_seconds: float = FLUSH_SECONDS):
+        self.pool = pool
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.written = 0
+        self.rejected = 0
+        self.dirty = False
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def add(self, rows: list):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.flush_rows:
+            self._full.set()
+
+    def _write(self, rows) -> tuple:
+        """(записано, отвергнуто). Пачку, отвергнутую базой, делим пополам до плохих строк."""
+        try:
+            with db.connection(self.pool) as conn:
+                return insert_rows(conn, rows), 0
+        except (psycopg2.DataError, psycopg2.IntegrityError, ValueError) as e:
+            # ValueError — psycopg2 не передаёт строки с NUL
+            if len(rows) == 1:
+                logger.error("Анализ %s отвергнут базой, пропущен: %s", rows[0][0], e)
+                return 0, 1
+        middle = len(rows) // 2
+        head, tail = self._write(rows[:middle]), self._write(rows[middle:])
+        return head[0] + tail[0], head[1] + tail[1]
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self.buffer:
+                return
+            rows, self.buffer = self.buffer, []
+            self._full.clear()
+            try:
+                count, rejected = await asyncio.to_thread(self._write, rows)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError) as e:
+                # База недоступна — вернуть строки в буфер, попробуем на следующем сбросе
+                logger.error("Не удалось записать %d анализов: %s", len(rows), e)
+                self.buffer[:0] = rows
+                return
+            except Exception as e:
+                # Ошибка не из-за данных и не из-за сети — повтор не поможет
+                logger.exception("Пачка из %d анализов отброшена: %s", len(rows), e)
+                self.rejected += len(rows)
+                return
+            self.written += count
+            self.rejected += rejected
+            self.dirty = self.dirty or count > 0
+            logger.info("Записано анализов звонков: %d%s", count, f", отвергнуто {rejected}" if rejected else "")
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+async def refresh_loop(app: web.Application):
+    writer = app["writer"]
+
+    def _refresh():
+        with db.connection(app["pool"]) as conn:
+            refresh_rollups(conn)
+
+    while True:
+        await asyncio.sleep(ROLLUP_REFRESH)
+        if not writer.dirty:
+            continue
+        writer.dirty = False
+        try:
+            await asyncio.to_thread(_refresh)
+            logger.info("Сводка call_analyses_weekly обновлена")
+        except Exception as e:
+            writer.dirty = True
+            logger.error("Не удалось обновить сводку: %s", e)
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def post_calls(request: web.Request) -> web.Response:
+    data = await request.json()
+    items = data if isinstance(data, list) else [data]
+    try:
+        rows = [to_row(item) for item in items]
+    except (ValueError, AttributeError) as e:
+        raise web.HTTPBadRequest(text=f"Некорректный анализ: {e}")
+    request.app["writer"].add(rows)
+    return web.json_response({"queued": len(rows)}, status=202)
+
+
+async def health(request: web.Request) -> web.Response:
+    writer = request.app["writer"]
+    return web.json_response({
+        "ok": True, "buffered": len(writer.buffer), "written": writer.written, "rejected": writer.rejected,
+    })
+
+
+async def _background(app: web.Application):
+    with db.connection(app["pool"]) as conn:
+        ensure_schema(conn)
+    tasks = [
+        asyncio.create_task(app["writer"].run()),
+        asyncio.create_task(refresh_loop(app)),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    # Не терять то, что ещё в буфере
+    await app["writer"].flush()
+    if app["writer"].dirty:
+        with db.connection(app["pool"]) as conn:
+            refresh_rollups(conn)
+
+
+def create_app(pool=None) -> web.Application:
+    pool = pool or db.create_pool()
+    app = web.Application()
+    app["pool"] = pool
+    app["writer"] = BatchWriter(pool)
+    app.router.add_post("/calls", post_calls)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("CALLS_PORT", "8503")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Кэш транскрипций и анализов звонков в Postgres n8n.
+
+- transcript_cache: ключ — file_uuid файла amoCRM ("file:<uuid>") или
+  sha256 содержимого аудио ("sha256:<hex>") плюс хэш варианта распознавания
+  (бэкенд, язык, preprocess...) -> транскрипция AssemblyAI. Повтор вебхука
+  не скачивает и не транскрибирует звонок заново, а смена бэкенда или опций
+  не отдаёт старую транскрипцию. source — ключ без варианта (для call_search).
+- analysis_cache: (sha256 текста транскрипции, версия промпта, модель) ->
+  JSON анализа Gemini. Версия промпта — хэш текста system_prompt, так что
+  после отката промпта к прежнему тексту старые анализы снова попадают в кэш.
+
+Размер ограничен: при превышении CACHE_MAX_MB (на каждую таблицу) удаляются
+давно не использованные записи (last_used_at).
+
+HTTP (подключается к transcription_service.py):
+  POST /analysis/lookup  {"text": ..., "system_prompt": ..., "model": ...}
+                         -> {"hit": bool, "key": {...}, "analysis": {...}|null}
+  POST /analysis/store   {"key": {...} из lookup, "analysis": {...}}
+  GET  /cache/stats
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+import aiohttp
+from aiohttp import web
+
+import db
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_MB = float(os.getenv("CACHE_MAX_MB", "512"))
+CACHE_EVICT_INTERVAL = float(os.getenv("CACHE_EVICT_INTERVAL", "600"))
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS transcript_cache (
+    key          TEXT PRIMARY KEY,
+    source       TEXT,
+    transcript   JSONB NOT NULL,
+    size_bytes   INTEGER NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_used_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE transcript_cache ADD COLUMN IF NOT EXISTS source TEXT;
+UPDATE transcript_cache SET source = split_part(key, '|', 1) WHERE source IS NULL;
+CREATE INDEX IF NOT EXISTS transcript_cache_used ON transcript_cache (last_used_at);
+CREATE INDEX IF NOT EXISTS transcript_cache_source ON transcript_cache (source, last_used_at);
+
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    transcript_hash TEXT NOT NULL,
+    prompt_version  TEXT NOT NULL,
+    model           TEXT NOT NULL,
+    analysis        JSONB NOT NULL,
+    size_bytes      INTEGER NOT NULL,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT now(),
+    last_used_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (transcript_hash, prompt_version, model)
+);
+CREATE INDEX IF NOT EXISTS analysis_cache_used ON analysis_cache (last_used_at);
+"""
+
+# Таблица -> первичный ключ (для вытеснения)
+TABLES = {
+    "transcript_cache": "key",
+    "analysis_cache": "transcript_hash, prompt_version, model",
+}
+
+
+# =========================================================================
+# КЛЮЧИ
+# =========================================================================
+def sha256_text(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def prompt_version(system_prompt: str) -> str:
+    return sha256_text(system_prompt)[:16]
+
+
+def transcript_key(file_uuid: str = None, audio_hash: str = None, variant: dict = None) -> str:
+    """"file:<uuid>" или "sha256:<hex>"; с variant — плюс "|<хэш варианта>"."""
+    if file_uuid:
+        source = f"file:{file_uuid}"
+    elif audio_hash:
+        source = f"sha256:{audio_hash}"
+    else:
+        raise ValueError("нужен file_uuid или хэш аудио")
+    if variant:
+        return f"{source}|{sha256_text(json.dumps(variant, sort_keys=True, ensure_ascii=False))[:16]}"
+    return source
+
+
+async def hash_url(session: aiohttp.ClientSession, url: str, chunk_size: int = 256 * 1024) -> str:
+    """sha256 содержимого по URL, потоково (файл не держится в памяти)."""
+    digest = hashlib.sha256()
+    async with session.get(url, timeout=aiohttp.ClientTimeout(total=300)) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# =========================================================================
+# РАБОТА С БАЗОЙ
+# =========================================================================
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+
+
+def get_transcript(conn, key: str):
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE transcript_cache SET last_used_at = now() WHERE key = %s RETURNING transcript;",
+            (key,),
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def put_transcript(conn, key: str, transcript: dict):
+    data = json.dumps(transcript, ensure_ascii=False)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO transcript_cache (key, source, transcript, size_bytes) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (key) DO UPDATE SET transcript = EXCLUDED.transcript,
+                size_bytes = EXCLUDED.size_bytes, last_used_at = now();
+            """,
+            (key, key.split("|", 1)[0], data, len(data.encode("utf-8"))),
+        )
+
+
+def get_analysis(conn, transcript_hash: str, version: str, model: str):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE analysis_cache SET last_used_at = now()
+            WHERE transcript_hash = %s AND prompt_version = %s AND model = %s
+            RETURNING analysis;
+            """,
+            (transcript_hash, version, model),
+        )
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def put_analysis(conn, transcript_hash: str, version: str, model: str, analysis: dict):
+    data = json.dumps(analysis, ensure_ascii=False)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO analysis_cache (transcript_hash, prompt_version, model, analysis, size_bytes)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (transcript_hash, prompt_version, model) DO UPDATE SET
+                analysis = EXCLUDED.analysis, size_bytes = EXCLUDED.size_bytes, last_used_at = now();
+            """,
+            (transcript_hash, version, model, data, len(data.encode("utf-8"))),
+        )
+
+
+def evict(conn, max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024)) -> dict:
+    """Оставить в каждой таблице самые свежие записи суммарно не больше max_bytes."""
+    removed = {}
+    with conn.cursor() as cur:
+        for table, pk in TABLES.items():
+            cur.execute(
+                f"""
+                DELETE FROM {table} WHERE ({pk}) IN (
+                    SELECT {pk} FROM (
+                        SELECT {pk}, sum(size_bytes) OVER (ORDER BY last_used_at DESC) AS running
+                        FROM {table}
+                    ) ranked
+                    WHERE running > %s
+                );
+                """,
+                (max_bytes,),
+            )
+            removed[table] = cur.rowcount
+    return removed
+
+
+def stats(conn) -> dict:
+    result = {}
+    with conn.cursor() as cur:
+        for table in TABLES:
+            cur.execute(f"SELECT count(*), COALESCE(sum(size_bytes), 0) FROM {table};")
+            count, size = cur.fetchone()
+            result[table] = {"entries": count, "bytes": int(size)}
+    return result
+
+
+async def evict_loop(pool, interval: float = CACHE_EVICT_INTERVAL):
+    def _evict():
+        with db.connection(pool) as conn:
+            return evict(conn)
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(_evict)
+            if any(removed.values()):
+                logger.info("Кэш: вытеснено %s", removed)
+        except Exception as e:
+            logger.error("Вытеснение кэша: %s", e)
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+def _run(request: web.Request, func, *args):
+    def _call():
+        with db.connection(request.app["pool"]) as conn:
+            return func(conn, *args)
+    return asyncio.to_thread(_call)
+
+
+async def post_analysis_lookup(request: web.Request) -> web.Response:
+    data = await request.json()
+    key = {
+        "transcript_hash": sha256_text(data.get("text", "")),
+        "prompt_version": prompt_version(data.get("system_prompt", "")),
+        "model": data.get("model", ""),
+    }
+    analysis = await _run(request, get_analysis, key["transcript_hash"], key["prompt_version"], key["model"])
+    return web.json_response({"hit": analysis is not None, "key": key, "analysis": analysis})
+
+
+async def post_analysis_store(request: web.Request) -> web.Response:
+    data = await request.json()
+    key, analysis = data.get("key") or {}, data.get("analysis")
+    if not analysis or not key.get("transcript_hash") or not key.get("prompt_version"):
+        raise web.HTTPBadRequest(text="Нужны key (из /analysis/lookup) и analysis")
+    if analysis.get("error"):
+        # Не кэшировать ответ, который "Распарсить JSON1" не смог разобрать
+        return web.json_response({"stored": False})
+    await _run(request, put_analysis, key["transcript_hash"], key["prompt_version"], key.get("model", ""), analysis)
+    return web.json_response({"stored": True})
+
+
+async def get_stats(request: web.Request) -> web.Response:
+    return web.json_response(await _run(request, stats))
+
+
+def setup_routes(app: web.Application):
+    """Маршруты кэша анализов; app["pool"] должен быть задан."""
+    app.router.add_post("/analysis/lookup", post_analysis_lookup)
+    app.router.add_post("/analysis/store", post_analysis_store)
+    app.router.add_get("/cache/stats", get_stats)
@@ -0,0 +1,529 @@
+"""
+Семантический поиск по звонкам: "где клиент возражал по цене".
+
+Индексация идёт в фоне. Новые и переанализированные строки call_analyses
+(по analyzed_at) читаются пачками по SEARCH_BATCH звонков. Транскрипция
+берётся из transcript_cache по file_uuid. Каждый звонок даёт:
+  - кусок "analysis": итог, намерение клиента, сводка, плюсы/минусы;
+  - куски "transcript": окна из целых реплик до SEARCH_CHUNK_TOKENS токенов
+    (call_analysis.make_windows, последняя реплика окна повторяется в
+    следующем), после сжатия transcript_compaction без бюджета.
+Эмбеддинги даёт локальная модель Ollama (EMBED_MODEL, /api/embed), по
+EMBED_BATCH текстов за запрос. Точки загружаются в Qdrant пачкой, старые
+точки звонка перед этим удаляются. У коллекции индексы payload: manager,
+date, score (фильтры поиска), note_id и analyzed_ts (курсор индексации).
+
+SEARCH_BACKEND=memory — индекс в памяти процесса на NumPy вместо Qdrant,
+для проверки без сервера (после перезапуска строится заново).
+
+Эндпоинты:
+  POST /search   {"query": ..., "limit"?: 10, "manager"?, "date_from"?, "date_to"?,
+                  "min_score"?, "max_score"?}
+                 -> {"results": [{note_id, manager, score, date, summary, outcome,
+                                  audio_url, similarity, kind, snippet}]}
+  POST /reindex  {"note_ids"?: [...]} — переиндексировать эти звонки; без тела — все
+  GET  /health
+
+Запуск:
+  python call_search.py          # порт SEARCH_PORT (по умолчанию 8511)
+
+Проверка без Qdrant и Ollama: python stubs.py ollama,
+OLLAMA_URL=http://localhost:8603 SEARCH_BACKEND=memory python call_search.py.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+import call_analysis
+import call_analytics
+import call_cache
+import db
+import transcript_compaction
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://144.217.12.20:11434").rstrip("/")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "bge-m3")
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "32"))
+QDRANT_URL = os.getenv("QDRANT_URL", "http://144.217.12.20:6333").rstrip("/")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", "")
+QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "calls")
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "qdrant")
+SEARCH_BATCH = int(os.getenv("SEARCH_BATCH", "50"))
+SEARCH_POLL_INTERVAL = float(os.getenv("SEARCH_POLL_INTERVAL", "60"))
+CHUNK_TOKENS = int(os.getenv("SEARCH_CHUNK_TOKENS", "350"))
+SEARCH_URL = os.getenv("SEARCH_URL", "http://search:8511").rstrip("/")
+UPSERT_POINTS = 256
+SNIPPET_CHARS = 400
+
+# Ключ точки: note_id + номер куска (uuid5 — повторная индексация перезаписывает те же точки)
+POINT_NAMESPACE = uuid.UUID("5b0c6d1e-3f0a-4c55-9a43-6b1f0e2d7c11")
+UUID_PATTERN = "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+
+# manager — точное совпадение, date/score — диапазоны, note_id/analyzed_ts — служебные
+PAYLOAD_INDEXES = {
+    "manager": "keyword",
+    "date": "float",
+    "score": "integer",
+    "note_id": "keyword",
+    "analyzed_ts": "float",
+}
+
+
+class SearchError(Exception):
+    pass
+
+
+# =========================================================================
+# ЭМБЕДДИНГИ
+# =========================================================================
+async def embed(session: aiohttp.ClientSession, texts: list) -> np.ndarray:
+    """Векторы Ollama /api/embed, нормированные (косинус = скалярное произведение)."""
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH):
+        batch = texts[i:i + EMBED_BATCH]
+        async with session.post(f"{OLLAMA_URL}/api/embed", json={"model": EMBED_MODEL, "input": batch}) as resp:
+            if resp.status >= 400:
+                raise SearchError(f"Ollama embed: HTTP {resp.status} {(await resp.text())[:300]}")
+            vectors.extend((await resp.json())["embeddings"])
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+# =========================================================================
+# КУСКИ ЗВОНКА
+# =========================================================================
+def _ts(value) -> float:
+    return value.timestamp() if value else None
+
+
+def call_chunks(row: dict) -> list:
+    """(вид, текст) куска: один "analysis" и окна транскрипции по репликам."""
+    analysis = " ".join(
+        f"{label}: {str(row[key]).strip().rstrip('.')}." for label, key in (
+            ("Итог", "outcome"), ("Намерение клиента", "client_intent"), ("Кратко", "summary"),
+            ("Хорошо", "good_points"), ("Плохо", "bad_points"), ("Следующий шаг", "next_step"),
+        ) if row.get(key)
+    )
+    chunks = [("analysis", analysis)] if analysis else []
+    transcript = row.get("transcript")
+    if transcript and (transcript.get("utterances") or transcript.get("text")):
+        compacted, _ = transcript_compaction.compact(transcript, budget=0)
+        lines = call_analysis.transcript_lines(compacted)
+        chunks.extend(("transcript", window) for window in call_analysis.make_windows(lines, CHUNK_TOKENS, overlap=1))
+    return chunks
+
+
+def call_points(row: dict, chunks: list) -> tuple:
+    """(id точек, payload) для кусков одного звонка."""
+    date = row.get("called_at") or row["analyzed_at"]
+    ids, payloads = [], []
+    for number, (kind, text) in enumerate(chunks):
+        ids.append(str(uuid.uuid5(POINT_NAMESPACE, f"{row['note_id']}:{number}")))
+        payloads.append({
+            "call_id": row["id"],
+            "note_id": row["note_id"],
+            "lead_id": row.get("lead_id"),
+            "manager": row.get("manager") or "",
+            "score": row.get("manager_score"),
+            "date": _ts(date),
+            "analyzed_ts": _ts(row["analyzed_at"]),
+            "kind": kind,
+            "text": text,
+            "summary": row.get("summary"),
+            "outcome": row.get("outcome"),
+            "audio_url": row.get("audio_url"),
+        })
+    return ids, payloads
+
+
+def fetch_calls(conn, after_ts: float = 0.0, after_id: int = 0, limit: int = SEARCH_BATCH, note_ids: list = None) -> list:
+    """Звонки с анализом и транскрипцией (если есть в кэше) по возрастанию analyzed_at."""
+    if note_ids:
+        condition, params = "c.note_id = ANY(%s)", [list(note_ids)]
+    else:
+        after = datetime.fromtimestamp(after_ts, tz=timezone.utc)
+        condition, params = "(c.analyzed_at, c.id) > (%s, %s)", [after, after_id]
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT c.id, c.note_id, c.lead_id, c.manager, c.manager_score, c.outcome, c.client_intent,
+                   c.summary, c.good_points, c.bad_points, c.next_step, c.audio_url,
+                   c.called_at, c.analyzed_at, t.transcript
+            FROM call_analyses c
+            LEFT JOIN LATERAL (
+                SELECT transcript FROM transcript_cache
+                WHERE source = 'file:' || COALESCE(c.file_uuid, substring(c.audio_url from '{UUID_PATTERN}'))
+                ORDER BY last_used_at DESC
+                LIMIT 1
+            ) t ON true
+            WHERE {condition}
+            ORDER BY c.analyzed_at, c.id
+            LIMIT %s;
+            """,
+            params + [limit],
+        )
+        columns = [d[0] for d in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+# =========================================================================
+# ИНДЕКСЫ
+# =========================================================================
+def _matches(payload: dict, filters: dict) -> bool:
+    if filters.get("manager") and payload["manager"] != filters["manager"]:
+        return False
+    for field, low, high in (("date", "date_from", "date_to"), ("score", "min_score", "max_score")):
+        value = payload.get(field)
+        if filters.get(low) is not None and (value is None or value < filters[low]):
+            return False
+        if filters.get(high) is not None and (value is None or value > filters[high]):
+            return False
+    return True
+
+
+class MemoryIndex:
+    """Индекс в памяти процесса: матрица NumPy и список payload."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.ids = []
+        self.payloads = []
+        self.vectors = None
+
+    async def ensure(self, dim: int):
+        if self.vectors is None:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        elif self.vectors.shape[1] != dim:
+            raise SearchError(f"Размер векторов {dim}, а в индексе {self.vectors.shape[1]}: сменилась модель?")
+
+    async def delete(self, note_ids: list):
+        if self.vectors is None:
+            return
+        drop = set(note_ids)
+        keep = [i for i, payload in enumerate(self.payloads) if payload["note_id"] not in drop]
+        self.ids = [self.ids[i] for i in keep]
+        self.payloads = [self.payloads[i] for i in keep]
+        self.vectors = self.vectors[keep]
+
+    async def upsert(self, ids: list, vectors: np.ndarray, payloads: list):
+        self.ids.extend(ids)
+        self.payloads.extend(payloads)
+        self.vectors = np.vstack([self.vectors, vectors])
+
+    async def search(self, vector: np.ndarray, limit: int, filters: dict) -> list:
+        if self.vectors is None or not self.payloads:
+            return []
+        mask = np.fromiter((_matches(p, filters) for p in self.payloads), dtype=bool, count=len(self.payloads))
+        candidates = np.flatnonzero(mask)
+        scores = self.vectors[candidates] @ vector
+        top = candidates[np.argsort(-scores)[:limit]]
+        return [(float(self.vectors[i] @ vector), self.payloads[i]) for i in top]
+
+    async def cursor(self) -> tuple:
+        if not self.payloads:
+            return 0.0, 0
+        last = max(self.payloads, key=lambda p: (p["analyzed_ts"], p["call_id"]))
+        return last["analyzed_ts"], last["call_id"]
+
+    async def count(self) -> int:
+        return len(self.payloads)
+
+
+class QdrantIndex:
+    """Коллекция Qdrant через REST API."""
+
+    name = "qdrant"
+
+    def __init__(self, session: aiohttp.ClientSession, url: str = QDRANT_URL, collection: str = QDRANT_COLLECTION):
+        self.session = session
+        self.url = f"{url}/collections/{collection}"
+        self.headers = {"api-key": QDRANT_API_KEY} if QDRANT_API_KEY else {}
+        self.ready = False
+
+    async def _request(self, method: str, path: str = "", body: dict = None, missing_ok: bool = False):
+        async with self.session.request(method, f"{self.url}{path}", json=body, headers=self.headers) as resp:
+            if resp.status == 404 and missing_ok:
+                return None
+            if resp.status >= 400:
+                raise SearchError(f"Qdrant {method} {path or '/'}: HTTP {resp.status} {(await resp.text())[:300]}")
+            return (await resp.json())["result"]
+
+    async def ensure(self, dim: int):
+        if self.ready:
+            return
+        info = await self._request("GET", missing_ok=True)
+        if info is None:
+            await self._request("PUT", body={"vectors": {"size": dim, "distance": "Cosine"}})
+            for field, schema in PAYLOAD_INDEXES.items():
+                await self._request("PUT", "/index?wait=true", {"field_name": field, "field_schema": schema})
+            logger.info("Создана коллекция Qdrant %s (%d измерений)", self.url, dim)
+        elif info["config"]["params"]["vectors"]["size"] != dim:
+            raise SearchError(f"Размер векторов {dim}, а в коллекции {info['config']['params']['vectors']['size']}: "
+                              f"сменилась модель? Задайте другой QDRANT_COLLECTION")
+        self.ready = True
+
+    async def delete(self, note_ids: list):
+        await self._request("POST", "/points/delete?wait=true",
+                            {"filter": {"must": [{"key": "note_id", "match": {"any": list(note_ids)}}]}},
+                            missing_ok=True)
+
+    async def upsert(self, ids: list, vectors: np.ndarray, payloads: list):
+        for i in range(0, len(ids), UPSERT_POINTS):
+            points = [
+                {"id": point_id, "vector": vector.tolist(), "payload": payload}
+                for point_id, vector, payload in zip(ids[i:i + UPSERT_POINTS], vectors[i:i + UPSERT_POINTS],
+                                                     payloads[i:i + UPSERT_POINTS])
+            ]
+            await self._request("PUT", "/points?wait=true", {"points": points})
+
+    @staticmethod
+    def _filter(filters: dict) -> dict:
+        must = []
+        if filters.get("manager"):
+            must.append({"key": "manager", "match": {"value": filters["manager"]}})
+        for field, low, high in (("date", "date_from", "date_to"), ("score", "min_score", "max_score")):
+            bounds = {op: filters[key] for op, key in (("gte", low), ("lte", high)) if filters.get(key) is not None}
+            if bounds:
+                must.append({"key": field, "range": bounds})
+        return {"must": must} if must else None
+
+    async def search(self, vector: np.ndarray, limit: int, filters: dict) -> list:
+        hits = await self._request("POST", "/points/search", {
+            "vector": vector.tolist(), "limit": limit, "filter": self._filter(filters), "with_payload": True,
+        }, missing_ok=True)
+        return [(hit["score"], hit["payload"]) for hit in hits or []]
+
+    async def cursor(self) -> tuple:
+        page = await self._request("POST", "/points/scroll", {
+            "limit": 1, "with_payload": ["analyzed_ts", "call_id"], "with_vector": False,
+            "order_by": {"key": "analyzed_ts", "direction": "desc"},
+        }, missing_ok=True)
+        if not page or not page["points"]:
+            return 0.0, 0
+        payload = page["points"][0]["payload"]
+        return payload["analyzed_ts"], payload["call_id"]
+
+    async def count(self) -> int:
+        result = await self._request("POST", "/points/count", {"exact": False}, missing_ok=True)
+        return result["count"] if result else 0
+
+
+# =========================================================================
+# ИНДЕКСАЦИЯ И ПОИСК
+# =========================================================================
+def _db(pool, func, *args):
+    def _call():
+        with db.connection(pool) as conn:
+            return func(conn, *args)
+    return asyncio.to_thread(_call)
+
+
+class Indexer:
+    def __init__(self, pool, session: aiohttp.ClientSession, index):
+        self.pool = pool
+        self.session = session
+        self.index = index
+        self.position = None  # (analyzed_ts, call_id) последнего проиндексированного звонка
+        self.indexed_calls = 0
+        self.indexed_chunks = 0
+        self.last_error = None
+        self._wake = asyncio.Event()
+
+    async def index_rows(self, rows: list) -> int:
+        """Эмбеддинги всех кусков пачки звонков и одна загрузка в индекс."""
+        ids, payloads, texts = [], [], []
+        for row in rows:
+            chunks = call_chunks(row)
+            row_ids, row_payloads = call_points(row, chunks)
+            ids.extend(row_ids)
+            payloads.extend(row_payloads)
+            texts.extend(text for _, text in chunks)
+        if not texts:
+            return 0
+        started = time.monotonic()
+        vectors = await embed(self.session, texts)
+        await self.index.ensure(vectors.shape[1])
+        await self.index.delete([row["note_id"] for row in rows])
+        await self.index.upsert(ids, vectors, payloads)
+        self.indexed_calls += len(rows)
+        self.indexed_chunks += len(texts)
+        logger.info("Проиндексировано звонков %d, кусков %d за %.1f с", len(rows), len(texts), time.monotonic() - started)
+        return len(texts)
+
+    async def reindex(self, note_ids: list = None) -> int:
+        if note_ids:
+            rows = await _db(self.pool, fetch_calls, 0.0, 0, len(note_ids), note_ids)
+            await self.index_rows(rows)
+            return len(rows)
+        self.position = (0.0, 0)
+        self._wake.set()
+        return 0
+
+    async def run(self):
+        while True:
+            try:
+                if self.position is None:
+                    self.position = await self.index.cursor()
+                rows = await _db(self.pool, fetch_calls, *self.position, SEARCH_BATCH)
+                if rows:
+                    await self.index_rows(rows)
+                    self.position = (_ts(rows[-1]["analyzed_at"]), rows[-1]["id"])
+                    self.last_error = None
+                    if len(rows) == SEARCH_BATCH:
+                        continue
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("Индексация не удалась")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), SEARCH_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+def _filters(data: dict) -> dict:
+    """Фильтры запроса: даты ISO ("2026-10-01" или с временем, без зоны — UTC), оценки 0–10."""
+    filters = {"manager": data.get("manager") or None}
+    for key in ("date_from", "date_to"):
+        value = datetime.fromisoformat(data[key]) if data.get(key) else None
+        if value and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        filters[key] = value.timestamp() if value else None
+    for key in ("min_score", "max_score"):
+        filters[key] = int(data[key]) if data.get(key) is not None else None
+    return filters
+
+
+def _snippet(text: str) -> str:
+    text = "\n".join(line.removeprefix("[контекст] ") for line in text.splitlines())
+    return text if len(text) <= SNIPPET_CHARS else text[:SNIPPET_CHARS].rsplit(" ", 1)[0] + " …"
+
+
+async def search(session: aiohttp.ClientSession, index, query: str, limit: int = 10, filters: dict = None) -> list:
+    """Лучший кусок каждого звонка, звонки по убыванию сходства."""
+    vector = (await embed(session, [query]))[0]
+    hits = await index.search(vector, limit * 5, filters or {})
+    best = {}
+    for score, payload in hits:
+        if score <= 0:
+            continue
+        if payload["note_id"] not in best or score > best[payload["note_id"]][0]:
+            best[payload["note_id"]] = (score, payload)
+    results = []
+    for score, payload in sorted(best.values(), key=lambda item: -item[0])[:limit]:
+        results.append({
+            "note_id": payload["note_id"],
+            "lead_id": payload.get("lead_id"),
+            "manager": payload["manager"],
+            "score": payload.get("score"),
+            "date": datetime.fromtimestamp(payload["date"], tz=timezone.utc).isoformat() if payload.get("date") else None,
+            "summary": payload.get("summary"),
+            "outcome": payload.get("outcome"),
+            "audio_url": payload.get("audio_url"),
+            "similarity": round(score, 3),
+            "kind": payload["kind"],
+            "snippet": _snippet(payload["text"]),
+        })
+    return results
+
+
+def remote_search(payload: dict, url: str = SEARCH_URL, timeout: float = 30) -> list:
+    """POST /search сервиса из синхронного кода (админка)."""
+    request = urllib.request.Request(
+        f"{url}/search", data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return json.loads(resp.read())["results"]
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def post_search(request: web.Request) -> web.Response:
+    app = request.app
+    data = await request.json()
+    query = (data.get("query") or "").strip()
+    if not query:
+        raise web.HTTPBadRequest(text="Нужен query")
+    try:
+        limit = max(1, min(int(data.get("limit") or 10), 100))
+        filters = _filters(data)
+    except (TypeError, ValueError) as e:
+        raise web.HTTPBadRequest(text=f"Неверный фильтр: {e}")
+    try:
+        results = await search(app["session"], app["index"], query, limit, filters)
+    except (SearchError, aiohttp.ClientError) as e:
+        raise web.HTTPBadGateway(text=f"Поиск не удался: {e}")
+    return web.json_response({"results": results})
+
+
+async def post_reindex(request: web.Request) -> web.Response:
+    data = await request.json() if request.can_read_body else {}
+    note_ids = [str(n) for n in data.get("note_ids") or []]
+    try:
+        count = await request.app["indexer"].reindex(note_ids)
+    except (SearchError, aiohttp.ClientError) as e:
+        raise web.HTTPBadGateway(text=f"Индексация не удалась: {e}")
+    return web.json_response({"reindexed": count} if note_ids else {"reindexing": "all"})
+
+
+async def health(request: web.Request) -> web.Response:
+    indexer = request.app["indexer"]
+    try:
+        points = await request.app["index"].count()
+    except (SearchError, aiohttp.ClientError) as e:
+        points, indexer.last_error = None, str(e)
+    return web.json_response({
+        "ok": indexer.last_error is None,
+        "backend": request.app["index"].name,
+        "points": points,
+        "indexed_calls": indexer.indexed_calls,
+        "indexed_chunks": indexer.indexed_chunks,
+        "last_error": indexer.last_error,
+    })
+
+
+async def _background(app: web.Application):
+    with db.connection(app["pool"]) as conn:
+        call_analytics.ensure_schema(conn)
+        call_cache.ensure_schema(conn)
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=300))
+    app["session"] = session
+    app["index"] = MemoryIndex() if SEARCH_BACKEND == "memory" else QdrantIndex(session)
+    app["indexer"] = Indexer(app["pool"], session, app["index"])
+    task = asyncio.create_task(app["indexer"].run())
+    yield
+    task.cancel()
+    await session.close()
+
+
+def create_app(pool=None) -> web.Application:
+    app = web.Application()
+    app["pool"] = pool or db.create_pool()
+    app.router.add_post("/search", post_search)
+    app.router.add_post("/reindex", post_reindex)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("SEARCH_PORT", "8511")))
+
+
+if __name__ == "__main__":
+    main()
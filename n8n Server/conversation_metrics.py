@@ -0,0 +1,168 @@
+"""
+Объективные метрики разговора по репликам с диаризацией (speaker_labels).
+
+Раньше Gemini получал только текст и сам "на глаз" оценивал, кто сколько
+говорил и перебивал ли менеджер. Здесь это считается по таймкодам
+utterances (ответ AssemblyAI или local_stt.py) векторно, на NumPy:
+
+  talk_ratio          доля речи каждого спикера
+  longest_monologue   самый длинный непрерывный отрезок речи спикера
+                      (соседние реплики с паузой до MONOLOGUE_GAP_MS — один отрезок)
+  interruptions       сколько раз спикер вступил, пока другой не договорил:
+                      наложение реплик или вход через < INTERRUPT_GAP_MS после
+                      реплики без точки/вопроса в конце
+  silence_share       доля записи без речи; longest_silence — самая длинная пауза
+                      (кроме transcript["preprocessed"]: audio_preprocess укоротил
+                      паузы, поэтому нет тишины, длительности записи и входа по паузе —
+                      перебиванием считается только наложение реплик)
+  questions           число вопросов ("?") у спикера
+  words_per_minute    темп речи
+  turns               смен говорящего
+
+Таймкоды переводятся в целые микросекунды (int64): суммы по тысячам
+реплик без накопления ошибки float, те же единицы для всех операций.
+
+compute() -> полный словарь для записи анализа (call_analyses.metrics),
+prompt_line() -> одна строка для промпта вместо таймкодов у каждой реплики.
+
+Проверка на своей транскрипции:
+  python conversation_metrics.py transcript.json
+"""
+
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+MONOLOGUE_GAP_MS = int(os.getenv("METRICS_MONOLOGUE_GAP_MS", "1500"))
+INTERRUPT_GAP_MS = int(os.getenv("METRICS_INTERRUPT_GAP_MS", "300"))
+
+US_PER_MS = 1000
+TERMINAL = re.compile(r"[.!?…]\s*$")
+
+
+def _seconds(us) -> float:
+    return round(float(us) / 1_000_000, 1)
+
+
+def _clock(seconds: float) -> str:
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def compute(transcript: dict) -> dict:
+    """Метрики по transcript["utterances"]; без реплик или таймкодов — None."""
+    utterances = [
+        u for u in (transcript.get("utterances") or [])
+        if u.get("start") is not None and u.get("end") is not None
+    ]
+    if not utterances:
+        return None
+    utterances.sort(key=lambda u: u["start"])
+
+    starts = np.fromiter((u["start"] for u in utterances), dtype=np.int64, count=len(utterances)) * US_PER_MS
+    ends = np.fromiter((u["end"] for u in utterances), dtype=np.int64, count=len(utterances)) * US_PER_MS
+    ends = np.maximum(ends, starts)
+    speakers = np.array([str(u.get("speaker") or "?") for u in utterances])
+    texts = np.array([u.get("text") or "" for u in utterances], dtype=str)
+    lengths = ends - starts
+
+    preprocessed = bool(transcript.get("preprocessed"))
+    audio_us = int((transcript.get("audio_duration") or 0) * 1_000_000)
+    duration_us = max(audio_us, int(ends.max()))
+
+    # Речь без наложений: отрезки, склеенные по накопленному максимуму концов
+    reach = np.maximum.accumulate(ends)
+    gaps = starts[1:] - reach[:-1]
+    silences = np.concatenate(([starts[0]], gaps[gaps > 0], [duration_us - reach[-1]]))
+    silences = silences[silences > 0]
+    speech_us = duration_us - int(silences.sum())
+
+    # Непрерывные отрезки одного спикера: новый отрезок при смене спикера или длинной паузе
+    breaks = np.flatnonzero(
+        (speakers[1:] != speakers[:-1]) | (starts[1:] - ends[:-1] > MONOLOGUE_GAP_MS * US_PER_MS)
+    ) + 1
+    segment_starts = np.concatenate(([0], breaks))
+    segment_lengths = np.maximum.reduceat(ends, segment_starts) - starts[segment_starts]
+    segment_speakers = speakers[segment_starts]
+
+    # Перебивание: другой спикер вошёл до конца реплики или сразу после оборванной фразы
+    changed = speakers[1:] != speakers[:-1]
+    overlap = starts[1:] < ends[:-1]
+    cut_off = np.array([not TERMINAL.search(t) for t in texts[:-1]], dtype=bool)
+    quick = starts[1:] - ends[:-1] < INTERRUPT_GAP_MS * US_PER_MS
+    interrupted = changed & (overlap if preprocessed else overlap | (quick & cut_off))
+    interrupters = speakers[1:][interrupted]
+
+    questions = np.char.count(texts, "?")
+    words = np.array([len(t.split()) for t in texts])
+    talk_total = int(lengths.sum()) or 1
+
+    per_speaker = {}
+    for speaker in sorted(set(speakers.tolist())):
+        mask = speakers == speaker
+        talk_us = int(lengths[mask].sum())
+        segment_mask = segment_speakers == speaker
+        per_speaker[speaker] = {
+            "talk_seconds": _seconds(talk_us),
+            "talk_ratio": round(talk_us / talk_total, 3),
+            "longest_monologue_seconds": _seconds(segment_lengths[segment_mask].max()) if segment_mask.any() else 0.0,
+            "interruptions": int((interrupters == speaker).sum()),
+            "questions": int(questions[mask].sum()),
+            "words_per_minute": round(float(words[mask].sum()) / (talk_us / 60_000_000), 1) if talk_us else 0.0,
+            "utterances": int(mask.sum()),
+        }
+
+    metrics = {
+        "speech_seconds": _seconds(speech_us),
+        "turns": int(changed.sum()),
+        "speakers": per_speaker,
+    }
+    if preprocessed:
+        metrics["preprocessed"] = True
+    else:
+        metrics.update({
+            "duration_seconds": _seconds(duration_us),
+            "silence_share": round(1 - speech_us / duration_us, 3) if duration_us else 0.0,
+            "longest_silence_seconds": _seconds(silences.max()) if silences.size else 0.0,
+        })
+    return metrics
+
+
+def prompt_line(metrics: dict) -> str:
+    """Компактная строка для промпта: только числа, без таймкодов реплик."""
+    if not metrics:
+        return ""
+    speakers = metrics["speakers"]
+
+    def _each(field, fmt=str) -> str:
+        return ", ".join(f"{name} {fmt(values[field])}" for name, values in speakers.items())
+
+    parts = [f"длительность {_clock(metrics['duration_seconds'])}"] if "duration_seconds" in metrics else []
+    parts += [
+        f"доля речи {_each('talk_ratio', '{:.0%}'.format)}",
+        f"самый длинный монолог {_each('longest_monologue_seconds', _clock)}",
+        f"перебивания {_each('interruptions')}",
+        f"вопросы {_each('questions')}",
+    ]
+    if "silence_share" in metrics:
+        parts.append(f"тишина {metrics['silence_share']:.0%}, "
+                     f"самая длинная пауза {_clock(metrics['longest_silence_seconds'])}")
+    parts.append(f"смен говорящего {metrics['turns']}")
+    return "Метрики разговора (посчитаны по таймкодам, не пересчитывай): " + "; ".join(parts) + "."
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Метрики разговора по транскрипции AssemblyAI")
+    parser.add_argument("transcript", help="JSON ответа AssemblyAI / transcription_service")
+    args = parser.parse_args()
+    with open(args.transcript, encoding="utf-8") as f:
+        metrics = compute(json.load(f))
+    print(json.dumps(metrics, ensure_ascii=False, indent=2))
+    print(prompt_line(metrics))
+
+
+if __name__ == "__main__":
+    main()
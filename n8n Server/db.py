@@ -0,0 +1,70 @@
+"""
+Подключение к Postgres n8n для админки и сервисов рядом с ней.
+
+Один пул соединений на процесс: соединения переиспользуются,
+а не открываются заново на каждый запрос. Когда все DB_POOL_MAX
+соединений заняты, запрос ждёт свободное до DB_POOL_TIMEOUT секунд
+(сервисы ходят в базу из потоков asyncio.to_thread — их больше, чем
+соединений), а не падает сразу с "connection pool exhausted".
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+# Для локальной разработки можно переопределить через окружение, на сервере — сеть Docker
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "postgres"),  # Внутри сети docker
+    "port": int(os.getenv("DB_PORT", "5432")),
+    "database": os.getenv("DB_NAME", "n8n"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", "Ujp74hLVjaU5pUA1KTshZx2Xr154yAQW"),
+}
+
+
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+
+class WaitingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool, который ждёт освобождения соединения вместо PoolError."""
+
+    def __init__(self, minconn: int, maxconn: int, *args, timeout: float = DB_POOL_TIMEOUT, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.timeout = timeout
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"нет свободного соединения с Postgres за {self.timeout:g} с")
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+def create_pool(minconn: int = 1, maxconn: int = None) -> ThreadedConnectionPool:
+    maxconn = maxconn or int(os.getenv("DB_POOL_MAX", "5"))
+    return WaitingConnectionPool(minconn, maxconn, **DB_CONFIG)
+
+
+@contextmanager
+def connection(pool: ThreadedConnectionPool):
+    """Соединение из пула: commit при успехе, rollback при ошибке."""
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
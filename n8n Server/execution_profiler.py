@@ -0,0 +1,447 @@
+"""
+Профиль выполнений n8n по нодам: где на самом деле теряется время.
+
+Вместо догадок (так появился fix_amocrm_timeout.py) — замер: из каждого
+выполнения берутся запуски нод (startTime, executionTime, статус) и
+складываются в компактную SQLite-базу (PROFILER_STORE): имена нод —
+в справочник, запуск — строка из целых чисел. Повторный sync читает
+только выполнения новее последнего увиденного id; незавершённые
+(running/waiting) не пропускаются — sync вернётся к ним в следующий раз,
+пока они не старше PROFILER_STALE_HOURS.
+
+Источники:
+  --source api   публичный API n8n (N8N_API_URL, N8N_API_KEY)
+  --source db    таблицы execution_entity/execution_data в Postgres n8n
+  --fixture F    дамп (JSON: список выполнений или страницы API), см. dump
+
+Отчёты:
+  report        p50/p95/p99, доля ошибок по нодам; --by-version — по версиям воркфлоу
+  regressions   ноды, у которых за последние --recent-hours p95 или доля
+                ошибок заметно хуже, чем за --baseline-days до этого;
+                код выхода 1, если есть (для cron)
+
+Запуск:
+  python execution_profiler.py sync --source db
+  python execution_profiler.py report --workflow <id> --days 7 --by-version
+  python execution_profiler.py regressions
+  python execution_profiler.py dump --out fixture.json --limit 500
+  python execution_profiler.py sync --fixture fixture.json --store /tmp/profile.sqlite
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import aiohttp
+
+import db
+import n8n_api
+import stats
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.getenv("PROFILER_STORE", "execution_profile.sqlite")
+STALE_HOURS = float(os.getenv("PROFILER_STALE_HOURS", "24"))
+# Регрессия: p95 вырос в REGRESSION_RATIO раз и хотя бы на REGRESSION_MIN_MS,
+# или доля ошибок выросла на REGRESSION_ERROR_DELTA; выборки не меньше MIN_SAMPLES
+REGRESSION_RATIO = float(os.getenv("PROFILER_REGRESSION_RATIO", "1.5"))
+REGRESSION_MIN_MS = int(os.getenv("PROFILER_REGRESSION_MIN_MS", "500"))
+REGRESSION_ERROR_DELTA = float(os.getenv("PROFILER_REGRESSION_ERROR_DELTA", "0.05"))
+MIN_SAMPLES = int(os.getenv("PROFILER_MIN_SAMPLES", "20"))
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    source  TEXT PRIMARY KEY,
+    last_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS executions (
+    id          INTEGER PRIMARY KEY,
+    workflow_id TEXT NOT NULL,
+    version     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    mode        TEXT,
+    started_at  INTEGER NOT NULL,
+    duration_ms INTEGER
+);
+CREATE INDEX IF NOT EXISTS executions_workflow ON executions (workflow_id, started_at);
+CREATE TABLE IF NOT EXISTS nodes (
+    id          INTEGER PRIMARY KEY,
+    workflow_id TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    type        TEXT,
+    UNIQUE (workflow_id, name)
+);
+CREATE TABLE IF NOT EXISTS node_runs (
+    execution_id INTEGER NOT NULL,
+    node_id      INTEGER NOT NULL,
+    run          INTEGER NOT NULL,
+    offset_ms    INTEGER,
+    duration_ms  INTEGER NOT NULL,
+    ok           INTEGER NOT NULL,
+    PRIMARY KEY (execution_id, node_id, run)
+) WITHOUT ROWID;
+"""
+
+
+# =========================================================================
+# ХРАНИЛИЩЕ
+# =========================================================================
+class Store:
+    def __init__(self, path: str = STORE_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA_SQL)
+        self._node_ids = {}
+
+    def close(self):
+        self.conn.close()
+
+    def last_id(self, source: str) -> int:
+        row = self.conn.execute("SELECT last_id FROM sync_state WHERE source = ?;", (source,)).fetchone()
+        return row[0] if row else 0
+
+    def set_last_id(self, source: str, last_id: int):
+        self.conn.execute(
+            "INSERT INTO sync_state (source, last_id) VALUES (?, ?) "
+            "ON CONFLICT (source) DO UPDATE SET last_id = excluded.last_id;",
+            (source, last_id),
+        )
+
+    def _node_id(self, workflow_id: str, name: str, node_type: str) -> int:
+        key = (workflow_id, name)
+        if key not in self._node_ids:
+            self.conn.execute(
+                "INSERT INTO nodes (workflow_id, name, type) VALUES (?, ?, ?) ON CONFLICT DO NOTHING;",
+                (workflow_id, name, node_type),
+            )
+            self._node_ids[key] = self.conn.execute(
+                "SELECT id FROM nodes WHERE workflow_id = ? AND name = ?;", key,
+            ).fetchone()[0]
+        return self._node_ids[key]
+
+    def add(self, execution: dict) -> int:
+        """Записать выполнение и запуски его нод; вернуть число запусков."""
+        started = n8n_api.parse_time(execution.get("startedAt"))
+        stopped = n8n_api.parse_time(execution.get("stoppedAt"))
+        if started is None:
+            return 0
+        workflow_id = str(execution.get("workflowId") or "?")
+        types = {node.get("name"): node.get("type") for node in (execution["workflowData"].get("nodes") or [])}
+        self.conn.execute(
+            "INSERT OR REPLACE INTO executions (id, workflow_id, version, status, mode, started_at, duration_ms) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?);",
+            (execution["id"], workflow_id, n8n_api.workflow_version(execution), execution.get("status") or "?",
+             execution.get("mode"), int(started), int((stopped - started) * 1000) if stopped else None),
+        )
+        rows = []
+        for name, runs in n8n_api.run_data(execution).items():
+            node_id = self._node_id(workflow_id, name, types.get(name))
+            for i, task in enumerate(runs or []):
+                if not isinstance(task, dict) or task.get("executionTime") is None:
+                    continue
+                status = task.get("executionStatus")
+                ok = 0 if task.get("error") or status == "error" else 1
+                offset = int(task["startTime"] - started * 1000) if task.get("startTime") else None
+                rows.append((execution["id"], node_id, i, offset, int(task["executionTime"]), ok))
+        self.conn.executemany("INSERT OR REPLACE INTO node_runs VALUES (?, ?, ?, ?, ?, ?);", rows)
+        return len(rows)
+
+    def samples(self, since: float, until: float = None, workflow_id: str = None) -> list:
+        """(workflow_id, version, node, type, duration_ms, ok) запусков в окне."""
+        query = (
+            "SELECT e.workflow_id, e.version, n.name, n.type, r.duration_ms, r.ok "
+            "FROM node_runs r JOIN executions e ON e.id = r.execution_id JOIN nodes n ON n.id = r.node_id "
+            "WHERE e.started_at >= ? AND e.started_at < ?"
+        )
+        params = [int(since), int(until or time.time() + 1)]
+        if workflow_id:
+            query += " AND e.workflow_id = ?"
+            params.append(workflow_id)
+        return self.conn.execute(query + ";", params).fetchall()
+
+    def versions(self, workflow_id: str = None) -> dict:
+        """(workflow_id, version) -> (первое выполнение, последнее, число)."""
+        query = "SELECT workflow_id, version, min(started_at), max(started_at), count(*) FROM executions"
+        params = []
+        if workflow_id:
+            query += " WHERE workflow_id = ?"
+            params.append(workflow_id)
+        rows = self.conn.execute(query + " GROUP BY workflow_id, version;", params).fetchall()
+        return {(w, v): (first, last, n) for w, v, first, last, n in rows}
+
+
+# =========================================================================
+# СИНХРОНИЗАЦИЯ
+# =========================================================================
+def is_settled(execution: dict, now: float) -> bool:
+    """Завершено или висит дольше PROFILER_STALE_HOURS (упавший процесс n8n)."""
+    if execution.get("status") not in n8n_api.UNFINISHED:
+        return True
+    started = n8n_api.parse_time(execution.get("startedAt")) or 0
+    return now - started > STALE_HOURS * 3600
+
+
+def ingest(store: Store, source: str, executions: list, blocked: bool = False) -> dict:
+    """
+    Выполнения (любого порядка) новее last_id -> хранилище. last_id
+    сдвигается только до первого незавершённого (blocked — оно было на
+    прошлой странице), чтобы дочитать его позже; уже записанные после
+    него выполнения второй раз не разбираются.
+    """
+    last_id = store.last_id(source)
+    now = time.time()
+    known = {row[0] for row in store.conn.execute("SELECT id FROM executions WHERE id > ?;", (last_id,))}
+    added = runs = 0
+    new_last = last_id
+    for execution in sorted((e for e in executions if e["id"] > last_id), key=lambda e: e["id"]):
+        if not is_settled(execution, now):
+            blocked = True
+            continue
+        if execution["id"] not in known:
+            runs += store.add(execution)
+            added += 1
+        if not blocked:
+            new_last = execution["id"]
+    store.set_last_id(source, new_last)
+    store.conn.commit()
+    return {"executions": added, "node_runs": runs, "last_id": new_last, "blocked": blocked}
+
+
+def _add_page(store: Store, page: list, now: float) -> tuple:
+    """Записать завершённые выполнения страницы, которых ещё нет; (выполнений, запусков)."""
+    ids = [execution["id"] for execution in page]
+    known = {row[0] for row in store.conn.execute(
+        f"SELECT id FROM executions WHERE id IN ({','.join('?' * len(ids))});", ids,
+    )}
+    added = runs = 0
+    for execution in page:
+        if execution["id"] not in known and is_settled(execution, now):
+            runs += store.add(execution)
+            added += 1
+    store.conn.commit()
+    return added, runs
+
+
+async def _fetch_api(store: Store, source: str, workflow_id: str) -> dict:
+    """
+    Страницы API от новых к старым, пока не дошли до уже прочитанного id.
+    Каждая страница сразу пишется в хранилище — история с includeData
+    целиком в памяти не держится. last_id — самое новое завершённое
+    выполнение старше всех незавершённых; ставится, когда дочитали до конца.
+    """
+    last_id = store.last_id(source)
+    now = time.time()
+    total = {"executions": 0, "node_runs": 0, "last_id": last_id, "blocked": False}
+    new_last = None
+    page = []
+
+    def flush():
+        added, runs = _add_page(store, page, now)
+        total["executions"] += added
+        total["node_runs"] += runs
+        logger.info("Прочитано до id %d: %d выполнений", page[-1]["id"], total["executions"])
+        page.clear()
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        api = n8n_api.N8nAPI(session)
+        async for execution in api.executions(workflow_id=workflow_id):
+            if execution["id"] <= last_id:
+                break
+            # От новых к старым: незавершённое сбрасывает кандидата в last_id
+            if not is_settled(execution, now):
+                total["blocked"] = True
+                new_last = None
+            elif new_last is None:
+                new_last = execution["id"]
+            page.append(execution)
+            if len(page) >= n8n_api.PAGE_SIZE:
+                flush()
+        if page:
+            flush()
+    total["last_id"] = new_last or last_id
+    store.set_last_id(source, total["last_id"])
+    store.conn.commit()
+    return total
+
+
+def _fetch_db(store: Store, source: str, workflow_id: str) -> dict:
+    pool = db.create_pool()
+    total = {"executions": 0, "node_runs": 0, "last_id": store.last_id(source), "blocked": False}
+    cursor = total["last_id"]
+    try:
+        while True:
+            with db.connection(pool) as conn:
+                page = n8n_api.fetch_executions_db(conn, cursor, workflow_id=workflow_id)
+            if not page:
+                break
+            cursor = page[-1]["id"]
+            result = ingest(store, source, page, total["blocked"])
+            total.update(
+                executions=total["executions"] + result["executions"],
+                node_runs=total["node_runs"] + result["node_runs"],
+                last_id=result["last_id"],
+                blocked=result["blocked"],
+            )
+            logger.info("Прочитано до id %d: %d выполнений", cursor, total["executions"])
+    finally:
+        pool.closeall()
+    return total
+
+
+def load_fixture(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    pages = data if isinstance(data, list) and data and "data" in data[0] and "id" not in data[0] else [data]
+    executions = []
+    for page in pages:
+        items = page.get("data", []) if isinstance(page, dict) else page
+        executions.extend(n8n_api.normalize(item) for item in items)
+    return executions
+
+
+def sync(store: Store, args) -> dict:
+    if args.fixture:
+        return ingest(store, f"fixture:{os.path.basename(args.fixture)}", load_fixture(args.fixture))
+    source = f"{args.source}:{args.workflow or '*'}"
+    if args.source == "db":
+        return _fetch_db(store, source, args.workflow)
+    return asyncio.run(_fetch_api(store, source, args.workflow))
+
+
+async def _dump(args):
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        api = n8n_api.N8nAPI(session)
+        result = []
+        async for execution in api.executions(workflow_id=args.workflow):
+            result.append(execution)
+            if len(result) >= args.limit:
+                break
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"data": result}, f, ensure_ascii=False)
+    logger.info("Сохранено %d выполнений в %s", len(result), args.out)
+
+
+# =========================================================================
+# ОТЧЁТЫ
+# =========================================================================
+def node_stats(samples: list, by_version: bool) -> dict:
+    groups = collections.defaultdict(lambda: ([], [0, 0]))
+    for workflow_id, version, node, node_type, duration, ok in samples:
+        key = (workflow_id, version if by_version else "*", node, node_type)
+        durations, counts = groups[key]
+        durations.append(duration)
+        counts[0] += 1
+        counts[1] += 0 if ok else 1
+    return {
+        key: {
+            "n": counts[0],
+            "p50": stats.percentile(durations, 50),
+            "p95": stats.percentile(durations, 95),
+            "p99": stats.percentile(durations, 99),
+            "errors": round(counts[1] / counts[0], 3),
+        }
+        for key, (durations, counts) in groups.items()
+    }
+
+
+def report(store: Store, args) -> list:
+    groups = node_stats(store.samples(time.time() - args.days * 86400, workflow_id=args.workflow), args.by_version)
+    rows = [{"workflow": w, "version": v, "node": n, "type": t, **s} for (w, v, n, t), s in groups.items()]
+    rows.sort(key=lambda r: (r["workflow"], r["version"], -(r["p95"] or 0)))
+    return rows
+
+
+def regressions(store: Store, args) -> list:
+    now = time.time()
+    split = now - args.recent_hours * 3600
+    recent = node_stats(store.samples(split, now, args.workflow), False)
+    baseline = node_stats(store.samples(split - args.baseline_days * 86400, split, args.workflow), False)
+    versions = store.versions(args.workflow)
+    found = []
+    for key, new in recent.items():
+        old = baseline.get(key)
+        if not old or new["n"] < MIN_SAMPLES or old["n"] < MIN_SAMPLES:
+            continue
+        reasons = []
+        if new["p95"] >= old["p95"] * REGRESSION_RATIO and new["p95"] - old["p95"] >= REGRESSION_MIN_MS:
+            reasons.append(f"p95 {old['p95']} -> {new['p95']} мс")
+        if new["errors"] - old["errors"] >= REGRESSION_ERROR_DELTA:
+            reasons.append(f"ошибки {old['errors']:.1%} -> {new['errors']:.1%}")
+        if reasons:
+            workflow_id, _, node, node_type = key
+            # Версии, появившиеся в недавнем окне, — первые подозреваемые
+            new_versions = sorted(v for (w, v), (first, _, _) in versions.items() if w == workflow_id and first >= split)
+            found.append({"workflow": workflow_id, "node": node, "type": node_type, "reasons": reasons,
+                          "baseline": old, "recent": new, "new_versions": new_versions})
+    return found
+
+
+def print_report(rows: list):
+    current = None
+    for row in rows:
+        if (row["workflow"], row["version"]) != current:
+            current = (row["workflow"], row["version"])
+            print(f"\nВоркфлоу {row['workflow']}" + (f", версия {row['version']}" if row["version"] != "*" else ""))
+            print(f"  {'нода':<40} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'ошибки':>7}")
+        print(f"  {row['node'][:40]:<40} {row['n']:>6} {row['p50']:>8} {row['p95']:>8} {row['p99']:>8} {row['errors']:>7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время нод n8n по выполнениям: p50/p95/p99, регрессии")
+    parser.add_argument("--store", default=STORE_PATH, help="SQLite-файл профиля")
+    parser.add_argument("--workflow", help="Только этот workflowId")
+    parser.add_argument("--json", action="store_true", help="Вывод в JSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sync = sub.add_parser("sync", help="Дочитать новые выполнения")
+    p_sync.add_argument("--source", choices=("api", "db"), default="api")
+    p_sync.add_argument("--fixture", help="Читать из дампа вместо n8n")
+    p_report = sub.add_parser("report", help="Перцентили по нодам")
+    p_report.add_argument("--days", type=float, default=7)
+    p_report.add_argument("--by-version", action="store_true", help="Отдельно по версиям воркфлоу")
+    p_reg = sub.add_parser("regressions", help="Ноды, ставшие медленнее или чаще падать")
+    p_reg.add_argument("--recent-hours", type=float, default=24)
+    p_reg.add_argument("--baseline-days", type=float, default=7)
+    p_dump = sub.add_parser("dump", help="Сохранить выполнения из API как дамп для --fixture")
+    p_dump.add_argument("--out", required=True)
+    p_dump.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.command == "dump":
+        asyncio.run(_dump(args))
+        return
+    store = Store(args.store)
+    try:
+        if args.command == "sync":
+            result = sync(store, args)
+            logger.info("Синхронизация: %s", result)
+            if args.json:
+                print(json.dumps(result))
+        elif args.command == "report":
+            rows = report(store, args)
+            if args.json:
+                print(json.dumps(rows, ensure_ascii=False, indent=2))
+            else:
+                print_report(rows)
+        else:
+            found = regressions(store, args)
+            if args.json:
+                print(json.dumps(found, ensure_ascii=False, indent=2))
+            else:
+                for item in found:
+                    versions = f" (новые версии: {', '.join(item['new_versions'])})" if item["new_versions"] else ""
+                    print(f"{item['workflow']} / {item['node']}: {'; '.join(item['reasons'])}{versions}")
+                if not found:
+                    print("Регрессий нет")
+            if found:
+                raise SystemExit(1)
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,627 @@
+"""
+Повтор упавших выполнений воркфлоу amoCRM пачкой — вместо AMO CRM Error
+Handler (amo-error-handler-nodes.json), где каждое падение ждёт свои
+5 минут и повторяется вслепую, даже если это примечание уже повторяли.
+
+- Сбор: раз в REPLAY_POLL_INTERVAL новые выполнения со статусом error
+  (REPLAY_WORKFLOW_ID) из API n8n или Postgres n8n (REPLAY_SOURCE),
+  начиная с последнего увиденного id; или сразу — POST /failed из
+  Error Trigger. При первом запуске точка отсчёта — самое новое уже
+  упавшее выполнение (или REPLAY_SINCE): старые падения, которые
+  AMO CRM Error Handler уже повторил, сами не повторяются. Накопленное —
+  только явно: POST /collect {"since": 0} или кнопкой в админке. Из выполнения достаётся тело вебхука amoCRM (как в ноде
+  "Extract webhook body").
+- Дедупликация: тело режется на примечания, ключ — id примечания или
+  файла (как в webhook_gateway.py). Новое падение того же примечания
+  только дописывает id выполнения к задаче, второй повтор не ставится.
+  Примечание, уже выполненное через шлюз (call_jobs done), не повторяется.
+- Группировка: причина = нода, на которой упало, + текст ошибки без
+  чисел и id. Повторы идут не больше REPLAY_CONCURRENCY сразу. Повтор
+  упал — задача ждёт REPLAY_RETRY_BASE * 2^n (до REPLAY_RETRY_MAX), и
+  вся её причина тоже: пока amoCRM лежит, остальные задачи с той же
+  причиной не стреляют, после паузы идёт одна пробная.
+- Dead letter: после REPLAY_MAX_ATTEMPTS попыток задача остаётся со
+  статусом dead и последней ошибкой; видно в админке и GET /replays,
+  вернуть — POST /replays/retry или кнопкой в админке.
+
+Эндпоинты:
+  POST /failed          {"execution": {"id": ...}} или {"execution_id": ...} — из Error Trigger
+  POST /collect         собрать упавшие сейчас; {"since": id} — все после id
+  GET  /replays         причины, счётчики, dead letter
+  POST /replays/retry   {"dedupe_key"} | {"cause"} | {} (весь dead letter)
+  GET  /health
+
+Запуск:
+  python execution_replayer.py   # порт REPLAY_PORT (по умолчанию 8510)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+import urllib.request
+from urllib.parse import urlencode
+
+import aiohttp
+from aiohttp import web
+
+import db
+import n8n_api
+import webhook_gateway
+
+logger = logging.getLogger(__name__)
+
+REPLAY_TARGET_URL = os.getenv("REPLAY_TARGET_URL", webhook_gateway.N8N_WEBHOOK_URL)
+REPLAY_WORKFLOW_ID = os.getenv("REPLAY_WORKFLOW_ID", "")
+REPLAY_SOURCE = os.getenv("REPLAY_SOURCE", "api")
+REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY", "3"))
+REPLAY_MAX_ATTEMPTS = int(os.getenv("REPLAY_MAX_ATTEMPTS", "6"))
+REPLAY_RETRY_BASE = float(os.getenv("REPLAY_RETRY_BASE", "60"))
+REPLAY_RETRY_MAX = float(os.getenv("REPLAY_RETRY_MAX", "3600"))
+REPLAY_POLL_INTERVAL = float(os.getenv("REPLAY_POLL_INTERVAL", "60"))
+REPLAY_TICK = float(os.getenv("REPLAY_TICK", "5"))
+REPLAY_TIMEOUT = float(os.getenv("REPLAY_TIMEOUT", "900"))
+REPLAY_KEEP_DAYS = int(os.getenv("REPLAY_KEEP_DAYS", "30"))
+# id выполнения, после которого собирать при первом запуске; пусто — только новые падения
+REPLAY_SINCE = os.getenv("REPLAY_SINCE", "")
+# Адрес сервиса для админки
+REPLAY_URL = os.getenv("REPLAY_URL", "http://replayer:8510").rstrip("/")
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS replay_jobs (
+    dedupe_key    TEXT PRIMARY KEY,
+    body          TEXT NOT NULL,
+    cause         TEXT NOT NULL,
+    node          TEXT,
+    error         TEXT,
+    execution_ids BIGINT[] NOT NULL,
+    status        TEXT NOT NULL DEFAULT 'queued',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    available_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+    leased_until  TIMESTAMPTZ,
+    last_error    TEXT,
+    created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS replay_jobs_ready
+    ON replay_jobs (available_at) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS replay_jobs_cause ON replay_jobs (cause, status);
+
+CREATE TABLE IF NOT EXISTS replay_state (
+    source  TEXT PRIMARY KEY,
+    last_id BIGINT NOT NULL
+);
+"""
+
+NOISE = [
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I), "<uuid>"),
+    (re.compile(r"\d+"), "N"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+
+
+# =========================================================================
+# РАЗБОР УПАВШЕГО ВЫПОЛНЕНИЯ
+# =========================================================================
+def form_pairs(value, prefix: str = "") -> list:
+    """Тело вебхука из n8n (вложенный объект или плоские ключи) -> пары формы amoCRM."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return [(prefix, "" if value is None else str(value))]
+    pairs = []
+    for key, item in items:
+        pairs.extend(form_pairs(item, f"{prefix}[{key}]" if prefix else str(key)))
+    return pairs
+
+
+def webhook_body(execution: dict) -> str:
+    """Тело вебхука из выхода ноды Webhook (первая нода с json.body), как в "Extract webhook body"."""
+    for runs in n8n_api.run_data(execution).values():
+        try:
+            item = runs[0]["data"]["main"][0][0]["json"]
+        except (IndexError, KeyError, TypeError):
+            continue
+        body = item.get("body") if isinstance(item, dict) else None
+        if body:
+            return body if isinstance(body, str) else urlencode(form_pairs(body))
+    return ""
+
+
+def failure_cause(execution: dict) -> tuple:
+    """(причина, нода, текст ошибки): нода падения + ошибка без чисел и id."""
+    result = (execution.get("data") or {}).get("resultData") or {}
+    error = result.get("error") or {}
+    node = result.get("lastNodeExecuted") or (error.get("node") or {}).get("name") or "?"
+    message = str(error.get("message") or error.get("description") or "без текста ошибки")
+    normalized = message.lower()
+    for pattern, replacement in NOISE:
+        normalized = pattern.sub(replacement, normalized)
+    return f"{node} | {normalized.strip()[:120]}", node, message[:1000]
+
+
+def replay_items(execution: dict) -> list:
+    """Упавшее выполнение -> [(dedupe_key, тело формы)] по примечаниям."""
+    body = webhook_body(execution)
+    if not body:
+        return []
+    notes = webhook_gateway.split_notes(body)
+    if not notes:
+        return [(f"body:{execution['id']}", body)]
+    return [(webhook_gateway.dedupe_key(pairs), urlencode(pairs)) for pairs in notes]
+
+
+# =========================================================================
+# РАБОТА С БАЗОЙ
+# =========================================================================
+def record(conn, key: str, body: str, cause: str, node: str, error: str, execution_id: int) -> bool:
+    """True — новая задача; повтор примечания только дописывает id выполнения."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('call_jobs') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute("SELECT 1 FROM call_jobs WHERE dedupe_key = %s AND status = 'done';", (key,))
+            handled = cur.fetchone() is not None
+        else:
+            handled = False
+        cur.execute(
+            """
+            INSERT INTO replay_jobs (dedupe_key, body, cause, node, error, execution_ids, status)
+            VALUES (%(key)s, %(body)s, %(cause)s, %(node)s, %(error)s, ARRAY[%(execution)s]::bigint[], %(status)s)
+            ON CONFLICT (dedupe_key) DO UPDATE SET
+                execution_ids = CASE WHEN %(execution)s = ANY(replay_jobs.execution_ids)
+                                     THEN replay_jobs.execution_ids
+                                     ELSE replay_jobs.execution_ids || %(execution)s::bigint END,
+                updated_at = now()
+            RETURNING (xmax = 0);
+            """,
+            {"key": key, "body": body, "cause": cause, "node": node, "error": error,
+             "execution": execution_id, "status": "skipped" if handled else "queued"},
+        )
+        return cur.fetchone()[0] and not handled
+
+
+def last_id(conn, source: str) -> int:
+    """Последний увиденный id; None — источник ещё не читали."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT last_id FROM replay_state WHERE source = %s;", (source,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+
+def set_last_id(conn, source: str, value: int):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO replay_state (source, last_id) VALUES (%s, %s) "
+            "ON CONFLICT (source) DO UPDATE SET last_id = GREATEST(replay_state.last_id, EXCLUDED.last_id);",
+            (source, value),
+        )
+
+
+def lease(conn, limit: int, blocked: list, probing: list) -> list:
+    """
+    До limit готовых задач, кроме причин из blocked; из причин probing —
+    не больше одной (пробный повтор после серии ошибок).
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT dedupe_key, cause FROM replay_jobs
+            WHERE ((status = 'queued' AND available_at <= now())
+                   OR (status = 'running' AND leased_until < now()))
+              AND NOT (cause = ANY(%s::text[]))
+            ORDER BY available_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED;
+            """,
+            (blocked, limit * 4),
+        )
+        chosen, probes = [], set()
+        for key, cause in cur.fetchall():
+            if cause in probing:
+                if cause in probes:
+                    continue
+                probes.add(cause)
+            chosen.append(key)
+            if len(chosen) >= limit:
+                break
+        if not chosen:
+            return []
+        cur.execute(
+            """
+            UPDATE replay_jobs SET status = 'running', attempts = attempts + 1,
+                leased_until = now() + make_interval(secs => %s), updated_at = now()
+            WHERE dedupe_key = ANY(%s)
+            RETURNING dedupe_key, body, cause, attempts;
+            """,
+            (REPLAY_TIMEOUT + 60, chosen),
+        )
+        return [{"dedupe_key": k, "body": b, "cause": c, "attempts": a} for k, b, c, a in cur.fetchall()]
+
+
+def complete(conn, key: str):
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE replay_jobs SET status = 'done', leased_until = NULL, last_error = NULL, updated_at = now() "
+            "WHERE dedupe_key = %s;",
+            (key,),
+        )
+
+
+def fail(conn, job: dict, error: str, delay: float) -> bool:
+    """Отложить на delay секунд или, после REPLAY_MAX_ATTEMPTS, в dead letter. True — dead."""
+    dead = job["attempts"] >= REPLAY_MAX_ATTEMPTS
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE replay_jobs SET status = %s, leased_until = NULL, last_error = %s,
+                available_at = now() + make_interval(secs => %s), updated_at = now()
+            WHERE dedupe_key = %s;
+            """,
+            ("dead" if dead else "queued", error, delay, job["dedupe_key"]),
+        )
+    return dead
+
+
+def requeue(conn, dedupe_key: str = None, cause: str = None) -> list:
+    """Вернуть в очередь с нуля: одну задачу, все задачи причины или весь dead letter; причины задач."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE replay_jobs SET status = 'queued', attempts = 0, available_at = now(), updated_at = now()
+            WHERE status IN ('dead', 'queued')
+              AND (%(key)s::text IS NULL OR dedupe_key = %(key)s)
+              AND (%(cause)s::text IS NULL OR cause = %(cause)s)
+              AND (%(key)s::text IS NOT NULL OR %(cause)s::text IS NOT NULL OR status = 'dead')
+            RETURNING cause;
+            """,
+            {"key": dedupe_key, "cause": cause},
+        )
+        return [row[0] for row in cur.fetchall()]
+
+
+def causes(conn) -> list:
+    """Причины падений: сколько задач в каком статусе, последняя ошибка."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT cause, node,
+                   count(*) FILTER (WHERE status IN ('queued', 'running')) AS pending,
+                   count(*) FILTER (WHERE status = 'done') AS done,
+                   count(*) FILTER (WHERE status = 'dead') AS dead,
+                   count(*) FILTER (WHERE status = 'skipped') AS skipped,
+                   sum(cardinality(execution_ids)) AS executions,
+                   max(updated_at) AS last_seen,
+                   (array_agg(last_error ORDER BY updated_at DESC) FILTER (WHERE last_error IS NOT NULL))[1] AS last_error
+            FROM replay_jobs
+            GROUP BY cause, node
+            ORDER BY pending DESC, dead DESC, last_seen DESC;
+            """
+        )
+        names = [c.name for c in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def jobs(conn, status: str = "dead", cause: str = None, limit: int = 200) -> list:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT dedupe_key, cause, status, attempts, execution_ids, last_error, error,
+                   available_at, created_at, updated_at
+            FROM replay_jobs
+            WHERE status = %s AND (%s::text IS NULL OR cause = %s)
+            ORDER BY updated_at DESC
+            LIMIT %s;
+            """,
+            (status, cause, cause, limit),
+        )
+        names = [c.name for c in cur.description]
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def purge(conn, keep_days: int = REPLAY_KEEP_DAYS) -> int:
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM replay_jobs WHERE status IN ('done', 'skipped') "
+            "AND updated_at < now() - make_interval(days => %s);",
+            (keep_days,),
+        )
+        return cur.rowcount
+
+
+# =========================================================================
+# ПОВТОРЫ
+# =========================================================================
+class CauseGate:
+    """Пауза на всю причину после ошибки повтора; после паузы — одна пробная задача."""
+
+    def __init__(self):
+        self.failures = {}  # причина -> (ошибок подряд, до какого времени пауза)
+
+    def delay(self, cause: str) -> float:
+        count, _ = self.failures.get(cause, (0, 0.0))
+        return random.uniform(0.5, 1.0) * min(REPLAY_RETRY_MAX, REPLAY_RETRY_BASE * 2 ** count)
+
+    def failed(self, cause: str) -> float:
+        pause = self.delay(cause)
+        count, _ = self.failures.get(cause, (0, 0.0))
+        self.failures[cause] = (count + 1, time.monotonic() + pause)
+        return pause
+
+    def succeeded(self, cause: str):
+        self.failures.pop(cause, None)
+
+    def blocked(self) -> list:
+        now = time.monotonic()
+        return [cause for cause, (_, until) in self.failures.items() if until > now]
+
+    def probing(self) -> list:
+        return list(self.failures)
+
+
+class Replayer:
+    def __init__(self, pool, session: aiohttp.ClientSession):
+        self.pool = pool
+        self.session = session
+        self.gate = CauseGate()
+        self.inflight = {}  # задача asyncio -> причина
+        self.stats = {"collected": 0, "duplicates": 0, "replayed": 0, "failed": 0, "dead": 0}
+        self._wakeup = asyncio.Event()
+
+    def _db(self, func, *args):
+        def _call():
+            with db.connection(self.pool) as conn:
+                return func(conn, *args)
+        return asyncio.to_thread(_call)
+
+    def wake(self):
+        """Появились задачи — не ждать REPLAY_TICK."""
+        self._wakeup.set()
+
+    # --- сбор ---
+
+    async def add_execution(self, execution: dict) -> int:
+        items = replay_items(execution)
+        if not items:
+            logger.warning("Выполнение %s: тело вебхука не найдено, пропущено", execution["id"])
+            return 0
+        cause, node, error = failure_cause(execution)
+        new = 0
+        for key, body in items:
+            if await self._db(record, key, body, cause, node, error, execution["id"]):
+                new += 1
+                logger.info("Выполнение %s: %s в очередь (%s)", execution["id"], key, cause)
+            else:
+                self.stats["duplicates"] += 1
+        self.stats["collected"] += new
+        if new:
+            self.wake()
+        return new
+
+    async def _newest_error_id(self) -> int:
+        if REPLAY_SOURCE == "db":
+            return await self._db(n8n_api.newest_execution_id_db, REPLAY_WORKFLOW_ID or None, "error")
+        api = n8n_api.N8nAPI(self.session)
+        async for execution in api.executions(workflow_id=REPLAY_WORKFLOW_ID or None, status="error",
+                                              include_data=False, limit=1):
+            return execution["id"]
+        return 0
+
+    async def collect(self, since: int = None, backlog: bool = False) -> int:
+        """
+        Упавшие выполнения после последнего увиденного id (или после since).
+        Первый фоновый сбор без REPLAY_SINCE только запоминает самое новое
+        падение: накопленное до запуска сервиса уже повторял Error Handler.
+        backlog — явный запрос (POST /collect): первый сбор берёт всё.
+        """
+        source = f"{REPLAY_SOURCE}:{REPLAY_WORKFLOW_ID or '*'}"
+        after = since if since is not None else await self._db(last_id, source)
+        if after is None and REPLAY_SINCE:
+            after = int(REPLAY_SINCE)
+        if after is None and backlog:
+            after = 0
+        if after is None:
+            newest = await self._newest_error_id()
+            await self._db(set_last_id, source, newest)
+            logger.info("Первый запуск: повторяются падения после выполнения %s, прежние — через POST /collect", newest)
+            return 0
+        new = 0
+        if REPLAY_SOURCE == "db":
+            while True:
+                page = await self._db(n8n_api.fetch_executions_db, after, n8n_api.PAGE_SIZE,
+                                      REPLAY_WORKFLOW_ID or None, "error")
+                if not page:
+                    break
+                for execution in page:
+                    new += await self.add_execution(execution)
+                after = page[-1]["id"]
+                await self._db(set_last_id, source, after)
+        else:
+            api = n8n_api.N8nAPI(self.session)
+            newest = after
+            async for execution in api.executions(workflow_id=REPLAY_WORKFLOW_ID or None, status="error"):
+                if execution["id"] <= after:
+                    break
+                newest = max(newest, execution["id"])
+                new += await self.add_execution(execution)
+            await self._db(set_last_id, source, newest)
+        return new
+
+    # --- повтор ---
+
+    async def _replay(self, job: dict):
+        try:
+            async with self.session.post(
+                REPLAY_TARGET_URL,
+                data=job["body"],
+                headers={"Content-Type": "application/x-www-form-urlencoded"},
+                timeout=aiohttp.ClientTimeout(total=REPLAY_TIMEOUT),
+            ) as resp:
+                if resp.status >= 400:
+                    raise RuntimeError(f"n8n ответил {resp.status}: {(await resp.text())[:300]}")
+        except Exception as e:
+            self.stats["failed"] += 1
+            error = f"{type(e).__name__}: {e}"[:2000]
+            pause = self.gate.failed(job["cause"])
+            delay = max(pause, min(REPLAY_RETRY_MAX, REPLAY_RETRY_BASE * 2 ** (job["attempts"] - 1)))
+            dead = await self._db(fail, job, error, delay)
+            if dead:
+                self.stats["dead"] += 1
+            logger.warning("Повтор %s, попытка %d: %s%s", job["dedupe_key"], job["attempts"], error,
+                           " -> dead letter" if dead else f", повтор через {delay:.0f} с, причина на паузе {pause:.0f} с")
+        else:
+            self.stats["replayed"] += 1
+            self.gate.succeeded(job["cause"])
+            await self._db(complete, job["dedupe_key"])
+            logger.info("Повтор %s выполнен", job["dedupe_key"])
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            free = REPLAY_CONCURRENCY - len(self.inflight)
+            if free > 0:
+                # Причина с пробным повтором в работе — ждём его исхода
+                busy = set(self.inflight.values()) & set(self.gate.probing())
+                try:
+                    leased = await self._db(lease, free, self.gate.blocked() + list(busy), self.gate.probing())
+                except Exception as e:
+                    logger.error("Не удалось взять задачи: %s", e)
+                    leased = []
+                for job in leased:
+                    task = asyncio.create_task(self._replay(job))
+                    self.inflight[task] = job["cause"]
+                    task.add_done_callback(self._done)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=REPLAY_TICK)
+            except asyncio.TimeoutError:
+                pass
+
+    def _done(self, task):
+        self.inflight.pop(task, None)
+        self.wake()
+
+
+def remote_call(path: str, payload: dict, url: str = REPLAY_URL, timeout: float = 30) -> dict:
+    """POST /replays/retry или /collect сервиса из синхронного кода (админка)."""
+    request = urllib.request.Request(
+        f"{url}{path}", data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def post_failed(request: web.Request) -> web.Response:
+    data = await request.json()
+    execution_id = data.get("execution_id") or (data.get("execution") or {}).get("id")
+    if not execution_id:
+        raise web.HTTPBadRequest(text="Нужен execution.id (как в Error Trigger) или execution_id")
+    replayer = request.app["replayer"]
+    try:
+        execution = await n8n_api.N8nAPI(replayer.session).execution(execution_id)
+    except (n8n_api.N8nAPIError, aiohttp.ClientError) as e:
+        raise web.HTTPBadGateway(text=str(e))
+    return web.json_response({"queued": await replayer.add_execution(execution)})
+
+
+async def post_collect(request: web.Request) -> web.Response:
+    data = await request.json() if request.can_read_body else {}
+    since = data.get("since")
+    try:
+        new = await request.app["replayer"].collect(int(since) if since is not None else None, backlog=True)
+    except (n8n_api.N8nAPIError, aiohttp.ClientError) as e:
+        raise web.HTTPBadGateway(text=str(e))
+    return web.json_response({"queued": new})
+
+
+async def get_replays(request: web.Request) -> web.Response:
+    replayer = request.app["replayer"]
+
+    def _load():
+        with db.connection(request.app["pool"]) as conn:
+            return causes(conn), jobs(conn, "dead", request.query.get("cause"))
+
+    cause_rows, dead = await asyncio.to_thread(_load)
+    return web.json_response({
+        "stats": {**replayer.stats, "inflight": len(replayer.inflight), "paused_causes": replayer.gate.blocked()},
+        "causes": cause_rows,
+        "dead": dead,
+    }, dumps=lambda value: json.dumps(value, ensure_ascii=False, default=str))
+
+
+async def post_retry(request: web.Request) -> web.Response:
+    data = await request.json() if request.can_read_body else {}
+
+    def _requeue():
+        with db.connection(request.app["pool"]) as conn:
+            return requeue(conn, data.get("dedupe_key"), data.get("cause"))
+
+    requeued = await asyncio.to_thread(_requeue)
+    # Снять паузу с причин: иначе возвращённые задачи ждут её конца
+    for cause in set(requeued):
+        request.app["replayer"].gate.succeeded(cause)
+    request.app["replayer"].wake()
+    return web.json_response({"requeued": len(requeued)})
+
+
+async def health(request: web.Request) -> web.Response:
+    replayer = request.app["replayer"]
+    return web.json_response({"ok": True, "inflight": len(replayer.inflight), **replayer.stats})
+
+
+async def _collect_loop(replayer: Replayer):
+    while True:
+        try:
+            await replayer.collect()
+            await replayer._db(purge)
+        except Exception as e:
+            logger.error("Сбор упавших выполнений: %s", e)
+        await asyncio.sleep(REPLAY_POLL_INTERVAL)
+
+
+async def _background(app: web.Application):
+    with db.connection(app["pool"]) as conn:
+        ensure_schema(conn)
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120))
+    app["replayer"] = Replayer(app["pool"], session)
+    tasks = [asyncio.create_task(app["replayer"].run())]
+    if REPLAY_POLL_INTERVAL > 0:
+        tasks.append(asyncio.create_task(_collect_loop(app["replayer"])))
+    yield
+    for task in tasks:
+        task.cancel()
+    # Прерванные повторы вернутся в очередь по истечении аренды
+    await session.close()
+
+
+def create_app(pool=None) -> web.Application:
+    app = web.Application()
+    app["pool"] = pool or db.create_pool()
+    app.router.add_post("/failed", post_failed)
+    app.router.add_post("/collect", post_collect)
+    app.router.add_get("/replays", get_replays)
+    app.router.add_post("/replays/retry", post_retry)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("REPLAY_PORT", "8510")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Надёжная очередь задач в Postgres n8n (call_jobs) для webhook_gateway.py.
+
+- enqueue: вставка с дедупликацией по dedupe_key (повтор вебхука amoCRM
+  не создаёт вторую задачу, в том числе если первая уже в dead letter).
+- lease: воркеры забирают задачи через FOR UPDATE SKIP LOCKED — несколько
+  процессов не мешают друг другу. Задача арендуется на lease_seconds;
+  если воркер умер, по истечении аренды её заберёт другой. complete/fail
+  проверяют, что аренда всё ещё своя: опоздавший воркер не закроет и не
+  вернёт в очередь задачу, которую уже ведёт другой.
+- fail: повтор с экспоненциальной задержкой, после max_attempts — перенос
+  в call_jobs_dead с последней ошибкой.
+- Планирование (JOBS_SCHEDULING=sjf): у задачи оценка est_seconds —
+  длительность записи (из вебхука или audio_probe.py). Сначала берутся
+  короткие: порядок по est_seconds - JOBS_AGING_RATE * ожидание, так что
+  долго ждущая длинная запись тоже дойдёт до очереди. Записи длиннее
+  JOBS_LONG_SECONDS идут в полосу long со своими JOBS_LONG_CONCURRENCY
+  слотами и не занимают слоты коротких. JOBS_SCHEDULING=fifo — по
+  порядку поступления, одна полоса.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from decimal import Decimal
+
+import db
+
+logger = logging.getLogger(__name__)
+
+JOBS_CONCURRENCY = int(os.getenv("JOBS_CONCURRENCY", "4"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+JOBS_LEASE_SECONDS = int(os.getenv("JOBS_LEASE_SECONDS", "900"))
+JOBS_RETRY_BASE = float(os.getenv("JOBS_RETRY_BASE", "30"))
+JOBS_RETRY_MAX = float(os.getenv("JOBS_RETRY_MAX", "3600"))
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "5"))
+JOBS_KEEP_DAYS = int(os.getenv("JOBS_KEEP_DAYS", "30"))
+JOBS_SCHEDULING = os.getenv("JOBS_SCHEDULING", "sjf")
+JOBS_LONG_SECONDS = float(os.getenv("JOBS_LONG_SECONDS", "900"))
+JOBS_LONG_CONCURRENCY = int(os.getenv("JOBS_LONG_CONCURRENCY", "1"))
+JOBS_DEFAULT_SECONDS = float(os.getenv("JOBS_DEFAULT_SECONDS", "180"))  # пока длительность неизвестна
+JOBS_AGING_RATE = float(os.getenv("JOBS_AGING_RATE", "4"))  # секунд записи "скидки" за секунду ожидания
+
+LANES = ("short", "long") if JOBS_SCHEDULING == "sjf" else ("short",)
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS call_jobs (
+    id           BIGSERIAL PRIMARY KEY,
+    dedupe_key   TEXT NOT NULL UNIQUE,
+    payload      JSONB NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'queued',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    leased_by    TEXT,
+    leased_until TIMESTAMPTZ,
+    last_error   TEXT,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS call_jobs_queued
+    ON call_jobs (available_at, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS call_jobs_running
+    ON call_jobs (leased_until) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS call_jobs_done
+    ON call_jobs (updated_at) WHERE status = 'done';
+ALTER TABLE call_jobs ADD COLUMN IF NOT EXISTS est_seconds REAL;
+ALTER TABLE call_jobs ADD COLUMN IF NOT EXISTS lane TEXT NOT NULL DEFAULT 'short';
+ALTER TABLE call_jobs ADD COLUMN IF NOT EXISTS started_at TIMESTAMPTZ;
+CREATE INDEX IF NOT EXISTS call_jobs_lane_queued
+    ON call_jobs (lane, available_at) WHERE status = 'queued';
+
+CREATE TABLE IF NOT EXISTS call_jobs_dead (
+    id         BIGINT PRIMARY KEY,
+    dedupe_key TEXT NOT NULL UNIQUE,
+    payload    JSONB NOT NULL,
+    attempts   INTEGER NOT NULL,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL,
+    failed_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+ALTER TABLE call_jobs_dead ADD COLUMN IF NOT EXISTS est_seconds REAL;
+"""
+
+
+# =========================================================================
+# РАБОТА С БАЗОЙ
+# =========================================================================
+def ensure_schema(conn):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+
+
+def lane_for(est_seconds: float) -> str:
+    if JOBS_SCHEDULING == "sjf" and est_seconds is not None and est_seconds > JOBS_LONG_SECONDS:
+        return "long"
+    return "short"
+
+
+def enqueue(conn, dedupe_key: str, payload: dict, est_seconds: float = None, hold_seconds: float = 0) -> bool:
+    """
+    True — задача новая, False — дубль. hold_seconds — не выдавать задачу
+    столько секунд, пока set_estimate() не уточнит её длительность.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO call_jobs (dedupe_key, payload, est_seconds, lane, available_at)
+            SELECT %(key)s, %(payload)s, %(est)s, %(lane)s, now() + make_interval(secs => %(hold)s)
+            WHERE NOT EXISTS (SELECT 1 FROM call_jobs_dead WHERE dedupe_key = %(key)s)
+            ON CONFLICT (dedupe_key) DO NOTHING
+            RETURNING id;
+            """,
+            {"key": dedupe_key, "payload": json.dumps(payload, ensure_ascii=False),
+             "est": est_seconds, "lane": lane_for(est_seconds), "hold": hold_seconds},
+        )
+        return cur.fetchone() is not None
+
+
+def set_estimate(conn, dedupe_key: str, est_seconds: float = None) -> bool:
+    """Оценка длительности из пробы; снимает hold у ещё не начатой задачи. None — оценки нет."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE call_jobs
+            SET est_seconds = COALESCE(%(est)s, est_seconds),
+                lane = CASE WHEN %(est)s IS NULL THEN lane ELSE %(lane)s END,
+                available_at = CASE WHEN attempts = 0 THEN LEAST(available_at, now()) ELSE available_at END,
+                updated_at = now()
+            WHERE dedupe_key = %(key)s AND status = 'queued'
+            RETURNING id;
+            """,
+            {"key": dedupe_key, "est": est_seconds, "lane": lane_for(est_seconds)},
+        )
+        return cur.fetchone() is not None
+
+
+# Меньше — раньше: оценка длительности минус скидка за время ожидания
+PRIORITY_SQL = {
+    "sjf": "COALESCE(est_seconds, %(default)s) - %(aging)s * extract(epoch FROM now() - created_at), id",
+    "fifo": "available_at, id",
+}
+
+
+def lease(conn, worker: str, limit: int, lease_seconds: int = JOBS_LEASE_SECONDS, lane: str = None) -> list:
+    """Забрать до limit готовых задач (новых, отложенных или с истёкшей арендой) полосы lane."""
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            UPDATE call_jobs j
+            SET status = 'running', attempts = j.attempts + 1, leased_by = %(worker)s,
+                leased_until = now() + make_interval(secs => %(lease)s),
+                started_at = COALESCE(j.started_at, now()), updated_at = now()
+            FROM (
+                SELECT id FROM call_jobs
+                WHERE ((status = 'queued' AND available_at <= now())
+                       OR (status = 'running' AND leased_until < now()))
+                  AND (%(lane)s::text IS NULL OR lane = %(lane)s)
+                ORDER BY {PRIORITY_SQL[JOBS_SCHEDULING]}
+                LIMIT %(limit)s
+                FOR UPDATE SKIP LOCKED
+            ) ready
+            WHERE j.id = ready.id
+            RETURNING j.id, j.dedupe_key, j.payload, j.attempts;
+            """,
+            {"worker": worker, "lease": lease_seconds, "limit": limit, "lane": lane,
+             "default": JOBS_DEFAULT_SECONDS, "aging": JOBS_AGING_RATE},
+        )
+        return [
+            {"id": i, "dedupe_key": k, "payload": p, "attempts": a, "leased_by": worker}
+            for i, k, p, a in cur.fetchall()
+        ]
+
+
+# Аренда всё ещё наша: задачу не перехватил другой воркер (или этот же при
+# новой аренде — attempts растёт с каждой арендой)
+OWNED_SQL = "id = %(id)s AND status = 'running' AND leased_by = %(worker)s AND attempts = %(attempts)s"
+
+
+def _owner(job: dict) -> dict:
+    return {"id": job["id"], "worker": job["leased_by"], "attempts": job["attempts"]}
+
+
+def complete(conn, job: dict) -> bool:
+    """Отметить выполненной. False — аренда истекла и задачу уже взял другой воркер."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE call_jobs SET status = 'done', leased_by = NULL, leased_until = NULL, "
+            f"last_error = NULL, updated_at = now() WHERE {OWNED_SQL};",
+            _owner(job),
+        )
+        return cur.rowcount > 0
+
+
+def fail(conn, job: dict, error: str, max_attempts: int = JOBS_MAX_ATTEMPTS):
+    """
+    Отложить повтор или перенести в dead letter. True — задача в dead letter,
+    False — отложена, None — аренда потеряна, задачу ведёт другой воркер.
+    """
+    with conn.cursor() as cur:
+        if job["attempts"] >= max_attempts:
+            cur.execute(
+                f"""
+                WITH moved AS (DELETE FROM call_jobs WHERE {OWNED_SQL}
+                               RETURNING id, dedupe_key, payload, attempts, created_at, est_seconds)
+                INSERT INTO call_jobs_dead (id, dedupe_key, payload, attempts, last_error, created_at, est_seconds)
+                SELECT id, dedupe_key, payload, attempts, %(error)s, created_at, est_seconds FROM moved;
+                """,
+                {**_owner(job), "error": error},
+            )
+            return True if cur.rowcount else None
+        delay = min(JOBS_RETRY_BASE * 2 ** (job["attempts"] - 1), JOBS_RETRY_MAX)
+        cur.execute(
+            f"""
+            UPDATE call_jobs SET status = 'queued', leased_by = NULL, leased_until = NULL,
+                available_at = now() + make_interval(secs => %(delay)s), last_error = %(error)s, updated_at = now()
+            WHERE {OWNED_SQL};
+            """,
+            {**_owner(job), "delay": delay, "error": error},
+        )
+        return False if cur.rowcount else None
+
+
+def requeue_dead(conn, job_id: int) -> bool:
+    """Вернуть задачу из dead letter в очередь (попытки с нуля) с её оценкой и полосой."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH moved AS (DELETE FROM call_jobs_dead WHERE id = %(id)s
+                           RETURNING id, dedupe_key, payload, created_at, est_seconds)
+            INSERT INTO call_jobs (id, dedupe_key, payload, created_at, est_seconds, lane)
+            SELECT id, dedupe_key, payload, created_at, est_seconds,
+                   CASE WHEN %(sjf)s AND est_seconds > %(long)s THEN 'long' ELSE 'short' END  -- как lane_for()
+            FROM moved
+            RETURNING id;
+            """,
+            {"id": job_id, "sjf": JOBS_SCHEDULING == "sjf", "long": JOBS_LONG_SECONDS},
+        )
+        return cur.fetchone() is not None
+
+
+def purge_done(conn, keep_days: int = JOBS_KEEP_DAYS) -> int:
+    """Удалить старые выполненные задачи (ключи дедупликации нужны только недавним)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM call_jobs WHERE status = 'done' AND updated_at < now() - make_interval(days => %s);",
+            (keep_days,),
+        )
+        return cur.rowcount
+
+
+def stats(conn) -> dict:
+    with conn.cursor() as cur:
+        cur.execute("SELECT status, count(*) FROM call_jobs GROUP BY status;")
+        result = {"queued": 0, "running": 0, "done": 0}
+        result.update(dict(cur.fetchall()))
+        cur.execute("SELECT count(*) FROM call_jobs_dead;")
+        result["dead"] = cur.fetchone()[0]
+        return result
+
+
+def metrics(conn, window_minutes: int = 60) -> dict:
+    """
+    Состояние очереди по полосам: сколько ждёт и выполняется, сколько
+    секунд записи в очереди, самое долгое ожидание; за последние
+    window_minutes — выполнено, p50/p95 ожидания и времени до готовности.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH recent AS (
+                SELECT lane, extract(epoch FROM started_at - created_at) AS wait,
+                       extract(epoch FROM updated_at - created_at) AS total
+                FROM call_jobs
+                WHERE status = 'done' AND updated_at > now() - make_interval(mins => %(window)s)
+            )
+            SELECT l.lane, q.queued, q.running, q.unestimated, q.queued_audio, q.oldest_wait,
+                   r.done, r.wait_p50, r.wait_p95, r.total_p50, r.total_p95
+            FROM unnest(%(lanes)s::text[]) AS l(lane)
+            LEFT JOIN LATERAL (
+                SELECT count(*) FILTER (WHERE status = 'queued') AS queued,
+                       count(*) FILTER (WHERE status = 'running') AS running,
+                       count(*) FILTER (WHERE status = 'queued' AND est_seconds IS NULL) AS unestimated,
+                       COALESCE(sum(COALESCE(est_seconds, %(default)s)) FILTER (WHERE status = 'queued'), 0) AS queued_audio,
+                       max(extract(epoch FROM now() - created_at)) FILTER (WHERE status = 'queued') AS oldest_wait
+                FROM call_jobs WHERE lane = l.lane AND status IN ('queued', 'running')
+            ) q ON true
+            LEFT JOIN LATERAL (
+                SELECT count(*) AS done,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY wait) AS wait_p50,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY wait) AS wait_p95,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY total) AS total_p50,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY total) AS total_p95
+                FROM recent WHERE recent.lane = l.lane
+            ) r ON true;
+            """,
+            {"window": window_minutes, "lanes": list(LANES), "default": JOBS_DEFAULT_SECONDS},
+        )
+        columns = [d[0] for d in cur.description]
+        lanes = {}
+        for row in cur.fetchall():
+            values = dict(zip(columns, row))
+            lane = values.pop("lane")
+            lanes[lane] = {k: round(float(v), 1) if isinstance(v, (float, Decimal)) else v for k, v in values.items()}
+        cur.execute("SELECT count(*) FROM call_jobs_dead;")
+        return {"scheduling": JOBS_SCHEDULING, "window_minutes": window_minutes, "lanes": lanes, "dead": cur.fetchone()[0]}
+
+
+# =========================================================================
+# ВОРКЕР
+# =========================================================================
+class Worker:
+    """
+    Выполняет задачи async-обработчиком handler(payload), не больше
+    concurrency одновременно. Ошибка обработчика -> повтор/dead letter.
+    lease_seconds должен быть больше времени обработчика, иначе задачу,
+    которая ещё выполняется, заберёт другой воркер.
+    """
+
+    def __init__(
+        self,
+        pool,
+        handler,
+        concurrency: int = JOBS_CONCURRENCY,
+        poll_interval: float = JOBS_POLL_INTERVAL,
+        name: str = None,
+        lane: str = None,
+        lease_seconds: int = JOBS_LEASE_SECONDS,
+    ):
+        self.pool = pool
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}" + (f":{lane}" if lane else "")
+        self.lane = lane  # None — все полосы
+        self.lease_seconds = lease_seconds
+        self.inflight = set()
+        self.processed = 0
+        self.failed = 0
+        self._wakeup = asyncio.Event()
+        self._slot_free = asyncio.Event()
+
+    def wake(self):
+        """Есть новые задачи — не ждать poll_interval."""
+        self._wakeup.set()
+
+    def _db(self, func, *args):
+        def _call():
+            with db.connection(self.pool) as conn:
+                return func(conn, *args)
+        return asyncio.to_thread(_call)
+
+    async def _run_job(self, job: dict):
+        started = time.monotonic()
+        try:
+            await self.handler(job["payload"])
+        except Exception as e:
+            self.failed += 1
+            error = f"{type(e).__name__}: {e}"[:2000]
+            dead = await self._db(fail, job, error)
+            if dead is None:
+                logger.warning("Задача %s (%s): аренда потеряна, ошибка не записана: %s",
+                               job["id"], job["dedupe_key"], error)
+                return
+            logger.warning(
+                "Задача %s (%s), попытка %d: %s%s",
+                job["id"], job["dedupe_key"], job["attempts"], error, " -> dead letter" if dead else "",
+            )
+        else:
+            self.processed += 1
+            if not await self._db(complete, job):
+                logger.warning("Задача %s (%s) выполнена за %.1f с, но аренда потеряна — её ведёт другой воркер",
+                               job["id"], job["dedupe_key"], time.monotonic() - started)
+                return
+            logger.info("Задача %s (%s) выполнена за %.1f с", job["id"], job["dedupe_key"], time.monotonic() - started)
+
+    def _done(self, task):
+        self.inflight.discard(task)
+        self._slot_free.set()
+
+    async def run(self):
+        logger.info("Воркер %s, полоса %s, параллельно %d", self.name, self.lane or "все", self.concurrency)
+        while True:
+            # Сбрасываем до lease: всё, что случится после, разбудит ожидание ниже
+            self._wakeup.clear()
+            self._slot_free.clear()
+            free = self.concurrency - len(self.inflight)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = await self._db(lease, self.name, free, self.lease_seconds, self.lane)
+                except Exception as e:
+                    logger.error("Не удалось взять задачи: %s", e)
+            for job in jobs:
+                task = asyncio.create_task(self._run_job(job))
+                self.inflight.add(task)
+                task.add_done_callback(self._done)
+            if jobs and len(self.inflight) < self.concurrency:
+                continue  # возможно, готово ещё
+
+            # Ждём нового вебхука, освободившегося слота или таймера
+            waiters = [
+                asyncio.ensure_future(self._wakeup.wait()),
+                asyncio.ensure_future(self._slot_free.wait()),
+            ]
+            _, pending = await asyncio.wait(
+                waiters, timeout=self.poll_interval, return_when=asyncio.FIRST_COMPLETED
+            )
+            for w in pending:
+                w.cancel()
+
+    async def drain(self):
+        if self.inflight:
+            await asyncio.wait(self.inflight)
+
+
+def lane_workers(pool, handler, lease_seconds: int = JOBS_LEASE_SECONDS) -> list:
+    """Воркеры на все полосы: в sjf длинные записи не занимают слоты коротких."""
+    if JOBS_SCHEDULING != "sjf":
+        return [Worker(pool, handler, lease_seconds=lease_seconds)]
+    return [
+        Worker(pool, handler, concurrency=JOBS_CONCURRENCY, lane="short", lease_seconds=lease_seconds),
+        Worker(pool, handler, concurrency=JOBS_LONG_CONCURRENCY, lane="long", lease_seconds=lease_seconds),
+    ]
@@ -0,0 +1,417 @@
+"""
+Роутер LLM-запросов между Gemini и локальной Ollama (порт 11434).
+
+Один API для анализатора звонков и контент-конвейера. По каждому
+бэкенду ведётся скользящее окно (LLM_STATS_WINDOW последних запросов не
+старше LLM_STATS_MAX_AGE): p50/p95 задержки и доля ошибок. Запрос идёт
+в бэкенд с лучшей оценкой (p95 со штрафом за ошибки и поправкой на
+очередь; без статистики — по порядку LLM_BACKENDS). Если ответа нет дольше дедлайна хеджирования
+(p95 основного, не меньше LLM_HEDGE_MIN), тот же запрос параллельно
+уходит во второй бэкенд — берётся первый успешный ответ, второй
+отменяется. Ошибка основного — сразу второй. Одновременных запросов к
+бэкенду не больше его лимита (GEMINI_CONCURRENCY, OLLAMA_CONCURRENCY);
+в занятый бэкенд не хеджируем.
+
+Эндпоинты:
+  POST /v1/generate  {"system": ..., "prompt": ..., "json": true, "max_tokens": 2048,
+                      "temperature": 0.2, "model": "gemini-2.5-flash"?, "backends": [...]?}
+                     -> {"text": ..., "backend": ..., "latency_ms": ..., "hedged": bool}
+  GET  /stats        p50/p95/ошибки/в работе по бэкендам
+  GET  /health
+
+Запуск:
+  python llm_router.py           # порт LLM_ROUTER_PORT (по умолчанию 8507)
+
+Проверка без сети: python stubs.py gemini / python stubs.py ollama и
+GEMINI_BASE_URL=http://localhost:8602 OLLAMA_URL=http://localhost:8603.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+import db
+
+logger = logging.getLogger(__name__)
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://144.217.12.20:11434").rstrip("/")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+
+BACKEND_ORDER = [b.strip() for b in os.getenv("LLM_BACKENDS", "gemini,ollama").split(",") if b.strip()]
+STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+STATS_MAX_AGE = float(os.getenv("LLM_STATS_MAX_AGE", "600"))
+HEDGE_MIN = float(os.getenv("LLM_HEDGE_MIN", "8"))
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "180"))
+ERROR_PENALTY = 4.0
+MIN_SAMPLES = 5
+SETTINGS_TTL = float(os.getenv("SETTINGS_TTL", "30"))
+
+
+class BackendError(Exception):
+    pass
+
+
+# =========================================================================
+# СТАТИСТИКА
+# =========================================================================
+class RollingStats:
+    """
+    Последние N запросов не старше STATS_MAX_AGE: задержка успешных и доля
+    ошибок. Старые отсчёты забываются, чтобы упавший бэкенд со временем
+    снова получил шанс. Проигравший хедж пишется как цензурированный
+    отсчёт: ответа не было, но он был бы не быстрее этого времени — иначе
+    замедлившийся основной бэкенд навсегда сохранил бы старый быстрый p95.
+    """
+
+    def __init__(self, size: int = STATS_WINDOW, max_age: float = STATS_MAX_AGE):
+        self.samples = collections.deque(maxlen=size)  # (когда, секунды, ok, цензурирован)
+        self.max_age = max_age
+
+    def record(self, seconds: float, ok: bool, censored: bool = False):
+        """censored — нижняя граница задержки (запрос отменён), в перцентилях как успешный."""
+        self.samples.append((time.monotonic(), seconds, ok, censored))
+
+    def _recent(self) -> list:
+        horizon = time.monotonic() - self.max_age
+        return [(seconds, ok) for at, seconds, ok, _ in self.samples if at >= horizon]
+
+    def percentile(self, q: float):
+        latencies = sorted(seconds for seconds, ok in self._recent() if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    @property
+    def error_rate(self) -> float:
+        recent = self._recent()
+        if not recent:
+            return 0.0
+        return sum(1 for _, ok in recent if not ok) / len(recent)
+
+    def score(self):
+        """Меньше — лучше. None — статистики пока мало."""
+        recent = self._recent()
+        errors = sum(1 for _, ok in recent if not ok)
+        if recent and errors == len(recent) and errors >= MIN_SAMPLES // 2:
+            return float("inf")
+        p95 = self.percentile(0.95)
+        if len(recent) < MIN_SAMPLES or p95 is None:
+            return None
+        return p95 * (1 + ERROR_PENALTY * errors / len(recent))
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        horizon = time.monotonic() - self.max_age
+        return {
+            "samples": len(self._recent()),
+            "censored": sum(1 for at, _, _, censored in self.samples if censored and at >= horizon),
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+# =========================================================================
+# БЭКЕНДЫ
+# =========================================================================
+class Backend:
+    name = ""
+
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int):
+        self.session = session
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = RollingStats()
+        self.inflight = 0
+        self.waiting = 0
+        self.wins = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self.inflight + self.waiting >= self.concurrency
+
+    def expected_latency(self, default: float) -> float:
+        """Оценка p95 с учётом очереди к семафору: каждый полный круг очереди — ещё одна задержка."""
+        score = self.stats.score()
+        score = default if score is None else score
+        queued = self.waiting + (1 if self.saturated else 0)
+        return score * (1 + queued / self.concurrency)
+
+    async def complete(self, request: dict) -> str:
+        raise NotImplementedError
+
+    def start(self, request: dict) -> asyncio.Task:
+        """Запустить запрос; место в очереди учитывается сразу, до первого await."""
+        self.waiting += 1
+        queued = [True]
+
+        def dequeue(_=None):
+            if queued[0]:
+                queued[0] = False
+                self.waiting -= 1
+
+        task = asyncio.create_task(self._run(request, dequeue))
+        task.add_done_callback(dequeue)  # отменённую до старта задачу тоже убрать из очереди
+        return task
+
+    async def _run(self, request: dict, dequeue) -> str:
+        try:
+            await self.semaphore.acquire()
+        finally:
+            dequeue()
+        self.inflight += 1
+        started = time.monotonic()
+        try:
+            text = await asyncio.wait_for(self.complete(request), REQUEST_TIMEOUT)
+        except asyncio.CancelledError:
+            # Проигравший хедж — не ошибка бэкенда, но и не быстрый ответ
+            self.stats.record(time.monotonic() - started, True, censored=True)
+            raise
+        except Exception as e:
+            self.stats.record(time.monotonic() - started, False)
+            raise BackendError(f"{self.name}: {type(e).__name__}: {e}") from e
+        finally:
+            self.inflight -= 1
+            self.semaphore.release()
+        self.stats.record(time.monotonic() - started, True)
+        return text
+
+
+class GeminiBackend(Backend):
+    name = "gemini"
+
+    def __init__(self, session, concurrency: int, api_key_getter):
+        super().__init__(session, concurrency)
+        self.api_key_getter = api_key_getter
+
+    async def complete(self, request: dict) -> str:
+        model = request.get("model") or GEMINI_MODEL
+        config = {"maxOutputTokens": request.get("max_tokens", 2048), "temperature": request.get("temperature", 0.2)}
+        if request.get("json"):
+            config["responseMimeType"] = "application/json"
+        body = {
+            "contents": [{"role": "user", "parts": [{"text": request["prompt"]}]}],
+            "generationConfig": config,
+        }
+        if request.get("system"):
+            body["systemInstruction"] = {"parts": [{"text": request["system"]}]}
+        parts = []
+        async with self.session.post(
+            f"{GEMINI_BASE_URL}/v1beta/models/{model}:streamGenerateContent",
+            params={"alt": "sse", "key": await self.api_key_getter()}, json=body,
+        ) as resp:
+            if resp.status >= 400:
+                raise BackendError(f"HTTP {resp.status}: {(await resp.text())[:300]}")
+            async for raw in resp.content:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                chunk = json.loads(line[5:])
+                for candidate in chunk.get("candidates", []):
+                    for part in candidate.get("content", {}).get("parts", []):
+                        parts.append(part.get("text", ""))
+        return "".join(parts)
+
+
+class OllamaBackend(Backend):
+    name = "ollama"
+
+    async def complete(self, request: dict) -> str:
+        messages = []
+        if request.get("system"):
+            messages.append({"role": "system", "content": request["system"]})
+        messages.append({"role": "user", "content": request["prompt"]})
+        body = {
+            "model": OLLAMA_MODEL,
+            "messages": messages,
+            "stream": True,
+            "options": {"num_predict": request.get("max_tokens", 2048), "temperature": request.get("temperature", 0.2)},
+        }
+        if request.get("json"):
+            body["format"] = "json"
+        parts = []
+        async with self.session.post(f"{OLLAMA_URL}/api/chat", json=body) as resp:
+            if resp.status >= 400:
+                raise BackendError(f"HTTP {resp.status}: {(await resp.text())[:300]}")
+            async for raw in resp.content:
+                if not raw.strip():
+                    continue
+                chunk = json.loads(raw)
+                if chunk.get("error"):
+                    raise BackendError(chunk["error"])
+                parts.append(chunk.get("message", {}).get("content", ""))
+        return "".join(parts)
+
+
+# =========================================================================
+# РОУТЕР
+# =========================================================================
+class Router:
+    def __init__(self, backends: dict, order: list = BACKEND_ORDER, hedge_min: float = HEDGE_MIN):
+        self.backends = backends
+        self.order = [name for name in order if name in backends]
+        self.hedge_min = hedge_min
+        self.hedges = 0
+        self.failovers = 0
+
+    def ranked(self, allowed: list = None) -> list:
+        names = [n for n in self.order if not allowed or n in allowed]
+
+        def key(name):
+            # Без статистики считаем, что бэкенд отвечает за дедлайн хеджирования
+            return (self.backends[name].expected_latency(self.hedge_min), names.index(name))
+
+        return [self.backends[n] for n in sorted(names, key=key)]
+
+    def hedge_deadline(self, backend: Backend) -> float:
+        p95 = backend.stats.percentile(0.95)
+        return max(self.hedge_min, p95 or 0.0)
+
+    async def generate(self, request: dict) -> dict:
+        ranked = self.ranked(request.get("backends"))
+        if not ranked:
+            raise BackendError("нет доступных бэкендов")
+        started = time.monotonic()
+        primary, rest = ranked[0], ranked[1:]
+        tasks = {primary.start(request): primary}
+        hedged = False
+        errors = []
+        try:
+            timeout = self.hedge_deadline(primary) if rest else None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Дедлайн: хеджируем, если запасной бэкенд не занят
+                    timeout = None
+                    backup = next((b for b in rest if not b.saturated), None)
+                    if backup:
+                        rest.remove(backup)
+                        hedged = True
+                        self.hedges += 1
+                        logger.info("Хедж: %s не ответил за %.1f с, дублируем в %s",
+                                    primary.name, self.hedge_deadline(primary), backup.name)
+                        tasks[backup.start(request)] = backup
+                    continue
+                for task in done:
+                    backend = tasks.pop(task)
+                    try:
+                        text = task.result()
+                    except BackendError as e:
+                        errors.append(str(e))
+                        continue
+                    backend.wins += 1
+                    return {
+                        "text": text,
+                        "backend": backend.name,
+                        "latency_ms": round((time.monotonic() - started) * 1000),
+                        "hedged": hedged,
+                    }
+                # Все завершившиеся — с ошибкой: сразу следующий бэкенд
+                if not tasks and rest:
+                    backup = rest.pop(0)
+                    self.failovers += 1
+                    logger.warning("Переключение на %s: %s", backup.name, errors[-1])
+                    tasks[backup.start(request)] = backup
+                    timeout = None
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise BackendError("; ".join(errors))
+
+    def snapshot(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "backends": {
+                name: {
+                    **b.stats.snapshot(),
+                    "inflight": b.inflight,
+                    "concurrency": b.concurrency,
+                    "wins": b.wins,
+                    "hedge_deadline_s": round(self.hedge_deadline(b), 2),
+                }
+                for name, b in self.backends.items()
+            },
+        }
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def post_generate(request: web.Request) -> web.Response:
+    data = await request.json()
+    if not data.get("prompt"):
+        raise web.HTTPBadRequest(text="Нужен prompt")
+    try:
+        result = await request.app["router"].generate(data)
+    except BackendError as e:
+        raise web.HTTPBadGateway(text=str(e))
+    return web.json_response(result)
+
+
+async def get_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app["router"].snapshot())
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"ok": True})
+
+
+def _gemini_key_getter(app: web.Application):
+    """Ключ Gemini из админки (кэш SETTINGS_TTL), иначе GEMINI_API_KEY."""
+    state = {"at": float("-inf"), "key": os.getenv("GEMINI_API_KEY", "")}
+
+    async def getter() -> str:
+        if "pool" in app and time.monotonic() - state["at"] > SETTINGS_TTL:
+            def _load():
+                with db.connection(app["pool"]) as conn, conn.cursor() as cur:
+                    cur.execute("SELECT value FROM n8n_app_settings WHERE key = 'gemini_key';")
+                    row = cur.fetchone()
+                    return row[0] if row else None
+            try:
+                state["key"] = await asyncio.to_thread(_load) or state["key"]
+            except Exception as e:
+                logger.warning("Не удалось прочитать gemini_key: %s", e)
+            state["at"] = time.monotonic()
+        return state["key"]
+
+    return getter
+
+
+async def _session(app: web.Application):
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_read=120))
+    backends = {
+        "gemini": GeminiBackend(session, int(os.getenv("GEMINI_CONCURRENCY", "8")), _gemini_key_getter(app)),
+        "ollama": OllamaBackend(session, int(os.getenv("OLLAMA_CONCURRENCY", "2"))),
+    }
+    app["router"] = Router(backends)
+    yield
+    await session.close()
+
+
+def create_app(pool=None) -> web.Application:
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    if os.getenv("LLM_ROUTER_DB", "1") == "1":
+        app["pool"] = pool or db.create_pool()
+    app.router.add_post("/v1/generate", post_generate)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_session)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("LLM_ROUTER_PORT", "8507")))
+
+
+if __name__ == "__main__":
+    main()
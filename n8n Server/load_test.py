@@ -0,0 +1,586 @@
+"""
+Нагрузочный прогон конвейера звонков (amoCRM -> AssemblyAI -> Gemini ->
+Telegram/Sheets) на локальных заглушках: сколько звонков в час он
+переваривает, прежде чем задачи начинают копиться в очереди.
+
+Что поднимается:
+- заглушки stubs.py (amocrm, assemblyai, gemini, telegram, sheets) в этом
+  же процессе, задержки и доля ошибок — из профиля (--profile) и --set;
+- сервисы как отдельные процессы, с адресами заглушек в окружении:
+  webhook_gateway, transcription_service, call_analysis,
+  telegram_delivery, sheets_sink (остальные настройки — из окружения,
+  например JOBS_CONCURRENCY, TRANSCRIBE_CONCURRENCY, DB_HOST);
+- вместо воркфлоу n8n — его шаги по порядку, как в
+  nodes_amocrm_fixed.json / MVP_Call_Analyzer_N8n_v2.json:
+    amocrm     сделка, links, файл с drive-b (amocrm_client, 7 запросов/с)
+    transcribe POST /transcribe
+    analyze    POST /analyze
+    deliver    Telegram + Sheets + примечание в сделку параллельно
+  Шаг упал — ответ 500, шлюз повторит задачу, как с настоящим n8n.
+
+Генератор шлёт в шлюз вебхуки amoCRM (form-urlencoded, как настоящие:
+account[...], leads[note][0][note][...]) с пуассоновскими интервалами,
+--rate звонков в час. Часть вебхуков — обычные примечания без записи
+(--noise) и повторные доставки того же примечания (--duplicates).
+
+Длительность записей: --short-minutes (±50%), доля --long-share длинных
+по --long-minutes. Заглушка amoCRM отдаёт mp3 такой длины (шлюз узнаёт
+её пробой заголовка), а шаг transcribe дополнительно ждёт
+длительность × --work-ratio — как транскрипция, которая растёт с записью.
+
+Отчёт: пропускная способность (звонков в час), задержка в очереди
+(вебхук -> начало обработки), p50/p95/p99 по шагам и сквозное время
+(до ответа "n8n" и до сообщения в Telegram, отдельно для коротких и
+длинных записей), повторы, dead letter, максимальная очередь шлюза и
+его /metrics, счётчики заглушек. --json — то же в файл.
+
+С --target генератор шлёт вебхуки на указанный URL (настоящий n8n или
+уже запущенный шлюз), сервисы не поднимаются, а готовность звонка
+видна по сообщению в заглушке Telegram (ноды n8n должны смотреть на
+заглушки). Тогда в отчёте только сквозное время.
+
+Запуск:
+  DB_HOST=localhost python load_test.py --rate 600 --duration 120
+  python load_test.py --profile slow-gemini --set assemblyai.error_rate=0.05 --rate 1200
+  python load_test.py --target http://localhost:5678/webhook/<id> --rate 300
+
+Сравнение планирования очереди (короткие вперёд против по порядку):
+  JOBS_SCHEDULING=fifo python load_test.py --rate 1800 --long-share 0.1 --work-ratio 0.05 --seed 1 --json fifo.json
+  JOBS_SCHEDULING=sjf  python load_test.py --rate 1800 --long-share 0.1 --work-ratio 0.05 --seed 1 --json sjf.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import parse_qsl, urlencode
+
+import aiohttp
+from aiohttp import web
+
+import stubs
+import stats
+
+logger = logging.getLogger(__name__)
+
+SUBDOMAIN = "alexneurosolutions"
+ACCOUNT_ID = "31540726"
+CHAT_ID = "100500"
+EMULATOR_PORT = int(os.getenv("LOAD_N8N_PORT", "8599"))
+
+# Заглушка -> (задержка, доля ошибок); None — значение по умолчанию заглушки
+PROFILES = {
+    "normal": {"amocrm": (None, 0.0), "assemblyai": (None, 0.0), "gemini": (None, 0.0),
+               "telegram": (None, 0.0), "sheets": (None, 0.0)},
+    "fast": {"amocrm": (0.01, 0.0), "assemblyai": (0.5, 0.0), "gemini": (0.2, 0.0),
+             "telegram": (0.02, 0.0), "sheets": (0.05, 0.0)},
+    "slow-gemini": {"amocrm": (None, 0.0), "assemblyai": (None, 0.0), "gemini": (8, 0.0),
+                    "telegram": (None, 0.0), "sheets": (None, 0.0)},
+    "flaky": {"amocrm": (None, 0.05), "assemblyai": (None, 0.05), "gemini": (None, 0.05),
+              "telegram": (None, 0.05), "sheets": (None, 0.1)},
+}
+
+STUB_PORTS = {name: stubs.STUBS[name][1] for name in PROFILES["normal"]}
+
+# Сервис -> (скрипт, переменная порта, порт)
+SERVICES = {
+    "gateway": ("webhook_gateway.py", "GATEWAY_PORT", 8505),
+    "transcription": ("transcription_service.py", "TRANSCRIBE_PORT", 8504),
+    "analysis": ("call_analysis.py", "ANALYSIS_PORT", 8506),
+    "telegram": ("telegram_delivery.py", "TELEGRAM_PORT", 8508),
+    "sheets": ("sheets_sink.py", "SHEETS_PORT", 8509),
+}
+
+STAGES = ("amocrm", "transcribe", "analyze", "deliver")
+
+
+def summary(values: list) -> dict:
+    return {
+        "n": len(values),
+        **{f"p{q}": None if stats.percentile(values, q) is None else round(stats.percentile(values, q), 2) for q in (50, 95, 99)},
+        "max": round(max(values), 2) if values else None,
+    }
+
+
+# =========================================================================
+# ВЕБХУКИ amoCRM
+# =========================================================================
+def note_webhook(note_id: int, lead_id: int, call: bool) -> list:
+    """Пары ключ-значение вебхука "примечание добавлено" (как шлёт amoCRM)."""
+    now = int(time.time())
+    note = {
+        "id": str(note_id),
+        "element_id": str(lead_id),
+        "element_type": "2",
+        "date_create": str(now),
+        "last_modified": str(now),
+        "created_by": "0",
+        "main_user_id": str(random.choice((8912345, 8912346, 8912347))),
+        "account_id": ACCOUNT_ID,
+        "group_id": "0",
+    }
+    if call:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        note.update({
+            "note_type": random.choice(("10", "11")),  # входящий / исходящий
+            "text": f"call_{stamp}_{note_id}.mp3",
+            "attachement": str(uuid.uuid4()),
+        })
+    else:
+        note.update({"note_type": "4", "text": random.choice(("Перезвонить завтра", "Отправил КП на почту"))})
+    pairs = [(f"leads[note][0][note][{key}]", value) for key, value in note.items()]
+    pairs.append(("leads[note][0][type]", "lead"))
+    pairs.append(("leads[note][0][id]", str(note_id)))
+    return pairs + [
+        ("account[subdomain]", SUBDOMAIN),
+        ("account[id]", ACCOUNT_ID),
+        ("account[_links][self]", f"https://{SUBDOMAIN}.amocrm.ru"),
+    ]
+
+
+class Run:
+    """Что отправлено, что и когда прошло по шагам."""
+
+    def __init__(self):
+        self.calls = {}  # note_id -> запись
+        self.by_filename = {}
+        self.first_sent = None
+        self.last_sent = None
+        self.sent = 0
+        self.backlog = []  # (t, queued, running, dead)
+
+    def sent_call(self, note_id: str, filename: str, audio_seconds: float = 0.0, long: bool = False):
+        now = time.monotonic()
+        self.first_sent = self.first_sent or now
+        self.last_sent = now
+        self.calls[note_id] = {
+            "sent": now, "attempts": 0, "stages": {}, "errors": [], "audio_seconds": audio_seconds, "long": long,
+        }
+        self.by_filename[filename] = note_id
+
+    def delivered(self, text: str, at: float):
+        for filename, note_id in self.by_filename.items():
+            call = self.calls[note_id]
+            if "delivered" not in call and filename in text:
+                call["delivered"] = at
+
+    @property
+    def outstanding(self) -> int:
+        return sum(1 for call in self.calls.values() if "done" not in call)
+
+
+def call_seconds(args, rng: random.Random) -> tuple:
+    """Длительность записи и признак длинной."""
+    if rng.random() < args.long_share:
+        return args.long_minutes * 60 * rng.uniform(0.9, 1.1), True
+    return args.short_minutes * 60 * rng.uniform(0.5, 1.5), False
+
+
+async def generate(session: aiohttp.ClientSession, url: str, run: Run, args, durations: dict):
+    """
+    Пуассоновский поток вебхуков: в среднем args.rate звонков в час.
+    durations — длительности файлов в заглушке amoCRM (uuid -> секунды).
+    """
+    interval = 3600 / args.rate
+    # Интервалы и длительности — своим генератором: с --seed поток тот же, а id примечаний новые
+    rng = random.Random(args.seed)
+    deadline = time.monotonic() + args.duration
+    note_id = random.randint(10 ** 8, 9 * 10 ** 8)
+    tasks = set()
+
+    async def _post(pairs):
+        try:
+            async with session.post(url, data=urlencode(pairs),
+                                    headers={"Content-Type": "application/x-www-form-urlencoded"}) as resp:
+                if resp.status >= 400:
+                    logger.warning("Вебхук: HTTP %s", resp.status)
+        except aiohttp.ClientError as e:
+            logger.warning("Вебхук: %s", e)
+
+    while time.monotonic() < deadline and (not args.calls or run.sent < args.calls):
+        batch = []
+        if random.random() < args.noise:
+            note_id += 1
+            batch.append(note_webhook(note_id, random.randint(1, 10 ** 6), call=False))
+        note_id += 1
+        pairs = note_webhook(note_id, random.randint(1, 10 ** 6), call=True)
+        note = dict(pairs)
+        seconds, long = call_seconds(args, rng)
+        durations[note["leads[note][0][note][attachement]"]] = seconds
+        run.sent_call(str(note_id), note["leads[note][0][note][text]"], seconds, long)
+        run.sent += 1
+        batch.append(pairs)
+        if random.random() < args.duplicates:
+            batch.append(pairs)
+        for item in batch:
+            task = asyncio.create_task(_post(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.sleep(rng.expovariate(1 / interval))
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+# =========================================================================
+# ВОРКФЛОУ n8n
+# =========================================================================
+class Pipeline:
+    """Шаги воркфлоу по порядку с замером времени каждого."""
+
+    def __init__(self, run: Run, session: aiohttp.ClientSession, amo, work_ratio: float = 0.0):
+        self.run = run
+        self.session = session
+        self.amo = amo
+        self.work_ratio = work_ratio
+
+    async def _post(self, service: str, path: str, payload: dict) -> dict:
+        port = SERVICES[service][2]
+        async with self.session.post(f"http://127.0.0.1:{port}{path}", json=payload) as resp:
+            if resp.status >= 400:
+                raise RuntimeError(f"{service}{path}: HTTP {resp.status} {(await resp.text())[:200]}")
+            return await resp.json()
+
+    async def _stage(self, call: dict, name: str, coro):
+        started = time.monotonic()
+        try:
+            return await coro
+        finally:
+            call["stages"].setdefault(name, []).append(time.monotonic() - started)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = dict(parse_qsl(await request.text(), keep_blank_values=True))
+        note_id = body.get("leads[note][0][note][id]", "")
+        call = self.run.calls.get(note_id)
+        if call is None:
+            return web.Response(text="unknown note")
+        call["attempts"] += 1
+        call.setdefault("started", time.monotonic())
+        lead_id = int(body["leads[note][0][note][element_id]"])
+        filename = body.get("leads[note][0][note][text]", "")
+        try:
+            audio_url = await self._stage(call, "amocrm", self._amocrm(lead_id, body["leads[note][0][note][attachement]"]))
+            transcript = await self._stage(call, "transcribe", self._transcribe(call, {
+                "audio_url": audio_url, "file_uuid": body["leads[note][0][note][attachement]"], "backend": "assemblyai",
+            }))
+            analysis = await self._stage(call, "analyze", self._post("analysis", "/analyze", {"transcript": transcript}))
+            report = {**analysis, "filename": filename, "audio_url": audio_url, "chat_id": CHAT_ID}
+            await self._stage(call, "deliver", asyncio.gather(
+                self._post("telegram", "/send/analysis", report),
+                self._post("sheets", "/report", report),
+                self.amo.add_lead_note(lead_id, analysis.get("summary") or "Анализ звонка готов"),
+            ))
+        except Exception as e:
+            call["errors"].append(f"{type(e).__name__}: {e}"[:200])
+            return web.Response(status=500, text=str(e))
+        call["done"] = time.monotonic()
+        return web.json_response({"ok": True})
+
+    async def _transcribe(self, call: dict, payload: dict) -> dict:
+        # Заглушка AssemblyAI не зависит от длины записи — добираем время здесь
+        await asyncio.sleep(call["audio_seconds"] * self.work_ratio)
+        return await self._post("transcription", "/transcribe", payload)
+
+    async def _amocrm(self, lead_id: int, file_uuid: str) -> str:
+        await self.amo.get_lead(lead_id)
+        await self.amo.get_lead_links(lead_id)
+        return await self.amo.file_download_url(file_uuid)
+
+
+# =========================================================================
+# ЗАПУСК
+# =========================================================================
+def parse_overrides(items: list) -> dict:
+    """["gemini.delay=3", "sheets.error_rate=0.1"] -> {"gemini": {"delay": 3.0, ...}}."""
+    result = collections.defaultdict(dict)
+    for item in items:
+        key, _, value = item.partition("=")
+        stub, _, field = key.partition(".")
+        if stub not in STUB_PORTS or field not in ("delay", "error_rate", "quota"):
+            raise SystemExit(f"--set {item}: ожидается <{'|'.join(STUB_PORTS)}>.<delay|error_rate|quota>=число")
+        result[stub][field] = float(value) if field != "quota" else int(value)
+    return result
+
+
+async def start_stubs(profile: dict, overrides: dict) -> list:
+    runners = []
+    for name, port in STUB_PORTS.items():
+        delay, error_rate = profile[name]
+        options = {"error_rate": error_rate}
+        if delay is not None:
+            options["delay"] = delay
+        options.update(overrides.get(name, {}))
+        app = stubs.STUBS[name][0](**options)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append((name, runner, app))
+    return runners
+
+
+def service_env(workdir: str) -> dict:
+    stub = {name: f"http://127.0.0.1:{port}" for name, port in STUB_PORTS.items()}
+    env = dict(os.environ)
+    env.update({
+        "N8N_WEBHOOK_URL": f"http://127.0.0.1:{EMULATOR_PORT}/webhook",
+        "ASSEMBLYAI_BASE_URL": stub["assemblyai"],
+        "ASSEMBLYAI_API_KEY": "test",
+        "TRANSCRIBE_PREPROCESS": "",
+        "GEMINI_BASE_URL": stub["gemini"],
+        "GEMINI_API_KEY": "test",
+        "LLM_ROUTER_URL": "",
+        "TELEGRAM_API_URL": stub["telegram"],
+        "TELEGRAM_BOT_TOKEN": "test",
+        "SHEETS_API_URL": stub["sheets"],
+        "SHEETS_ACCESS_TOKEN": "test",
+        "GOOGLE_REFRESH_TOKEN": "",
+        "SHEETS_JOURNAL": os.path.join(workdir, "sheets_journal.jsonl"),
+    })
+    env.setdefault("POLL_INITIAL", "1")
+    env.setdefault("POLL_MAX", "5")
+    env.setdefault("JOBS_POLL_INTERVAL", "1")
+    env.setdefault("JOBS_RETRY_BASE", "5")
+    env.setdefault("JOBS_RETRY_MAX", "60")
+    return env
+
+
+async def start_services(session: aiohttp.ClientSession, workdir: str) -> list:
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = service_env(workdir)
+    processes = []
+    for name, (script, port_var, port) in SERVICES.items():
+        log = open(os.path.join(workdir, f"{name}.log"), "w")
+        processes.append((name, subprocess.Popen(
+            [sys.executable, os.path.join(here, script)],
+            env={**env, port_var: str(port)}, cwd=here, stdout=log, stderr=subprocess.STDOUT,
+        )))
+    for name, process in processes:
+        port = SERVICES[name][2]
+        for _ in range(100):
+            if process.poll() is not None:
+                raise SystemExit(f"{name} завершился с кодом {process.returncode}, лог: {workdir}/{name}.log")
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/health") as resp:
+                    if resp.status == 200:
+                        break
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        else:
+            raise SystemExit(f"{name} не ответил на /health, лог: {workdir}/{name}.log")
+    return processes
+
+
+def stop_services(processes: list):
+    for _, process in processes:
+        process.terminate()
+    for _, process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def watch(session: aiohttp.ClientSession, run: Run, telegram_stub, gateway: bool):
+    """Раз в секунду: очередь шлюза и новые сообщения в заглушке Telegram."""
+    seen = 0
+    while True:
+        now = time.monotonic()
+        for message in telegram_stub.messages[seen:]:
+            run.delivered(message["text"], now)
+        seen = len(telegram_stub.messages)
+        if gateway:
+            try:
+                async with session.get(f"http://127.0.0.1:{SERVICES['gateway'][2]}/health") as resp:
+                    queue = (await resp.json())["queue"]
+                    run.backlog.append((now, queue["queued"], queue["running"], queue["dead"]))
+            except (aiohttp.ClientError, KeyError, ValueError):
+                pass
+        await asyncio.sleep(1)
+
+
+async def gateway_metrics(session: aiohttp.ClientSession) -> dict:
+    try:
+        async with session.get(f"http://127.0.0.1:{SERVICES['gateway'][2]}/metrics") as resp:
+            return await resp.json()
+    except (aiohttp.ClientError, ValueError):
+        return {}
+
+
+def report(run: Run, stub_stats: dict, args) -> dict:
+    calls = list(run.calls.values())
+    done = [c for c in calls if "done" in c]
+    delivered = [c for c in calls if "delivered" in c]
+    finished = [c.get("done") or c.get("delivered") for c in calls if "done" in c or "delivered" in c]
+    window = (max(finished) - run.first_sent) if finished else 0
+    result = {
+        "rate_offered_per_hour": args.rate,
+        "sent": run.sent,
+        "sending_seconds": round((run.last_sent or 0) - (run.first_sent or 0), 1),
+        "completed": len(done) if not args.target else len(delivered),
+        "outstanding": len(calls) - (len(done) if not args.target else len(delivered)),
+        "throughput_per_hour": round(len(finished) / window * 3600, 1) if window else 0.0,
+        "retried": sum(1 for c in calls if c["attempts"] > 1),
+        "queue_delay": summary([c["started"] - c["sent"] for c in calls if "started" in c]),
+        "stages": {
+            stage: summary([c["stages"][stage][-1] for c in done if stage in c["stages"]]) for stage in STAGES
+        },
+        "end_to_end": summary([c["done"] - c["sent"] for c in done]),
+        "end_to_telegram": summary([c["delivered"] - c["sent"] for c in delivered]),
+        "stubs": stub_stats,
+    }
+    if args.long_share:
+        for kind, long in (("short", False), ("long", True)):
+            result[f"end_to_telegram_{kind}"] = summary(
+                [c["delivered"] - c["sent"] for c in delivered if c["long"] == long]
+            )
+            result[f"audio_minutes_{kind}"] = round(sum(c["audio_seconds"] for c in calls if c["long"] == long) / 60, 1)
+    if run.backlog:
+        result["gateway_queue_max"] = max(b[1] for b in run.backlog)
+        result["gateway_dead"] = run.backlog[-1][3] - run.backlog[0][3]
+    errors = collections.Counter(e[:100] for c in calls for e in c["errors"])
+    result["errors"] = dict(errors.most_common(10))
+    return result
+
+
+def print_report(result: dict):
+    def _row(name, s):
+        if not s["n"]:
+            return f"  {name:<16} —"
+        return f"  {name:<16} n={s['n']:<5} p50={s['p50']:>7.2f}  p95={s['p95']:>7.2f}  p99={s['p99']:>7.2f}  max={s['max']:>7.2f}"
+
+    print()
+    print(f"Отправлено звонков: {result['sent']} за {result['sending_seconds']} с "
+          f"(задано {result['rate_offered_per_hour']}/ч)")
+    print(f"Готово: {result['completed']}, не дошли: {result['outstanding']}, с повторами: {result['retried']}")
+    print(f"Пропускная способность: {result['throughput_per_hour']} звонков/ч")
+    if "gateway_queue_max" in result:
+        print(f"Очередь шлюза: максимум {result['gateway_queue_max']}, новых в dead letter {result['gateway_dead']}")
+    print("Время, с:")
+    print(_row("в очереди", result["queue_delay"]))
+    for stage, stage_stats in result["stages"].items():
+        print(_row(stage, stage_stats))
+    print(_row("сквозное", result["end_to_end"]))
+    print(_row("до Telegram", result["end_to_telegram"]))
+    for kind, label in (("short", "  коротких"), ("long", "  длинных")):
+        if f"end_to_telegram_{kind}" in result:
+            print(_row(label, result[f"end_to_telegram_{kind}"]) + f"  ({result[f'audio_minutes_{kind}']} мин записи)")
+    if result.get("gateway"):
+        print(f"Шлюз, планирование {result['gateway']['scheduling']}:")
+        for lane, values in result["gateway"]["lanes"].items():
+            print(f"  {lane:<16} выполнено {values['done']}, ожидание p50/p95 {values['wait_p50']}/{values['wait_p95']} с, "
+                  f"готово p50/p95 {values['total_p50']}/{values['total_p95']} с")
+    if result["errors"]:
+        print("Ошибки шагов:")
+        for error, count in result["errors"].items():
+            print(f"  {count:>5}  {error}")
+    print("Заглушки:")
+    for name, stub_stats in result["stubs"].items():
+        print(f"  {name:<11} {json.dumps(stub_stats, ensure_ascii=False)}")
+
+
+async def _main(args):
+    profile = PROFILES[args.profile]
+    overrides = parse_overrides(args.set)
+    run = Run()
+    workdir = args.logs or tempfile.mkdtemp(prefix="load_test_")
+    os.makedirs(workdir, exist_ok=True)
+    runners = await start_stubs(profile, overrides)
+    telegram_stub = next(app["stub"] for name, _, app in runners if name == "telegram")
+    amocrm_stub = next(app["stub"] for name, _, app in runners if name == "amocrm")
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=3600))
+    processes, amo, emulator = [], None, None
+    try:
+        if args.target:
+            url = args.target
+        else:
+            # Импорт здесь: amocrm_client читает адреса из окружения при импорте
+            os.environ.update({
+                "AMOCRM_BASE_URL": f"http://127.0.0.1:{STUB_PORTS['amocrm']}",
+                "AMOCRM_DRIVE_URL": f"http://127.0.0.1:{STUB_PORTS['amocrm']}",
+                "AMOCRM_ACCESS_TOKEN": "test",
+            })
+            import amocrm_client
+
+            amo = amocrm_client.AmoCRM()
+            pipeline = Pipeline(run, session, amo, args.work_ratio)
+            app = web.Application()
+            app.router.add_post("/webhook", pipeline.handle)
+            emulator = web.AppRunner(app, access_log=None)
+            await emulator.setup()
+            await web.TCPSite(emulator, "127.0.0.1", EMULATOR_PORT).start()
+            processes = await start_services(session, workdir)
+            url = f"http://127.0.0.1:{SERVICES['gateway'][2]}/amocrm"
+        logger.info("Профиль %s, %s звонков/ч, %s с -> %s (логи: %s)", args.profile, args.rate, args.duration, url, workdir)
+
+        watcher = asyncio.create_task(watch(session, run, telegram_stub, not args.target))
+        await generate(session, url, run, args, amocrm_stub.durations)
+        logger.info("Отправлено %d звонков, ждём завершения (до %s с)", run.sent, args.drain_timeout)
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline:
+            pending = run.outstanding if not args.target else sum(1 for c in run.calls.values() if "delivered" not in c)
+            if not pending:
+                break
+            await asyncio.sleep(1)
+        if not args.target:
+            # Сообщения Telegram уходят из очереди с лимитами Bot API — даём им дойти
+            await asyncio.sleep(min(10, max(0.0, deadline - time.monotonic())))
+        watcher.cancel()
+
+        stub_stats = {}
+        for name, port in STUB_PORTS.items():
+            async with session.get(f"http://127.0.0.1:{port}/stats") as resp:
+                stub_stats[name] = await resp.json()
+        result = report(run, stub_stats, args)
+        if not args.target:
+            result["gateway"] = await gateway_metrics(session)
+    finally:
+        stop_services(processes)
+        if amo:
+            await amo.close()
+        if emulator:
+            await emulator.cleanup()
+        await session.close()
+        for _, runner, _ in runners:
+            await runner.cleanup()
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон конвейера звонков на заглушках")
+    parser.add_argument("--rate", type=float, default=600, help="Звонков в час (в среднем, пуассоновский поток)")
+    parser.add_argument("--duration", type=float, default=60, help="Сколько секунд слать вебхуки")
+    parser.add_argument("--calls", type=int, help="Остановиться после стольких звонков")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="normal", help="Задержки и ошибки заглушек")
+    parser.add_argument("--set", action="append", default=[], metavar="STUB.FIELD=VALUE",
+                        help="Переопределить профиль, например gemini.delay=3 или sheets.error_rate=0.1")
+    parser.add_argument("--noise", type=float, default=0.1, help="Сколько вебхуков без записи звонка на один звонок")
+    parser.add_argument("--duplicates", type=float, default=0.02, help="Доля повторных доставок вебхука")
+    parser.add_argument("--short-minutes", type=float, default=2, help="Средняя длительность обычного звонка, мин")
+    parser.add_argument("--long-share", type=float, default=0.0, help="Доля длинных записей (совещания, вебинары)")
+    parser.add_argument("--long-minutes", type=float, default=90, help="Длительность длинной записи, мин")
+    parser.add_argument("--work-ratio", type=float, default=0.0,
+                        help="Секунд обработки на секунду записи в шаге transcribe (0 — не зависит от длины)")
+    parser.add_argument("--seed", type=int, help="Тот же поток звонков (интервалы и длительности) для сравнения прогонов")
+    parser.add_argument("--drain-timeout", type=float, default=600, help="Сколько ждать хвост после генерации, с")
+    parser.add_argument("--target", help="Слать вебхуки сюда (n8n), сервисы не поднимать")
+    parser.add_argument("--logs", help="Каталог для логов сервисов и журнала Sheets")
+    parser.add_argument("--json", help="Сохранить отчёт в файл")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
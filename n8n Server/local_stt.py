@@ -0,0 +1,349 @@
+"""
+Локальная транскрибация на CPU сервера (вместо AssemblyAI).
+
+Модель Whisper через faster-whisper (CTranslate2, int8). Запись
+декодируется ffmpeg в 16 кГц, режется по тишине на куски до
+LOCAL_STT_CHUNK секунд (тишина между кусками не декодируется), куски
+распознаются параллельно в пуле процессов (LOCAL_STT_WORKERS, модель
+загружается в каждый процесс один раз), затем склеиваются в реплики.
+
+Спикеры: телефонные записи amoCRM обычно стерео — менеджер и клиент на
+разных каналах. Такие каналы распознаются отдельно (спикеры A и B) и
+сливаются по времени. Моно-запись — один спикер A.
+
+Результат — в формате AssemblyAI (id, status, text, utterances, words,
+audio_duration), как ждут ноды "Получаем текст из записи" / "Распарсить JSON".
+
+  pip install faster-whisper
+  python local_stt.py transcribe call.wav --out call.json
+  python local_stt.py bench call1.wav call2.mp3 --workers 2 3 6
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from audio_preprocess import FFMPEG_BIN
+
+logger = logging.getLogger(__name__)
+
+MODEL = os.getenv("LOCAL_STT_MODEL", "small")
+COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+WORKERS = int(os.getenv("LOCAL_STT_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+CHUNK_SECONDS = float(os.getenv("LOCAL_STT_CHUNK", "30"))
+BEAM_SIZE = int(os.getenv("LOCAL_STT_BEAM", "1"))
+LANGUAGE = os.getenv("LOCAL_STT_LANGUAGE", "ru")
+MAX_SECONDS = float(os.getenv("LOCAL_STT_MAX_SECONDS", "14400"))  # 0 — без ограничения
+
+SAMPLE_RATE = 16000
+FRAME = SAMPLE_RATE * 30 // 1000  # 30 мс
+SILENCE_DB = -40.0
+MIN_SILENCE = 0.5   # пауза, по которой можно резать, с
+PAD = 0.2           # запас вокруг речи, с
+TURN_GAP_MS = 1500  # сегменты одного спикера ближе этого — одна реплика
+BLOCK_SECONDS = 60  # блок чтения и перевода во float32, с
+CUT_WINDOW = 3.0    # длинная речь режется в самом тихом кадре за столько секунд до границы куска
+
+
+# =========================================================================
+# АУДИО
+# =========================================================================
+def load_audio(source: str, max_seconds: float = MAX_SECONDS) -> np.ndarray:
+    """
+    Аудио (файл или URL) -> int16 [каналы, отсчёты], 16 кГц.
+    Моно и стерео с одинаковыми каналами возвращаются одним каналом.
+
+    Вывод ffmpeg читается блоками по BLOCK_SECONDS и хранится в int16 как
+    есть: 90 минут стерео — ~350 МБ вместо ~1.5 ГБ при переводе всей записи
+    во float32. Во float32 переводятся только куски (speech_regions, _decode).
+    Записи длиннее max_seconds обрезаются.
+    """
+    command = [FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-nostdin", "-i", source, "-vn"]
+    if max_seconds:
+        command += ["-t", str(max_seconds)]
+    command += ["-ac", "2", "-ar", str(SAMPLE_RATE), "-f", "s16le", "pipe:1"]
+
+    data = bytearray()
+    diff = level = 0.0
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        with proc.stdout:
+            while True:
+                block = proc.stdout.read(BLOCK_SECONDS * SAMPLE_RATE * 4)
+                if not block:
+                    break
+                block = block[: len(block) // 4 * 4]
+                left, right = _to_float(np.frombuffer(block, dtype=np.int16).reshape(-1, 2).T)
+                diff += float(np.abs(left - right).sum())
+                level += float((np.abs(left) + np.abs(right)).sum()) / 2
+                data += block
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise RuntimeError(f"ffmpeg: {stderr.read().decode('utf-8', 'replace').strip()[-500:]}")
+
+    samples = np.frombuffer(data, dtype=np.int16).reshape(-1, 2).T
+    if max_seconds and samples.shape[1] >= int(max_seconds * SAMPLE_RATE):
+        logger.warning("%s длиннее %s с, распознаётся только начало", source, max_seconds)
+    if diff > 0.05 * level:
+        return samples
+    mono = np.empty(samples.shape[1], dtype=np.int16)
+    step = BLOCK_SECONDS * SAMPLE_RATE
+    for start in range(0, samples.shape[1], step):
+        left, right = samples[:, start:start + step].astype(np.int32)
+        mono[start:start + step] = (left + right) // 2
+    return mono[None, :]
+
+
+def _to_float(samples: np.ndarray) -> np.ndarray:
+    return samples.astype(np.float32) / 32768.0
+
+
+def frame_levels(samples: np.ndarray) -> np.ndarray:
+    """Громкость кадров 30 мс, дБ."""
+    n_frames = len(samples) // FRAME
+    if n_frames == 0:
+        return np.empty(0, dtype=np.float32)
+    frames = samples[: n_frames * FRAME].reshape(n_frames, FRAME)
+    # Громкость по блокам: во float32 переводится не больше BLOCK_SECONDS за раз
+    step = BLOCK_SECONDS * SAMPLE_RATE // FRAME
+    rms = np.concatenate([
+        np.sqrt(np.mean(_to_float(frames[i:i + step]) ** 2, axis=1) + 1e-12)
+        for i in range(0, n_frames, step)
+    ])
+    return 20 * np.log10(rms)
+
+
+def speech_regions(samples: np.ndarray, threshold_db: float = SILENCE_DB, min_silence: float = MIN_SILENCE,
+                   levels: np.ndarray = None) -> list:
+    """Отрезки речи [(начало, конец)] в отсчётах: громкость кадров 30 мс против порога."""
+    levels = frame_levels(samples) if levels is None else levels
+    if len(levels) == 0:
+        return []
+    voiced = levels > threshold_db
+
+    # Границы участков речи: переходы 0->1 и 1->0
+    edges = np.diff(np.concatenate(([0], voiced.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return []
+
+    # Сливаем участки, разделённые паузой короче min_silence
+    min_gap = int(min_silence * SAMPLE_RATE / FRAME)
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] >= min_gap))
+    merged_starts = starts[keep]
+    merged_ends = np.concatenate((ends[np.flatnonzero(keep)[1:] - 1], [ends[-1]]))
+
+    pad = int(PAD * SAMPLE_RATE)
+    return [
+        (max(0, int(s) * FRAME - pad), min(len(samples), int(e) * FRAME + pad))
+        for s, e in zip(merged_starts, merged_ends)
+    ]
+
+
+def chunk_regions(regions: list, max_seconds: float = CHUNK_SECONDS, levels: np.ndarray = None) -> list:
+    """
+    Упаковать отрезки речи в куски не длиннее max_seconds. Длинный отрезок
+    режется в самом тихом кадре (по levels из frame_levels) за CUT_WINDOW
+    до границы — между словами, а не посреди слова; без levels — по границе.
+    """
+    limit = int(max_seconds * SAMPLE_RATE)
+    window = min(int(CUT_WINDOW * SAMPLE_RATE), limit // 2)
+    chunks = []
+    for start, end in regions:
+        while end - start > limit:
+            cut = start + limit
+            if levels is not None:
+                first, last = -(-(cut - window) // FRAME), min(cut // FRAME, len(levels))
+                if last > first:
+                    cut = (first + int(np.argmin(levels[first:last]))) * FRAME + FRAME // 2
+            chunks.append((start, cut))
+            start = cut
+        if chunks and end - chunks[-1][0] <= limit:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+# =========================================================================
+# РАСПОЗНАВАНИЕ (в процессах пула)
+# =========================================================================
+_model = None
+
+
+def _init_worker(model_name: str, compute_type: str, cpu_threads: int):
+    global _model
+    from faster_whisper import WhisperModel
+
+    _model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads)
+
+
+def _decode(audio: np.ndarray, offset: int, speaker: str, language: str, beam_size: int) -> list:
+    segments, _ = _model.transcribe(
+        _to_float(audio), language=language, beam_size=beam_size, word_timestamps=True,
+        condition_on_previous_text=False, vad_filter=False,
+    )
+    base_ms = offset * 1000 // SAMPLE_RATE
+    result = []
+    for segment in segments:
+        words = [
+            {
+                "text": w.word.strip(),
+                "start": base_ms + int(w.start * 1000),
+                "end": base_ms + int(w.end * 1000),
+                "confidence": round(w.probability, 3),
+                "speaker": speaker,
+            }
+            for w in (segment.words or [])
+            if w.word.strip()
+        ]
+        if not words:
+            continue
+        result.append({
+            "speaker": speaker,
+            "text": segment.text.strip(),
+            "start": words[0]["start"],
+            "end": words[-1]["end"],
+            "words": words,
+        })
+    return result
+
+
+def stitch(segments: list) -> list:
+    """Сегменты всех каналов -> реплики по времени (соседние сегменты одного спикера сливаются)."""
+    utterances = []
+    for segment in sorted(segments, key=lambda s: s["start"]):
+        last = utterances[-1] if utterances else None
+        if last and last["speaker"] == segment["speaker"] and segment["start"] - last["end"] <= TURN_GAP_MS:
+            last["text"] = f"{last['text']} {segment['text']}"
+            last["end"] = max(last["end"], segment["end"])
+            last["words"].extend(segment["words"])
+        else:
+            utterances.append({**segment, "words": list(segment["words"])})
+    for utterance in utterances:
+        utterance["confidence"] = round(float(np.mean([w["confidence"] for w in utterance["words"]])), 3)
+    return utterances
+
+
+class LocalSTT:
+    def __init__(self, model: str = MODEL, workers: int = WORKERS, compute_type: str = COMPUTE_TYPE):
+        self.model = model
+        self.workers = workers
+        self.compute_type = compute_type
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            cpu_threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self._pool = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.model, self.compute_type, cpu_threads),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+
+    def transcribe(self, source: str, language: str = LANGUAGE) -> dict:
+        audio = load_audio(source)
+        speakers = "AB" if audio.shape[0] == 2 else "A"
+        futures = []
+        for channel, speaker in zip(audio, speakers):
+            levels = frame_levels(channel)
+            for start, end in chunk_regions(speech_regions(channel, levels=levels), levels=levels):
+                futures.append(self.pool.submit(
+                    _decode, channel[start:end], start, speaker, language, BEAM_SIZE,
+                ))
+        try:
+            segments = [segment for future in futures for segment in future.result()]
+        except BrokenProcessPool:
+            # Процесс упал (память, не загрузилась модель) — следующий вызов поднимет пул заново
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            raise
+        utterances = stitch(segments)
+        words = sorted((w for u in utterances for w in u["words"]), key=lambda w: w["start"])
+        return {
+            "id": f"local-{uuid.uuid4().hex}",
+            "status": "completed",
+            "audio_url": source,
+            "language_code": language,
+            "text": " ".join(u["text"] for u in utterances),
+            "utterances": utterances,
+            "words": words,
+            "audio_duration": round(audio.shape[1] / SAMPLE_RATE),
+            "confidence": round(float(np.mean([w["confidence"] for w in words])), 3) if words else None,
+            "error": None,
+            "speech_model": f"local:{self.model}",
+        }
+
+
+# =========================================================================
+# CLI
+# =========================================================================
+def bench(files: list, workers_list: list, model: str):
+    """Скорость: секунды аудио на секунду работы, для разного числа процессов."""
+    print(f"Модель {model}, {COMPUTE_TYPE}, ядер {os.cpu_count()}")
+    for workers in workers_list:
+        engine = LocalSTT(model=model, workers=workers)
+        # Прогрев: загрузка модели в процессы не входит в замер
+        list(engine.pool.map(_noop, range(workers)))
+        audio_seconds, started = 0.0, time.monotonic()
+        for path in files:
+            audio_seconds += engine.transcribe(path)["audio_duration"]
+        wall = time.monotonic() - started
+        engine.close()
+        print(f"процессов {workers}: аудио {audio_seconds:.0f} с за {wall:.1f} с -> {audio_seconds / wall:.1f}x")
+
+
+def _noop(_):
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная транскрибация (faster-whisper, CPU)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("transcribe", help="Распознать файл/URL в формате AssemblyAI")
+    p_run.add_argument("source")
+    p_run.add_argument("--out", help="JSON-файл (по умолчанию — в stdout)")
+    p_run.add_argument("--model", default=MODEL, help="tiny/base/small/medium/large-v3 или путь")
+
+    p_bench = sub.add_parser("bench", help="Замер скорости (секунд аудио в секунду)")
+    p_bench.add_argument("files", nargs="+")
+    p_bench.add_argument("--workers", type=int, nargs="+", default=[WORKERS])
+    p_bench.add_argument("--model", default=MODEL, help="tiny/base/small/medium/large-v3 или путь")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.command == "bench":
+        bench(args.files, args.workers, args.model)
+        return
+
+    engine = LocalSTT(model=args.model)
+    try:
+        result = engine.transcribe(args.source)
+    finally:
+        engine.close()
+    data = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(data)
+    else:
+        print(data)
+
+
+if __name__ == "__main__":
+    main()
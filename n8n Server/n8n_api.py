@@ -0,0 +1,200 @@
+"""
+Доступ к выполнениям n8n: публичный REST API или таблицы в Postgres n8n.
+
+- N8nAPI: GET /api/v1/executions постранично (cursor), одно выполнение,
+  ключ N8N_API_KEY (Settings -> API в n8n, тот же, что у ноды
+  "Get Execution" в AMO CRM Error Handler).
+- fetch_executions_db: то же из execution_entity + execution_data, когда
+  API недоступен; поле data там в формате flatted — unflatten().
+Выполнение из обоих источников приводится к виду ответа API:
+{"id", "workflowId", "status", "mode", "startedAt", "stoppedAt",
+ "data": {"resultData": {"runData": ...}}, "workflowData": {...}}.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import aiohttp
+
+N8N_API_URL = os.getenv("N8N_API_URL", "https://vps-39eb0606.vps.ovh.ca").rstrip("/")
+N8N_API_KEY = os.getenv("N8N_API_KEY", "")
+PAGE_SIZE = int(os.getenv("N8N_API_PAGE", "100"))
+
+# Выполнение ещё идёт — его узлы не окончательны
+UNFINISHED = ("new", "running", "waiting", "unknown")
+
+
+class N8nAPIError(Exception):
+    pass
+
+
+def unflatten(text: str):
+    """
+    Разбор формата flatted (так n8n хранит execution_data.data): JSON-массив,
+    где строка внутри объекта — номер элемента массива, а строки верхнего
+    уровня — сами значения. Повторные ссылки дают тот же объект.
+    """
+    table = json.loads(text)
+    built = {}
+
+    def ref(index):
+        index = int(index)
+        item = table[index]
+        if not isinstance(item, (dict, list)):
+            return item
+        if index in built:
+            return built[index]
+        if isinstance(item, list):
+            out = []
+            built[index] = out
+            out.extend(ref(v) if isinstance(v, str) else v for v in item)
+        else:
+            out = {}
+            built[index] = out
+            for key, value in item.items():
+                out[key] = ref(value) if isinstance(value, str) else value
+        return out
+
+    return ref(0)
+
+
+def _json_field(value):
+    if isinstance(value, str):
+        text = value.strip()
+        if text.startswith("[") and text.endswith("]"):
+            return unflatten(text)
+        return json.loads(text) if text else None
+    return value
+
+
+def normalize(execution: dict) -> dict:
+    """Выполнение из API, БД или дампа -> единый вид (id — int, data/workflowData — dict)."""
+    result = dict(execution)
+    result["id"] = int(execution["id"])
+    for field in ("startedAt", "stoppedAt"):
+        if isinstance(result.get(field), datetime):
+            result[field] = result[field].isoformat()
+    result["data"] = _json_field(execution.get("data")) or {}
+    result["workflowData"] = _json_field(execution.get("workflowData")) or {}
+    result.setdefault("status", "success" if execution.get("finished") else "unknown")
+    return result
+
+
+def run_data(execution: dict) -> dict:
+    """Имя ноды -> список запусков ({startTime, executionTime, executionStatus, error, data})."""
+    return ((execution.get("data") or {}).get("resultData") or {}).get("runData") or {}
+
+
+def workflow_version(execution: dict) -> str:
+    """versionId воркфлоу или, в старых n8n, хэш нод и связей."""
+    workflow = execution.get("workflowData") or {}
+    if workflow.get("versionId"):
+        return str(workflow["versionId"])[:12]
+    if workflow.get("nodes"):
+        shape = json.dumps([workflow.get("nodes"), workflow.get("connections")], sort_keys=True, ensure_ascii=False)
+        return "h" + hashlib.sha1(shape.encode("utf-8")).hexdigest()[:11]
+    return "?"
+
+
+def parse_time(value) -> float:
+    """ISO-время n8n -> unix-время, с."""
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+
+
+# =========================================================================
+# REST API
+# =========================================================================
+class N8nAPI:
+    def __init__(self, session: aiohttp.ClientSession, url: str = N8N_API_URL, key: str = N8N_API_KEY):
+        self.session = session
+        self.url = url
+        self.key = key
+
+    async def _get(self, path: str, params: dict = None) -> dict:
+        async with self.session.get(
+            f"{self.url}/api/v1{path}",
+            params={k: v for k, v in (params or {}).items() if v is not None},
+            headers={"X-N8N-API-KEY": self.key, "Accept": "application/json"},
+        ) as resp:
+            if resp.status >= 400:
+                raise N8nAPIError(f"n8n API {path}: HTTP {resp.status} {(await resp.text())[:300]}")
+            return await resp.json()
+
+    async def executions(self, workflow_id: str = None, status: str = None,
+                         include_data: bool = True, limit: int = PAGE_SIZE):
+        """Выполнения от новых к старым, страницами по limit."""
+        cursor = None
+        while True:
+            page = await self._get("/executions", {
+                "workflowId": workflow_id, "status": status, "limit": limit, "cursor": cursor,
+                "includeData": "true" if include_data else "false",
+            })
+            for execution in page.get("data", []):
+                yield normalize(execution)
+            cursor = page.get("nextCursor")
+            if not cursor:
+                return
+
+    async def execution(self, execution_id, include_data: bool = True) -> dict:
+        return normalize(await self._get(f"/executions/{execution_id}",
+                                         {"includeData": "true" if include_data else "false"}))
+
+    async def workflows(self) -> list:
+        result, cursor = [], None
+        while True:
+            page = await self._get("/workflows", {"limit": 250, "cursor": cursor})
+            result.extend(page.get("data", []))
+            cursor = page.get("nextCursor")
+            if not cursor:
+                return result
+
+
+# =========================================================================
+# POSTGRES n8n
+# =========================================================================
+def newest_execution_id_db(conn, workflow_id: str = None, status: str = None) -> int:
+    """id последнего выполнения (с фильтрами), 0 — выполнений нет."""
+    conditions, params = ["true"], []
+    if workflow_id:
+        conditions.append('"workflowId" = %s')
+        params.append(workflow_id)
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COALESCE(max(id), 0) FROM execution_entity WHERE {' AND '.join(conditions)};", params)
+        return cur.fetchone()[0]
+
+
+def fetch_executions_db(conn, after_id: int = 0, limit: int = PAGE_SIZE,
+                        workflow_id: str = None, status: str = None) -> list:
+    """Выполнения с id > after_id по возрастанию id, с данными запуска."""
+    conditions, params = ['e.id > %s'], [after_id]
+    if workflow_id:
+        conditions.append('e."workflowId" = %s')
+        params.append(workflow_id)
+    if status:
+        conditions.append("e.status = %s")
+        params.append(status)
+    params.append(limit)
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT e.id, e."workflowId", e.status, e.mode, e."startedAt", e."stoppedAt",
+                   d.data, d."workflowData"
+            FROM execution_entity e
+            LEFT JOIN execution_data d ON d."executionId" = e.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY e.id
+            LIMIT %s;
+            """,
+            params,
+        )
+        columns = ("id", "workflowId", "status", "mode", "startedAt", "stoppedAt", "data", "workflowData")
+        return [normalize(dict(zip(columns, row))) for row in cur.fetchall()]
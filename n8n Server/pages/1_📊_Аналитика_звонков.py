@@ -0,0 +1,126 @@
+import datetime as dt
+
+import streamlit as st
+from psycopg2 import errors
+
+import call_analytics
+import db
+from admin_common import get_pool
+
+st.set_page_config(page_title="Аналитика звонков", page_icon="📊", layout="wide")
+st.title("📊 Аналитика звонков")
+
+DASHBOARD_TTL = 60
+PAGE_SIZE = 50
+
+
+# Всё считает Postgres: сюда приходят только агрегаты и одна страница звонков
+@st.cache_data(ttl=DASHBOARD_TTL)
+def load_managers():
+    with db.connection(get_pool()) as conn:
+        return call_analytics.managers(conn)
+
+
+@st.cache_data(ttl=DASHBOARD_TTL)
+def load_weekly(since, selected):
+    with db.connection(get_pool()) as conn:
+        return call_analytics.weekly(conn, since, list(selected))
+
+
+@st.cache_data(ttl=DASHBOARD_TTL)
+def load_summary(since, selected):
+    with db.connection(get_pool()) as conn:
+        return call_analytics.manager_summary(conn, since, list(selected))
+
+
+@st.cache_data(ttl=DASHBOARD_TTL)
+def load_page(since, selected, after):
+    with db.connection(get_pool()) as conn:
+        return call_analytics.calls_page(conn, since, list(selected), after, PAGE_SIZE)
+
+
+try:
+    all_managers = load_managers()
+except errors.UndefinedTable:
+    st.info("Данные появятся после первого запуска call_analytics.py.")
+    st.stop()
+
+col_period, col_managers = st.columns([1, 3])
+weeks = col_period.selectbox("Период, недель", [4, 12, 26, 52], index=1)
+selected = tuple(col_managers.multiselect("Менеджеры", all_managers))
+since = dt.datetime.combine(dt.date.today() - dt.timedelta(weeks=weeks), dt.time(), tzinfo=dt.timezone.utc)
+
+summary = load_summary(since, selected)
+if not summary:
+    st.info("За выбранный период звонков нет.")
+    st.stop()
+
+total_calls = sum(row["calls"] for row in summary)
+scored = [row for row in summary if row["avg_score"] is not None]
+m1, m2, m3 = st.columns(3)
+m1.metric("Звонков", f"{total_calls:,}".replace(",", " "))
+m2.metric("Менеджеров", len(summary))
+if scored:
+    m3.metric("Средняя оценка", f"{sum(r['avg_score'] * r['calls'] for r in scored) / sum(r['calls'] for r in scored):.2f}")
+
+st.subheader("Средняя оценка по неделям")
+weekly = load_weekly(since, selected)
+trend = {}
+for row in weekly:
+    trend.setdefault(row["week"].date(), {})[row["manager"] or "—"] = row["avg_score"]
+st.line_chart(
+    [{"неделя": week, **scores} for week, scores in sorted(trend.items())],
+    x="неделя",
+)
+
+st.subheader("По менеджерам")
+st.dataframe(
+    [
+        {
+            "Менеджер": row["manager"] or "—",
+            "Звонков": row["calls"],
+            "Средняя оценка": row["avg_score"],
+            "Минут разговора": round((row["duration_sec"] or 0) / 60),
+        }
+        for row in summary
+    ],
+    hide_index=True,
+)
+st.caption(f"Сводка по неделям обновляется раз в {int(call_analytics.ROLLUP_REFRESH)} с.")
+
+# --- ЗВОНКИ (keyset-пагинация) ---
+
+st.subheader("Звонки")
+filters_key = (since, selected)
+if st.session_state.get("calls_filters") != filters_key:
+    st.session_state["calls_filters"] = filters_key
+    st.session_state["calls_cursors"] = [None]
+cursors = st.session_state["calls_cursors"]
+
+rows = load_page(since, selected, cursors[-1])
+st.dataframe(
+    [
+        {
+            "Дата звонка": row["call_time"].strftime("%d.%m.%Y %H:%M"),
+            "Менеджер": row["manager"],
+            "Оценка": row["manager_score"],
+            "Итог": row["outcome"],
+            "Сделка": row["lead_id"],
+            "Длительность, с": row["duration_sec"],
+            "Резюме": row["summary"],
+            "Запись": row["audio_url"],
+        }
+        for row in rows
+    ],
+    hide_index=True,
+    column_config={"Запись": st.column_config.LinkColumn("Запись")},
+)
+
+prev_col, page_col, next_col = st.columns([1, 2, 1])
+if prev_col.button("← Новее", disabled=len(cursors) == 1):
+    cursors.pop()
+    st.rerun()
+page_col.markdown(f"Страница {len(cursors)}")
+if next_col.button("Старее →", disabled=len(rows) < PAGE_SIZE):
+    cursors.append((rows[-1]["call_time"], rows[-1]["id"]))
+    st.rerun()
@@ -0,0 +1,127 @@
+import urllib.error
+
+import streamlit as st
+from psycopg2 import errors
+
+import db
+import execution_replayer
+from admin_common import get_pool
+
+st.set_page_config(page_title="Повторы выполнений", page_icon="🔁", layout="wide")
+st.title("🔁 Повторы упавших выполнений")
+
+REPLAYS_TTL = 15
+
+
+@st.cache_data(ttl=REPLAYS_TTL)
+def load_causes():
+    with db.connection(get_pool()) as conn:
+        return execution_replayer.causes(conn)
+
+
+@st.cache_data(ttl=REPLAYS_TTL)
+def load_jobs(status, cause):
+    with db.connection(get_pool()) as conn:
+        return execution_replayer.jobs(conn, status, cause)
+
+
+def call_service(path, payload, timeout=30):
+    """Через сервис, а не в БД: он снимает паузу с причины и сразу берёт задачи."""
+    try:
+        result = execution_replayer.remote_call(path, payload, timeout=timeout)
+    except (urllib.error.URLError, OSError) as e:
+        st.error(f"Сервис повторов недоступен ({execution_replayer.REPLAY_URL}): {e}")
+        st.stop()
+    load_causes.clear()
+    load_jobs.clear()
+    return result
+
+
+def requeue(dedupe_key=None, cause=None):
+    payload = {key: value for key, value in (("dedupe_key", dedupe_key), ("cause", cause)) if value}
+    return call_service("/replays/retry", payload)["requeued"]
+
+
+def backlog_button():
+    with st.expander("Старые падения"):
+        st.write("При первом запуске сервис берёт только новые падения. Падения, которые n8n хранит "
+                 "с прошлых недель, ставятся в очередь только здесь.")
+        if st.button("Собрать все упавшие выполнения"):
+            st.success(f"В очереди: {call_service('/collect', {'since': 0}, timeout=600)['queued']}")
+
+
+try:
+    causes = load_causes()
+except errors.UndefinedTable:
+    st.info("Данные появятся после первого запуска execution_replayer.py.")
+    st.stop()
+
+if not causes:
+    st.success("Упавших выполнений нет.")
+    backlog_button()
+    st.stop()
+
+m1, m2, m3 = st.columns(3)
+m1.metric("Ждут повтора", sum(row["pending"] for row in causes))
+m2.metric("Повторено", sum(row["done"] for row in causes))
+m3.metric("Dead letter", sum(row["dead"] for row in causes))
+
+st.subheader("Причины")
+st.dataframe(
+    [
+        {
+            "Нода": row["node"],
+            "Причина": row["cause"].split(" | ", 1)[-1],
+            "Ждут": row["pending"],
+            "Повторено": row["done"],
+            "Dead": row["dead"],
+            "Уже выполнены шлюзом": row["skipped"],
+            "Падений": row["executions"],
+            "Последнее": row["last_seen"].strftime("%d.%m.%Y %H:%M"),
+            "Последняя ошибка повтора": row["last_error"],
+        }
+        for row in causes
+    ],
+    hide_index=True,
+)
+
+# --- ЗАДАЧИ ПО ПРИЧИНЕ ---
+
+col_cause, col_status = st.columns([3, 1])
+cause = col_cause.selectbox("Причина", [None] + [row["cause"] for row in causes],
+                            format_func=lambda value: "Все" if value is None else value)
+status = col_status.selectbox("Статус", ["dead", "queued", "running", "done", "skipped"])
+
+rows = load_jobs(status, cause)
+st.dataframe(
+    [
+        {
+            "Примечание": row["dedupe_key"],
+            "Попыток": row["attempts"],
+            "Выполнения n8n": ", ".join(str(i) for i in row["execution_ids"]),
+            "Ошибка повтора": row["last_error"],
+            "Исходная ошибка": row["error"],
+            "Следующая попытка": row["available_at"].strftime("%d.%m.%Y %H:%M:%S") if status == "queued" else "",
+            "Обновлено": row["updated_at"].strftime("%d.%m.%Y %H:%M"),
+        }
+        for row in rows
+    ],
+    hide_index=True,
+)
+
+if status == "dead" and rows:
+    col_one, col_cause_btn, col_all = st.columns(3)
+    key = col_one.selectbox("Задача", [row["dedupe_key"] for row in rows])
+    if col_one.button("Повторить задачу"):
+        st.success(f"В очереди: {requeue(dedupe_key=key)}")
+    if cause and col_cause_btn.button("Повторить всю причину"):
+        st.success(f"В очереди: {requeue(cause=cause)}")
+    if col_all.button("Повторить весь dead letter"):
+        st.success(f"В очереди: {requeue()}")
+
+backlog_button()
+
+st.caption(
+    f"Повторы идут не больше {execution_replayer.REPLAY_CONCURRENCY} одновременно; "
+    f"после {execution_replayer.REPLAY_MAX_ATTEMPTS} неудачных попыток задача попадает в dead letter."
+)
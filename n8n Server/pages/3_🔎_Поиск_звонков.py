@@ -0,0 +1,81 @@
+import datetime as dt
+import urllib.error
+
+import streamlit as st
+from psycopg2 import errors
+
+import call_analytics
+import call_search
+import db
+from admin_common import get_pool
+
+st.set_page_config(page_title="Поиск звонков", page_icon="🔎", layout="wide")
+st.title("🔎 Поиск по звонкам")
+
+SEARCH_TTL = 60
+
+
+@st.cache_data(ttl=SEARCH_TTL)
+def load_managers():
+    with db.connection(get_pool()) as conn:
+        return call_analytics.managers(conn)
+
+
+@st.cache_data(ttl=SEARCH_TTL)
+def run_search(payload_items):
+    return call_search.remote_search(dict(payload_items))
+
+
+try:
+    all_managers = load_managers()
+except errors.UndefinedTable:
+    all_managers = []
+
+with st.form("search_form"):
+    query = st.text_input("Что ищем", placeholder="клиент возражал по цене")
+    col_manager, col_dates, col_score = st.columns([2, 2, 2])
+    manager = col_manager.selectbox("Менеджер", [None] + all_managers,
+                                    format_func=lambda value: "Все" if value is None else value)
+    today = dt.date.today()
+    dates = col_dates.date_input("Период", (today - dt.timedelta(days=90), today))
+    min_score, max_score = col_score.slider("Оценка менеджера", 0, 10, (0, 10))
+    limit = st.select_slider("Сколько звонков показать", [10, 20, 50], value=10)
+    submitted = st.form_submit_button("Найти")
+
+if not submitted or not query.strip():
+    st.caption("Поиск по смыслу: по итогам анализа и по репликам транскрипций, а не по точным словам.")
+    st.stop()
+
+payload = {"query": query.strip(), "limit": limit, "manager": manager}
+if len(dates) == 2:
+    payload["date_from"] = dates[0].isoformat()
+    payload["date_to"] = (dates[1] + dt.timedelta(days=1)).isoformat()
+if (min_score, max_score) != (0, 10):
+    payload["min_score"], payload["max_score"] = min_score, max_score
+
+try:
+    results = run_search(tuple(sorted(payload.items())))
+except (urllib.error.URLError, OSError) as e:
+    st.error(f"Сервис поиска недоступен ({call_search.SEARCH_URL}): {e}")
+    st.stop()
+
+if not results:
+    st.info("Ничего не нашлось.")
+    st.stop()
+
+for item in results:
+    date = dt.datetime.fromisoformat(item["date"]).strftime("%d.%m.%Y") if item["date"] else "—"
+    score = f"{item['score']}/10" if item["score"] is not None else "—"
+    with st.container(border=True):
+        st.markdown(
+            f"**{item['manager'] or 'Без менеджера'}** · {date} · оценка {score} · "
+            f"сходство {item['similarity']:.2f} · сделка {item['lead_id'] or '—'}"
+        )
+        if item["outcome"]:
+            st.markdown(f"**Итог:** {item['outcome']}")
+        if item["summary"]:
+            st.caption(item["summary"])
+        label = "Фрагмент разговора" if item["kind"] == "transcript" else "Из анализа"
+        st.text(f"{label}:\n{item['snippet']}")
+        if item["audio_url"]:
+            st.markdown(f"[🔗 Запись]({item['audio_url']})")
@@ -0,0 +1,337 @@
+"""
+Сервис настроек для воркфлоу n8n (рядом с админкой app.py).
+
+- Отдаёт n8n_app_settings по локальному HTTP из памяти, с ETag / версией.
+- Копия в памяти обновляется по Postgres LISTEN/NOTIFY: триггер на таблице
+  пишет каждое изменение в n8n_app_settings_history и шлёт pg_notify.
+- Любую прошлую версию можно вернуть одним запросом (или из админки).
+
+- Секреты (ключи *_key, *_token, *_secret, *_password) отдаются открыто
+  только с заголовком Authorization: Bearer SETTINGS_TOKEN, остальным —
+  замаскированными. Откат при заданном SETTINGS_TOKEN — только с ним.
+
+Эндпоинты:
+  GET  /settings                 {"version": N, "settings": {...}}, ETag "vN-<хэш>"
+  GET  /settings/{key}           {"key": ..., "value": ..., "version": N}
+  GET  /settings/history?key=&limit=
+  POST /settings/rollback        {"version": N}
+  GET  /health
+
+Запуск:
+  python settings_service.py     # порт SETTINGS_PORT (по умолчанию 8502)
+
+В n8n вместо Postgres-ноды: HTTP Request GET http://admin:8502/settings
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+
+import psycopg2
+import psycopg2.extensions
+from aiohttp import web
+
+import db
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "n8n_app_settings"
+SETTINGS_TOKEN = os.getenv("SETTINGS_TOKEN", "")
+SECRET_KEY = re.compile(r"(^|_)(key|token|secret|password)$")
+MASK = "••••••"
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS n8n_app_settings_history (
+    version    BIGSERIAL PRIMARY KEY,
+    key        TEXT NOT NULL,
+    value      TEXT,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS n8n_app_settings_history_key
+    ON n8n_app_settings_history (key, version DESC);
+
+CREATE OR REPLACE FUNCTION n8n_app_settings_audit() RETURNS trigger AS $$
+DECLARE
+    v BIGINT;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO n8n_app_settings_history (key, value) VALUES (OLD.key, NULL)
+        RETURNING version INTO v;
+    ELSE
+        IF TG_OP = 'UPDATE' AND NEW.value IS NOT DISTINCT FROM OLD.value THEN
+            RETURN NULL;
+        END IF;
+        INSERT INTO n8n_app_settings_history (key, value) VALUES (NEW.key, NEW.value)
+        RETURNING version INTO v;
+    END IF;
+    PERFORM pg_notify('n8n_app_settings', v::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS n8n_app_settings_audit ON n8n_app_settings;
+CREATE TRIGGER n8n_app_settings_audit
+    AFTER INSERT OR UPDATE OR DELETE ON n8n_app_settings
+    FOR EACH ROW EXECUTE FUNCTION n8n_app_settings_audit();
+
+INSERT INTO n8n_app_settings_history (key, value)
+SELECT key, value FROM n8n_app_settings
+WHERE NOT EXISTS (SELECT 1 FROM n8n_app_settings_history);
+"""
+
+
+# =========================================================================
+# РАБОТА С БАЗОЙ (используется и из app.py)
+# =========================================================================
+def ensure_schema(conn):
+    """История, триггер аудита + NOTIFY. Первая версия — текущее состояние таблицы."""
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+
+
+def load_versioned(conn) -> tuple:
+    """
+    (version, settings) одним запросом — значит, одним снимком: версия и
+    строки не расходятся, даже если между ними кто-то закоммитил.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            WITH v AS (SELECT COALESCE(MAX(version), 0) AS version FROM n8n_app_settings_history)
+            SELECT v.version, s.key, s.value FROM v LEFT JOIN n8n_app_settings s ON true;
+            """
+        )
+        rows = cur.fetchall()
+    return rows[0][0], {key: value for _, key, value in rows if key is not None}
+
+
+def history(conn, key: str = None, limit: int = 50) -> list:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT version, key, value, changed_at FROM n8n_app_settings_history "
+            "WHERE %(key)s IS NULL OR key = %(key)s ORDER BY version DESC LIMIT %(limit)s;",
+            {"key": key, "limit": limit},
+        )
+        return [
+            {"version": v, "key": k, "value": val, "changed_at": ts.isoformat()}
+            for v, k, val, ts in cur.fetchall()
+        ]
+
+
+def rollback(conn, version: int) -> int:
+    """
+    Вернуть все ключи к состоянию на версию version (в одной транзакции).
+    Сам откат тоже пишется в историю новыми версиями. Возвращает число изменённых ключей.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT DISTINCT ON (key) key, value FROM n8n_app_settings_history
+            WHERE version <= %s ORDER BY key, version DESC;
+            """,
+            (version,),
+        )
+        target = dict(cur.fetchall())
+        cur.execute("SELECT key, value FROM n8n_app_settings FOR UPDATE;")
+        current = dict(cur.fetchall())
+
+        changed = 0
+        for key, value in target.items():
+            if value is None:
+                continue
+            if current.get(key) != value:
+                cur.execute(
+                    "INSERT INTO n8n_app_settings (key, value) VALUES (%s, %s) "
+                    "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value;",
+                    (key, value),
+                )
+                changed += 1
+        for key in current:
+            if target.get(key) is None:
+                cur.execute("DELETE FROM n8n_app_settings WHERE key = %s;", (key,))
+                changed += 1
+    return changed
+
+
+def masked(key: str, value):
+    """Значение для ответа без токена: секрет скрыт, пустое остаётся пустым."""
+    return MASK if value and SECRET_KEY.search(key) else value
+
+
+# =========================================================================
+# КЭШ В ПАМЯТИ + LISTEN/NOTIFY
+# =========================================================================
+class SettingsCache:
+    def __init__(self, pool):
+        self.pool = pool
+        self.version = 0
+        self.settings = {}
+        self.body = b"{}"
+        self.masked_body = b"{}"
+        self._digest = ""
+        self._listen_conn = None
+        self._reload_lock = asyncio.Lock()
+
+    @property
+    def etag(self) -> str:
+        return f'"v{self.version}-{self._digest}"'
+
+    def _load(self):
+        with db.connection(self.pool) as conn:
+            return load_versioned(conn)
+
+    async def reload(self):
+        async with self._reload_lock:
+            version, settings = await asyncio.to_thread(self._load)
+            self.version, self.settings = version, settings
+            # Тело ответа сериализуем один раз на версию
+            self.body = json.dumps(
+                {"version": version, "settings": settings}, ensure_ascii=False
+            ).encode("utf-8")
+            self.masked_body = json.dumps(
+                {"version": version, "settings": {k: masked(k, v) for k, v in settings.items()}}, ensure_ascii=False
+            ).encode("utf-8")
+            # Версии BIGSERIAL коммитятся не по порядку: при той же max-версии
+            # содержимое может отличаться, поэтому ETag — версия плюс хэш тела
+            self._digest = hashlib.sha256(self.body).hexdigest()[:12]
+            logger.info("Настройки загружены, версия %s", version)
+
+    def _on_notify(self):
+        try:
+            self._listen_conn.poll()
+        except psycopg2.Error as e:
+            logger.error("LISTEN соединение потеряно: %s", e)
+            asyncio.get_running_loop().remove_reader(self._listen_conn.fileno())
+            asyncio.ensure_future(self.listen())
+            return
+        notifies = self._listen_conn.notifies
+        if not notifies:
+            return
+        # Перечитываем на каждую пачку уведомлений, а не только при версии выше
+        # текущей: транзакция с меньшей версией могла закоммититься позже
+        notifies.clear()
+        asyncio.ensure_future(self.reload())
+
+    async def listen(self):
+        """Отдельное autocommit-соединение под LISTEN, с переподключением."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                conn = await asyncio.to_thread(psycopg2.connect, **db.DB_CONFIG)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                self._listen_conn = conn
+                loop.add_reader(conn.fileno(), self._on_notify)
+                # Пока не слушали — могли пропустить изменения
+                await self.reload()
+                logger.info("LISTEN %s", NOTIFY_CHANNEL)
+                return
+            except psycopg2.Error as e:
+                logger.error("Не удалось подписаться на %s: %s", NOTIFY_CHANNEL, e)
+                await asyncio.sleep(5)
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+def _not_modified(request: web.Request, cache: SettingsCache) -> bool:
+    return request.headers.get("If-None-Match") == cache.etag
+
+
+def _headers(cache: SettingsCache) -> dict:
+    return {"ETag": cache.etag, "X-Settings-Version": str(cache.version), "Vary": "Authorization"}
+
+
+def _authorized(request: web.Request) -> bool:
+    """Запрос с SETTINGS_TOKEN — ему можно видеть секреты."""
+    header = request.headers.get("Authorization", "")
+    return bool(SETTINGS_TOKEN) and hmac.compare_digest(header, f"Bearer {SETTINGS_TOKEN}")
+
+
+async def get_settings(request: web.Request) -> web.Response:
+    cache = request.app["cache"]
+    if _not_modified(request, cache):
+        return web.Response(status=304, headers=_headers(cache))
+    body = cache.body if _authorized(request) else cache.masked_body
+    return web.Response(body=body, content_type="application/json", headers=_headers(cache))
+
+
+async def get_setting(request: web.Request) -> web.Response:
+    cache = request.app["cache"]
+    key = request.match_info["key"]
+    if key not in cache.settings:
+        raise web.HTTPNotFound(text=f"Нет настройки {key}")
+    if _not_modified(request, cache):
+        return web.Response(status=304, headers=_headers(cache))
+    value = cache.settings[key] if _authorized(request) else masked(key, cache.settings[key])
+    return web.json_response({"key": key, "value": value, "version": cache.version}, headers=_headers(cache))
+
+
+async def get_history(request: web.Request) -> web.Response:
+    key = request.query.get("key")
+    limit = int(request.query.get("limit", "50"))
+
+    def _history():
+        with db.connection(request.app["pool"]) as conn:
+            return history(conn, key, limit)
+
+    rows = await asyncio.to_thread(_history)
+    if not _authorized(request):
+        rows = [{**row, "value": masked(row["key"], row["value"])} for row in rows]
+    return web.json_response(rows)
+
+
+async def post_rollback(request: web.Request) -> web.Response:
+    if SETTINGS_TOKEN and not _authorized(request):
+        raise web.HTTPUnauthorized(text="Нужен Authorization: Bearer SETTINGS_TOKEN")
+    data = await request.json()
+    version = int(data["version"])
+
+    def _rollback():
+        with db.connection(request.app["pool"]) as conn:
+            return rollback(conn, version)
+
+    changed = await asyncio.to_thread(_rollback)
+    cache = request.app["cache"]
+    await cache.reload()
+    logger.warning("Откат настроек к версии %s: изменено ключей %s", version, changed)
+    return web.json_response({"rolled_back_to": version, "changed": changed, "version": cache.version})
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"ok": True, "version": request.app["cache"].version})
+
+
+async def _on_startup(app: web.Application):
+    pool = app["pool"]
+    with db.connection(pool) as conn:
+        ensure_schema(conn)
+    await app["cache"].listen()
+
+
+def create_app(pool=None) -> web.Application:
+    pool = pool or db.create_pool()
+    app = web.Application()
+    app["pool"] = pool
+    app["cache"] = SettingsCache(pool)
+    app.router.add_get("/settings", get_settings)
+    app.router.add_get("/settings/history", get_history)
+    app.router.add_post("/settings/rollback", post_rollback)
+    app.router.add_get("/settings/{key}", get_setting)
+    app.router.add_get("/health", health)
+    app.on_startup.append(_on_startup)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("SETTINGS_PORT", "8502")))
+
+
+if __name__ == "__main__":
+    main()
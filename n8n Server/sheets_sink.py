@@ -0,0 +1,389 @@
+"""
+Буферизованная запись строк в Google Sheets вместо "Google Sheets: Отчёт РОПу".
+
+Строки принимаются по локальному HTTP и копятся в буфере. Сброс — одним
+запросом values.append на диапазон, когда набралось SHEETS_FLUSH_ROWS
+строк или прошло SHEETS_FLUSH_SECONDS. На 429/5xx (квота, перегрузка)
+строки остаются в буфере, следующий сброс — с экспоненциальной паузой
+(SHEETS_RETRY_BASE .. SHEETS_RETRY_MAX, с разбросом).
+
+Каждая принятая строка сразу пишется в журнал на диске (SHEETS_JOURNAL,
+JSONL, fsync), после успешной записи в таблицу — отметка ack. При
+старте неподтверждённые строки поднимаются из журнала, поэтому рестарт
+или падение не теряют отчёт. Журнал сжимается, когда всё подтверждено.
+Строки, которые Sheets отверг (400), уходят в <журнал>.failed.
+
+Доступ: GOOGLE_CLIENT_ID / GOOGLE_CLIENT_SECRET / GOOGLE_REFRESH_TOKEN
+(OAuth2, как у credentials n8n) или готовый SHEETS_ACCESS_TOKEN.
+
+Эндпоинты:
+  POST /report   {<JSON "Распарсить JSON1">, "filename"?, "audio_url"?} -> строка листа Report
+  POST /rows     {"range": "Лист!A:Z"?, "spreadsheet_id"?, "values": [[...], ...]}
+  POST /flush    сбросить сейчас
+  GET  /stats
+  GET  /health
+
+Запуск:
+  python sheets_sink.py          # порт SHEETS_PORT (по умолчанию 8509)
+
+Проверка без Google: python stubs.py sheets и SHEETS_API_URL=http://localhost:8605
+SHEETS_ACCESS_TOKEN=test.
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+logger = logging.getLogger(__name__)
+
+SHEETS_API_URL = os.getenv("SHEETS_API_URL", "https://sheets.googleapis.com").rstrip("/")
+TOKEN_URL = os.getenv("GOOGLE_TOKEN_URL", "https://oauth2.googleapis.com/token")
+SPREADSHEET_ID = os.getenv("SHEETS_SPREADSHEET_ID", "1_HdTtGBpYEsiRE-F5flPBo3RW9iwChHS4iX2F-x4rMU")
+REPORT_RANGE = os.getenv("SHEETS_REPORT_RANGE", "Report!A:L")
+REPORT_TIMEZONE = os.getenv("SHEETS_TIMEZONE", "Asia/Dubai")
+FLUSH_ROWS = int(os.getenv("SHEETS_FLUSH_ROWS", "50"))
+FLUSH_SECONDS = float(os.getenv("SHEETS_FLUSH_SECONDS", "10"))
+MAX_BATCH = int(os.getenv("SHEETS_MAX_BATCH", "1000"))
+RETRY_BASE = float(os.getenv("SHEETS_RETRY_BASE", "2"))
+RETRY_MAX = float(os.getenv("SHEETS_RETRY_MAX", "120"))
+JOURNAL_PATH = os.getenv("SHEETS_JOURNAL", "sheets_journal.jsonl")
+COMPACT_ACKS = 500
+
+# Порядок колонок листа Report (как в ноде "Google Sheets: Отчёт РОПу")
+REPORT_COLUMNS = (
+    "Date", "Manager_name", "Filename", "Score", "Client_intent", "Outcome",
+    "Next_step", "Summary", "Good_points", "Bad_Points", "Advice", "Link",
+)
+
+
+class SheetsError(Exception):
+    def __init__(self, message: str, retryable: bool = True, retry_after: float = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def report_row(analysis: dict, filename: str = "", audio_url: str = "", now: datetime = None) -> list:
+    now = now or datetime.now(ZoneInfo(REPORT_TIMEZONE))
+    values = {
+        "Date": now.strftime("%d.%m.%Y %H:%M"),
+        "Manager_name": analysis.get("manager_name", ""),
+        "Filename": (filename or "").strip(),
+        "Score": analysis.get("manager_score") if analysis.get("manager_score") is not None else "",
+        "Client_intent": analysis.get("client_intent", ""),
+        "Outcome": analysis.get("outcome", ""),
+        "Next_step": analysis.get("next_step", ""),
+        "Summary": analysis.get("summary", ""),
+        "Good_points": analysis.get("good_points", ""),
+        "Bad_Points": analysis.get("bad_points", ""),
+        "Advice": analysis.get("advice", ""),
+        "Link": audio_url or "",
+    }
+    return [values[column] for column in REPORT_COLUMNS]
+
+
+# =========================================================================
+# ЖУРНАЛ
+# =========================================================================
+class Journal:
+    """
+    JSONL: {"seq", "target", "values"} — принятая строка, {"ack": [seq, ...]} —
+    записана в таблицу. target — [spreadsheet_id, range].
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self.acks = 0
+
+    def load(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        pending, acked = {}, set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # недописанная строка при падении
+                if "ack" in entry:
+                    acked.update(entry["ack"])
+                else:
+                    pending[entry["seq"]] = entry
+        return [entry for seq, entry in sorted(pending.items()) if seq not in acked]
+
+    def _append(self, lines: list):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write(self, entries: list):
+        self._append(entries)
+
+    def ack(self, seqs: list):
+        self._append([{"ack": seqs}])
+        self.acks += 1
+
+    def compact(self, pending: list):
+        """Переписать журнал только с неподтверждёнными строками (атомарно)."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in pending)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.acks = 0
+
+    def reject(self, entries: list, reason: str):
+        with open(self.path + ".failed", "a", encoding="utf-8") as f:
+            f.writelines(json.dumps({**entry, "error": reason}, ensure_ascii=False) + "\n" for entry in entries)
+
+
+# =========================================================================
+# SHEETS API
+# =========================================================================
+class GoogleToken:
+    """access_token по refresh_token (OAuth2), обновляется за минуту до истечения."""
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self.session = session
+        self.token = os.getenv("SHEETS_ACCESS_TOKEN", "")
+        self.expires_at = float("inf") if self.token else 0.0
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        if os.getenv("GOOGLE_REFRESH_TOKEN"):
+            self.expires_at = 0.0
+
+    async def get(self) -> str:
+        async with self._lock:
+            if time.monotonic() < self.expires_at - 60:
+                return self.token
+            form = {
+                "client_id": os.getenv("GOOGLE_CLIENT_ID", ""),
+                "client_secret": os.getenv("GOOGLE_CLIENT_SECRET", ""),
+                "refresh_token": os.getenv("GOOGLE_REFRESH_TOKEN", ""),
+                "grant_type": "refresh_token",
+            }
+            try:
+                async with self.session.post(TOKEN_URL, data=form) as resp:
+                    data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise SheetsError(f"token: {type(e).__name__}: {e}") from e
+            if "access_token" not in data:
+                raise SheetsError(f"token: HTTP {resp.status} {data}", retryable=resp.status >= 500)
+            self.token = data["access_token"]
+            self.expires_at = time.monotonic() + float(data.get("expires_in", 3600))
+            return self.token
+
+
+async def append_values(session: aiohttp.ClientSession, token: GoogleToken, spreadsheet_id: str,
+                        range_: str, values: list) -> dict:
+    """Один values.append на все строки."""
+    url = URL(
+        f"{SHEETS_API_URL}/v4/spreadsheets/{spreadsheet_id}/values/{quote(range_, safe='')}:append"
+        "?valueInputOption=USER_ENTERED&insertDataOption=INSERT_ROWS",
+        encoded=True,
+    )
+    body = {"majorDimension": "ROWS", "values": values}
+    try:
+        async with session.post(url, json=body, headers={"Authorization": f"Bearer {await token.get()}"}) as resp:
+            data = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        raise SheetsError(f"{type(e).__name__}: {e}") from e
+    if resp.status < 400:
+        return data
+    message = (data or {}).get("error", {}).get("message", "") if isinstance(data, dict) else str(data)
+    if resp.status == 401:
+        token.invalidate()
+        raise SheetsError(f"HTTP 401: {message}")
+    retry_after = resp.headers.get("Retry-After")
+    raise SheetsError(
+        f"HTTP {resp.status}: {message}",
+        retryable=resp.status in (408, 429) or resp.status >= 500,
+        retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+    )
+
+
+# =========================================================================
+# БУФЕР
+# =========================================================================
+class SheetsSink:
+    """Копит строки по диапазонам и пишет их одним values.append по размеру или по таймеру."""
+
+    def __init__(self, session: aiohttp.ClientSession, journal: Journal,
+                 flush_rows: int = FLUSH_ROWS, flush_seconds: float = FLUSH_SECONDS):
+        self.session = session
+        self.token = GoogleToken(session)
+        self.journal = journal
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.buffers = collections.OrderedDict()  # (spreadsheet_id, range) -> [entry]
+        self.seq = 0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.stats = collections.Counter()
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def buffered(self) -> int:
+        return sum(len(rows) for rows in self.buffers.values())
+
+    def restore(self):
+        entries = self.journal.load()
+        for entry in entries:
+            self.buffers.setdefault(tuple(entry["target"]), []).append(entry)
+            self.seq = max(self.seq, entry["seq"])
+        if entries:
+            logger.info("Из журнала восстановлено строк: %d", len(entries))
+        self.journal.compact(entries)
+
+    def add(self, spreadsheet_id: str, range_: str, rows: list):
+        entries = []
+        for values in rows:
+            self.seq += 1
+            entries.append({"seq": self.seq, "target": [spreadsheet_id, range_], "values": values})
+        self.journal.write(entries)
+        self.buffers.setdefault((spreadsheet_id, range_), []).extend(entries)
+        self.stats["accepted"] += len(entries)
+        if self.buffered >= self.flush_rows:
+            self._full.set()
+
+    def _backoff(self, error: SheetsError) -> float:
+        self.failures += 1
+        delay = min(RETRY_MAX, RETRY_BASE * 2 ** (self.failures - 1))
+        delay = random.uniform(delay / 2, delay)
+        return max(delay, error.retry_after or 0.0)
+
+    async def flush(self, force: bool = False):
+        async with self._flush_lock:
+            if not force and time.monotonic() < self.retry_at:
+                return
+            self._full.clear()
+            for target in list(self.buffers):
+                entries = self.buffers[target][:MAX_BATCH]
+                if not entries:
+                    continue
+                spreadsheet_id, range_ = target
+                try:
+                    await append_values(self.session, self.token, spreadsheet_id, range_, [e["values"] for e in entries])
+                except SheetsError as e:
+                    if e.retryable:
+                        delay = self._backoff(e)
+                        self.retry_at = time.monotonic() + delay
+                        self.stats["retries"] += 1
+                        logger.warning("Sheets: %s, %d строк ждут, повтор через %.0f с", e, self.buffered, delay)
+                        return
+                    # Отвергнутое Sheets не повторяем, чтобы не держать остальные строки
+                    logger.error("Sheets отверг %d строк (%s): %s", len(entries), range_, e)
+                    self.journal.reject(entries, str(e))
+                    self.stats["rejected"] += len(entries)
+                else:
+                    self.stats["written"] += len(entries)
+                    self.stats["requests"] += 1
+                    logger.info("В Sheets записано строк: %d (%s)", len(entries), range_)
+                del self.buffers[target][:len(entries)]
+                if not self.buffers[target]:
+                    del self.buffers[target]
+                self.journal.ack([e["seq"] for e in entries])
+                self.failures = 0
+                self.retry_at = 0.0
+            if not self.buffers or self.journal.acks >= COMPACT_ACKS:
+                self.journal.compact([e for rows in self.buffers.values() for e in rows])
+            if self.buffered >= self.flush_rows:
+                self._full.set()  # осталось больше MAX_BATCH — сразу следующий сброс
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            wait = self.retry_at - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.flush()
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def post_report(request: web.Request) -> web.Response:
+    data = await request.json()
+    items = data if isinstance(data, list) else [data]
+    rows = [report_row(item, item.get("filename", ""), item.get("audio_url", "")) for item in items]
+    request.app["sink"].add(SPREADSHEET_ID, REPORT_RANGE, rows)
+    return web.json_response({"buffered": len(rows)}, status=202)
+
+
+async def post_rows(request: web.Request) -> web.Response:
+    data = await request.json()
+    values = data.get("values")
+    if not isinstance(values, list) or not all(isinstance(row, list) for row in values):
+        raise web.HTTPBadRequest(text="values — список строк (списков)")
+    request.app["sink"].add(data.get("spreadsheet_id") or SPREADSHEET_ID, data.get("range") or REPORT_RANGE, values)
+    return web.json_response({"buffered": len(values)}, status=202)
+
+
+async def post_flush(request: web.Request) -> web.Response:
+    sink = request.app["sink"]
+    await sink.flush(force=True)
+    return web.json_response({"buffered": sink.buffered})
+
+
+async def get_stats(request: web.Request) -> web.Response:
+    sink = request.app["sink"]
+    return web.json_response({
+        **sink.stats,
+        "buffered": sink.buffered,
+        "retry_in": round(max(0.0, sink.retry_at - time.monotonic()), 1),
+    })
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"ok": True, "buffered": request.app["sink"].buffered})
+
+
+async def _background(app: web.Application):
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+    sink = SheetsSink(session, Journal())
+    sink.restore()
+    app["sink"] = sink
+    task = asyncio.create_task(sink.run())
+    yield
+    task.cancel()
+    # Не терять то, что ещё в буфере: не получилось — останется в журнале
+    await sink.flush(force=True)
+    await session.close()
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post("/report", post_report)
+    app.router.add_post("/rows", post_rows)
+    app.router.add_post("/flush", post_flush)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("SHEETS_PORT", "8509")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+Перцентили для отчётов о задержках (load_test.py, execution_profiler.py).
+
+Ближайший ранг без интерполяции: p95 — реальное значение из выборки,
+как в отчётах n8n и Grafana, а не точка между двумя замерами.
+"""
+
+
+def percentile(values: list, q: float):
+    """q-й перцентиль (0..100) списка чисел; пустой список — None."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
@@ -0,0 +1,687 @@
+"""
+Локальные заглушки внешних API для проверки сервисов без сети и ключей.
+
+  python stubs.py assemblyai --port 8601 --delay 5 --error-rate 0.05
+
+assemblyai — /v2/upload принимает поток (chunked) и отдаёт upload_url;
+/v2/transcript: задача "обрабатывается" ~delay секунд (±50%),
+затем completed (или error с вероятностью error-rate). Если при отправке
+указан webhook_url — по готовности шлёт колбэк, как настоящий AssemblyAI.
+Ответ — в формате AssemblyAI: text, utterances (speaker A/B), words, audio_duration.
+
+  python stubs.py gemini --port 8602 --delay 1
+
+gemini — /v1beta/models/{model}:streamGenerateContent?alt=sse: ответ
+частями (SSE), время ~ delay + 0.2 с на 1000 входных токенов. Для
+фрагментов map отдаёт факты, для итогового запроса — анализ звонка.
+
+  python stubs.py ollama --port 8603 --delay 3
+
+ollama — /api/chat (NDJSON-поток, как Ollama со stream=true), те же
+ответы, что у gemini; время ~ delay + 0.5 с на 1000 входных токенов.
+/api/embed — векторы из хэшей основ слов (256 измерений): тексты с общими
+словами близки, для проверки call_search.py; ~delay/100 с на текст.
+
+  python stubs.py telegram --port 8604 --delay 0.1
+
+telegram — /bot{token}/sendMessage с проверками Bot API: длина до 4096,
+разбор HTML/MarkdownV2 ("can't parse entities"), не чаще раза в секунду
+в чат (в группу — 20 в минуту) и 30 в секунду всего, иначе 429 с
+retry_after. Принятые сообщения — GET /messages.
+
+  python stubs.py sheets --port 8605 --delay 0.3 --error-rate 0.1
+
+sheets — values.append Google Sheets API v4: квота --quota запросов на
+запись в минуту (сверх — 429 RESOURCE_EXHAUSTED), с вероятностью
+error-rate — 503. Строки копятся в памяти: GET .../values/{range}.
+/token выдаёт access_token для проверки OAuth refresh.
+
+  python stubs.py amocrm --port 8606 --delay 0.05 --error-rate 0.05
+
+amocrm — API v4 (сделки, связи, примечания пачкой до 250), drive-b
+/v1.0/files/{uuid} и /oauth2/access_token с одноразовым refresh_token.
+Файл — mp3 32 кбит/с (/download/{uuid}/call.mp3, с Range) длительностью
+из POST /durations {uuid: секунды}, по умолчанию 120 с.
+Больше 7 запросов в секунду к API — 429, с вероятностью error-rate — 503.
+Токен "test" принимается всегда. /stats считает и TCP-соединения
+(проверка keep-alive).
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import random
+import re
+import time
+import uuid
+import zlib
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PHRASES = [
+    "Здравствуйте, компания, меня зовут Анна, чем могу помочь?",
+    "Добрый день, я хотел узнать про стоимость доставки.",
+    "Подскажите, на какой объём вы рассчитываете?",
+    "Примерно две тонны в месяц, нужен договор.",
+    "Хорошо, я подготовлю предложение и пришлю его сегодня.",
+    "Спасибо, буду ждать, до свидания.",
+]
+
+
+# =========================================================================
+# ASSEMBLYAI
+# =========================================================================
+def fake_transcript(transcript_id: str, options: dict) -> dict:
+    utterances, words = [], []
+    start = 0
+    for i in range(random.randint(4, 30)):
+        text = random.choice(PHRASES)
+        speaker = "AB"[i % 2]
+        utt_words = []
+        for word in text.split():
+            end = start + random.randint(200, 600)
+            utt_words.append({"text": word, "start": start, "end": end, "confidence": 0.95, "speaker": speaker})
+            start = end
+        utterances.append({
+            "speaker": speaker, "text": text, "confidence": 0.95,
+            "start": utt_words[0]["start"], "end": utt_words[-1]["end"], "words": utt_words,
+        })
+        words.extend(utt_words)
+        start += random.randint(300, 1500)
+    return {
+        "id": transcript_id,
+        "status": "completed",
+        "audio_url": options.get("audio_url"),
+        "language_code": options.get("language_code", "ru"),
+        "text": " ".join(u["text"] for u in utterances),
+        "utterances": utterances if options.get("speaker_labels") else None,
+        "words": words,
+        "audio_duration": round(start / 1000),
+        "confidence": 0.95,
+        "error": None,
+    }
+
+
+class AssemblyAIStub:
+    def __init__(self, delay: float, error_rate: float):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.jobs = {}
+        self.submitted = 0
+        self.polls = 0
+        self.uploaded_bytes = 0
+
+    async def _finish(self, app: web.Application, transcript_id: str, options: dict):
+        await asyncio.sleep(self.delay * random.uniform(0.5, 1.5))
+        job = self.jobs[transcript_id]
+        if random.random() < self.error_rate:
+            job.update(status="error", error="Stub: transcoding failed")
+        else:
+            job.update(fake_transcript(transcript_id, options))
+        if options.get("webhook_url"):
+            headers = {}
+            if options.get("webhook_auth_header_name"):
+                headers[options["webhook_auth_header_name"]] = options.get("webhook_auth_header_value", "")
+            try:
+                async with app["session"].post(
+                    options["webhook_url"], json={"transcript_id": transcript_id, "status": job["status"]},
+                    headers=headers,
+                ) as resp:
+                    logger.info("webhook %s -> %s", transcript_id, resp.status)
+            except aiohttp.ClientError as e:
+                logger.warning("webhook %s: %s", transcript_id, e)
+
+    async def submit(self, request: web.Request) -> web.Response:
+        options = await request.json()
+        if not options.get("audio_url"):
+            return web.json_response({"error": "audio_url is required"}, status=400)
+        transcript_id = uuid.uuid4().hex
+        self.jobs[transcript_id] = {"id": transcript_id, "status": "queued", "created": time.time()}
+        self.submitted += 1
+        asyncio.create_task(self._finish(request.app, transcript_id, options))
+        return web.json_response(self.jobs[transcript_id])
+
+    async def upload(self, request: web.Request) -> web.Response:
+        size = 0
+        async for chunk in request.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+        self.uploaded_bytes += size
+        upload_id = uuid.uuid4().hex
+        logger.info("upload %s: %d байт", upload_id, size)
+        return web.json_response({"upload_url": f"https://cdn.assemblyai.stub/upload/{upload_id}"})
+
+    async def get(self, request: web.Request) -> web.Response:
+        job = self.jobs.get(request.match_info["id"])
+        if job is None:
+            return web.json_response({"error": "Transcript not found"}, status=404)
+        self.polls += 1
+        if job["status"] == "queued":
+            job["status"] = "processing"
+        return web.json_response(job)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"submitted": self.submitted, "polls": self.polls, "uploaded_bytes": self.uploaded_bytes})
+
+
+def create_assemblyai_app(delay: float = 5, error_rate: float = 0.0) -> web.Application:
+    stub = AssemblyAIStub(delay, error_rate)
+    app = web.Application()
+    app["stub"] = stub
+    app.router.add_post("/v2/upload", stub.upload)
+    app.router.add_post("/v2/transcript", stub.submit)
+    app.router.add_get("/v2/transcript/{id}", stub.get)
+    app.router.add_get("/stats", stub.stats)
+    app.cleanup_ctx.append(_session)
+    return app
+
+
+# =========================================================================
+# GEMINI
+# =========================================================================
+STUB_FINDINGS = {
+    "roles": "A — менеджер, B — клиент",
+    "manager_name": "Анна",
+    "client_needs": ["доставка две тонны в месяц"],
+    "objections": [],
+    "strengths": ["выявила объём"],
+    "mistakes": ["не назвала цену"],
+    "agreements": ["пришлёт предложение сегодня"],
+    "stage": "выявление потребностей",
+}
+
+STUB_ANALYSIS = {
+    "manager_name": "Анна",
+    "manager_score": 7,
+    "client_intent": "Узнать стоимость доставки",
+    "outcome": "Думает",
+    "good_points": "Выявила объём, зафиксировала шаг",
+    "bad_points": "Не назвала цену",
+    "advice": "Называть вилку цены в первом звонке",
+    "next_step": "Отправить предложение сегодня",
+    "summary": "Клиент интересуется доставкой двух тонн в месяц, ждёт предложение.",
+}
+
+
+def stub_answer(system: str) -> str:
+    answer = STUB_FINDINGS if ("ФРАГМЕНТ" in system or "Объедини" in system) else STUB_ANALYSIS
+    return json.dumps(answer, ensure_ascii=False)
+
+
+class GeminiStub:
+    def __init__(self, delay: float, error_rate: float):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.requests = 0
+        self.input_chars = 0
+
+    async def stream(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        if random.random() < self.error_rate:
+            return web.json_response({"error": {"code": 503, "message": "Stub: overloaded"}}, status=503)
+        system = "".join(p.get("text", "") for p in body.get("systemInstruction", {}).get("parts", []))
+        user = "".join(p.get("text", "") for c in body.get("contents", []) for p in c.get("parts", []))
+        self.input_chars += len(system) + len(user)
+        text = stub_answer(system)
+
+        await asyncio.sleep(self.delay + 0.2 * (len(system) + len(user)) / 3500)
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        step = max(1, len(text) // 4)
+        for i in range(0, len(text), step):
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text[i:i + step]}]}}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+            await asyncio.sleep(0.05)
+        await resp.write_eof()
+        return resp
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "input_chars": self.input_chars})
+
+
+def create_gemini_app(delay: float = 1, error_rate: float = 0.0) -> web.Application:
+    stub = GeminiStub(delay, error_rate)
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app["stub"] = stub
+    app.router.add_post("/v1beta/models/{model}:streamGenerateContent", stub.stream)
+    app.router.add_get("/stats", stub.stats)
+    return app
+
+
+# =========================================================================
+# OLLAMA
+# =========================================================================
+EMBED_DIM = 256
+
+
+class OllamaStub:
+    def __init__(self, delay: float, error_rate: float):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.requests = 0
+        self.input_chars = 0
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        if random.random() < self.error_rate:
+            return web.json_response({"error": "Stub: model is loading"}, status=500)
+        messages = body.get("messages", [])
+        system = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user = "".join(m.get("content", "") for m in messages if m.get("role") != "system")
+        self.input_chars += len(system) + len(user)
+        text = stub_answer(system)
+
+        await asyncio.sleep(self.delay + 0.5 * (len(system) + len(user)) / 3500)
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        step = max(1, len(text) // 8)
+        for i in range(0, len(text), step):
+            chunk = {"model": body.get("model"), "message": {"role": "assistant", "content": text[i:i + step]}, "done": False}
+            await resp.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+            await asyncio.sleep(0.05)
+        await resp.write((json.dumps({"model": body.get("model"), "done": True}) + "\n").encode("utf-8"))
+        await resp.write_eof()
+        return resp
+
+    async def embed(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests += 1
+        if random.random() < self.error_rate:
+            return web.json_response({"error": "Stub: model is loading"}, status=500)
+        inputs = body.get("input") or []
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self.input_chars += sum(len(text) for text in inputs)
+        await asyncio.sleep(self.delay / 100 * len(inputs))
+        embeddings = []
+        for text in inputs:
+            vector = [0.0] * EMBED_DIM
+            for word in re.findall(r"\w+", text.lower()):
+                vector[zlib.crc32(word[:5].encode("utf-8")) % EMBED_DIM] += 1.0
+            embeddings.append(vector)
+        return web.json_response({"model": body.get("model"), "embeddings": embeddings})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "input_chars": self.input_chars})
+
+
+def create_ollama_app(delay: float = 3, error_rate: float = 0.0) -> web.Application:
+    stub = OllamaStub(delay, error_rate)
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app["stub"] = stub
+    app.router.add_post("/api/chat", stub.chat)
+    app.router.add_post("/api/embed", stub.embed)
+    app.router.add_get("/stats", stub.stats)
+    return app
+
+
+# =========================================================================
+# TELEGRAM
+# =========================================================================
+TELEGRAM_HTML_TAGS = {"b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "a", "code", "pre", "tg-spoiler", "blockquote", "span"}
+
+
+def telegram_parse_error(text: str, parse_mode: str):
+    """Примерно как Bot API: описание ошибки разбора разметки или None."""
+    if parse_mode == "HTML":
+        stack = []
+        for match in re.finditer(r"<(/?)([\w-]+)[^>]*>|&(#?\w+);|[<&]", text):
+            closing, tag, entity = match.group(1), match.group(2), match.group(3)
+            if tag:
+                if tag not in TELEGRAM_HTML_TAGS:
+                    return f"Unsupported start tag \"{tag}\" at byte offset {match.start()}"
+                if not closing:
+                    stack.append(tag)
+                elif not stack or stack.pop() != tag:
+                    return f"Can't find end tag corresponding to start tag at byte offset {match.start()}"
+            elif entity is None:
+                return f"Unexpected character at byte offset {match.start()}"
+        if stack:
+            return f"Can't find end tag corresponding to start tag \"{stack[-1]}\""
+    elif parse_mode == "MarkdownV2":
+        stack = []
+        for match in re.finditer(r"\\.|\|\||__|[*_~`]|[\[\]()>#+\-=|{}.!]", text, re.S):
+            token = match.group()
+            if token.startswith("\\"):
+                continue
+            if token in ("||", "__", "*", "_", "~", "`"):
+                if stack and stack[-1] == token:
+                    stack.pop()
+                else:
+                    stack.append(token)
+            else:
+                return f"Character '{token}' is reserved and must be escaped with the preceding '\\'"
+        if stack:
+            return f"Can't find end of the entity starting at byte offset {text.rfind(stack[-1])}"
+    return None
+
+
+class TelegramStub:
+    def __init__(self, delay: float, error_rate: float):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.messages = []
+        self.last_sent = {}
+        self.recent = collections.deque()
+        self.counters = collections.Counter()
+
+    def _retry_after(self, chat_id: str) -> float:
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 1:
+            self.recent.popleft()
+        if len(self.recent) >= 30:
+            return 1.0
+        interval = 3.0 if chat_id.startswith("-") else 1.0
+        elapsed = now - self.last_sent.get(chat_id, float("-inf"))
+        return interval - elapsed if elapsed < interval else 0.0
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self.delay)
+        chat_id, text, parse_mode = str(body.get("chat_id", "")), body.get("text") or "", body.get("parse_mode")
+        if random.random() < self.error_rate:
+            self.counters["errors"] += 1
+            return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+        retry_after = self._retry_after(chat_id)
+        if retry_after > 0:
+            self.counters["rate_limited"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after:.0f}",
+                "parameters": {"retry_after": max(1, round(retry_after))},
+            }, status=429)
+        error = None
+        if len(text) > 4096:
+            error = "Bad Request: message is too long"
+        elif parse_mode:
+            parse_error = telegram_parse_error(text, parse_mode)
+            error = parse_error and f"Bad Request: can't parse entities: {parse_error}"
+        if error:
+            self.counters["bad_request"] += 1
+            return web.json_response({"ok": False, "error_code": 400, "description": error}, status=400)
+        now = time.monotonic()
+        self.last_sent[chat_id] = now
+        self.recent.append(now)
+        self.messages.append({"chat_id": chat_id, "parse_mode": parse_mode, "text": text, "at": time.time()})
+        self.counters["sent"] += 1
+        return web.json_response({"ok": True, "result": {"message_id": len(self.messages), "chat": {"id": chat_id}}})
+
+    async def get_messages(self, request: web.Request) -> web.Response:
+        return web.json_response(self.messages)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            **self.counters,
+            "max_length": max((len(m["text"]) for m in self.messages), default=0),
+        })
+
+
+def create_telegram_app(delay: float = 0.1, error_rate: float = 0.0) -> web.Application:
+    stub = TelegramStub(delay, error_rate)
+    app = web.Application()
+    app["stub"] = stub
+    app.router.add_post("/bot{token}/sendMessage", stub.send_message)
+    app.router.add_get("/messages", stub.get_messages)
+    app.router.add_get("/stats", stub.stats)
+    return app
+
+
+# =========================================================================
+# GOOGLE SHEETS
+# =========================================================================
+class SheetsStub:
+    def __init__(self, delay: float, error_rate: float, quota: int = 60):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.quota = quota
+        self.writes = collections.deque()
+        self.sheets = collections.defaultdict(list)
+        self.counters = collections.Counter()
+
+    async def append(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self.delay)
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"error": {"code": 401, "message": "Request is missing required authentication credential.", "status": "UNAUTHENTICATED"}}, status=401)
+        now = time.monotonic()
+        while self.writes and now - self.writes[0] > 60:
+            self.writes.popleft()
+        if len(self.writes) >= self.quota:
+            self.counters["quota_exceeded"] += 1
+            return web.json_response({"error": {
+                "code": 429, "status": "RESOURCE_EXHAUSTED",
+                "message": "Quota exceeded for quota metric 'Write requests' and limit 'Write requests per minute per user'",
+            }}, status=429)
+        if random.random() < self.error_rate:
+            self.counters["errors"] += 1
+            return web.json_response({"error": {"code": 503, "message": "The service is currently unavailable.", "status": "UNAVAILABLE"}}, status=503)
+        values = body.get("values")
+        if not isinstance(values, list) or not all(isinstance(row, list) for row in values):
+            return web.json_response({"error": {"code": 400, "message": "Invalid values", "status": "INVALID_ARGUMENT"}}, status=400)
+        self.writes.append(now)
+        range_ = request.match_info["range"]
+        rows = self.sheets[range_.split("!")[0]]
+        start = len(rows) + 1
+        rows.extend(values)
+        self.counters["requests"] += 1
+        self.counters["rows"] += len(values)
+        return web.json_response({
+            "spreadsheetId": request.match_info["id"],
+            "updates": {"updatedRange": f"{range_.split('!')[0]}!A{start}:A{len(rows)}", "updatedRows": len(values)},
+        })
+
+    async def get_values(self, request: web.Request) -> web.Response:
+        range_ = request.match_info["range"]
+        return web.json_response({"range": range_, "majorDimension": "ROWS", "values": self.sheets.get(range_.split("!")[0], [])})
+
+    async def token(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        if not form.get("refresh_token"):
+            return web.json_response({"error": "invalid_grant"}, status=400)
+        self.counters["tokens"] += 1
+        return web.json_response({"access_token": uuid.uuid4().hex, "expires_in": 3599, "token_type": "Bearer"})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.counters, "sheets": {name: len(rows) for name, rows in self.sheets.items()}})
+
+
+def create_sheets_app(delay: float = 0.3, error_rate: float = 0.0, quota: int = 60) -> web.Application:
+    stub = SheetsStub(delay, error_rate, quota)
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app["stub"] = stub
+    app.router.add_post("/v4/spreadsheets/{id}/values/{range}:append", stub.append)
+    app.router.add_get("/v4/spreadsheets/{id}/values/{range}", stub.get_values)
+    app.router.add_post("/token", stub.token)
+    app.router.add_get("/stats", stub.stats)
+    return app
+
+
+# =========================================================================
+# AMOCRM
+# =========================================================================
+class AmoCRMStub:
+    RPS = 7
+
+    def __init__(self, delay: float, error_rate: float):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.recent = collections.deque()
+        self.tokens = {"test"}
+        self.refresh_tokens = {"refresh-test"}
+        self.notes = []
+        self.connections = set()
+        self.counters = collections.Counter()
+        self.durations = {}
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        self.connections.add(request.transport.get_extra_info("peername") if request.transport else None)
+        self.counters["requests"] += 1
+        await asyncio.sleep(self.delay)
+        if request.path in ("/oauth2/access_token", "/stats", "/durations"):
+            return await handler(request)
+        if request.headers.get("Authorization", "").removeprefix("Bearer ") not in self.tokens:
+            self.counters["unauthorized"] += 1
+            return web.json_response({"title": "Unauthorized", "status": 401}, status=401)
+        if request.path.startswith("/download/"):
+            return await handler(request)  # у drive свой лимит, не API
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.RPS:
+            self.counters["rate_limited"] += 1
+            return web.json_response({"title": "Too Many Requests", "status": 429}, status=429)
+        self.recent.append(now)
+        if random.random() < self.error_rate:
+            self.counters["errors"] += 1
+            return web.json_response({"title": "Service Unavailable", "status": 503}, status=503)
+        return await handler(request)
+
+    async def lead(self, request: web.Request) -> web.Response:
+        lead_id = int(request.match_info["id"])
+        return web.json_response({
+            "id": lead_id, "name": f"Сделка #{lead_id}", "price": 0, "responsible_user_id": 1,
+            "_embedded": {"contacts": [{"id": lead_id * 10, "is_main": True}]},
+        })
+
+    async def links(self, request: web.Request) -> web.Response:
+        lead_id = int(request.match_info["id"])
+        return web.json_response({"_embedded": {"links": [
+            {"to_entity_id": lead_id * 10, "to_entity_type": "contacts", "metadata": {"main_contact": True}},
+        ]}})
+
+    async def get_note(self, request: web.Request) -> web.Response:
+        note_id = int(request.match_info["id"])
+        if not 0 < note_id <= len(self.notes):
+            return web.json_response({
+                "id": note_id, "entity_id": 1, "note_type": "call_in",
+                "params": {"link": f"https://drive-b.amocrm.ru/download/{uuid.uuid4()}", "duration": 120},
+            })
+        return web.json_response(self.notes[note_id - 1])
+
+    async def add_notes(self, request: web.Request) -> web.Response:
+        notes = await request.json()
+        if not isinstance(notes, list) or not notes or len(notes) > 250:
+            return web.json_response({"title": "Bad Request", "status": 400, "detail": "1..250 notes"}, status=400)
+        created = []
+        for i, note in enumerate(notes):
+            self.notes.append({**note, "id": len(self.notes) + 1, "entity_type": request.match_info["entity"]})
+            created.append({"id": len(self.notes), "entity_id": note.get("entity_id"), "request_id": str(i)})
+        self.counters["note_requests"] += 1
+        self.counters["notes"] += len(notes)
+        self.counters["max_batch"] = max(self.counters["max_batch"], len(notes))
+        return web.json_response({"_embedded": {"notes": created}})
+
+    # Кадр MPEG-1 Layer III, 32 кбит/с, 44.1 кГц, моно: 104 байта, 4000 байт на секунду записи
+    MP3_FRAME = bytes.fromhex("fffb10c0") + bytes(100)
+    MP3_BYTES_PER_SECOND = 4000
+
+    def _size(self, file_uuid: str) -> int:
+        return int(self.durations.get(file_uuid, 120) * self.MP3_BYTES_PER_SECOND)
+
+    async def file(self, request: web.Request) -> web.Response:
+        file_uuid = request.match_info["uuid"]
+        href = f"{request.url.origin()}/download/{file_uuid}/call.mp3"
+        return web.json_response({
+            "uuid": file_uuid, "name": "call.mp3", "type": "audio", "size": self._size(file_uuid),
+            "_links": {"download": {"href": href}, "download_version": {"href": href + "?version=1"}},
+        })
+
+    async def download(self, request: web.Request) -> web.Response:
+        size = self._size(request.match_info["uuid"])
+        start, end, status, headers = 0, size - 1, 200, {}
+        match = re.match(r"bytes=(\d+)-(\d*)$", request.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            status, headers = 206, {"Content-Range": f"bytes {start}-{end}/{size}"}
+        self.counters["downloads"] += 1
+        self.counters["downloaded_bytes"] += end - start + 1
+        frame = self.MP3_FRAME
+        offset = start % len(frame)
+        repeated = frame * ((end - start + offset) // len(frame) + 1)
+        return web.Response(body=repeated[offset:offset + end - start + 1], status=status,
+                            headers=headers, content_type="audio/mpeg")
+
+    async def set_durations(self, request: web.Request) -> web.Response:
+        self.durations.update({k: float(v) for k, v in (await request.json()).items()})
+        return web.json_response({"files": len(self.durations)})
+
+    async def oauth(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        refresh_token = body.get("refresh_token")
+        if body.get("grant_type") != "refresh_token" or refresh_token not in self.refresh_tokens:
+            self.counters["oauth_rejected"] += 1
+            return web.json_response({"hint": "Token has been revoked", "status": 400}, status=400)
+        self.refresh_tokens.discard(refresh_token)  # одноразовый, как у amoCRM
+        access_token, new_refresh = uuid.uuid4().hex, uuid.uuid4().hex
+        self.tokens.add(access_token)
+        self.refresh_tokens.add(new_refresh)
+        self.counters["oauth_refreshed"] += 1
+        return web.json_response({
+            "token_type": "Bearer", "expires_in": 86400,
+            "access_token": access_token, "refresh_token": new_refresh,
+        })
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.counters, "connections": len(self.connections)})
+
+
+def create_amocrm_app(delay: float = 0.05, error_rate: float = 0.0) -> web.Application:
+    stub = AmoCRMStub(delay, error_rate)
+    app = web.Application(middlewares=[stub.middleware])
+    app["stub"] = stub
+    app.router.add_get(r"/api/v4/leads/{id:\d+}", stub.lead)
+    app.router.add_get(r"/api/v4/leads/{id:\d+}/links", stub.links)
+    app.router.add_get(r"/api/v4/{entity}/notes/{id:\d+}", stub.get_note)
+    app.router.add_post("/api/v4/{entity}/notes", stub.add_notes)
+    app.router.add_get("/v1.0/files/{uuid}", stub.file)
+    app.router.add_get("/download/{uuid}/{name}", stub.download)
+    app.router.add_post("/durations", stub.set_durations)
+    app.router.add_post("/oauth2/access_token", stub.oauth)
+    app.router.add_get("/stats", stub.stats)
+    return app
+
+
+async def _session(app: web.Application):
+    app["session"] = aiohttp.ClientSession()
+    yield
+    await app["session"].close()
+
+
+STUBS = {
+    "assemblyai": (create_assemblyai_app, 8601),
+    "gemini": (create_gemini_app, 8602),
+    "ollama": (create_ollama_app, 8603),
+    "telegram": (create_telegram_app, 8604),
+    "sheets": (create_sheets_app, 8605),
+    "amocrm": (create_amocrm_app, 8606),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушки внешних API")
+    parser.add_argument("stub", choices=sorted(STUBS), help="Какой API поднять")
+    parser.add_argument("--port", type=int, help="Порт (по умолчанию свой у каждой заглушки)")
+    parser.add_argument("--delay", type=float, help="Средняя задержка ответа/обработки, с (по умолчанию своя у каждой заглушки)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ошибок, 0..1")
+    parser.add_argument("--quota", type=int, help="sheets: запросов на запись в минуту")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    factory, default_port = STUBS[args.stub]
+    options = {"error_rate": args.error_rate}
+    if args.delay is not None:
+        options["delay"] = args.delay
+    if args.quota is not None:
+        options["quota"] = args.quota
+    web.run_app(factory(**options), port=args.port or default_port)
+
+
+if __name__ == "__main__":
+    main()
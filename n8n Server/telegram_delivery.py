@@ -0,0 +1,467 @@
+"""
+Доставка сообщений в Telegram вместо нод "Code in JavaScript" + "Send a text message".
+
+Экранирование — за один проход таблицей str.translate (HTML: & < >,
+MarkdownV2: все 18 спецсимволов и обратный слэш), а не цепочкой .replace.
+
+Длинный текст режется на части до TG_MAX_LENGTH (4096) символов: по
+абзацам, строкам, пробелам; теги HTML (<b>, <a href=...>) и маркеры
+MarkdownV2 (*, _, ~, ||, `) закрываются в конце части и заново
+открываются в следующей, сущности (&amp;) и экранирование (\\.) не рвутся.
+
+Исходящая очередь по чатам соблюдает лимиты Bot API: не чаще раза в
+TG_CHAT_INTERVAL с в личный чат и TG_GROUP_INTERVAL с в группу,
+не больше TG_GLOBAL_RATE сообщений в секунду на бота. Накопившиеся для
+чата сообщения (пачка звонков) склеиваются в одно, пока оно влезает в
+лимит. На 429 чат ставится на паузу по retry_after, на "can't parse
+entities" сообщение уходит простым текстом.
+
+Эндпоинты:
+  POST /send           {"text": ..., "parse_mode": "HTML" | "MarkdownV2" | null, "chat_id"?, "escape"?: bool}
+  POST /send/analysis  {<JSON "Распарсить JSON1">, "filename"?, "audio_url"?, "chat_id"?}
+  GET  /stats
+  GET  /health
+chat_id по умолчанию — tg_chat_id из админки, токен — TELEGRAM_BOT_TOKEN.
+
+Запуск:
+  python telegram_delivery.py    # порт TELEGRAM_PORT (по умолчанию 8508)
+
+Проверка без Telegram: python stubs.py telegram и TELEGRAM_API_URL=http://localhost:8604.
+"""
+
+import asyncio
+import collections
+import html
+import logging
+import os
+import re
+import time
+
+import aiohttp
+from aiohttp import web
+
+import db
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+MAX_LENGTH = int(os.getenv("TG_MAX_LENGTH", "4096"))
+CHAT_INTERVAL = float(os.getenv("TG_CHAT_INTERVAL", "1"))
+GROUP_INTERVAL = float(os.getenv("TG_GROUP_INTERVAL", "3"))  # 20 сообщений в минуту в группу
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "25"))
+MAX_ATTEMPTS = int(os.getenv("TG_MAX_ATTEMPTS", "5"))
+COALESCE_SEPARATOR = "\n\n— — —\n\n"
+SETTINGS_TTL = float(os.getenv("SETTINGS_TTL", "30"))
+
+PARSE_MODES = ("HTML", "MarkdownV2")
+
+
+# =========================================================================
+# ЭКРАНИРОВАНИЕ
+# =========================================================================
+HTML_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+MARKDOWN_V2_TABLE = str.maketrans({c: "\\" + c for c in "\\_*[]()~`>#+-=|{}.!"})
+
+
+def escape_html(value) -> str:
+    return str(value if value is not None else "").translate(HTML_TABLE)
+
+
+def escape_markdown_v2(value) -> str:
+    return str(value if value is not None else "").translate(MARKDOWN_V2_TABLE)
+
+
+ESCAPERS = {"HTML": escape_html, "MarkdownV2": escape_markdown_v2, None: lambda v: str(v if v is not None else "")}
+
+
+ANALYSIS_TEMPLATE = """📞 <b>Разбор звонка</b> Файл: {filename}
+
+📝 <b>Кратко:</b> {summary}
+
+📊 Оценка: {manager_score}/10{metrics}
+
+<b>Вердикт</b>: {outcome}
+
+👍 <b>Что сделано круто:</b> {good_points}
+
+⚠️ <b>Зоны роста:</b> {next_step}
+
+✅ <b>Совет:</b> {advice}
+
+🔗 <b>Ссылка на запись</b> {audio_url}"""
+
+
+def format_analysis(analysis: dict, filename: str = "", audio_url: str = "") -> str:
+    """Текст как у "Send a text message" (HTML), все поля экранированы."""
+    fields = {key: escape_html(analysis.get(key, "")) for key in (
+        "summary", "manager_score", "outcome", "good_points", "next_step", "advice",
+    )}
+    if analysis.get("manager_score") is None:
+        fields["manager_score"] = "—"
+    return ANALYSIS_TEMPLATE.format(filename=escape_html(filename), audio_url=escape_html(audio_url),
+                                    metrics=_metrics_line(analysis.get("metrics")), **fields)
+
+
+def _metrics_line(metrics: dict) -> str:
+    """Строка с долей речи и перебиваниями из conversation_metrics; без метрик — пусто."""
+    if not metrics or not metrics.get("speakers"):
+        return ""
+    speakers = metrics["speakers"]
+    talk = ", ".join(f"{escape_html(name)} {values['talk_ratio']:.0%}" for name, values in speakers.items())
+    interruptions = ", ".join(f"{escape_html(name)} {values['interruptions']}" for name, values in speakers.items())
+    silence = f" · тишина {metrics['silence_share']:.0%}" if "silence_share" in metrics else ""
+    return f"\n🎙 Речь: {talk} · перебивания: {interruptions}{silence}"
+
+
+# =========================================================================
+# РАЗБИЕНИЕ
+# =========================================================================
+HTML_TOKEN = re.compile(r"<[^>]*>|&#?\w+;|[^<&]+|[<&]")
+MARKDOWN_V2_TOKEN = re.compile(r"\\.|\|\||__|[*_~`]|[^\\|_*~`]+|.", re.S)
+
+
+def _html_tokens(text: str):
+    """(вид, текст): text — можно резать, atom — нельзя, open/close — тег."""
+    for match in HTML_TOKEN.finditer(text):
+        token = match.group()
+        if token.startswith("</"):
+            yield "close", token
+        elif token.startswith("<") and token.endswith(">"):
+            yield "open", token
+        elif token.startswith("&") and len(token) > 1:
+            yield "atom", token
+        else:
+            yield "text", token
+
+
+def _markdown_tokens(text: str):
+    for match in MARKDOWN_V2_TOKEN.finditer(text):
+        token = match.group()
+        if token.startswith("\\"):
+            yield "atom", token
+        elif token in ("||", "__", "*", "_", "~", "`"):
+            yield "marker", token
+        else:
+            yield "text", token
+
+
+def _closing(tag: str) -> str:
+    return "</" + re.match(r"<\s*(\w+)", tag).group(1) + ">"
+
+
+def _break_at(text: str, room: int) -> int:
+    """Где резать кусок текста, чтобы влезло room символов: абзац, строка, пробел."""
+    window = text[:room + 1]
+    for separator in ("\n\n", "\n", " "):
+        position = window.rfind(separator)
+        if position > room // 3:
+            return position
+    return 0
+
+
+def split_message(text: str, parse_mode: str = None, limit: int = MAX_LENGTH) -> list:
+    """Части не длиннее limit; открытые теги/маркеры переносятся в следующую часть."""
+    if len(text) <= limit:
+        return [text]
+    tokens = _html_tokens(text) if parse_mode == "HTML" else (
+        _markdown_tokens(text) if parse_mode == "MarkdownV2" else (("text", text),)
+    )
+    parts = []
+    stack = []  # (открывающий, закрывающий)
+    current, prefix = "", ""
+
+    def suffix() -> str:
+        return "".join(close for _, close in reversed(stack))
+
+    def flush():
+        nonlocal current, prefix
+        part = (current + suffix()).strip()
+        if strip_markup(part, parse_mode).strip():  # часть из одних тегов не отправляем
+            parts.append(part)
+        prefix = "".join(opening for opening, _ in stack)
+        current = prefix
+
+    for kind, token in tokens:
+        if kind == "open":
+            needed = len(token) + len(_closing(token))
+        elif kind == "close" or kind == "marker" and stack and stack[-1][0] == token:
+            needed = 0  # закрывающий уже учтён в suffix()
+        elif kind == "marker":
+            needed = 2 * len(token)
+        else:
+            needed = len(token)
+
+        if kind != "text":
+            if len(current) + len(suffix()) + needed > limit and current != prefix:
+                flush()
+            if kind == "open":
+                stack.append((token, _closing(token)))
+            elif kind == "close":
+                if stack:
+                    stack.pop()
+            elif kind == "marker":
+                if stack and stack[-1][0] == token:
+                    stack.pop()
+                else:
+                    stack.append((token, token))
+            current += token
+            continue
+
+        while token:
+            room = limit - len(current) - len(suffix())
+            if len(token) <= room:
+                current += token
+                break
+            cut = _break_at(token, room)
+            if cut == 0 and current != prefix:
+                flush()
+                token = token.lstrip("\n ")
+                continue
+            cut = cut or max(1, room)
+            current += token[:cut]
+            flush()
+            token = token[cut:].lstrip("\n ")
+    flush()
+    return parts
+
+
+def strip_markup(text: str, parse_mode: str) -> str:
+    """Текст без разметки — запасной вариант, если Telegram не разобрал сущности."""
+    if parse_mode == "HTML":
+        return html.unescape(re.sub(r"<[^>]*>", "", text))
+    if parse_mode == "MarkdownV2":
+        return re.sub(r"\\(.)|\|\||[*_~`]", lambda m: m.group(1) or "", text)
+    return text
+
+
+# =========================================================================
+# ОЧЕРЕДЬ
+# =========================================================================
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class TelegramError(Exception):
+    pass
+
+
+class Outbox:
+    """Очереди по чатам, один диспетчер, отправки параллельно в разные чаты."""
+
+    def __init__(self, session: aiohttp.ClientSession, token: str = BOT_TOKEN, limit: int = MAX_LENGTH):
+        self.session = session
+        self.token = token
+        self.limit = limit
+        self.queues = collections.defaultdict(collections.deque)  # chat_id -> [(text, parse_mode, attempts)]
+        self.next_at = {}
+        self.busy = set()
+        self.bucket = TokenBucket(GLOBAL_RATE)
+        self.wakeup = asyncio.Event()
+        self.sending = set()
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def interval(chat_id) -> float:
+        return GROUP_INTERVAL if str(chat_id).startswith("-") else CHAT_INTERVAL
+
+    def put(self, chat_id, text: str, parse_mode: str = None) -> int:
+        parts = split_message(text, parse_mode, self.limit)
+        for part in parts:
+            self.queues[str(chat_id)].append((part, parse_mode, 0))
+        self.stats["queued"] += len(parts)
+        self.wakeup.set()
+        return len(parts)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def _take(self, chat_id: str) -> tuple:
+        """Первое сообщение чата и склеенные с ним следующие (тот же parse_mode, влезает в лимит)."""
+        queue = self.queues[chat_id]
+        text, parse_mode, attempts = queue.popleft()
+        while queue and attempts == 0 and queue[0][1] == parse_mode and queue[0][2] == 0:
+            merged = text + COALESCE_SEPARATOR + queue[0][0]
+            if len(merged) > self.limit:
+                break
+            text = merged
+            queue.popleft()
+            self.stats["coalesced"] += 1
+        return text, parse_mode, attempts
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            ready = [
+                chat for chat, queue in self.queues.items()
+                if queue and chat not in self.busy and self.next_at.get(chat, 0) <= now
+            ]
+            if not ready:
+                waits = [
+                    self.next_at.get(chat, 0) - now for chat, queue in self.queues.items()
+                    if queue and chat not in self.busy
+                ]
+                timeout = max(0.0, min(waits)) if waits else None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for chat_id in sorted(ready, key=lambda c: self.next_at.get(c, 0)):
+                await self.bucket.acquire()
+                message = self._take(chat_id)
+                self.busy.add(chat_id)
+                task = asyncio.create_task(self._deliver(chat_id, *message))
+                self.sending.add(task)
+                task.add_done_callback(self.sending.discard)
+
+    async def _deliver(self, chat_id: str, text: str, parse_mode: str, attempts: int):
+        try:
+            delay = await self._send(chat_id, text, parse_mode)
+        except TelegramError as e:
+            delay = min(60.0, 2.0 ** attempts)
+            if attempts + 1 >= MAX_ATTEMPTS:
+                self.stats["dropped"] += 1
+                logger.error("Сообщение в %s не доставлено после %d попыток: %s", chat_id, attempts + 1, e)
+            else:
+                self.queues[chat_id].appendleft((text, parse_mode, attempts + 1))
+                logger.warning("Ошибка отправки в %s (попытка %d): %s", chat_id, attempts + 1, e)
+        finally:
+            self.busy.discard(chat_id)
+        self.next_at[chat_id] = time.monotonic() + max(delay, self.interval(chat_id))
+        self.wakeup.set()
+
+    async def _send(self, chat_id: str, text: str, parse_mode: str) -> float:
+        """Отправка; возвращает паузу перед следующим сообщением в этот чат."""
+        payload = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        try:
+            async with self.session.post(f"{TELEGRAM_API_URL}/bot{self.token}/sendMessage", json=payload) as resp:
+                data = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise TelegramError(f"{type(e).__name__}: {e}") from e
+        if data.get("ok"):
+            self.stats["sent"] += 1
+            return 0.0
+        description = data.get("description", "")
+        if resp.status == 429:
+            retry_after = float(data.get("parameters", {}).get("retry_after", 5))
+            self.stats["rate_limited"] += 1
+            logger.warning("429 для %s, пауза %.0f с", chat_id, retry_after)
+            self.queues[chat_id].appendleft((text, parse_mode, 0))
+            return retry_after
+        if resp.status == 400 and parse_mode and "parse entities" in description:
+            logger.warning("Telegram не разобрал разметку (%s), отправляем простым текстом", description)
+            self.stats["plain_fallback"] += 1
+            for part in reversed(split_message(strip_markup(text, parse_mode), None, self.limit)):
+                self.queues[chat_id].appendleft((part, None, 0))
+            return 0.0
+        if resp.status >= 500:
+            raise TelegramError(f"HTTP {resp.status}: {description}")
+        self.stats["dropped"] += 1
+        logger.error("Telegram отклонил сообщение в %s: HTTP %s %s", chat_id, resp.status, description)
+        return 0.0
+
+    async def drain(self, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while (self.pending or self.sending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def _chat_id(request: web.Request, data: dict) -> str:
+    if data.get("chat_id"):
+        return str(data["chat_id"])
+    app = request.app
+    cached_at, chat_id = app["chat_id"]
+    if time.monotonic() - cached_at > SETTINGS_TTL:
+        def _load():
+            with db.connection(app["pool"]) as conn, conn.cursor() as cur:
+                cur.execute("SELECT value FROM n8n_app_settings WHERE key = 'tg_chat_id';")
+                row = cur.fetchone()
+                return row[0] if row else None
+        chat_id = await asyncio.to_thread(_load) or os.getenv("TELEGRAM_CHAT_ID", "")
+        app["chat_id"] = (time.monotonic(), chat_id)
+    if not chat_id:
+        raise web.HTTPBadRequest(text="Нет chat_id: ни в запросе, ни tg_chat_id в админке")
+    return chat_id
+
+
+async def post_send(request: web.Request) -> web.Response:
+    data = await request.json()
+    parse_mode = data.get("parse_mode")
+    if parse_mode not in PARSE_MODES + (None,):
+        raise web.HTTPBadRequest(text=f"parse_mode: {', '.join(PARSE_MODES)} или null")
+    text = data.get("text") or ""
+    if not text.strip():
+        raise web.HTTPBadRequest(text="Пустой text")
+    if data.get("escape"):
+        text = ESCAPERS[parse_mode](text)
+    parts = request.app["outbox"].put(await _chat_id(request, data), text, parse_mode)
+    return web.json_response({"queued": True, "parts": parts}, status=202)
+
+
+async def post_send_analysis(request: web.Request) -> web.Response:
+    data = await request.json()
+    text = format_analysis(data, data.get("filename", ""), data.get("audio_url", ""))
+    parts = request.app["outbox"].put(await _chat_id(request, data), text, "HTML")
+    return web.json_response({"queued": True, "parts": parts}, status=202)
+
+
+async def get_stats(request: web.Request) -> web.Response:
+    outbox = request.app["outbox"]
+    return web.json_response({**outbox.stats, "pending": outbox.pending, "chats": len(outbox.queues)})
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"ok": True, "pending": request.app["outbox"].pending})
+
+
+async def _background(app: web.Application):
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+    app["outbox"] = Outbox(session)
+    app["chat_id"] = (float("-inf"), None)
+    dispatcher = asyncio.create_task(app["outbox"].run())
+    yield
+    await app["outbox"].drain()
+    dispatcher.cancel()
+    await session.close()
+
+
+def create_app(pool=None) -> web.Application:
+    app = web.Application()
+    app["pool"] = pool or db.create_pool()
+    app.router.add_post("/send", post_send)
+    app.router.add_post("/send/analysis", post_send_analysis)
+    app.router.add_get("/stats", get_stats)
+    app.router.add_get("/health", health)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("TELEGRAM_PORT", "8508")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Сжатие транскрипции перед анализом в Gemini.
+
+Сырой текст AssemblyAI уходил в модель целиком: "э-э", повторы "алло",
+автоответчик ("ваш звонок очень важен для нас"), объявления на удержании.
+Всё это — токены и время ответа без пользы для разбора. compact() по шагам:
+
+  1. нормализация пробелов, разбиение реплик на предложения;
+  2. фразы IVR/автоответчика — предложение удаляется целиком; список
+     в админке (ключ ivr_phrases в n8n_app_settings, по фразе в строке),
+     без ключа — DEFAULT_IVR_PHRASES;
+  3. слова-паразиты: "э", "ммм", вводные "ну,", ", как бы," и повторы
+     слова подряд ("да да да") сворачиваются;
+  4. повторы: то же предложение тем же спикером подряд и повторно
+     встреченные длинные (от DEDUPE_MIN_WORDS слов) предложения;
+  5. бюджет COMPACT_TOKEN_BUDGET на звонок: сначала укорачиваются самые
+     длинные реплики (остаются начало и конец), потом выпадают реплики из
+     середины — начиная со спикера, который говорит больше. Короткие
+     ответы клиента не трогаются, первые и последние реплики укорачиваются
+     только в крайнем случае; не уложилось и так — stats["over_budget"].
+
+Метрики разговора (conversation_metrics.py) считаются по исходной
+транскрипции — таймкоды compact() не меняет.
+
+Сравнение на своих транскрипциях (токены; с --analyze — ещё и ответы
+Gemini на сырой и сжатый текст: оценка, вердикт, время):
+  python transcript_compaction.py show transcript.json
+  python transcript_compaction.py compare transcripts/*.json --analyze
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import statistics
+import time
+
+logger = logging.getLogger(__name__)
+
+COMPACT_TOKEN_BUDGET = int(os.getenv("COMPACT_TOKEN_BUDGET", "40000"))
+DEDUPE_MIN_WORDS = int(os.getenv("COMPACT_DEDUPE_MIN_WORDS", "6"))
+KEEP_HEAD = 6    # первые реплики (знакомство, повод звонка) не сокращаются
+KEEP_TAIL = 12   # последние реплики (договорённости) не сокращаются
+MARKER_TOKENS = 12  # строка "[пропущено реплик: N]" вместо выброшенных
+CHARS_PER_TOKEN = 3.5  # та же грубая оценка, что в call_analysis.py
+
+DEFAULT_IVR_PHRASES = (
+    "ваш звонок очень важен для нас",
+    "оставайтесь на линии",
+    "все операторы заняты",
+    "все операторы сейчас заняты",
+    "разговор может быть записан",
+    "разговоры записываются",
+    "звонок записывается",
+    "в целях улучшения качества обслуживания",
+    "в целях контроля качества",
+    "ожидайте ответа оператора",
+    "переводим ваш звонок",
+    "для связи с оператором нажмите",
+    "абонент не отвечает",
+    "абонент временно недоступен",
+    "аппарат абонента выключен",
+    "оставьте сообщение после сигнала",
+    "номер набран неправильно",
+)
+
+FILLERS = ("ну", "вот", "короче", "типа", "как бы", "это самое", "так сказать", "в общем", "значит")
+NUMERALS = {"ноль", "один", "одна", "два", "две", "три", "четыре", "пять", "шесть", "семь", "восемь", "девять", "десять", "сто"}
+
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+HESITATION = re.compile(r"(?<!\w)(?:э+(?:-э+)*м*|м{2,}|хм+|а{2,}(?:-а+)*|у{2,})(?![\w-])[,.…]?\s*", re.I)
+_FILLER = "|".join(re.escape(f) for f in sorted(FILLERS, key=len, reverse=True))
+FILLER_START = re.compile(rf"^(?:{_FILLER})\s*,\s*", re.I)
+FILLER_MIDDLE = re.compile(rf"\s*,\s*(?:{_FILLER})\s*,\s*", re.I)
+FILLER_END = re.compile(rf"\s*,\s*(?:{_FILLER})\s*(?=[.!?…]*$)", re.I)
+REPEATED_WORD = re.compile(r"\b([^\W\d_]+)(?:[,\s]+\1\b)+", re.I)
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _key(text: str) -> str:
+    """Ключ для сравнения: нижний регистр, е вместо ё, без знаков препинания."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower().replace("ё", "е")).split())
+
+
+def phrase_list(value) -> list:
+    """Значение ivr_phrases из настроек -> ключи фраз; ключа нет — DEFAULT_IVR_PHRASES."""
+    lines = DEFAULT_IVR_PHRASES if value is None else str(value).splitlines()
+    return [key for key in (_key(line) for line in lines) if key]
+
+
+def collapse_fillers(sentence: str) -> tuple:
+    """(предложение без паразитов, сколько убрано)."""
+    result, removed = sentence, 0
+    for pattern, repl in ((HESITATION, ""), (FILLER_START, ""), (FILLER_MIDDLE, " "), (FILLER_END, "")):
+        result, n = pattern.subn(repl, result)
+        removed += n
+
+    def _word(match):
+        nonlocal removed
+        if match.group(1).lower() in NUMERALS:
+            return match.group(0)
+        removed += 1
+        return match.group(1)
+
+    result = REPEATED_WORD.sub(_word, result)
+    result = re.sub(r"\s+([,.!?…])", r"\1", " ".join(result.split())).lstrip(",.-– ")
+    if result and sentence[:1].isupper():
+        result = result[0].upper() + result[1:]
+    return result, removed
+
+
+# =========================================================================
+# СЖАТИЕ
+# =========================================================================
+def _units(transcript: dict) -> list:
+    """Реплики [{"speaker", "start", "end", "sentences"}]; без utterances — одна на предложение."""
+    utterances = transcript.get("utterances") or []
+    if utterances:
+        return [
+            {"speaker": u.get("speaker"), "start": u.get("start"), "end": u.get("end"),
+             "sentences": SENTENCE_END.split(" ".join((u.get("text") or "").split()))}
+            for u in utterances
+        ]
+    text = " ".join((transcript.get("text") or "").split())
+    return [{"speaker": None, "start": None, "end": None, "sentences": [s]} for s in SENTENCE_END.split(text) if s]
+
+
+def _line(unit: dict) -> str:
+    text = " ".join(unit["sentences"])
+    return text if unit["speaker"] is None else f"Speaker {unit['speaker']}: {text}"
+
+
+def _tokens(units: list) -> int:
+    return estimate_tokens("\n".join(_line(u) for u in units))
+
+
+def _clean(units: list, ivr: list, stats: dict) -> list:
+    """Шаги 2–4: IVR, паразиты, повторы; пустые реплики выпадают, соседние одного спикера склеиваются."""
+    seen_long = set()
+    result = []
+    last_speaker, last_key = object(), None
+    for unit in units:
+        kept = []
+        for sentence in unit["sentences"]:
+            key = _key(sentence)
+            if not key:
+                continue
+            if any(phrase in key for phrase in ivr):
+                stats["ivr"] += 1
+                continue
+            sentence, removed = collapse_fillers(sentence)
+            stats["fillers"] += removed
+            key = _key(sentence)
+            if not key:
+                continue
+            long = len(key.split()) >= DEDUPE_MIN_WORDS
+            if (unit["speaker"] == last_speaker and key == last_key) or (long and key in seen_long):
+                stats["duplicates"] += 1
+                continue
+            if long:
+                seen_long.add(key)
+            kept.append(sentence)
+            last_speaker, last_key = unit["speaker"], key
+        if not kept:
+            continue
+        if result and unit["speaker"] is not None and result[-1]["speaker"] == unit["speaker"]:
+            result[-1]["sentences"].extend(kept)
+            result[-1]["end"] = unit["end"]
+        else:
+            result.append({**unit, "sentences": kept})
+    return result
+
+
+def _fit_budget(units: list, budget: int, stats: dict) -> list:
+    """
+    Шаг 5: укоротить длинные реплики, затем выбросить реплики из середины.
+    Если и этого мало — укоротить первые и последние реплики; не влезло
+    и так — stats["over_budget"].
+    """
+    total = _tokens(units)
+    if total <= budget:
+        return units
+    middle = range(KEEP_HEAD, max(KEEP_HEAD, len(units) - KEEP_TAIL))
+
+    def shorten(indices) -> bool:
+        """Длинные реплики -> первые два и последнее предложение; True — уложились."""
+        nonlocal total
+        for i in sorted(indices, key=lambda i: -len(_line(units[i]))):
+            if total <= budget:
+                return True
+            sentences = units[i]["sentences"]
+            if len(sentences) <= 4:
+                continue
+            before = estimate_tokens(_line(units[i]))
+            units[i] = {**units[i], "sentences": sentences[:2] + ["…"] + sentences[-1:]}
+            total -= before - estimate_tokens(_line(units[i]))
+            stats["shortened"] += 1
+        return total <= budget
+
+    if shorten(middle):
+        return units
+
+    # Выбросить реплики из середины: самую длинную у того, кто сейчас говорит больше
+    by_speaker, candidates = {}, {}
+    for i, unit in enumerate(units):
+        by_speaker[unit["speaker"]] = by_speaker.get(unit["speaker"], 0) + estimate_tokens(_line(unit))
+    for i in sorted(middle, key=lambda i: len(_line(units[i]))):
+        candidates.setdefault(units[i]["speaker"], []).append(i)
+    dropped = set()
+    while total > budget and candidates:
+        speaker = max(candidates, key=by_speaker.get)
+        i = candidates[speaker].pop()
+        if not candidates[speaker]:
+            del candidates[speaker]
+        size = estimate_tokens(_line(units[i]))
+        # Новый пропуск добавляет строку-маркер, склейка двух пропусков одну убирает
+        neighbours = (i - 1 in dropped) + (i + 1 in dropped)
+        dropped.add(i)
+        total -= size - MARKER_TOKENS * (1 - neighbours)
+        by_speaker[speaker] -= size
+    stats["dropped"] += len(dropped)
+
+    if not shorten(i for i in range(len(units)) if i not in middle):
+        stats["over_budget"] = True
+        logger.warning("Транскрипция не уложилась в бюджет %d токенов: осталось ~%d", budget, total)
+
+    result, skipped = [], 0
+    for i, unit in enumerate(units):
+        if i in dropped:
+            skipped += 1
+            continue
+        if skipped:
+            # Маркер без спикера и таймкода: transcript_lines выводит его как есть
+            result.append({"speaker": None, "start": None, "end": None, "sentences": [f"[пропущено реплик: {skipped}]"]})
+            skipped = 0
+        result.append(unit)
+    return result
+
+
+def compact(transcript: dict, ivr_phrases: list = None, budget: int = COMPACT_TOKEN_BUDGET) -> tuple:
+    """
+    (сжатая транскрипция, статистика). Транскрипция — копия исходной
+    с новыми utterances/text; ivr_phrases — результат phrase_list().
+    """
+    units = _units(transcript)
+    stats = {"tokens_before": _tokens(units), "ivr": 0, "fillers": 0, "duplicates": 0, "shortened": 0, "dropped": 0,
+             "over_budget": False}
+    units = _clean(units, phrase_list(None) if ivr_phrases is None else ivr_phrases, stats)
+    if budget:
+        units = _fit_budget(units, budget, stats)
+    stats["tokens_after"] = _tokens(units) if units else 0
+    stats["saved"] = round(1 - stats["tokens_after"] / stats["tokens_before"], 3) if stats["tokens_before"] else 0.0
+
+    compacted = dict(transcript)
+    if transcript.get("utterances"):
+        compacted["utterances"] = [
+            {"speaker": u["speaker"], "start": u["start"], "end": u["end"], "text": " ".join(u["sentences"])}
+            for u in units
+        ]
+        compacted["text"] = " ".join(u["text"] for u in compacted["utterances"])
+    else:
+        compacted["text"] = " ".join(" ".join(u["sentences"]) for u in units)
+    return compacted, stats
+
+
+# =========================================================================
+# СРАВНЕНИЕ
+# =========================================================================
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("transcript", data)
+
+
+def _settings() -> dict:
+    import db
+
+    pool = db.create_pool()
+    try:
+        with db.connection(pool) as conn, conn.cursor() as cur:
+            cur.execute("SELECT key, value FROM n8n_app_settings;")
+            return dict(cur.fetchall())
+    finally:
+        pool.closeall()
+
+
+async def _analyze_both(paths: list, settings: dict, args) -> list:
+    """Анализ сырой и сжатой транскрипции тем же промптом и моделью."""
+    import aiohttp
+
+    import call_analysis
+    import conversation_metrics
+
+    system_prompt = open(args.prompt, encoding="utf-8").read() if args.prompt else settings.get("system_prompt", "")
+    api_key = settings.get("gemini_key") or os.getenv("GEMINI_API_KEY", "")
+    rows = []
+    async with aiohttp.ClientSession() as session:
+        analyzer = call_analysis.Analyzer(session)
+        for path in paths:
+            raw = _load(path)
+            compacted, stats = compact(raw, phrase_list(settings.get("ivr_phrases")), args.budget)
+            metrics = conversation_metrics.compute(raw)
+            row = {"file": os.path.basename(path), **stats}
+            for variant, transcript in (("raw", raw), ("compact", compacted)):
+                started = time.monotonic()
+                result, _ = await analyzer.analyze(transcript, system_prompt, api_key, args.model, metrics)
+                row[f"{variant}_seconds"] = round(time.monotonic() - started, 2)
+                row[f"{variant}_analysis"] = call_analysis.normalize_analysis(result)
+            raw_analysis, compact_analysis = row["raw_analysis"], row["compact_analysis"]
+            scores = (compact_analysis["manager_score"], raw_analysis["manager_score"])
+            row["score_diff"] = scores[0] - scores[1] if None not in scores else None
+            row["same_outcome"] = _key(str(compact_analysis["outcome"])) == _key(str(raw_analysis["outcome"]))
+            rows.append(row)
+            logger.info("%s: токенов %d -> %d, %.1f с -> %.1f с", row["file"], row["tokens_before"],
+                        row["tokens_after"], row["raw_seconds"], row["compact_seconds"])
+    return rows
+
+
+def print_comparison(rows: list):
+    print(f"{'файл':<28} {'токенов':>15} {'экономия':>9} {'IVR':>4} {'паразит':>7} {'повтор':>6}"
+          f" {'Gemini, с':>13} {'оценка':>7} {'вердикт':>7}")
+    for row in rows:
+        line = (f"{row['file'][:28]:<28} {row['tokens_before']:>7}->{row['tokens_after']:<7} {row['saved']:>9.0%}"
+                f" {row['ivr']:>4} {row['fillers']:>7} {row['duplicates']:>6}")
+        if "raw_seconds" in row:
+            diff = f"{row['score_diff']:>+7d}" if row["score_diff"] is not None else f"{'—':>7}"
+            line += (f" {row['raw_seconds']:>6.1f}->{row['compact_seconds']:<6.1f} {diff}"
+                     f" {'=' if row['same_outcome'] else '≠':>7}")
+        print(line)
+    if not rows:
+        return
+    before = sum(row["tokens_before"] for row in rows)
+    after = sum(row["tokens_after"] for row in rows)
+    print(f"\nИтого токенов: {before} -> {after} (экономия {1 - after / before:.0%})")
+    if "raw_seconds" in rows[0]:
+        raw_seconds = statistics.median(row["raw_seconds"] for row in rows)
+        compact_seconds = statistics.median(row["compact_seconds"] for row in rows)
+        print(f"Медиана времени Gemini: {raw_seconds:.1f} с -> {compact_seconds:.1f} с")
+        diffs = [abs(row["score_diff"]) for row in rows if row["score_diff"] is not None]
+        print(f"Средняя |разница оценки|: {statistics.mean(diffs) if diffs else 0:.2f}, "
+              f"тот же вердикт: {sum(row['same_outcome'] for row in rows)}/{len(rows)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сжатие транскрипции перед анализом: просмотр и сравнение")
+    parser.add_argument("--budget", type=int, default=COMPACT_TOKEN_BUDGET, help="Бюджет токенов на звонок (0 — без)")
+    parser.add_argument("--no-db", action="store_true", help="Не читать настройки из Postgres (фразы IVR по умолчанию)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_show = sub.add_parser("show", help="Сжатая транскрипция и статистика")
+    p_show.add_argument("transcript", help="JSON ответа AssemblyAI / transcription_service")
+    p_compare = sub.add_parser("compare", help="Экономия по набору транскрипций")
+    p_compare.add_argument("transcripts", nargs="+")
+    p_compare.add_argument("--analyze", action="store_true", help="Прогнать обе версии через Gemini (call_analysis)")
+    p_compare.add_argument("--prompt", help="Файл с system_prompt (по умолчанию из админки)")
+    p_compare.add_argument("--model", default=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"))
+    p_compare.add_argument("--json", help="Сохранить результат в файл")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    settings = {} if args.no_db else _settings()
+    ivr = phrase_list(settings.get("ivr_phrases"))
+    if args.command == "show":
+        compacted, stats = compact(_load(args.transcript), ivr, args.budget)
+        for u in compacted.get("utterances") or [{"speaker": None, "text": compacted["text"]}]:
+            print(u["text"] if u["speaker"] is None else f"Speaker {u['speaker']}: {u['text']}")
+        print()
+        print(json.dumps(stats, ensure_ascii=False))
+        return
+
+    if args.analyze:
+        rows = asyncio.run(_analyze_both(args.transcripts, settings, args))
+    else:
+        rows = [{"file": os.path.basename(path), **compact(_load(path), ivr, args.budget)[1]} for path in args.transcripts]
+    print_comparison(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
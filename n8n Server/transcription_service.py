@@ -0,0 +1,376 @@
+"""
+Сервис транскрибации для воркфлоу n8n: один вызов вместо связки
+"Отправить на транскрипцию" -> Wait 20 с -> "Получаем транскрибацию".
+
+Задача отправляется в AssemblyAI, а готовность ждётся:
+- по webhook AssemblyAI (если задан TRANSCRIBE_PUBLIC_URL — адрес этого
+  сервиса, доступный из AssemblyAI), с редким опросом на случай потери
+  колбэка;
+- иначе опросом с экспоненциальной задержкой (POLL_INITIAL .. POLL_MAX).
+Одновременно в работе не больше TRANSCRIBE_CONCURRENCY задач.
+
+Готовые транскрипции кэшируются в Postgres (call_cache.py) по file_uuid
+файла amoCRM или sha256 аудио (TRANSCRIBE_HASH_AUDIO=1) и варианту
+распознавания (бэкенд, модель, опции AssemblyAI, preprocess): повтор того же
+звонка отдаётся из кэша без AssemblyAI. TRANSCRIBE_CACHE=0 — без кэша и БД.
+
+При TRANSCRIBE_PREPROCESS=1 (или "preprocess": true в запросе) запись
+сначала перекодируется в моно 16 кГц Opus без тишины и загружается в
+AssemblyAI потоком (audio_preprocess.py); audio_url в ответе — исходный.
+
+Бэкенд выбирается в админке (настройка stt_backend: assemblyai | local)
+или полем "backend" в запросе. local — Whisper на CPU сервера
+(local_stt.py), ответ в том же формате AssemblyAI.
+
+Эндпоинты:
+  POST /transcribe           {"audio_url": ..., "file_uuid": ..., "preprocess": true,
+                              "language_code": "ru", "speaker_labels": true}
+                             -> готовая транскрипция в формате AssemblyAI
+                                (X-Cache: hit|miss, X-Transcript-Hash)
+  POST /assemblyai/webhook   колбэк AssemblyAI {"transcript_id": ..., "status": ...}
+  GET  /health
+  POST /analysis/lookup, POST /analysis/store, GET /cache/stats — см. call_cache.py
+
+Запуск:
+  python transcription_service.py          # порт TRANSCRIBE_PORT (по умолчанию 8504)
+
+Для проверки без AssemblyAI: python stubs.py assemblyai и
+ASSEMBLYAI_BASE_URL=http://localhost:8601.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import secrets
+import time
+
+import aiohttp
+from aiohttp import web
+
+import audio_preprocess
+import call_cache
+import db
+import local_stt
+
+logger = logging.getLogger(__name__)
+
+ASSEMBLYAI_BASE_URL = os.getenv("ASSEMBLYAI_BASE_URL", "https://api.assemblyai.com").rstrip("/")
+ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY", "")
+CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "10"))
+TIMEOUT = float(os.getenv("TRANSCRIBE_TIMEOUT", "3600"))
+POLL_INITIAL = float(os.getenv("POLL_INITIAL", "2"))
+POLL_MAX = float(os.getenv("POLL_MAX", "30"))
+# При работе через webhook опрос — только страховка
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "120"))
+PUBLIC_URL = os.getenv("TRANSCRIBE_PUBLIC_URL", "").rstrip("/")
+CACHE_ENABLED = os.getenv("TRANSCRIBE_CACHE", "1") == "1"
+HASH_AUDIO = os.getenv("TRANSCRIBE_HASH_AUDIO", "") == "1"
+PREPROCESS = os.getenv("TRANSCRIBE_PREPROCESS", "") == "1"
+STT_BACKEND = os.getenv("STT_BACKEND", "assemblyai")
+BACKENDS = ("assemblyai", "local")
+# Сколько записей распознаётся локально одновременно (каждая и так занимает пул процессов)
+LOCAL_STT_CONCURRENCY = int(os.getenv("LOCAL_STT_CONCURRENCY", "1"))
+SETTINGS_TTL = float(os.getenv("SETTINGS_TTL", "30"))
+
+WEBHOOK_HEADER = "X-Transcribe-Secret"
+DONE_STATUSES = ("completed", "error")
+
+
+class TranscriptionError(Exception):
+    pass
+
+
+class _Retryable(Exception):
+    pass
+
+
+class Transcriber:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        base_url: str = ASSEMBLYAI_BASE_URL,
+        api_key: str = ASSEMBLYAI_API_KEY,
+        concurrency: int = CONCURRENCY,
+        public_url: str = PUBLIC_URL,
+        timeout: float = TIMEOUT,
+    ):
+        self.session = session
+        self.base_url = base_url
+        self.headers = {"authorization": api_key}
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.public_url = public_url
+        self.timeout = timeout
+        self.webhook_secret = secrets.token_urlsafe(24)
+        self._waiters = {}
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def _request(self, method: str, path: str, **kwargs) -> dict:
+        """Запрос к API с повтором на 429/5xx и сетевых ошибках."""
+        delay = 1.0
+        for attempt in range(5):
+            try:
+                async with self.session.request(
+                    method, self.base_url + path, headers=self.headers, **kwargs
+                ) as resp:
+                    if resp.status == 429 or resp.status >= 500:
+                        raise _Retryable(f"HTTP {resp.status}")
+                    data = await resp.json()
+                    if resp.status >= 400:
+                        raise TranscriptionError(data.get("error") or f"HTTP {resp.status}")
+                    return data
+            except (aiohttp.ClientError, asyncio.TimeoutError, _Retryable) as e:
+                if attempt == 4:
+                    raise TranscriptionError(f"{method} {path}: {e}") from e
+                logger.warning("AssemblyAI %s %s: %s, повтор через %.0f с", method, path, e, delay)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+                delay *= 2
+
+    async def submit(self, options: dict) -> str:
+        payload = dict(options)
+        if self.public_url:
+            payload["webhook_url"] = f"{self.public_url}/assemblyai/webhook"
+            payload["webhook_auth_header_name"] = WEBHOOK_HEADER
+            payload["webhook_auth_header_value"] = self.webhook_secret
+        data = await self._request("POST", "/v2/transcript", json=payload)
+        return data["id"]
+
+    async def get(self, transcript_id: str) -> dict:
+        return await self._request("GET", f"/v2/transcript/{transcript_id}")
+
+    def notify(self, transcript_id: str):
+        """Колбэк: разбудить ожидающую задачу (колбэк может прийти раньше, чем wait)."""
+        if transcript_id:
+            self._waiters.setdefault(transcript_id, asyncio.Event()).set()
+
+    async def wait(self, transcript_id: str) -> dict:
+        event = self._waiters.setdefault(transcript_id, asyncio.Event())
+        deadline = time.monotonic() + self.timeout
+        delay = POLL_INITIAL
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                pause = WEBHOOK_POLL_INTERVAL if self.public_url else delay
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=min(pause, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+                transcript = await self.get(transcript_id)
+                if transcript.get("status") in DONE_STATUSES:
+                    return transcript
+                delay = min(delay * 2, POLL_MAX) * random.uniform(0.8, 1.2)
+        finally:
+            self._waiters.pop(transcript_id, None)
+
+    async def _upload_preprocessed(self, audio_url: str) -> str:
+        """Перекодировать и загрузить в AssemblyAI; при ошибке — исходный URL."""
+        try:
+            upload_url, _ = await audio_preprocess.preprocess_and_upload(
+                self.session, audio_url, self.base_url, self.headers["authorization"]
+            )
+            return upload_url
+        except (audio_preprocess.PreprocessError, aiohttp.ClientError, OSError) as e:
+            logger.warning("Подготовка аудио не удалась (%s), отправляем исходный файл", e)
+            return audio_url
+
+    async def transcribe(self, options: dict, preprocess: bool = False) -> dict:
+        async with self.semaphore:
+            self.active += 1
+            started = time.monotonic()
+            try:
+                source_url = options["audio_url"]
+                if preprocess:
+                    options = {**options, "audio_url": await self._upload_preprocessed(source_url)}
+                transcript_id = await self.submit(options)
+                transcript = await self.wait(transcript_id)
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.active -= 1
+        if transcript["status"] == "error":
+            self.failed += 1
+            raise TranscriptionError(transcript.get("error") or "ошибка транскрибации")
+        self.completed += 1
+        if transcript.get("audio_url") != source_url:
+            # Загружен перекодированный файл с укороченными паузами: таймкоды не
+            # совпадают с исходной записью, conversation_metrics не считает по ним тишину
+            transcript["upload_url"] = transcript.get("audio_url")
+            transcript["audio_url"] = source_url
+            transcript["preprocessed"] = True
+        logger.info(
+            "Транскрипция %s готова за %.1f с (аудио %s с)",
+            transcript_id, time.monotonic() - started, transcript.get("audio_duration"),
+        )
+        return transcript
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+def _variant(request: web.Request, backend: str, options: dict, preprocess: bool) -> dict:
+    """Всё, от чего зависит текст транскрипции, кроме самой записи."""
+    if backend == "local":
+        return {"backend": backend, "model": request.app["local_stt"].model, "language_code": options["language_code"]}
+    return {"backend": backend, "preprocess": preprocess, **{k: v for k, v in options.items() if k != "audio_url"}}
+
+
+async def _cache_key(request: web.Request, data: dict, variant: dict):
+    if not CACHE_ENABLED:
+        return None
+    if data.get("file_uuid"):
+        return call_cache.transcript_key(file_uuid=data["file_uuid"], variant=variant)
+    if HASH_AUDIO:
+        try:
+            audio_hash = await call_cache.hash_url(request.app["transcriber"].session, data["audio_url"])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Не удалось посчитать хэш аудио %s: %s", data["audio_url"], e)
+            return None
+        return call_cache.transcript_key(audio_hash=audio_hash, variant=variant)
+    return None
+
+
+def _db(request: web.Request, func, *args):
+    def _call():
+        with db.connection(request.app["pool"]) as conn:
+            return func(conn, *args)
+    return asyncio.to_thread(_call)
+
+
+def _transcript_response(transcript: dict, cache: str) -> web.Response:
+    return web.json_response(transcript, headers={
+        "X-Cache": cache,
+        "X-Transcript-Hash": call_cache.sha256_text(transcript.get("text")),
+    })
+
+
+async def _backend(request: web.Request, data: dict) -> str:
+    """Запрос -> настройка stt_backend из админки (кэш SETTINGS_TTL) -> STT_BACKEND."""
+    if data.get("backend"):
+        return data["backend"]
+    app = request.app
+    if "pool" not in app:
+        return STT_BACKEND
+    cached_at, value = app["stt_backend"]
+    if time.monotonic() - cached_at > SETTINGS_TTL:
+        def _load():
+            with db.connection(app["pool"]) as conn, conn.cursor() as cur:
+                cur.execute("SELECT value FROM n8n_app_settings WHERE key = 'stt_backend';")
+                row = cur.fetchone()
+                return row[0] if row else None
+        try:
+            value = await asyncio.to_thread(_load) or STT_BACKEND
+        except Exception as e:
+            logger.warning("Не удалось прочитать stt_backend: %s", e)
+            value = value or STT_BACKEND
+        app["stt_backend"] = (time.monotonic(), value)
+    return value
+
+
+async def _transcribe_local(request: web.Request, audio_url: str, language: str) -> dict:
+    app = request.app
+    async with app["local_slots"]:
+        started = time.monotonic()
+        transcript = await asyncio.to_thread(app["local_stt"].transcribe, audio_url, language)
+    logger.info(
+        "Локальная транскрипция готова за %.1f с (аудио %s с)",
+        time.monotonic() - started, transcript["audio_duration"],
+    )
+    return transcript
+
+
+async def post_transcribe(request: web.Request) -> web.Response:
+    data = await request.json()
+    if not data.get("audio_url"):
+        raise web.HTTPBadRequest(text="Нужен audio_url")
+    backend = await _backend(request, data)
+    if backend not in BACKENDS:
+        raise web.HTTPBadRequest(text=f"Неизвестный backend {backend}, допустимо: {', '.join(BACKENDS)}")
+    options = {"language_code": "ru", "speaker_labels": True, **data}
+    for field in ("file_uuid", "backend"):
+        options.pop(field, None)
+    preprocess = bool(options.pop("preprocess", PREPROCESS))
+
+    key = await _cache_key(request, data, _variant(request, backend, options, preprocess))
+    if key:
+        cached = await _db(request, call_cache.get_transcript, key)
+        if cached is not None:
+            logger.info("Транскрипция %s из кэша", key)
+            return _transcript_response(cached, "hit")
+
+    try:
+        if backend == "local":
+            transcript = await _transcribe_local(request, options["audio_url"], options["language_code"])
+        else:
+            transcript = await request.app["transcriber"].transcribe(options, preprocess)
+    except asyncio.TimeoutError:
+        raise web.HTTPGatewayTimeout(text="Транскрипция не готова за TRANSCRIBE_TIMEOUT")
+    except (TranscriptionError, RuntimeError) as e:
+        raise web.HTTPBadGateway(text=str(e))
+    if key:
+        await _db(request, call_cache.put_transcript, key, transcript)
+    return _transcript_response(transcript, "miss")
+
+
+async def post_webhook(request: web.Request) -> web.Response:
+    transcriber = request.app["transcriber"]
+    if request.headers.get(WEBHOOK_HEADER) != transcriber.webhook_secret:
+        raise web.HTTPForbidden()
+    data = await request.json()
+    transcriber.notify(data.get("transcript_id"))
+    return web.Response(text="ok")
+
+
+async def health(request: web.Request) -> web.Response:
+    t = request.app["transcriber"]
+    return web.json_response(
+        {"ok": True, "active": t.active, "completed": t.completed, "failed": t.failed,
+         "webhook": bool(t.public_url)}
+    )
+
+
+async def _session(app: web.Application):
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+    app["transcriber"] = Transcriber(session, **app["transcriber_options"])
+    app["local_stt"] = local_stt.LocalSTT()
+    app["local_slots"] = asyncio.Semaphore(LOCAL_STT_CONCURRENCY)
+    app["stt_backend"] = (float("-inf"), None)
+    evict_task = None
+    if CACHE_ENABLED:
+        with db.connection(app["pool"]) as conn:
+            call_cache.ensure_schema(conn)
+        evict_task = asyncio.create_task(call_cache.evict_loop(app["pool"]))
+    yield
+    if evict_task:
+        evict_task.cancel()
+    app["local_stt"].close()
+    await session.close()
+
+
+def create_app(pool=None, **transcriber_options) -> web.Application:
+    app = web.Application()
+    app["transcriber_options"] = transcriber_options
+    app.router.add_post("/transcribe", post_transcribe)
+    app.router.add_post("/assemblyai/webhook", post_webhook)
+    app.router.add_get("/health", health)
+    if CACHE_ENABLED:
+        app["pool"] = pool or db.create_pool()
+        call_cache.setup_routes(app)
+    app.cleanup_ctx.append(_session)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not ASSEMBLYAI_API_KEY:
+        logger.warning("ASSEMBLYAI_API_KEY не задан")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("TRANSCRIBE_PORT", "8504")))
+
+
+if __name__ == "__main__":
+    main()
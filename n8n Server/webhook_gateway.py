@@ -0,0 +1,303 @@
+"""
+Приёмник вебхуков amoCRM перед n8n.
+
+amoCRM шлёт вебхук сюда, а не в ноду Webhook: сервис отвечает сразу
+после записи задачи в Postgres (call_jobs), а тяжёлая цепочка
+(drive amoCRM -> AssemblyAI -> Gemini) запускается воркерами из очереди.
+Так медленный amoCRM/AssemblyAI не копит висящие выполнения n8n,
+а повтор не ждёт вслепую 5 минут, как Error Workflow.
+
+- Тело form-urlencoded (leads[note][0][note][...]) разбирается по
+  примечаниям: каждое примечание со звонком/вложением — отдельная задача.
+- Дедупликация по id примечания (или файла): повтор вебхука — не дубль.
+- Воркер (job_queue.Worker) отправляет задачу в воркфлоу n8n тем же
+  form-телом, что прислал бы amoCRM, и ждёт ответа (в ноде Webhook нужен
+  Respond: "When Last Node Finishes", тогда ошибка воркфлоу = повтор).
+- Длительность записи для планирования (короткие звонки вперёд, см.
+  job_queue): params[duration] из вебхука, иначе проба заголовка файла
+  (audio_probe.py) в фоне — задача придерживается до PROBE_TIMEOUT,
+  пока проба не закончится. GATEWAY_PROBE=0 — без пробы.
+
+Эндпоинты:
+  POST /amocrm                  вебхук amoCRM
+  GET  /health                  счётчики очереди
+  GET  /metrics                 очередь по полосам: ожидание, p50/p95
+  POST /jobs/dead/{id}/retry    вернуть задачу из dead letter
+
+Запуск:
+  python webhook_gateway.py     # порт GATEWAY_PORT (по умолчанию 8505)
+"""
+
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import re
+from urllib.parse import parse_qsl, urlencode
+
+import aiohttp
+from aiohttp import web
+
+import amocrm_client
+import audio_probe
+import db
+import job_queue
+
+logger = logging.getLogger(__name__)
+
+N8N_WEBHOOK_URL = os.getenv(
+    "N8N_WEBHOOK_URL",
+    "https://vps-39eb0606.vps.ovh.ca/webhook/4d00ff65-0d6f-45bc-80f5-effc885e48fe",
+)
+JOB_TIMEOUT = float(os.getenv("GATEWAY_JOB_TIMEOUT", "900"))
+# Аренда переживает таймаут запроса в n8n: пока он идёт, задачу не заберёт второй воркер
+JOB_LEASE_SECONDS = max(job_queue.JOBS_LEASE_SECONDS, int(JOB_TIMEOUT) + 60)
+# Ставить в очередь и примечания без вложения/ссылки (по умолчанию — только звонки и файлы)
+ALL_NOTES = os.getenv("GATEWAY_ALL_NOTES", "") == "1"
+PROBE = os.getenv("GATEWAY_PROBE", "1") == "1"
+PROBE_CONCURRENCY = int(os.getenv("GATEWAY_PROBE_CONCURRENCY", "8"))
+
+NOTE_KEY = re.compile(r"^(leads\[note\])\[(\d+)\](.*)$")
+
+
+# =========================================================================
+# РАЗБОР ВЕБХУКА amoCRM
+# =========================================================================
+def split_notes(body: str) -> list:
+    """
+    Тело вебхука -> список примечаний. Каждое — пары (ключ, значение) в том
+    же формате, что шлёт amoCRM, но с индексом [0], как ждёт воркфлоу;
+    общие ключи (account[...]) копируются в каждое.
+    """
+    common, notes = [], {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        match = NOTE_KEY.match(key)
+        if match:
+            prefix, index, rest = match.groups()
+            notes.setdefault(index, []).append((f"{prefix}[0]{rest}", value))
+        else:
+            common.append((key, value))
+    return [pairs + common for _, pairs in sorted(notes.items(), key=lambda item: int(item[0]))]
+
+
+def note_field(pairs: list, name: str) -> str:
+    return next((v for k, v in pairs if k == f"leads[note][0][note][{name}]"), "")
+
+
+def dedupe_key(pairs: list) -> str:
+    note_id = note_field(pairs, "id") or next((v for k, v in pairs if k == "leads[note][0][id]"), "")
+    if note_id:
+        return f"note:{note_id}"
+    attachment = note_field(pairs, "attachement")
+    if attachment:
+        return f"file:{attachment}"
+    return "body:" + hashlib.sha1(urlencode(pairs).encode("utf-8")).hexdigest()
+
+
+def is_call(pairs: list) -> bool:
+    """Примечание с файлом или ссылкой на запись разговора."""
+    return bool(note_field(pairs, "attachement") or note_field(pairs, "params][link"))
+
+
+def call_duration(pairs: list) -> float:
+    """Длительность звонка из примечания amoCRM (call_in/call_out), None — нет."""
+    try:
+        seconds = float(note_field(pairs, "params][duration"))
+    except ValueError:
+        return None
+    return seconds if seconds > 0 else None
+
+
+# =========================================================================
+# ОБРАБОТКА ЗАДАЧ
+# =========================================================================
+async def forward_to_n8n(session: aiohttp.ClientSession, payload: dict):
+    """Отправить задачу в воркфлоу n8n. Исключение — задача будет повторена."""
+    async with session.post(
+        N8N_WEBHOOK_URL,
+        data=payload["form"],
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        timeout=aiohttp.ClientTimeout(total=JOB_TIMEOUT),
+    ) as resp:
+        if resp.status >= 400:
+            text = await resp.text()
+            raise RuntimeError(f"n8n ответил {resp.status}: {text[:300]}")
+
+
+# =========================================================================
+# ДЛИТЕЛЬНОСТЬ ЗАПИСИ
+# =========================================================================
+async def probe_duration(app: web.Application, pairs: list) -> float:
+    """Длительность по заголовку файла: ссылка на запись или вложение на drive amoCRM."""
+    link = note_field(pairs, "params][link")
+    if link:
+        return await audio_probe.probe_url(app["session"], link)
+    amo, file_uuid = app["amo"], note_field(pairs, "attachement")
+    href = await amo.file_download_url(file_uuid)  # метаданные файла кэшируются клиентом
+    size = (await amo.get_file(file_uuid)).get("size")
+    token = await amo.tokens.get(amo.session)
+    return await audio_probe.probe_url(amo.session, href, headers={"Authorization": f"Bearer {token}"}, size=size)
+
+
+async def _estimate(app: web.Application, key: str, pairs: list):
+    """Проба в фоне; по результату (или ошибке) задача отпускается воркерам."""
+    seconds = None
+    async with app["probe_limit"]:
+        try:
+            seconds = await asyncio.wait_for(probe_duration(app, pairs), audio_probe.PROBE_TIMEOUT)
+            app["probes"]["ok" if seconds is not None else "unknown"] += 1
+        except Exception as e:
+            # Любая ошибка пробы — задачу всё равно отпускаем ниже, с оценкой по умолчанию
+            app["probes"]["failed"] += 1
+            logger.warning("Проба длительности %s: %s", key, f"{type(e).__name__}: {e}")
+
+    def _set():
+        with db.connection(app["pool"]) as conn:
+            return job_queue.set_estimate(conn, key, seconds)
+
+    await asyncio.to_thread(_set)
+    logger.info("Длительность %s: %s", key, f"{seconds} с" if seconds is not None else "неизвестна")
+    _wake(app)
+
+
+def _wake(app: web.Application):
+    for worker in app["workers"]:
+        worker.wake()
+
+
+# =========================================================================
+# HTTP
+# =========================================================================
+async def post_amocrm(request: web.Request) -> web.Response:
+    body = await request.text()
+    notes = [pairs for pairs in split_notes(body) if ALL_NOTES or is_call(pairs)]
+    if not notes:
+        return web.Response(text="ok")
+
+    jobs = []
+    for pairs in notes:
+        seconds = call_duration(pairs)
+        probe = PROBE and seconds is None and is_call(pairs)
+        jobs.append((dedupe_key(pairs), {"form": urlencode(pairs)}, seconds, probe, pairs))
+
+    def _enqueue():
+        with db.connection(request.app["pool"]) as conn:
+            return [
+                job_queue.enqueue(conn, key, payload, seconds, audio_probe.PROBE_TIMEOUT + 1 if probe else 0)
+                for key, payload, seconds, probe, _ in jobs
+            ]
+
+    created = await asyncio.to_thread(_enqueue)
+    if any(created):
+        _wake(request.app)
+    for (key, _, seconds, probe, pairs), new in zip(jobs, created):
+        if new and probe:
+            task = asyncio.create_task(_estimate(request.app, key, pairs))
+            request.app["probe_tasks"].add(task)
+            task.add_done_callback(request.app["probe_tasks"].discard)
+        logger.info("Вебхук: %s %s", key, "в очереди" if new else "дубль, пропущен")
+    return web.Response(text="ok")
+
+
+def _worker_counters(workers: list) -> dict:
+    return {
+        "inflight": sum(len(w.inflight) for w in workers),
+        "processed": sum(w.processed for w in workers),
+        "failed": sum(w.failed for w in workers),
+    }
+
+
+async def health(request: web.Request) -> web.Response:
+    def _stats():
+        with db.connection(request.app["pool"]) as conn:
+            return job_queue.stats(conn)
+
+    return web.json_response({
+        "ok": True,
+        "queue": await asyncio.to_thread(_stats),
+        **_worker_counters(request.app["workers"]),
+    })
+
+
+async def get_metrics(request: web.Request) -> web.Response:
+    window = int(request.query.get("minutes", "60"))
+
+    def _metrics():
+        with db.connection(request.app["pool"]) as conn:
+            return job_queue.metrics(conn, window)
+
+    metrics = await asyncio.to_thread(_metrics)
+    for worker in request.app["workers"]:
+        lane = metrics["lanes"].get(worker.lane or "short")
+        if lane is not None:
+            lane.update(_worker_counters([worker]), concurrency=worker.concurrency)
+    return web.json_response({**metrics, "probes": dict(request.app["probes"])})
+
+
+async def post_retry_dead(request: web.Request) -> web.Response:
+    job_id = int(request.match_info["id"])
+
+    def _requeue():
+        with db.connection(request.app["pool"]) as conn:
+            return job_queue.requeue_dead(conn, job_id)
+
+    if not await asyncio.to_thread(_requeue):
+        raise web.HTTPNotFound(text=f"Нет задачи {job_id} в dead letter")
+    _wake(request.app)
+    return web.json_response({"requeued": job_id})
+
+
+async def _purge_loop(pool):
+    def _purge():
+        with db.connection(pool) as conn:
+            return job_queue.purge_done(conn)
+
+    while True:
+        try:
+            removed = await asyncio.to_thread(_purge)
+            if removed:
+                logger.info("Удалено старых выполненных задач: %d", removed)
+        except Exception as e:
+            logger.error("Очистка очереди: %s", e)
+        await asyncio.sleep(3600)
+
+
+async def _background(app: web.Application):
+    pool = app["pool"]
+    with db.connection(pool) as conn:
+        job_queue.ensure_schema(conn)
+    session = app["session"] = aiohttp.ClientSession()
+    app["amo"] = amocrm_client.AmoCRM(pool, session)
+    app["probe_limit"] = asyncio.Semaphore(PROBE_CONCURRENCY)
+    app["probe_tasks"] = set()
+    app["probes"] = collections.Counter()
+    app["workers"] = job_queue.lane_workers(pool, lambda payload: forward_to_n8n(session, payload), JOB_LEASE_SECONDS)
+    tasks = [asyncio.create_task(worker.run()) for worker in app["workers"]]
+    tasks.append(asyncio.create_task(_purge_loop(pool)))
+    yield
+    for task in tasks + list(app["probe_tasks"]):
+        task.cancel()
+    # Незавершённые задачи вернутся в очередь по истечении аренды,
+    # непроверенные — по истечении hold с оценкой по умолчанию
+    await session.close()
+
+
+def create_app(pool=None) -> web.Application:
+    app = web.Application()
+    app["pool"] = pool or db.create_pool()
+    app.router.add_post("/amocrm", post_amocrm)
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", get_metrics)
+    app.router.add_post("/jobs/dead/{id}/retry", post_retry_dead)
+    app.cleanup_ctx.append(_background)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.getenv("GATEWAY_PORT", "8505")))
+
+
+if __name__ == "__main__":
+    main()